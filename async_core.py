@@ -0,0 +1,959 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+asyncio transport for the chat protocol.
+
+AsyncChatClient reuses chat_core's decoder and reply dispatch on top of
+asyncio streams, so one event loop can drive any number of connections,
+their uploads/downloads and timers without a thread per transfer.
+
+Commands can be fire-and-forget (``send``) or awaited (``await request(cmd)``):
+the server answers each connection strictly in order, so a SUCCESS/FAIL line
+resolves the oldest open request. UPLOAD_DATA and REQ_DOWNLOAD resolve on
+their final status line, HISTORY resolves with its body lines. A reply whose
+kind only one command gets (FRIENDS, CAPS, READY_UPLOAD, ... see
+REPLY_COMMANDS) arriving for a later request means the replies to the
+requests before it were lost; those fail with ReplyLost instead of every
+later reply landing on the wrong request.
+
+All bytes for a connection go through one WriteQueue, so frames never
+interleave and callers never wait on the socket.
+
+With ``reconnect=True`` a dropped connection is re-established with
+exponential backoff and re-authenticated with the saved session (AUTH).
+TEXT/TEXT_ID commands typed meanwhile, and those the server had not acknowledged
+when the connection dropped, wait in an OfflineOutbox and are re-sent in
+order once AUTH succeeds; the client then emits ``reconnected`` so views
+can resync. Only a rejected session or stop() ends run().
+
+With ``heartbeat=(interval, timeout)`` an idle connection is probed with
+PING every ``interval`` seconds. server.cpp's UNKNOWN_COMMAND answer counts
+as a pong. If nothing arrives and nothing drains for
+``max(timeout, RTO)`` after a probe, the peer is declared dead and the
+socket aborted, which starts the reconnect; so a dead peer is noticed
+within ``interval + timeout`` (RTO is capped at HEARTBEAT_MAX_TIMEOUT). Any
+line arriving after a probe proves the peer alive, even if the probe's own
+reply never comes. Without coalesce no PING is written while a command is
+outstanding (it would only queue behind it): that command's reply is the
+probe. If nothing moves for ``interval + timeout`` the reply is taken as
+lost, not the peer: the request fails with ReplyLost and the next command
+or PING decides. Only silence after that, or writes the peer stopped
+taking, counts as a dead peer. The smoothed RTT also sizes the upload
+queue (bandwidth-delay product).
+
+The GUI runs the loop on NetworkThread and reaches it through
+``call_soon_threadsafe`` / ``run_coroutine_threadsafe``.
+"""
+
+import asyncio
+import os
+import random
+import socket
+import struct
+import time
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+from collections import deque, namedtuple
+
+from chat_core import (ProtocolHandler, CHUNK_HEADER_SIZE, CHUNK_SIZE, OPTIONAL_COMMANDS, QUIET_COMMANDS,
+                       CAP_MSGID, CAP_ZCHUNK, CAP_ZLIB, COMPRESS_PROBE_SIZE, FRAME_COMPRESSED, FRAME_HEADER_SIZE,
+                       decode_reply, encode_auth, encode_caps, encode_ping, encode_text_id, new_message_id,
+                       text_id_to_text, encode_req_preview, encode_req_upload, encode_req_upload_hash, hash_file,
+                       is_compressible, is_unknown_command, pack_chunk, pack_eof, pack_zchunk,
+                       split_chunk_length, unpack_chunk_data, unpack_chunk_header)
+from debug_log import DEBUG_LOG
+from telemetry import INTERIM_REPLIES, command_name
+
+# StreamReader limit; must hold the longest reply line (FRIENDS/GROUPS lists)
+LINE_LIMIT = 1 << 20
+
+# Outbound queue limits
+MAX_CONTROL_QUEUE = 1024  # command lines; send() fails beyond this
+CONTROL_CONGESTED = 64  # lines waiting before back-pressure is reported
+MAX_COALESCE = 64 * 1024  # bytes of command lines joined into one write
+BULK_HIGH_WATER = 4 * CHUNK_SIZE  # upload producers wait above this
+BULK_LOW_WATER = CHUNK_SIZE
+
+BULK_MAX_HIGH_WATER = 64 * CHUNK_SIZE  # upper bound for the RTT-sized window
+
+# Heartbeat defaults (seconds); see the module docstring
+HEARTBEAT_INTERVAL = 15.0
+HEARTBEAT_TIMEOUT = 10.0
+HEARTBEAT_MAX_TIMEOUT = 30.0
+
+
+def heartbeat_config(value):
+    """Parse '<interval>[,<timeout>]' (LTM_HEARTBEAT); '0' disables, '' gives the defaults"""
+    if not value:
+        return (HEARTBEAT_INTERVAL, HEARTBEAT_TIMEOUT)
+    try:
+        parts = [float(p) for p in value.split(',')]
+    except ValueError:
+        return (HEARTBEAT_INTERVAL, HEARTBEAT_TIMEOUT)
+    if parts[0] <= 0:
+        return None
+    return (parts[0], parts[1] if len(parts) > 1 and parts[1] > 0 else HEARTBEAT_TIMEOUT)
+
+
+# Reply kinds (decode_reply) sent only in answer to these commands
+REPLY_COMMANDS = {
+    "session": {"LOGIN"},
+    "registered": {"REGISTER"},
+    "friends": {"GET_FRIENDS"},
+    "pending_requests": {"GET_PENDING_REQUESTS"},
+    "group_invites": {"GET_GROUP_INVITES"},
+    "groups": {"GET_GROUPS"},
+    "members": {"GET_MEMBERS"},
+    "caps": {"CAPS"},
+    "files": {"LIST_FILES"},
+    "history_header": {"HISTORY"},
+    "sent": {"TEXT_ID"},
+    "ready_upload": {"REQ_UPLOAD", "REQ_UPLOAD_HASH", "REQ_RESUME_UPLOAD"},
+    "upload_dedup": {"REQ_UPLOAD_HASH"},
+    "forwarded": {"FORWARD_FILE"},
+    "start_upload": {"UPLOAD_DATA"},
+    "upload_complete": {"UPLOAD_DATA"},
+    "ready_download": {"REQ_DOWNLOAD", "REQ_PREVIEW"},
+    "resume_download": {"REQ_RESUME_DOWNLOAD"},
+    "download_complete": {"REQ_DOWNLOAD", "REQ_PREVIEW", "REQ_RESUME_DOWNLOAD"},
+}
+
+
+class ReplyLost(Exception):
+    """The server answered a later request, so this one will get no reply"""
+
+
+# Reconnect backoff: the first retry is immediate, then doubling with jitter
+RECONNECT_BASE_DELAY = 0.1
+RECONNECT_MAX_DELAY = 10.0
+RECONNECT_TIMEOUT = 5.0  # per connect attempt
+# Commands kept for re-sending across a reconnect; the rest are either
+# re-requested by the resync or only make sense on the old connection
+OUTBOX_COMMANDS = {"TEXT", "TEXT_ID"}
+
+
+def reconnect_delay(attempt):
+    """Seconds to wait before reconnect attempt number ``attempt`` (0-based)"""
+    if attempt == 0:
+        return 0.0
+    delay = min(RECONNECT_MAX_DELAY, RECONNECT_BASE_DELAY * 2 ** (attempt - 1))
+    return delay * random.uniform(0.8, 1.2)
+
+
+class OfflineOutbox:
+    """Commands waiting for the connection, oldest first.
+
+    With a path (open()) every command is also appended to that file and the
+    file is emptied when the commands are handed back, so messages typed
+    while offline survive a restart of the client.
+    """
+
+    def __init__(self):
+        self.path = None
+        self._commands = deque()
+
+    def __len__(self):
+        return len(self._commands)
+
+    def open(self, path):
+        """Persist to path; commands already stored there are queued first"""
+        stored = []
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                stored = [line for line in f if line.strip()]
+        except OSError:
+            pass
+        self.path = path
+        self._commands.extendleft(reversed(stored))
+        self._rewrite()
+
+    def append(self, cmd):
+        if not cmd.endswith('\n'):
+            cmd = cmd + '\n'
+        self._commands.append(cmd)
+        if self.path:
+            try:
+                with open(self.path, 'a', encoding='utf-8') as f:
+                    f.write(cmd)
+            except OSError as e:
+                print(f"[WARN] Outbox not saved: {e}")
+
+    def prepend(self, cmds):
+        """Queue cmds (in order) ahead of everything queued so far"""
+        if cmds:
+            self._commands.extendleft(reversed([c if c.endswith('\n') else c + '\n' for c in cmds]))
+            self._rewrite()
+
+    def drain(self):
+        commands, self._commands = list(self._commands), deque()
+        self._rewrite()
+        return commands
+
+    def _rewrite(self):
+        if not self.path:
+            return
+        try:
+            tmp = self.path + ".tmp"
+            with open(tmp, 'w', encoding='utf-8') as f:
+                f.writelines(self._commands)
+            os.replace(tmp, self.path)
+        except OSError as e:
+            print(f"[WARN] Outbox not saved: {e}")
+
+
+# Chunk compression runs on a small pool (zlib releases the GIL); this many
+# chunks are compressed ahead of the one being written
+COMPRESS_WORKERS = 2
+COMPRESS_AHEAD = 4
+_compress_pool = None
+
+
+def compress_pool():
+    global _compress_pool
+    if _compress_pool is None:
+        _compress_pool = ThreadPoolExecutor(COMPRESS_WORKERS, thread_name_prefix="zchunk")
+    return _compress_pool
+
+
+async def chunk_frames(f, offset, filesize, compress):
+    """Yield (frame, plain length) for f from offset; compressed frames are
+    built on compress_pool() while earlier ones are being written"""
+    loop = asyncio.get_running_loop()
+    ahead = deque()
+    while offset < filesize or ahead:
+        while offset < filesize and len(ahead) < (COMPRESS_AHEAD if compress else 1):
+            data = f.read(min(CHUNK_SIZE, filesize - offset))
+            if not data:
+                filesize = offset
+                break
+            if compress:
+                frame = loop.run_in_executor(compress_pool(), pack_zchunk, offset, data)
+            else:
+                frame = pack_chunk(offset, data)
+            ahead.append((frame, len(data)))
+            offset += len(data)
+        if not ahead:
+            break
+        frame, length = ahead.popleft()
+        yield (await frame if compress else frame), length
+
+
+class WriteQueue:
+    """Single writer for one connection.
+
+    Command lines (control) go ahead of queued upload chunks (bulk). With
+    ``coalesce`` several queued lines are joined into one write; that needs
+    a server that frames commands by newline. server.cpp handles each
+    recv() as a single command, and TCP may still deliver two separate
+    writes in one recv(), so by default only one command is in flight: the
+    next line is held until reply_received() reports the final reply to
+    the previous one. Once the line opening an upload stream
+    (UPLOAD_DATA) is written the server reads raw chunk headers, so later
+    control lines are held until close_stream(): the client calls it when
+    the upload's final reply (UPLOAD_COMPLETE / FAIL) arrives. Releasing
+    them any earlier could put a command into the chunk stream, or into the
+    same recv() as the EOF marker that server.cpp leaves unread. Bulk
+    producers are bounded by awaiting put_bulk(); control overflow and
+    congestion are reported through on_backpressure(congested).
+    """
+
+    def __init__(self, writer, on_backpressure=None, coalesce=False):
+        self.writer = writer
+        self.on_backpressure = on_backpressure
+        self.coalesce = coalesce
+        self.congested = False
+        self._control = deque()  # (line, opens_stream)
+        self._bulk = deque()
+        self._bulk_bytes = 0
+        self.bulk_high_water = BULK_HIGH_WATER
+        self._streaming = False
+        self._in_flight = False  # without coalesce: a command awaits its reply
+        self._wakeup = asyncio.Event()
+        self._bulk_space = asyncio.Event()
+        self._bulk_space.set()
+        self._task = None
+        self.writes = 0
+        self.lines_written = 0
+        self.bytes_written = 0
+        self.dropped = 0
+
+    def start(self):
+        self._task = asyncio.ensure_future(self.run())
+        return self._task
+
+    def close(self):
+        if self._task is not None:
+            self._task.cancel()
+
+    def _set_congested(self, congested):
+        if congested != self.congested:
+            self.congested = congested
+            if self.on_backpressure is not None:
+                self.on_backpressure(congested)
+
+    def put_control(self, data, opens_stream=False):
+        """Queue one encoded command line; False when the queue is full.
+        With opens_stream, control lines after it are held from the moment
+        it is written until close_stream()."""
+        if len(self._control) >= MAX_CONTROL_QUEUE:
+            self.dropped += 1
+            self._set_congested(True)
+            return False
+        self._control.append((data, opens_stream))
+        if len(self._control) >= CONTROL_CONGESTED:
+            self._set_congested(True)
+        self._wakeup.set()
+        return True
+
+    def close_stream(self):
+        """The server is reading command lines again: release held control lines"""
+        if self._streaming:
+            self._streaming = False
+            self._wakeup.set()
+
+    def backlog(self):
+        """Bytes queued for the socket that it has not taken yet (held
+        command lines excluded: they wait for a reply, not the socket)"""
+        return self._bulk_bytes + self.writer.transport.get_write_buffer_size()
+
+    def reply_received(self):
+        """The command in flight got its final reply: release the next line"""
+        if self._in_flight:
+            self._in_flight = False
+            self._wakeup.set()
+
+    async def put_bulk(self, frame):
+        while self._bulk_bytes >= self.bulk_high_water:
+            self._bulk_space.clear()
+            await self._bulk_space.wait()
+        self._bulk.append(frame)
+        self._bulk_bytes += len(frame)
+        self._wakeup.set()
+
+    def _next_write(self):
+        if self._control and not (self._streaming or self._in_flight):
+            batch = []
+            size = 0
+            while self._control and size < MAX_COALESCE:
+                data, opens_stream = self._control.popleft()
+                batch.append(data)
+                size += len(data)
+                if opens_stream:
+                    self._streaming = True
+                    break
+                if not self.coalesce:
+                    self._in_flight = True
+                    break
+            self.lines_written += len(batch)
+            if not self._control:
+                self._set_congested(False)
+            return b''.join(batch)
+        if self._bulk:
+            frame = self._bulk.popleft()
+            self._bulk_bytes -= len(frame)
+            if self._bulk_bytes < BULK_LOW_WATER:
+                self._bulk_space.set()
+            return frame
+        return None
+
+    async def run(self):
+        while True:
+            await self._wakeup.wait()
+            self._wakeup.clear()
+            while True:
+                data = self._next_write()
+                if data is None:
+                    break
+                self.writer.write(data)
+                self.writes += 1
+                self.bytes_written += len(data)
+                await self.writer.drain()
+
+    def snapshot(self):
+        return {
+            "control_queued": len(self._control),
+            "bulk_queued_bytes": self._bulk_bytes,
+            "bulk_high_water": self.bulk_high_water,
+            "streaming": self._streaming,
+            "in_flight": self._in_flight,
+            "writes": self.writes,
+            "lines_written": self.lines_written,
+            "bytes_written": self.bytes_written,
+            "dropped": self.dropped,
+            "congested": self.congested,
+        }
+
+
+class Reply(namedtuple("Reply", "line kind fields lines")):
+    """Final reply to an awaited command; ``lines`` holds HISTORY body lines"""
+
+    @property
+    def ok(self):
+        return self.line.startswith("SUCCESS ")
+
+
+class AsyncChatClient(ProtocolHandler):
+    """One control connection driven by an asyncio event loop"""
+
+    def __init__(self, host, port, on_event=None, telemetry=None, coalesce=False, compress=False,
+                 reconnect=False, heartbeat=None, client_ids=False):
+        super().__init__(on_event, telemetry)
+        self.host = host
+        self.port = port
+        self.coalesce = coalesce
+        self.compress = compress  # ask for CAPS zlib after AUTH
+        self.reconnect = reconnect  # resume the session after a dropped connection
+        self.reconnecting = False  # between losing the connection and AUTH_OK
+        self.offline = OfflineOutbox()
+        self._unacked = deque()  # OUTBOX_COMMANDS written but not yet answered
+        self._stopped = False
+        self.heartbeat = heartbeat  # (interval, timeout) or None
+        self.client_ids = client_ids  # ask for CAPS msgid after AUTH
+        self._last_rx = 0.0  # perf_counter of the last bytes from the server
+        self._pings = 0
+        self.compression = None  # negotiated capability, e.g. "zlib"
+        self.negotiation = None  # task sending CAPS once AUTH is answered
+        self.wire_bytes_in = 0  # framed bytes read since compression started
+        self.plain_bytes_in = 0  # the same data after inflating
+        self.reader = None
+        self.writer = None
+        self.outbox = None
+        self._waiting = deque()  # [command, future or None, interim_seen]
+        self._transfer = None  # download coroutine to finish before the next line
+        self._tasks = set()
+
+    # -- connection --------------------------------------------------------
+
+    async def connect(self, timeout=5.0):
+        self.reader, self.writer = await asyncio.wait_for(
+            asyncio.open_connection(self.host, self.port, limit=LINE_LIMIT), timeout)
+        # Without Nagle a command leaves as soon as the previous reply
+        # releases it instead of waiting for an ACK
+        sock = self.writer.get_extra_info('socket')
+        if sock is not None:
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
+        self.outbox = WriteQueue(self.writer, self._on_backpressure, self.coalesce)
+        self.outbox.start()
+        self.telemetry.connection_reset()
+        self._last_rx = time.perf_counter()
+        self.compression = None
+        self.chunk_compression = False
+        self.message_ids = False
+        self._history_expected = 0
+        self._history_buffer = []
+        self._transfer = None
+        self.running = True
+        if self.heartbeat:
+            self._spawn(self._heartbeat())
+        self._adapt_to_rtt()
+
+    def _on_backpressure(self, congested):
+        self.emit("write_backpressure", congested)
+
+    # -- stream compression ------------------------------------------------
+
+    def _caps_wanted(self):
+        caps = [CAP_ZLIB, CAP_ZCHUNK] if self.compress else []
+        if self.client_ids:
+            caps.append(CAP_MSGID)
+        return caps if self.supports("CAPS") else []
+
+    def _on_session(self, session):
+        # LOGIN reply: AUTH this connection, CAPS only once AUTH is answered
+        self.session = session
+        auth = asyncio.get_running_loop().create_future()
+        self._write_command(encode_auth(session), auth)
+        self.emit("login_success", session, self.username)
+        self.negotiation = self._spawn(self._negotiate(auth))
+
+    async def _negotiate(self, auth=None):
+        """Ask for the wanted capabilities on an authenticated connection"""
+        try:
+            if auth is not None and not (await auth).ok:
+                return
+            caps = self._caps_wanted()
+            if caps:
+                await self.request(encode_caps(*caps))
+        except (ConnectionError, ReplyLost):
+            pass
+
+    def _on_caps(self, caps):
+        self.chunk_compression = CAP_ZCHUNK in caps
+        self.message_ids = CAP_MSGID in caps
+        if CAP_ZLIB in caps and self.compression is None:
+            # Everything after this reply arrives framed; run() and the
+            # download engine keep reading lines/chunks from self.reader
+            raw, self.reader = self.reader, asyncio.StreamReader(limit=LINE_LIMIT)
+            self.compression = CAP_ZLIB
+            self._spawn(self._inflate(raw, self.reader))
+
+    async def _inflate(self, raw, plain):
+        """Unframe the server stream into plain (see chat_core FRAME_*)"""
+        inflater = zlib.decompressobj()
+        try:
+            while True:
+                (header,) = struct.unpack('!I', await raw.readexactly(FRAME_HEADER_SIZE))
+                data = await raw.readexactly(header & ~FRAME_COMPRESSED)
+                self.wire_bytes_in += FRAME_HEADER_SIZE + len(data)
+                self._last_rx = time.perf_counter()
+                if header & FRAME_COMPRESSED:
+                    data = inflater.decompress(data)
+                self.plain_bytes_in += len(data)
+                plain.feed_data(data)
+        except (OSError, asyncio.IncompleteReadError, zlib.error) as e:
+            if not isinstance(e, asyncio.IncompleteReadError) or e.partial:
+                print(f"[ERROR] Compressed stream failed: {e}")
+        finally:
+            plain.feed_eof()
+
+    async def run(self):
+        """Connect and process server lines until disconnected (with
+        reconnect: until stop() or the server rejects the session)"""
+        try:
+            await self.connect()
+        except (OSError, asyncio.TimeoutError) as e:
+            self.emit("message_received", f"Connection failed: {e}")
+            self.emit("disconnected")
+            return
+        self.emit("connected")
+        await self._serve()
+        while self.reconnect and self.session and not self._stopped:
+            if not await self._reconnect():
+                break
+            await self._serve()
+        self.reconnecting = False
+        self.emit("disconnected")
+
+    async def _serve(self):
+        """Read and dispatch lines until the connection closes"""
+        try:
+            while self.running:
+                raw = await self.reader.readline()
+                if not raw:
+                    # Not an error: "disconnected" follows. Kept out of stdout,
+                    # which a load test closing thousands of connections floods
+                    DEBUG_LOG.info("Connection to %s:%s closed by server", self.host, self.port)
+                    break
+                self._last_rx = time.perf_counter()
+                self.telemetry.bytes_received(len(raw))
+                line = raw.decode('utf-8', errors='replace').strip()
+                if not line:
+                    continue
+                try:
+                    self.handle_line(line)
+                except Exception as e:
+                    print(f"[ERROR] Failed to handle message '{line}': {e}")
+                    import traceback
+                    traceback.print_exc()
+                if self._transfer is not None:
+                    transfer, self._transfer = self._transfer, None
+                    await transfer
+        except (OSError, asyncio.IncompleteReadError, ValueError) as e:
+            print(f"[ERROR] recv() failed: {e}")
+            if self.running:
+                self.emit("message_received", f"Error: {e}")
+        finally:
+            self._close()
+
+    # -- reconnect ---------------------------------------------------------
+
+    async def _reconnect(self):
+        """Reconnect with backoff and resume the session; False once stopped"""
+        self.reconnecting = True
+        lost_at = time.perf_counter()
+        # Unanswered TEXT may or may not have reached the server; re-send it
+        self.offline.prepend(list(self._unacked))
+        self._unacked.clear()
+        self._fail_transfers("Connection lost")
+        attempt = 0
+        while not self._stopped:
+            delay = reconnect_delay(attempt)
+            attempt += 1
+            self.emit("reconnecting", attempt, delay)
+            if delay:
+                await asyncio.sleep(delay)
+            if self._stopped:
+                break
+            try:
+                await self.connect(RECONNECT_TIMEOUT)
+            except (OSError, asyncio.TimeoutError):
+                continue
+            # AUTH goes out first; commands sent meanwhile queue behind it
+            auth = asyncio.get_running_loop().create_future()
+            self._write_command(encode_auth(self.session), auth)
+            self._spawn(self._resume(auth, lost_at))
+            return True
+        return False
+
+    async def _resume(self, auth, lost_at):
+        try:
+            reply = await auth
+        except (ConnectionError, ReplyLost):
+            return  # dropped again; run() goes round once more
+        if not reply.ok:
+            print(f"[ERROR] Session not resumed: {reply.line}")
+            self.session = None  # run() ends after this connection
+            self.reconnecting = False
+            self.emit("session_rejected", reply.line)
+            self._close()
+            return
+        caps = self._caps_wanted()
+        if caps:
+            # Negotiate first: the outbox goes out as TEXT_ID only with msgid
+            try:
+                await self.request(encode_caps(*caps))
+            except (ConnectionError, ReplyLost):
+                return
+        self.reconnecting = False
+        replayed = self._replay_offline()
+        self.emit("reconnected", time.perf_counter() - lost_at, replayed)
+
+    def _replay_offline(self):
+        commands = self.offline.drain()
+        for cmd in commands:
+            self._write_command(cmd, None)
+        return len(commands)
+
+    def open_outbox(self, path):
+        """Persist the offline outbox to path (loop thread); commands left
+        there by an earlier run are sent now if the session is up"""
+        self.offline.open(path)
+        if self.running and self.session and not self.reconnecting and len(self.offline):
+            self._replay_offline()
+
+    def _fail_transfers(self, reason):
+        if self.active_upload is not None:
+            file_id = self.active_upload[0]
+            self.active_upload = None
+            self.emit("upload_failed", file_id, reason)
+        for file_id in list(self.pending_downloads):
+            self.emit("download_failed", file_id, reason)
+        self.pending_downloads.clear()
+
+    # -- heartbeat ---------------------------------------------------------
+
+    async def _heartbeat(self):
+        """Probe an idle connection; abort it when the peer stops answering"""
+        interval, timeout = self.heartbeat
+        tick = min(1.0, interval / 4)
+        loop = asyncio.get_running_loop()
+        ping = None  # {"fut", "sent", "written", "clean"} while a probe is open
+        written, moved_at = self.outbox.bytes_written, time.perf_counter()
+        gave_up_at = None  # when a reply was last taken as lost
+        while self.running:
+            await asyncio.sleep(tick)
+            now = time.perf_counter()
+            if self.outbox.bytes_written != written:
+                written, moved_at = self.outbox.bytes_written, now
+            if ping is not None:
+                if ping["fut"].done():
+                    ping = None
+                elif self._last_rx > ping["sent"]:
+                    # The peer is answering, so it is alive even if the
+                    # reply to this probe went missing
+                    ping = None
+                elif written != ping["written"]:
+                    # Busy (the probe is held behind an upload), not dead:
+                    # restart the wait, skip the RTT sample
+                    ping.update(sent=now, written=written, clean=False)
+                elif now - ping["sent"] > self._probe_timeout(timeout):
+                    self._dead_peer(now - self._last_rx)
+                    return
+                continue
+            if now - self._last_rx < interval:
+                continue
+            if self._waiting and not self.coalesce:
+                # server.cpp reads one command at a time: wait for the reply
+                # to the outstanding one instead of queueing a PING behind it
+                silent = now - max(self._last_rx, moved_at)
+                if silent < interval + self._probe_timeout(timeout):
+                    continue
+                if self.outbox.backlog() or (gave_up_at is not None and self._last_rx < gave_up_at):
+                    self._dead_peer(now - self._last_rx)
+                    return
+                print(f"[WARN] No reply to {self._waiting[0][0]} for {silent:.1f}s - taking it as lost")
+                gave_up_at = now
+                self._reply_lost()
+                self.telemetry.trim_pending(len(self._waiting))
+                continue
+            self._pings += 1
+            fut = loop.create_future()
+            if not self._write_command(encode_ping(self._pings), fut):
+                continue
+            ping = {"fut": fut, "sent": now, "written": self.outbox.bytes_written, "clean": True}
+            fut.add_done_callback(lambda f, p=ping: self._on_pong(f, p))
+
+    def _probe_timeout(self, timeout):
+        rto = self.telemetry.rto(floor=0.0)
+        return min(HEARTBEAT_MAX_TIMEOUT, max(timeout, rto or 0))
+
+    def _on_pong(self, fut, ping):
+        if fut.cancelled() or fut.exception() is not None or not ping["clean"]:
+            return
+        self.telemetry.rtt_sample(time.perf_counter() - ping["sent"])
+        self._adapt_to_rtt()
+
+    def _dead_peer(self, silent_s):
+        print(f"[ERROR] No answer from server for {silent_s:.1f}s - connection is dead")
+        self.telemetry.dead_peer()
+        self.emit("message_received", f"Server not responding ({silent_s:.0f}s), reconnecting")
+        if self.writer is not None:
+            self.writer.transport.abort()
+
+    def _adapt_to_rtt(self):
+        """Keep about two bandwidth-delay products of upload chunks queued"""
+        if self.outbox is None or self.telemetry.srtt is None:
+            return
+        window = 2 * self.telemetry.throughput('upload') * self.telemetry.srtt
+        self.outbox.bulk_high_water = int(min(BULK_MAX_HIGH_WATER, max(BULK_HIGH_WATER, window)))
+
+    def _spawn(self, coro):
+        task = asyncio.ensure_future(coro)
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        return task
+
+    def _close(self):
+        self.running = False
+        for task in list(self._tasks):
+            task.cancel()
+        while self._waiting:
+            _, fut, _ = self._waiting.popleft()
+            if fut is not None and not fut.done():
+                fut.set_exception(ConnectionError("Connection closed"))
+        self.telemetry.connection_reset()
+        if self.outbox is not None:
+            self.outbox.close()
+        if self.writer is not None:
+            self.writer.close()
+
+    def stop(self):
+        """Close the connection for good; must be called on the loop's thread"""
+        self._stopped = True
+        self._close()
+
+    # -- sending -----------------------------------------------------------
+
+    def _write_command(self, cmd, fut):
+        name = command_name(cmd)
+        if name == "LOGOUT":
+            self.reconnect = False
+        if self.reconnecting and fut is None and name in OUTBOX_COMMANDS:
+            self.offline.append(cmd)
+            return True
+        if not (self.outbox and self.running):
+            print("[ERROR] Cannot send - not connected")
+            if fut is not None:
+                fut.set_exception(ConnectionError("Not connected"))
+            return False
+        if not cmd.endswith('\n'):
+            cmd = cmd + '\n'
+        wire = cmd
+        if name == "TEXT_ID" and not self.message_ids:
+            wire = text_id_to_text(cmd)[1]  # replies still match by order
+        data = wire.encode('utf-8')
+        if not self.outbox.put_control(data, opens_stream=name == "UPLOAD_DATA"):
+            print("[ERROR] Cannot send - outbound queue full")
+            if fut is not None:
+                fut.set_exception(ConnectionError("Outbound queue full"))
+            return False
+        self.telemetry.command_sent(wire, len(data))
+        if self.recorder is not None:
+            self.recorder.sent(wire)
+        self._waiting.append([command_name(wire), fut, False])
+        if name in OUTBOX_COMMANDS:
+            self._unacked.append(cmd)
+        return True
+
+    def send(self, cmd):
+        """Queue a command without waiting for its reply (loop thread only)"""
+        return self._write_command(cmd, None)
+
+    def send_text(self, chat_type, name, content, message_id=None):
+        """Send a TEXT tracked by message id; text_delivered / text_failed
+        report its fate. Returns the id (None if it could not be queued)."""
+        message_id = message_id or new_message_id()
+        self._seen_ids.add(message_id)  # our own echo is not a new message
+        if not self._write_command(encode_text_id(message_id, chat_type, name, content), None):
+            self.emit("text_failed", message_id, "not sent")
+            return None
+        return message_id
+
+    async def request(self, cmd, timeout=None):
+        """Send a command and wait for its final reply"""
+        fut = asyncio.get_running_loop().create_future()
+        self._write_command(cmd, fut)
+        if timeout is None:
+            return await fut
+        return await asyncio.wait_for(fut, timeout)
+
+    async def resume_session(self, session, timeout=None):
+        """AUTH with a session saved by an earlier run, instead of LOGIN.
+
+        On AUTH_OK the client is logged in as after a LOGIN reply
+        (login_success, then CAPS); otherwise the FAIL reply is returned
+        and the caller falls back to LOGIN.
+        """
+        reply = await self.request(encode_auth(session), timeout)
+        if reply.ok:
+            self.session = session
+            self.emit("login_success", session, self.username)
+            self.negotiation = self._spawn(self._negotiate())
+        return reply
+
+    async def offer_upload(self, target_type, target_name, filepath, filename, filesize, timeout=None):
+        """Ask to upload a file, offering its sha256 first.
+
+        Resolves with UPLOAD_DEDUP when the server already stores the
+        content (upload_deduplicated is emitted, nothing to send), else with
+        the READY_UPLOAD / FAIL reply. Falls back to plain REQ_UPLOAD on
+        servers without REQ_UPLOAD_HASH.
+        """
+        if self.supports("REQ_UPLOAD_HASH"):
+            digest = await asyncio.get_running_loop().run_in_executor(None, hash_file, filepath)
+            reply = await self.request(
+                encode_req_upload_hash(target_type, target_name, digest, filesize, filename), timeout)
+            if self.supports("REQ_UPLOAD_HASH"):
+                return reply
+        return await self.request(encode_req_upload(target_type, target_name, filename, filesize), timeout)
+
+    async def fetch_preview(self, file_id, save_path, max_bytes, timeout=None):
+        """Download file_id to save_path unless it is larger than max_bytes (REQ_PREVIEW)"""
+        self.pending_downloads[file_id] = ("", save_path, 0)
+        reply = await self.request(encode_req_preview(file_id, max_bytes), timeout)
+        if not reply.ok:
+            self.pending_downloads.pop(file_id, None)
+        return reply
+
+    def _lost_replies(self, kind):
+        """How many waiting requests come before the one a reply of kind answers"""
+        commands = REPLY_COMMANDS.get(kind)
+        if commands is None or self._waiting[0][0] in commands:
+            return 0
+        for i, (cmd, _, _) in enumerate(self._waiting):
+            if cmd in commands:
+                return i
+        return 0  # answers nothing we wait for: keep matching in order
+
+    def _reply_lost(self):
+        """Give up on the oldest waiting request"""
+        cmd, fut, _ = self._waiting.popleft()
+        self.outbox.reply_received()
+        if cmd == "UPLOAD_DATA":
+            self.outbox.close_stream()
+        if cmd in OUTBOX_COMMANDS and self._unacked:
+            sent = self._unacked.popleft()
+            if command_name(sent) == "TEXT_ID":
+                self.emit("text_failed", text_id_to_text(sent)[0], "no reply")
+        if fut is not None and not fut.done():
+            fut.set_exception(ReplyLost(f"No reply to {cmd}"))
+
+    def on_reply(self, line, lines=None):
+        if not self._waiting:
+            return
+        reply = decode_reply(line)
+        parts = line.split(' ', 3)
+        keyword = parts[2] if len(parts) > 2 else ""
+        lost = self._lost_replies(reply[0])
+        if lost:
+            print(f"[ERROR] Lost the replies to {' '.join(cmd for cmd, _, _ in list(self._waiting)[:lost])}")
+            for _ in range(lost):
+                self._reply_lost()
+            # Telemetry matched this line to the oldest command; leave it the
+            # ones still open once the line is handled
+            interim = INTERIM_REPLIES.get(self._waiting[0][0]) == keyword
+            self.telemetry.trim_pending(len(self._waiting) - (0 if interim else 1))
+        entry = self._waiting[0]
+        cmd, fut, interim_seen = entry
+        if not interim_seen and INTERIM_REPLIES.get(cmd) == keyword:
+            entry[2] = True
+            return
+        self._waiting.popleft()
+        self.outbox.reply_received()
+        if cmd == "UPLOAD_DATA":
+            # Final reply: the server has left its chunk loop
+            self.outbox.close_stream()
+        if cmd in OUTBOX_COMMANDS and self._unacked:
+            sent = self._unacked.popleft()
+            if command_name(sent) == "TEXT_ID":
+                message_id = text_id_to_text(sent)[0]
+                if line.startswith("SUCCESS "):
+                    fields = line.split(' ')
+                    self.emit("text_delivered", message_id, fields[4] if len(fields) > 4 else "")
+                else:
+                    self.emit("text_failed", message_id, line.split(' ', 2)[-1])
+        if cmd in OPTIONAL_COMMANDS and is_unknown_command(line):
+            self._mark_unsupported(cmd)
+        elif cmd in QUIET_COMMANDS and line.startswith("FAIL "):
+            self._quiet()
+        if fut is not None and not fut.done():
+            fut.set_result(Reply(line, reply[0], reply[1:], lines))
+
+    # -- transfer engines --------------------------------------------------
+
+    def begin_upload(self, file_id, filepath, filesize, offset):
+        # Commands are already held since UPLOAD_DATA was written (WriteQueue)
+        self._spawn(self.upload_file(file_id, filepath, filesize, offset))
+
+    def begin_download(self, file_id, save_path, filesize):
+        # Chunks follow READY_DOWNLOAD on this stream, so run() awaits the
+        # download before reading the next line.
+        self._transfer = self.download_file(file_id, save_path, filesize)
+
+    async def upload_file(self, file_id, filepath, filesize, offset):
+        """Stream a file as binary chunks followed by the EOF marker"""
+        bytes_sent = offset
+        try:
+            started = time.perf_counter()
+            with open(filepath, 'rb') as f:
+                f.seek(offset)
+                compress = self.chunk_compression and is_compressible(
+                    filepath, f.read(COMPRESS_PROBE_SIZE))
+                f.seek(offset)
+                async for frame, length in chunk_frames(f, offset, filesize, compress):
+                    await self.outbox.put_bulk(frame)
+                    self.telemetry.bytes_sent(len(frame))
+                    bytes_sent += length
+                    self.emit("upload_progress", file_id, bytes_sent, filesize)
+            eof = pack_eof(bytes_sent)
+            await self.outbox.put_bulk(eof)
+            self.telemetry.bytes_sent(len(eof))
+            self._transfer_done('upload', bytes_sent - offset, time.perf_counter() - started)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            print(f"[ERROR] Upload failed: {e}")
+            # End the stream; the server's FAIL reply releases queued commands
+            await self.outbox.put_bulk(pack_eof(bytes_sent))
+            self.emit("upload_failed", file_id, str(e))
+
+    async def download_file(self, file_id, save_path, filesize):
+        """Receive binary chunks up to and including the EOF marker"""
+        try:
+            started = time.perf_counter()
+            with open(save_path, 'wb') as f:
+                bytes_received = 0
+                # The server always terminates the stream with the EOF marker
+                while True:
+                    header = await self.reader.readexactly(CHUNK_HEADER_SIZE)
+                    offset, length = unpack_chunk_header(header)
+                    self.telemetry.bytes_received(CHUNK_HEADER_SIZE)
+                    if length == 0:
+                        break
+                    length, compressed = split_chunk_length(length)
+                    data = await self.reader.readexactly(length)
+                    self._last_rx = time.perf_counter()
+                    self.telemetry.bytes_received(length)
+                    data = unpack_chunk_data(data, compressed)
+                    f.seek(offset)
+                    f.write(data)
+                    bytes_received += len(data)
+                    self.emit("download_progress", file_id, bytes_received, filesize)
+            self._transfer_done('download', bytes_received, time.perf_counter() - started)
+            self.emit("download_complete", file_id)
+            self.pending_downloads.pop(file_id, None)
+        except (OSError, asyncio.IncompleteReadError, zlib.error) as e:
+            print(f"[ERROR] Download failed: {e}")
+            self.pending_downloads.pop(file_id, None)
+            self.emit("download_failed", file_id, str(e))
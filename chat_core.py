@@ -0,0 +1,989 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Headless chat protocol client (no Qt dependency).
+
+Contains the line/chunk framing, command encoders, reply decoder and the
+blocking upload/download engines used by the GUI's NetworkThread. Events are
+reported through a single callback ``on_event(name, *args)`` whose names match
+the GUI's NetworkSignals (friends_updated, text_message, history_received, ...).
+
+Script usage:
+    client = ChatClient("127.0.0.1", 8888)
+    client.start()                      # read loop on a background thread
+    client.send(encode_login("alice", "pw"))
+    name, args = client.wait_for("login_success")
+"""
+
+import hashlib
+import json
+import os
+import queue
+import socket
+import struct
+import sys
+import threading
+import time
+import zlib
+from collections import deque
+from urllib.parse import unquote
+
+from debug_log import DEBUG_LOG
+from telemetry import Telemetry, SPAN_HISTORY_BODY
+
+# Hằng số truyền file
+CHUNK_HEADER_SIZE = 8
+CHUNK_SIZE = 65536  # 64KB
+RECV_SIZE = 65536
+
+# Marker used by history_received when the server answers FAIL 404 NO_MESSAGES
+NO_MESSAGES = "__NO_MESSAGES__"
+
+# File to record the session to as a replay script (see replay_bench.py)
+RECORD_ENV = "LTM_RECORD"
+REPLAY_FORMAT = "ltm-replay"
+
+# Extensions only reference_server.py implements; server.cpp answers them with
+# FAIL 400 UNKNOWN_COMMAND, after which the client stops sending them
+OPTIONAL_COMMANDS = {"REQ_UPLOAD_HASH", "FORWARD_FILE", "LIST_FILES", "REQ_PREVIEW", "CAPS", "PING"}
+# Commands whose FAIL replies only matter to the caller (no user notification)
+QUIET_COMMANDS = {"REQ_PREVIEW"}
+HASH_READ_SIZE = 1 << 20
+
+# Control stream compression (CAPS zlib): after the CAPS reply the server
+# sends [flags|length:4][payload] frames; flagged payloads continue one zlib
+# stream, the others (download chunks) are raw
+COMPRESS_ENV = "LTM_COMPRESS"  # "0" disables it in the GUI
+HEARTBEAT_ENV = "LTM_HEARTBEAT"  # "<interval>[,<timeout>]" seconds for the GUI, "0" disables
+CAP_ZLIB = "zlib"
+FRAME_HEADER_SIZE = 4
+FRAME_COMPRESSED = 0x80000000
+
+# Client message ids (CAPS msgid): TEXT_ID <id> <type> <name> <content> is
+# answered SUCCESS 201 SENT <id> <ts>, and receivers that negotiated msgid get
+# NOTIFY_TEXT_ID <id> ...; the server drops a resent id instead of storing it
+# twice. Without msgid the client sends TEXT and matches replies by order.
+CAP_MSGID = "msgid"
+RECENT_IDS = 4096  # message ids remembered for deduplication
+
+# Chunk compression (CAPS zchunk): a chunk whose length has CHUNK_COMPRESSED
+# set carries zlib data; its offset is still the offset in the plain file
+CAP_ZCHUNK = "zchunk"
+CHUNK_COMPRESSED = 0x80000000
+CHUNK_ZLIB_LEVEL = 3
+COMPRESS_PROBE_SIZE = 16384
+COMPRESS_PROBE_RATIO = 0.9  # probe must shrink below this to compress the file
+COMPRESSED_EXTENSIONS = {
+    ".jpg", ".jpeg", ".jfif", ".png", ".gif", ".webp", ".heic",
+    ".zip", ".gz", ".tgz", ".bz2", ".xz", ".7z", ".rar", ".zst",
+    ".mp3", ".m4a", ".aac", ".ogg", ".mp4", ".mkv", ".mov", ".avi", ".webm",
+    ".docx", ".xlsx", ".pptx", ".jar", ".apk",
+}
+
+
+# ============================================================================
+# Framing
+# ============================================================================
+
+class RecentIds:
+    """Set of the last ``capacity`` ids added; O(1) add and lookup"""
+
+    def __init__(self, capacity=RECENT_IDS):
+        self.capacity = capacity
+        self._order = deque()
+        self._ids = set()
+
+    def __contains__(self, item):
+        return item in self._ids
+
+    def __len__(self):
+        return len(self._ids)
+
+    def add(self, item):
+        """Add item; False if it was already there"""
+        if item in self._ids:
+            return False
+        self._ids.add(item)
+        self._order.append(item)
+        if len(self._order) > self.capacity:
+            self._ids.discard(self._order.popleft())
+        return True
+
+
+def new_message_id():
+    return os.urandom(8).hex()
+
+
+class LineBuffer:
+    """Byte buffer that yields newline-terminated text lines and raw byte runs.
+
+    Text and binary chunks share one socket, so binary payloads that arrive in
+    the same recv() as a text line must be served from here first.
+    """
+
+    def __init__(self):
+        self._buf = bytearray()
+
+    def __len__(self):
+        return len(self._buf)
+
+    def feed(self, data):
+        self._buf += data
+
+    def next_line(self):
+        """Return the next complete line (stripped), or None if incomplete"""
+        idx = self._buf.find(b'\n')
+        if idx < 0:
+            return None
+        raw = bytes(self._buf[:idx])
+        del self._buf[:idx + 1]
+        return raw.decode('utf-8', errors='replace').strip()
+
+    def take(self, n):
+        """Remove and return up to n buffered bytes"""
+        data = bytes(self._buf[:n])
+        del self._buf[:n]
+        return data
+
+
+def pack_chunk(offset, data):
+    """Binary chunk: [offset:4][length:4][data]"""
+    return struct.pack('!II', offset, len(data)) + data
+
+
+def pack_eof(offset):
+    return struct.pack('!II', offset, 0)
+
+
+def unpack_chunk_header(header):
+    """Return (offset, length); length == 0 is the EOF marker"""
+    return struct.unpack('!II', header)
+
+
+def split_chunk_length(length):
+    """(bytes on the wire, compressed?) for a chunk header length"""
+    return length & ~CHUNK_COMPRESSED, bool(length & CHUNK_COMPRESSED)
+
+
+def pack_zchunk(offset, data):
+    """pack_chunk with zlib data when that is smaller (runs on worker threads)"""
+    packed = zlib.compress(data, CHUNK_ZLIB_LEVEL)
+    if len(packed) >= len(data):
+        return pack_chunk(offset, data)
+    return struct.pack('!II', offset, CHUNK_COMPRESSED | len(packed)) + packed
+
+
+def unpack_chunk_data(data, compressed):
+    return zlib.decompress(data) if compressed else data
+
+
+def is_compressible(filename, sample):
+    """Worth compressing: not a known compressed format and the sample shrinks"""
+    if os.path.splitext(filename)[1].lower() in COMPRESSED_EXTENSIONS:
+        return False
+    sample = sample[:COMPRESS_PROBE_SIZE]
+    if not sample:
+        return False
+    return len(zlib.compress(sample, 1)) < len(sample) * COMPRESS_PROBE_RATIO
+
+
+# ============================================================================
+# Command encoders
+# ============================================================================
+
+def encode(*tokens):
+    return ' '.join(str(t) for t in tokens) + '\n'
+
+
+def encode_register(username, password):
+    return encode("REGISTER", username, password)
+
+
+def encode_login(username, password):
+    return encode("LOGIN", username, password)
+
+
+def encode_auth(session):
+    return encode("AUTH", session)
+
+
+def encode_logout():
+    return encode("LOGOUT")
+
+
+def encode_text(chat_type, name, content):
+    return encode("TEXT", chat_type, name, content)
+
+
+def encode_text_id(message_id, chat_type, name, content):
+    return encode("TEXT_ID", message_id, chat_type, name, content)
+
+
+def text_id_to_text(cmd):
+    """TEXT_ID line -> (message id, the same message as a plain TEXT line)"""
+    _, message_id, rest = cmd.split(' ', 2)
+    return message_id, "TEXT " + rest
+
+
+def encode_history(chat_type, name, begin=0, end=0):
+    return encode("HISTORY", chat_type, name, begin, end)
+
+
+def encode_req_upload(target_type, target_name, filename, filesize):
+    return encode("REQ_UPLOAD", target_type, target_name, filename, filesize)
+
+
+def encode_req_upload_hash(target_type, target_name, digest, filesize, filename):
+    """REQ_UPLOAD with the file's sha256 so the server can reuse a stored copy"""
+    return encode("REQ_UPLOAD_HASH", target_type, target_name, digest, filesize, filename)
+
+
+def encode_upload_data(file_id):
+    return encode("UPLOAD_DATA", file_id)
+
+
+def encode_cancel_upload(file_id):
+    return encode("REQ_CANCEL_UPLOAD", file_id)
+
+
+def encode_caps(*caps):
+    return encode("CAPS", *caps)
+
+
+def encode_ping(token):
+    return encode("PING", token)
+
+
+def encode_req_download(file_id):
+    return encode("REQ_DOWNLOAD", file_id)
+
+
+def encode_req_preview(file_id, max_bytes):
+    """REQ_DOWNLOAD that the server refuses (FAIL 413) for files over max_bytes"""
+    return encode("REQ_PREVIEW", file_id, max_bytes)
+
+
+def encode_forward_file(file_id, target_type, target_name):
+    """Share an already stored file with another chat; no payload is sent"""
+    return encode("FORWARD_FILE", file_id, target_type, target_name)
+
+
+def encode_list_files(chat_type, name, offset=0, limit=50, sort="-time", sender="", ext="",
+                      min_size=0, max_size=0):
+    """One page of a conversation's file catalog; sort is time|size|name, '-' for descending"""
+    opts = {"offset": offset, "limit": limit, "sort": sort, "sender": sender, "ext": ext,
+            "min_size": min_size, "max_size": max_size}
+    return encode("LIST_FILES", chat_type, name, *(f"{k}={v}" for k, v in opts.items() if v))
+
+
+# ============================================================================
+# Reply decoder
+# ============================================================================
+
+def hash_file(path):
+    """Hex sha256 of a file, read in HASH_READ_SIZE pieces"""
+    h = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(HASH_READ_SIZE), b''):
+            h.update(block)
+    return h.hexdigest()
+
+
+def is_unknown_command(line):
+    return line.startswith("FAIL 400 UNKNOWN_COMMAND")
+
+
+def _split_tail(data):
+    """'KEYWORD rest' -> rest ('' when absent)"""
+    return data.split(' ', 1)[1] if ' ' in data else ""
+
+
+def _pairs(text, maxsplit=1):
+    out = []
+    for tok in text.split():
+        if ':' in tok:
+            out.append(tuple(tok.split(':', maxsplit)))
+    return out
+
+
+def parse_history_header(line):
+    """Return N for 'SUCCESS 200 <N>' or 'SUCCESS 200 HISTORY <N>', else -1"""
+    hdr = line.strip().split()
+    if len(hdr) >= 3 and hdr[0] == "SUCCESS" and hdr[1] == "200":
+        if len(hdr) == 3 and hdr[2].isdigit():
+            return int(hdr[2])
+        if len(hdr) >= 4 and hdr[2] == "HISTORY" and hdr[3].isdigit():
+            return int(hdr[3])
+    return -1
+
+
+def is_history_line(line):
+    """msgId|sender|timestamp|TYPE|length|content with a numeric msgId"""
+    return line.count('|') >= 5 and line.split('|', 1)[0].isdigit()
+
+
+def parse_history_line(line):
+    """Return (sender, timestamp, type, content) or None.
+
+    Accepts the server's 'msgId|sender|ts|TYPE|len|content' lines as well as
+    the legacy 'ts|sender|TYPE|content' storage format.
+    """
+    parts6 = line.split('|', 5)
+    if len(parts6) >= 6 and parts6[0].isdigit():
+        _msg_id, sender, ts, mtype, _length, content = parts6
+        return sender, ts, mtype, content
+    parts4 = line.split('|', 3)
+    if len(parts4) >= 4:
+        ts, sender, mtype, content = parts4
+        return sender, ts, mtype, content
+    return None
+
+
+def parse_file_entry(token):
+    """(file_id, sender, upload_time, size, filename) from a LIST_FILES entry, or None"""
+    parts = token.split('|', 4)
+    if len(parts) < 5 or not parts[2].isdigit() or not parts[3].isdigit():
+        return None
+    return parts[0], parts[1], int(parts[2]), int(parts[3]), unquote(parts[4])
+
+
+def decode_reply(line):
+    """Decode one server line into a (kind, *fields) tuple.
+
+    Unknown lines decode to ('unknown', line).
+    """
+    parts = line.split(' ', 2)
+    head = parts[0]
+    if head == "NOTIFY" and len(parts) > 1 and parts[1] == "SESSION_EXPIRED":
+        # NOTIFY SESSION_EXPIRED <old session>: logged in from another device
+        return ("notify_session_expired",)
+    if len(parts) < 2:
+        return ("unknown", line)
+
+    if head == "SUCCESS":
+        code = parts[1]
+        data = parts[2] if len(parts) > 2 else ""
+        if code == "200":
+            if data.startswith("SESSION "):
+                return ("session", data.split(' ', 1)[1])
+            if data.startswith("FRIENDS "):
+                return ("friends", _pairs(_split_tail(data)))
+            if data.startswith("PENDING_REQUESTS "):
+                return ("pending_requests", [r.strip() for r in _split_tail(data).split() if r.strip()])
+            if data.startswith("GROUP_INVITES "):
+                return ("group_invites", _pairs(_split_tail(data)))
+            if data.startswith("GROUPS "):
+                return ("groups", _pairs(_split_tail(data)))
+            if data.startswith("MEMBERS "):
+                members = [m for m in _pairs(_split_tail(data), 2) if len(m) >= 3]
+                return ("members", members)
+            if data.startswith("CAPS"):
+                return ("caps", data.split()[1:])
+            if data.startswith("FILES "):
+                # FILES <total> <offset> <entry>...
+                tokens = data.split(' ')
+                if len(tokens) >= 3 and tokens[1].isdigit() and tokens[2].isdigit():
+                    entries = [e for e in map(parse_file_entry, tokens[3:]) if e]
+                    return ("files", int(tokens[1]), int(tokens[2]), entries)
+                return ("unknown", line)
+            if data.startswith("READY_UPLOAD "):
+                return ("ready_upload", data.split(' ')[1])
+            if data.startswith("LEFT "):
+                return ("left", data.split(' ', 1)[1])
+            if data.startswith("LEFT_AND_DELETED "):
+                return ("left_and_deleted", data.split(' ', 1)[1])
+            if data.startswith("START_UPLOAD "):
+                return ("start_upload", int(data.split(' ')[1]))
+            if data.startswith("UPLOAD_COMPLETE"):
+                return ("upload_complete",)
+            if data.startswith("READY_DOWNLOAD "):
+                # READY_DOWNLOAD <file_id> <filename> <filesize>; filename may contain spaces
+                rest = _split_tail(data)
+                if ' ' in rest:
+                    file_id, tail = rest.split(' ', 1)
+                    if ' ' in tail:
+                        filename, size = tail.rsplit(' ', 1)
+                        if size.isdigit():
+                            return ("ready_download", file_id, filename, int(size))
+                return ("unknown", line)
+            if data.startswith("RESUME_DOWNLOAD "):
+                return ("resume_download", int(data.split(' ')[1]))
+            if data.startswith("DOWNLOAD_COMPLETE"):
+                return ("download_complete",)
+            n = parse_history_header(line)
+            if n >= 0:
+                return ("history_header", n)
+        elif code == "201":
+            if data.startswith("REGISTERED "):
+                return ("registered", data.split(' ', 1)[1])
+            if data.startswith("FRIEND_ADDED "):
+                return ("friend_added", data.split(' ', 1)[1])
+            if data.startswith("UPLOAD_DEDUP "):
+                return ("upload_dedup", data.split(' ')[1])
+            if data.startswith("FORWARDED "):
+                return ("forwarded", data.split(' ')[1])
+            if data.startswith("SENT "):
+                # SENT <message id> <ts> (TEXT_ID only)
+                fields = data.split(' ')
+                return ("sent", fields[1], fields[2] if len(fields) > 2 else "")
+        return ("ok", code, data)
+
+    if head == "FAIL":
+        return ("fail", parts[1], parts[2] if len(parts) > 2 else "Unknown error")
+
+    if head == "NOTIFY_FRIEND_REQUEST":
+        return ("notify_friend_request", line.split(' ', 1)[1])
+    if head == "NOTIFY_FRIEND_ACCEPTED":
+        return ("notify_friend_accepted", line.split(' ', 1)[1])
+    if head == "NOTIFY_TEXT_ID":
+        # NOTIFY_TEXT_ID <message id> <NOTIFY_TEXT fields>
+        if len(parts) >= 3:
+            text = decode_reply("NOTIFY_TEXT " + parts[2])
+            if text[0] == "text":
+                return ("text_id", parts[1]) + text[1:]
+        return ("unknown", line)
+    if head == "NOTIFY_TEXT":
+        # NOTIFY_TEXT U <sender> <timestamp> <content>
+        # NOTIFY_TEXT G <group_name> <sender> <timestamp> <content>
+        if len(parts) >= 3:
+            msg_type, rest = parts[1], parts[2]
+            if msg_type == "U":
+                rest_parts = rest.split(' ', 2)
+                if len(rest_parts) >= 3:
+                    sender, ts, content = rest_parts
+                    return ("text", "U", sender, sender, ts, content)
+            elif msg_type == "G":
+                rest_parts = rest.split(' ', 3)
+                if len(rest_parts) >= 4:
+                    group_name, sender, ts, content = rest_parts
+                    return ("text", "G", group_name, sender, ts, content)
+        return ("unknown", line)
+    if head == "NOTIFY_GROUP_INVITE":
+        p = line.split(' ', 3)
+        if len(p) >= 3:
+            return ("notify_group_invite", p[1], p[2])
+    if head == "NOTIFY_EJECTED":
+        p = line.split(' ', 3)
+        if len(p) >= 3:
+            return ("notify_ejected", p[1], p[2])
+    if head == "NOTIFY_MEMBER_LEFT":
+        p = line.split(' ', 3)
+        if len(p) >= 3:
+            return ("notify_member_left", p[1], p[2])
+    if head == "NOTIFY_NEW_ADMIN":
+        return ("notify_new_admin", line.split(' ', 2)[1])
+    if head == "NOTIFY_FILE":
+        # NOTIFY_FILE <type> <target> <sender> <file_id> <filename>
+        p = line.split(' ', 5)
+        if len(p) >= 6:
+            return ("file", p[1], p[2], p[3], p[4], p[5])
+    return ("unknown", line)
+
+
+# ============================================================================
+# Recording
+# ============================================================================
+
+class TrafficRecorder:
+    """Writes a session as a replay script: one JSON object per line, a header
+    then {"t": seconds, "c": client, "op": "send"|"recv"|"upload"|"download", ...}"""
+
+    def __init__(self, path, source="client"):
+        self._file = open(path, 'w', encoding='utf-8', buffering=1)
+        self._lock = threading.Lock()
+        self._started = time.perf_counter()
+        self._write({"format": REPLAY_FORMAT, "version": 1, "source": source, "started": time.time()})
+
+    def _write(self, record):
+        with self._lock:
+            if not self._file.closed:
+                self._file.write(json.dumps(record, ensure_ascii=False) + "\n")
+
+    def event(self, op, **fields):
+        self._write({"t": round(time.perf_counter() - self._started, 6), "c": 0, "op": op, **fields})
+
+    def sent(self, line):
+        self.event("send", line=line.rstrip('\n'))
+
+    def received(self, line):
+        self.event("recv", line=line)
+
+    def transfer(self, direction, nbytes):
+        self.event(direction, bytes=nbytes)
+
+    def close(self):
+        with self._lock:
+            self._file.close()
+
+
+# ============================================================================
+# Protocol state
+# ============================================================================
+
+class ProtocolHandler:
+    """Client-side protocol state and reply dispatch, independent of I/O.
+
+    Subclasses provide the transport: ``send(cmd)``, ``begin_upload(...)``
+    (stream chunks after START_UPLOAD) and ``begin_download(...)`` (read
+    chunks after READY_DOWNLOAD).
+    """
+
+    def __init__(self, on_event=None, telemetry=None):
+        self.running = False
+        self.session = None
+        self.username = None
+        self.pending_downloads = {}  # id_file -> (filename, save_path, filesize)
+        self.active_upload = None  # (id_file, filepath, filesize)
+        self.telemetry = telemetry or Telemetry()
+        self.events = None
+        if on_event is None:
+            # Scripts without a callback consume events from a queue
+            self.events = queue.Queue()
+            on_event = lambda name, *args: self.events.put((name, args))
+        self.on_event = on_event
+        self._history_expected = 0
+        self._history_header = None
+        self._history_buffer = []
+        self.recorder = None
+        self.unsupported = set()  # OPTIONAL_COMMANDS the server rejected
+        self.chunk_compression = False  # server accepted CAPS zchunk
+        self.message_ids = False  # server accepted CAPS msgid
+        self._seen_ids = RecentIds()  # message ids sent or shown already
+        self._quiet_reply = False
+
+    def supports(self, command):
+        return command not in self.unsupported
+
+    def emit(self, name, *args):
+        self.on_event(name, *args)
+
+    def start_recording(self, path):
+        """Record every command, reply and transfer size to a replay script"""
+        self.recorder = TrafficRecorder(path)
+
+    def stop_recording(self):
+        if self.recorder is not None:
+            self.recorder.close()
+            self.recorder = None
+
+    def _transfer_done(self, direction, nbytes, seconds):
+        self.telemetry.transfer_done(direction, nbytes, seconds)
+        if self.recorder is not None:
+            self.recorder.transfer(direction, nbytes)
+
+    def send(self, cmd):
+        raise NotImplementedError
+
+    def begin_upload(self, file_id, filepath, filesize, offset):
+        raise NotImplementedError
+
+    def begin_download(self, file_id, save_path, filesize):
+        raise NotImplementedError
+
+    def on_reply(self, line, lines=None):
+        """Called once per command reply (a HISTORY reply includes its body lines).
+
+        Transports that know which command a reply answers call
+        _mark_unsupported() for an optional one the server does not know
+        and _quiet() for replies that are not meant for the user.
+        """
+
+    def _quiet(self):
+        self._quiet_reply = True
+
+    def _mark_unsupported(self, command):
+        self.unsupported.add(command)
+        self._quiet()  # expected, not an error for the user
+
+    # -- high level operations --------------------------------------------
+
+    def upload_data(self, file_id, filepath, filesize):
+        """Answer READY_UPLOAD: remember the file and ask the server to start"""
+        self.active_upload = (file_id, filepath, filesize)
+        return self.send(encode_upload_data(file_id))
+
+    def request_download(self, file_id, save_path, filename=""):
+        self.pending_downloads[file_id] = (filename, save_path, 0)
+        return self.send(encode_req_download(file_id))
+
+    # -- reply handling ----------------------------------------------------
+
+    def handle_line(self, msg):
+        if DEBUG_LOG.verbose:
+            DEBUG_LOG.debug("[Server] %s", msg)
+        if self.recorder is not None:
+            self.recorder.received(msg)
+
+        # History lines are only expected right after a HISTORY header
+        if self._history_expected > 0 and is_history_line(msg):
+            self._history_buffer.append(msg)
+            self._history_expected -= 1
+            if self._history_expected == 0:
+                lines, self._history_buffer = self._history_buffer, []
+                self.telemetry.end_span(SPAN_HISTORY_BODY)
+                self.on_reply(self._history_header, lines)
+                self.emit("history_received", "", "", lines)
+            return
+
+        reply = decode_reply(msg)
+        kind = reply[0]
+        if msg.startswith("SUCCESS ") or msg.startswith("FAIL "):
+            self.telemetry.reply_received(msg)
+            if not (kind == "history_header" and reply[1] > 0):
+                self.on_reply(msg)
+            if self._quiet_reply:
+                self._quiet_reply = False
+                return
+        handler = getattr(self, "_on_" + kind, None)
+        if handler is not None:
+            handler(*reply[1:])
+
+    def _on_session(self, session):
+        self.session = session
+        # Send AUTH command to authenticate this connection with the session
+        self.send(encode_auth(session))
+        self.emit("login_success", session, self.username)
+
+    def _on_friends(self, friends):
+        self.emit("friends_updated", friends)
+
+    def _on_pending_requests(self, requests):
+        self.emit("pending_requests_updated", requests)
+
+    def _on_group_invites(self, invites):
+        self.emit("group_invites_updated", invites)
+
+    def _on_groups(self, groups):
+        self.emit("groups_updated", groups)
+
+    def _on_members(self, members):
+        # Group name is determined by the caller's context
+        self.emit("members_received", "", members)
+
+    def _on_ready_upload(self, file_id):
+        self.emit("upload_ready", file_id, "0")
+
+    def _on_upload_dedup(self, file_id):
+        # The server already had the content; no bytes to send
+        self.emit("upload_deduplicated", file_id)
+
+    def _on_left(self, group_name):
+        self.emit("left_group", group_name)
+        self.emit("notification", "Left Group", f"You have left {group_name}")
+        self.send("GET_GROUPS\n")
+
+    def _on_left_and_deleted(self, group_name):
+        self.emit("left_group", group_name)
+        self.emit("notification", "Group Deleted", f"You left and {group_name} was deleted")
+        self.send("GET_GROUPS\n")
+
+    def _on_start_upload(self, offset):
+        if self.active_upload:
+            file_id, filepath, filesize = self.active_upload
+            self.begin_upload(file_id, filepath, filesize, offset)
+
+    def _on_upload_complete(self):
+        if self.active_upload:
+            file_id = self.active_upload[0]
+            self.active_upload = None
+            self.emit("upload_complete", file_id)
+
+    def _on_ready_download(self, file_id, filename, filesize):
+        if file_id in self.pending_downloads:
+            _, save_path, _ = self.pending_downloads[file_id]
+            self.begin_download(file_id, save_path, filesize)
+        else:
+            print(f"[ERROR] No pending download for file_id={file_id}")
+
+    def _on_resume_download(self, offset):
+        self.emit("download_ready", "", "", offset)
+
+    def _on_history_header(self, n):
+        self._history_expected = n
+        self._history_header = f"SUCCESS 200 {n}"
+        self._history_buffer = []
+        if n > 0:
+            self.telemetry.start_span(SPAN_HISTORY_BODY)
+        else:
+            self.emit("history_received", "", "", [])
+
+    def _on_registered(self, user):
+        self.emit("notification", "Success", f"Account created: {user}")
+        self.emit("registration_success", user)
+
+    def _on_friend_added(self, friend):
+        self.emit("notification", "Friend Added", f"{friend} is now your friend")
+
+    def _on_fail(self, code, msg_text):
+        if code == "404" and msg_text == "NO_MESSAGES":
+            self.emit("history_received", "", "", [NO_MESSAGES])
+        elif not self.session:
+            # Only treat as login failure before session is established
+            self.emit("login_failed", msg_text)
+        else:
+            self.emit("notification", "Error", msg_text)
+
+    def _on_notify_friend_request(self, sender):
+        self.emit("notification", "Friend Request", f"{sender} sent you a friend request")
+
+    def _on_notify_friend_accepted(self, friend):
+        self.emit("notification", "Request Accepted", f"{friend} accepted your friend request")
+
+    def _on_notify_session_expired(self):
+        # The server closes this connection next; the session cannot be resumed
+        self.session = None
+        self.emit("session_rejected", "SESSION_EXPIRED")
+        self.emit("notification", "Session Expired", "Logged out from another device")
+
+    def _on_text(self, msg_type, name, sender, ts, content):
+        self.emit("text_message", msg_type, name, sender, content)
+
+    def _on_text_id(self, message_id, msg_type, name, sender, ts, content):
+        # A resend, or the echo of a message this client sent itself
+        if self._seen_ids.add(message_id):
+            self._on_text(msg_type, name, sender, ts, content)
+
+    def _on_notify_group_invite(self, group_name, inviter):
+        self.emit("notification", "Group Invite", f"{inviter} invited you to {group_name}")
+
+    def _on_notify_ejected(self, group_name, admin):
+        self.emit("notification", "Removed from Group", f"You were removed from {group_name} by {admin}")
+        self.emit("left_group", group_name)
+        self.send("GET_GROUPS\n")
+
+    def _on_notify_member_left(self, group_name, username):
+        self.emit("notification", "Member Left", f"{username} left {group_name}")
+
+    def _on_notify_new_admin(self, group_name):
+        self.emit("notification", "New Group Admin", f"You are now the admin of {group_name}")
+
+    def _on_file(self, file_type, target, sender, file_id, filename):
+        self.emit("file_notification", file_type, target, sender, file_id, filename)
+
+
+# ============================================================================
+# Blocking client
+# ============================================================================
+
+class ChatClient(ProtocolHandler):
+    """Blocking protocol client; one reader loop per connection.
+
+    ``run()`` connects and processes server lines until the socket closes.
+    Uploads and downloads run inline on the reader loop because the server
+    streams binary chunks over the control connection.
+    """
+
+    def __init__(self, host, port, on_event=None, telemetry=None):
+        super().__init__(on_event, telemetry)
+        self.host = host
+        self.port = port
+        self.sock = None
+        self._buffer = LineBuffer()
+        self._send_lock = threading.Lock()
+        self._thread = None
+
+    # -- connection --------------------------------------------------------
+
+    def connect(self, timeout=5.0):
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.sock.settimeout(timeout)
+        self.sock.connect((self.host, self.port))
+        self.sock.settimeout(None)
+        # OS-level backstop for half-open connections (AsyncChatClient also pings)
+        self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
+        self.running = True
+
+    def run(self):
+        """Connect and process server lines until disconnected"""
+        try:
+            self.connect()
+            self.emit("connected")
+            while self.running:
+                try:
+                    raw_data = self.sock.recv(RECV_SIZE)
+                except OSError as e:
+                    print(f"[ERROR] recv() failed: {e}")
+                    if self.running:
+                        self.emit("message_received", f"Error: {e}")
+                    break
+                if not raw_data:
+                    print("[ERROR] Socket closed by server")
+                    break
+                self.telemetry.bytes_received(len(raw_data))
+                self._buffer.feed(raw_data)
+                self._drain_lines()
+        except Exception as e:
+            self.emit("message_received", f"Connection failed: {e}")
+        finally:
+            self.running = False
+            if self.sock:
+                try:
+                    self.sock.close()
+                except OSError:
+                    pass
+            self.telemetry.connection_reset()
+            self.emit("disconnected")
+
+    def start(self):
+        """Run the reader loop on a daemon thread"""
+        self._thread = threading.Thread(target=self.run, daemon=True)
+        self._thread.start()
+        return self._thread
+
+    def _drain_lines(self):
+        while self.running:
+            line = self._buffer.next_line()
+            if line is None:
+                return
+            if not line:
+                continue
+            try:
+                self.handle_line(line)
+            except Exception as e:
+                print(f"[ERROR] Failed to handle message '{line}': {e}")
+                import traceback
+                traceback.print_exc()
+
+    def send(self, cmd):
+        if not (self.sock and self.running):
+            print("[ERROR] Cannot send - sock or running is False")
+            return False
+        # Don't add newline if cmd already ends with it
+        if not cmd.endswith('\n'):
+            cmd = cmd + '\n'
+        data = cmd.encode('utf-8')
+        try:
+            with self._send_lock:
+                self.telemetry.command_sent(cmd, len(data))
+                if self.recorder is not None:
+                    self.recorder.sent(cmd)
+                self.sock.sendall(data)
+            return True
+        except OSError as e:
+            print(f"[ERROR] Failed to send: {e}")
+            return False
+
+    def stop(self):
+        self.running = False
+        if self.sock:
+            try:
+                self.sock.close()
+            except OSError:
+                pass
+
+    def wait_for(self, *names, timeout=10.0):
+        """Block until one of the named events arrives (queue mode only)"""
+        deadline = time.monotonic() + timeout
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                raise TimeoutError(f"Timed out waiting for {names}")
+            name, args = self.events.get(timeout=remaining)
+            if name in names:
+                return name, args
+
+    def begin_upload(self, file_id, filepath, filesize, offset):
+        self.upload_file(file_id, filepath, filesize, offset)
+
+    def begin_download(self, file_id, save_path, filesize):
+        self.download_file(file_id, save_path, filesize)
+
+    # -- transfer engines --------------------------------------------------
+
+    def recv_exact(self, n):
+        """Receive exactly n bytes, serving already-buffered bytes first"""
+        data = self._buffer.take(n)
+        while len(data) < n:
+            chunk = self.sock.recv(n - len(data))
+            if not chunk:
+                raise ConnectionError("Connection closed while receiving data")
+            self.telemetry.bytes_received(len(chunk))
+            data += chunk
+        return data
+
+    def upload_file(self, file_id, filepath, filesize, offset):
+        """Stream a file as binary chunks followed by the EOF marker"""
+        try:
+            started = time.perf_counter()
+            with open(filepath, 'rb') as f:
+                f.seek(offset)
+                bytes_sent = offset
+                compress = self.chunk_compression and is_compressible(
+                    filepath, f.read(COMPRESS_PROBE_SIZE))
+                f.seek(offset)
+                while bytes_sent < filesize:
+                    data = f.read(min(CHUNK_SIZE, filesize - bytes_sent))
+                    if not data:
+                        break
+                    frame = pack_zchunk(bytes_sent, data) if compress else pack_chunk(bytes_sent, data)
+                    with self._send_lock:
+                        self.sock.sendall(frame)
+                    self.telemetry.bytes_sent(len(frame))
+                    bytes_sent += len(data)
+                    self.emit("upload_progress", file_id, bytes_sent, filesize)
+                eof = pack_eof(bytes_sent)
+                with self._send_lock:
+                    self.sock.sendall(eof)
+                self.telemetry.bytes_sent(len(eof))
+                self._transfer_done('upload', bytes_sent - offset, time.perf_counter() - started)
+        except Exception as e:
+            print(f"[ERROR] Upload failed: {e}")
+            self.emit("upload_failed", file_id, str(e))
+
+    def download_file(self, file_id, save_path, filesize):
+        """Receive binary chunks up to and including the EOF marker"""
+        try:
+            started = time.perf_counter()
+            with open(save_path, 'wb') as f:
+                bytes_received = 0
+                # The server always terminates the stream with the EOF marker
+                while True:
+                    offset, length = unpack_chunk_header(self.recv_exact(CHUNK_HEADER_SIZE))
+                    if length == 0:
+                        break
+                    length, compressed = split_chunk_length(length)
+                    data = unpack_chunk_data(self.recv_exact(length), compressed)
+                    f.seek(offset)
+                    f.write(data)
+                    bytes_received += len(data)
+                    self.emit("download_progress", file_id, bytes_received, filesize)
+            self._transfer_done('download', bytes_received, time.perf_counter() - started)
+            self.emit("download_complete", file_id)
+            self.pending_downloads.pop(file_id, None)
+        except Exception as e:
+            print(f"[ERROR] Download failed: {e}")
+            self.emit("download_failed", file_id, str(e))
+
+
+def main(argv):
+    """Log in and print every event: python chat_core.py host:port user password"""
+    if len(argv) < 4:
+        print("usage: chat_core.py host:port username password")
+        return 2
+    host, port = argv[1].rsplit(':', 1)
+    client = ChatClient(host, int(port))
+    client.username = argv[2]
+    if os.environ.get(RECORD_ENV):
+        client.start_recording(os.environ[RECORD_ENV])
+    client.start()
+    client.wait_for("connected")
+    client.send(encode_login(argv[2], argv[3]))
+    name, args = client.wait_for("login_success", "login_failed")
+    print(name, *args)
+    if name != "login_success":
+        return 1
+    client.send("GET_FRIENDS")
+    client.send("GET_GROUPS")
+    try:
+        while True:
+            name, args = client.events.get()
+            print(name, *args)
+            if name == "disconnected":
+                return 0
+    except KeyboardInterrupt:
+        client.stop()
+        return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
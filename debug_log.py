@@ -0,0 +1,89 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Bounded in-memory debug log with levels and lazy formatting.
+
+Records are stored as (seq, time, level, fmt, args) in a ring buffer and only
+formatted when a reader pulls them, so logging from the network thread costs
+one deque append. Callers on hot paths should guard with ``log.verbose``.
+"""
+
+import os
+import threading
+import time
+from collections import deque
+from datetime import datetime
+
+DEBUG = 10
+INFO = 20
+WARNING = 30
+ERROR = 40
+
+LEVEL_NAMES = {DEBUG: "DEBUG", INFO: "INFO", WARNING: "WARN", ERROR: "ERROR"}
+
+
+class DebugLog:
+    """Thread-safe ring buffer of log records"""
+
+    def __init__(self, capacity=2000, level=INFO):
+        self._records = deque(maxlen=capacity)
+        self._lock = threading.Lock()
+        self._seq = 0
+        self.level = level
+        self.verbose = level <= DEBUG
+
+    def set_level(self, level):
+        self.level = level
+        self.verbose = level <= DEBUG
+
+    def log(self, level, fmt, *args):
+        if level < self.level:
+            return
+        with self._lock:
+            self._seq += 1
+            self._records.append((self._seq, time.time(), level, fmt, args))
+
+    def debug(self, fmt, *args):
+        if self.verbose:
+            self.log(DEBUG, fmt, *args)
+
+    def info(self, fmt, *args):
+        self.log(INFO, fmt, *args)
+
+    def warning(self, fmt, *args):
+        self.log(WARNING, fmt, *args)
+
+    def error(self, fmt, *args):
+        self.log(ERROR, fmt, *args)
+
+    @property
+    def last_seq(self):
+        return self._seq
+
+    def since(self, seq):
+        """Return [(seq, formatted_line)] for records newer than seq"""
+        with self._lock:
+            if not self._records or self._records[-1][0] <= seq:
+                return []
+            records = [r for r in self._records if r[0] > seq]
+        return [(r[0], self.format_record(r)) for r in records]
+
+    @staticmethod
+    def format_record(record):
+        _seq, ts, level, fmt, args = record
+        try:
+            text = fmt % args if args else fmt
+        except (TypeError, ValueError):
+            text = f"{fmt} {args!r}"
+        stamp = datetime.fromtimestamp(ts).strftime("%H:%M:%S")
+        if level == INFO:
+            return f"[{stamp}] {text}"
+        return f"[{stamp}] {LEVEL_NAMES.get(level, level)}: {text}"
+
+    def clear(self):
+        with self._lock:
+            self._records.clear()
+
+
+# Shared instance used by the client; LTM_VERBOSE=1 enables per-line protocol tracing
+DEBUG_LOG = DebugLog(level=DEBUG if os.environ.get("LTM_VERBOSE") == "1" else INFO)
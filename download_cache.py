@@ -0,0 +1,302 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Client-side cache of transferred files, keyed by file_id.
+
+A file that was downloaded (or uploaded) once is kept under the cache
+directory, so asking for the same file_id again is a hard link or local copy
+instead of another REQ_DOWNLOAD. Content is stored once per sha256, however
+many file_ids point at it (the reference server hands out a new file_id for
+every share of the same content):
+
+    index.json      {"version": 1, "entries": {file_id: {...}}}
+    blobs/<sha256>  content
+
+Entries are evicted least-recently-used first once the blobs exceed the disk
+budget. The index is rewritten on every change, so the cache survives
+restarts; entries whose blob went missing or changed size are dropped on
+lookup.
+
+Usage:
+    python download_cache.py stats [DIR]
+    python download_cache.py list [DIR]
+    python download_cache.py clear [DIR]
+"""
+
+import argparse
+import hashlib
+import json
+import os
+import re
+import shutil
+import sys
+import threading
+import time
+import uuid
+from pathlib import Path
+
+CACHE_DIR_ENV = "LTM_CACHE_DIR"
+CACHE_BUDGET_ENV = "LTM_CACHE_MB"
+DEFAULT_BUDGET = 512 * 1024 * 1024
+INDEX_FILE = "index.json"
+INDEX_VERSION = 1
+COPY_SIZE = 1 << 20
+
+
+def default_cache_root():
+    return os.environ.get(CACHE_DIR_ENV) or str(Path.home() / "AppData" / "Roaming" / "LTM" / "cache")
+
+
+def default_budget():
+    try:
+        return int(os.environ[CACHE_BUDGET_ENV]) * 1024 * 1024
+    except (KeyError, ValueError):
+        return DEFAULT_BUDGET
+
+
+def cache_dir_for(server, root=None):
+    """One cache per server: file_ids are only unique within a server"""
+    return os.path.join(root or default_cache_root(), re.sub(r'[^A-Za-z0-9._-]', '_', server))
+
+
+class CacheEntry:
+    __slots__ = ("file_id", "filename", "size", "sha256", "mtime", "last_used")
+
+    def __init__(self, file_id, filename, size, sha256, mtime, last_used):
+        self.file_id = file_id
+        self.filename = filename
+        self.size = size
+        self.sha256 = sha256
+        self.mtime = mtime  # blob mtime_ns when stored; a hard-linked copy edited in place changes it
+        self.last_used = last_used
+
+    def to_json(self):
+        return {"filename": self.filename, "size": self.size, "sha256": self.sha256,
+                "mtime": self.mtime, "last_used": self.last_used}
+
+
+class DownloadCache:
+    """file_id -> content, LRU within a byte budget; safe to use from several threads"""
+
+    def __init__(self, directory, budget=None):
+        self.directory = directory
+        self.budget = default_budget() if budget is None else budget
+        self.blob_dir = os.path.join(directory, "blobs")
+        self._entries = {}  # file_id -> CacheEntry
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        os.makedirs(self.blob_dir, exist_ok=True)
+        self._load()
+
+    # -- persistence -------------------------------------------------------
+
+    def _load(self):
+        try:
+            with open(os.path.join(self.directory, INDEX_FILE), 'r', encoding='utf-8') as f:
+                data = json.load(f)
+            if data.get("version") != INDEX_VERSION:
+                raise ValueError("index version")
+            for file_id, e in data.get("entries", {}).items():
+                self._entries[file_id] = CacheEntry(file_id, e["filename"], int(e["size"]), e["sha256"],
+                                                    int(e["mtime"]), float(e["last_used"]))
+        except (OSError, ValueError, KeyError, TypeError):
+            self._entries = {}
+        # Blobs left behind by an interrupted put or a lost index
+        referenced = {e.sha256 for e in self._entries.values()}
+        for name in os.listdir(self.blob_dir):
+            if name not in referenced:
+                try:
+                    os.remove(os.path.join(self.blob_dir, name))
+                except OSError:
+                    pass
+
+    def _save(self):
+        path = os.path.join(self.directory, INDEX_FILE)
+        tmp = path + ".tmp"
+        with open(tmp, 'w', encoding='utf-8') as f:
+            json.dump({"version": INDEX_VERSION,
+                       "entries": {fid: e.to_json() for fid, e in self._entries.items()}}, f)
+        os.replace(tmp, path)
+
+    # -- lookups -----------------------------------------------------------
+
+    def _blob(self, sha256):
+        return os.path.join(self.blob_dir, sha256)
+
+    def _valid(self, entry):
+        try:
+            st = os.stat(self._blob(entry.sha256))
+        except OSError:
+            return False
+        return st.st_size == entry.size and st.st_mtime_ns == entry.mtime
+
+    def lookup(self, file_id):
+        """Path of the cached content, or None"""
+        with self._lock:
+            entry = self._entries.get(file_id)
+            if entry is None:
+                return None
+            if not self._valid(entry):
+                self._drop(file_id)
+                self._save()
+                return None
+            return self._blob(entry.sha256)
+
+    def materialize(self, file_id, dest):
+        """Hard-link (or copy) the cached file to dest; False on a miss"""
+        src = self.lookup(file_id)
+        if src is None:
+            self.misses += 1
+            return False
+        try:
+            if os.path.exists(dest):
+                os.remove(dest)
+            try:
+                os.link(src, dest)
+            except OSError:
+                shutil.copyfile(src, dest)
+        except OSError:
+            self.misses += 1
+            return False
+        with self._lock:
+            entry = self._entries.get(file_id)
+            if entry is not None:
+                entry.last_used = time.time()
+                self._save()
+        self.hits += 1
+        return True
+
+    # -- updates -----------------------------------------------------------
+
+    def put(self, file_id, src, filename=""):
+        """Copy src into the cache under file_id (hashing as it copies)"""
+        try:
+            size = os.path.getsize(src)
+        except OSError:
+            return None
+        if size > self.budget:
+            return None
+        tmp = os.path.join(self.blob_dir, f".{uuid.uuid4().hex}.tmp")
+        h = hashlib.sha256()
+        try:
+            with open(src, 'rb') as fin, open(tmp, 'wb') as fout:
+                for block in iter(lambda: fin.read(COPY_SIZE), b''):
+                    h.update(block)
+                    fout.write(block)
+        except OSError:
+            try:
+                os.remove(tmp)
+            except OSError:
+                pass
+            return None
+        sha256 = h.hexdigest()
+        with self._lock:
+            blob = self._blob(sha256)
+            # Always a new inode: the old blob may be hard-linked into a user
+            # folder by materialize() and edited there since
+            os.replace(tmp, blob)
+            mtime = os.stat(blob).st_mtime_ns
+            # The blob now holds exactly the content hashed above, so entries
+            # sharing that sha256 are valid again under the new mtime
+            for e in self._entries.values():
+                if e.sha256 == sha256:
+                    e.mtime = mtime
+            entry = CacheEntry(file_id, filename or os.path.basename(src), size, sha256, mtime, time.time())
+            self._entries[file_id] = entry
+            self._evict()
+            self._save()
+            return entry
+
+    def alias(self, file_id, existing_id, filename=None):
+        """Let file_id share the content cached for existing_id (e.g. a forward)"""
+        with self._lock:
+            entry = self._entries.get(existing_id)
+            if entry is None:
+                return None
+            alias = CacheEntry(file_id, filename or entry.filename, entry.size, entry.sha256,
+                               entry.mtime, time.time())
+            self._entries[file_id] = alias
+            self._save()
+            return alias
+
+    def put_async(self, file_id, src, filename=""):
+        """put() on a daemon thread so large files do not stall the caller"""
+        thread = threading.Thread(target=self.put, args=(file_id, src, filename), daemon=True)
+        thread.start()
+        return thread
+
+    def _drop(self, file_id):
+        entry = self._entries.pop(file_id, None)
+        if entry is None:
+            return 0
+        if any(e.sha256 == entry.sha256 for e in self._entries.values()):
+            return 0
+        try:
+            os.remove(self._blob(entry.sha256))
+        except OSError:
+            pass
+        return entry.size
+
+    def _used(self):
+        return sum({e.sha256: e.size for e in self._entries.values()}.values())
+
+    def _evict(self):
+        used = self._used()
+        for entry in sorted(self._entries.values(), key=lambda e: e.last_used):
+            if used <= self.budget:
+                break
+            used -= self._drop(entry.file_id)
+
+    def remove(self, file_id):
+        with self._lock:
+            self._drop(file_id)
+            self._save()
+
+    def clear(self):
+        with self._lock:
+            for file_id in list(self._entries):
+                self._drop(file_id)
+            self._save()
+
+    # -- inspection --------------------------------------------------------
+
+    def entries(self):
+        """CacheEntry list, most recently used first"""
+        with self._lock:
+            return sorted(self._entries.values(), key=lambda e: e.last_used, reverse=True)
+
+    def stats(self):
+        with self._lock:
+            return {"files": len(self._entries),
+                    "blobs": len({e.sha256 for e in self._entries.values()}),
+                    "bytes": self._used(), "budget": self.budget,
+                    "hits": self.hits, "misses": self.misses}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Inspect the client download cache")
+    parser.add_argument("command", choices=("stats", "list", "clear"))
+    parser.add_argument("directory", nargs="?", help="cache directory (default: all under the cache root)")
+    args = parser.parse_args(argv)
+
+    if args.directory:
+        dirs = [args.directory]
+    else:
+        root = default_cache_root()
+        dirs = [os.path.join(root, d) for d in sorted(os.listdir(root))] if os.path.isdir(root) else []
+    for d in dirs:
+        cache = DownloadCache(d)
+        if args.command == "clear":
+            cache.clear()
+        st = cache.stats()
+        print(f"{d}: {st['files']} files, {st['blobs']} blobs, {st['bytes']:,} of {st['budget']:,} bytes")
+        if args.command == "list":
+            for e in cache.entries():
+                used = time.strftime('%Y-%m-%d %H:%M', time.localtime(e.last_used))
+                print(f"  {e.file_id:<24} {e.size:>12,}  {used}  {e.filename}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -4,30 +4,64 @@
 PyQt5 GUI Client - Clean & Professional Design with File Transfer
 """
 
+# First, so that the imports below are timed
+from startup_profile import STARTUP, LOGIN_WINDOW, MAIN_WINDOW, LOGIN_REPLY, OPEN_MAIN, SESSION_RESUMED, TARGETS
 import sys
-import socket
-import threading
 import json
 import os
-import struct
 import time
+from collections import Counter
 from pathlib import Path
 from datetime import datetime
-from queue import Queue
+from urllib.parse import unquote
+STARTUP.mark("import stdlib")
 from PyQt5.QtWidgets import (QApplication, QWidget, QVBoxLayout, QHBoxLayout, 
                              QLabel, QLineEdit, QPushButton, QListWidget, 
                              QTextEdit, QTextBrowser, QMessageBox, QListWidgetItem, QFrame, QTabWidget, 
-                             QScrollArea, QSizePolicy, QFileDialog, QProgressBar, QDialog)
+                             QScrollArea, QSizePolicy, QFileDialog, QProgressBar, QDialog,
+                             QTableWidget, QTableWidgetItem, QHeaderView, QComboBox, QCheckBox)
 from PyQt5.QtCore import Qt, pyqtSignal, QObject, QThread, QTimer
-from PyQt5.QtGui import QFont
+from PyQt5.QtGui import QFont, QColor, QTextDocument
+STARTUP.mark("import PyQt5")
+
+from debug_log import DEBUG_LOG
+from telemetry import SPAN_RENDER_HISTORY
+from chat_core import (encode_cancel_upload, encode_forward_file, encode_list_files,
+                       is_unknown_command, new_message_id, NO_MESSAGES, RECORD_ENV, COMPRESS_ENV,
+                       HEARTBEAT_ENV)
+from download_cache import DownloadCache, cache_dir_for
+from thumbnails import ChatBrowser, ThumbnailManager, is_image, THUMB_WIDTH, THUMB_HEIGHT
+from ui_snapshot import UiSnapshot
+from session_store import SessionStore
+from message_render import MessageRenderer
+STARTUP.mark("import app modules")
+
+# Files dialog filters (LIST_FILES ext= / min_size= / sort=)
+FILE_CATEGORIES = [
+    ("All types", ""),
+    ("Images", "jpg,jpeg,jfif,png,gif,bmp,webp"),
+    ("Documents", "pdf,doc,docx,xls,xlsx,ppt,pptx,txt,md,csv"),
+    ("Archives", "zip,rar,7z,tar,gz"),
+    ("Audio/Video", "mp3,wav,ogg,m4a,mp4,mkv,avi,mov"),
+]
+FILE_SIZES = [("Any size", 0), ("> 100 KB", 100 * 1024), ("> 1 MB", 1 << 20), ("> 10 MB", 10 << 20)]
+FILE_SORTS = [("Newest first", "-time"), ("Oldest first", "time"), ("Largest first", "-size"), ("Name", "name")]
+FILES_PAGE_SIZE = 50
+
+# Phiên đã lưu: chờ AUTH tối đa RESUME_TIMEOUT giây; cửa sổ đăng nhập chỉ hiện
+# nếu phiên bị từ chối hoặc sau RESUME_SHOW_AFTER_MS
+RESUME_TIMEOUT = 5
+RESUME_SHOW_AFTER_MS = 1500
+# Sau khi LOGIN thành công: chờ để AUTH tới server trước loạt lệnh GET_* của cửa sổ chính
+LOGIN_PAUSE_MS = 500
+
+# Trạng thái tin nhắn của mình (TEXT_ID): chờ / đã tới server / lỗi
+MSG_PENDING, MSG_DELIVERED, MSG_FAILED = "\u25f7", "\u2713", "\u2717"
 
 # ============================================================================
 # Lớp mạng
 # ============================================================================
 
-# Hằng số truyền file
-CHUNK_HEADER_SIZE = 8
-CHUNK_SIZE = 65536  # 64KB
 
 class NetworkSignals(QObject):
     message_received = pyqtSignal(str)
@@ -53,467 +87,147 @@ class NetworkSignals(QObject):
     upload_progress = pyqtSignal(str, int, int)  # id_file, bytes_đã_gửi, tổng_bytes
     upload_complete = pyqtSignal(str)  # id_file
     upload_failed = pyqtSignal(str, str)  # id_file, error
+    upload_deduplicated = pyqtSignal(str)  # id_file (server already had the content)
     download_ready = pyqtSignal(str, str, int)  # id_file, filename, filesize
     download_progress = pyqtSignal(str, int, int)  # id_file, bytes_received, total_bytes
     download_complete = pyqtSignal(str)  # id_file
     download_failed = pyqtSignal(str, str)  # id_file, error
+    request_done = pyqtSignal(object, object)  # callback, async_core.Reply
+    write_backpressure = pyqtSignal(bool)  # outbound queue congested
+    reconnecting = pyqtSignal(int, float)  # attempt, delay before it (s)
+    reconnected = pyqtSignal(float, int)  # seconds offline, queued commands re-sent
+    text_delivered = pyqtSignal(str, str)  # message id, server timestamp
+    text_failed = pyqtSignal(str, str)  # message id, reason
+    session_rejected = pyqtSignal(str)  # AUTH refused / NOTIFY SESSION_EXPIRED: saved session is void
 
 class NetworkThread(QThread):
+    """Qt adapter: runs an asyncio loop with an async_core.AsyncChatClient on
+    this thread and re-emits its events as NetworkSignals (event names match
+    the signal names). Calls from GUI slots are handed to the loop and never
+    block on the socket."""
+
     def __init__(self, host, port, signals):
         super().__init__()
         self.host = host
         self.port = port
         self.signals = signals
-        self.sock = None
-        self.running = False
-        self.session = None
-        self.username = None
-        self.pending_downloads = {}  # id_file -> (filename, save_path, filesize)
-        
+        self.loop = None
+        # asyncio is only needed from here on (preloaded once the login window is up)
+        from async_core import AsyncChatClient, heartbeat_config
+        self.client = AsyncChatClient(host, port, on_event=self._emit_event,
+                                      compress=os.environ.get(COMPRESS_ENV, "1") != "0",
+                                      reconnect=True, client_ids=True,
+                                      heartbeat=heartbeat_config(os.environ.get(HEARTBEAT_ENV, "")))
+        if os.environ.get(RECORD_ENV):
+            self.client.start_recording(os.environ[RECORD_ENV])
+        # Queued to the GUI thread: callbacks passed to request() run there
+        self.signals.request_done.connect(self._deliver_reply)
+
+    def _emit_event(self, name, *args):
+        getattr(self.signals, name).emit(*args)
+
+    def _deliver_reply(self, callback, reply):
+        callback(reply)
+
     def run(self):
+        import asyncio
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
         try:
-            self.sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-            self.sock.settimeout(5.0)
-            self.sock.connect((self.host, self.port))
-            self.running = True
-            self.signals.connected.emit()
-            
-            buffer = ""
-            self.sock.settimeout(None)
-            
-            while self.running:
-                try:
-                    raw_data = self.sock.recv(1024)
-                    if not raw_data:
-                        print("[ERROR] Socket closed by server")
-                        break
-                    
-                    # Try to decode as UTF-8 text
-                    try:
-                        data = raw_data.decode('utf-8')
-                    except UnicodeDecodeError as e:
-                        # Binary data in buffer (probably residual after file transfer)
-                        print(f"[WARNING] Received non-UTF8 data (probably binary residual), skipping: {e}")
-                        continue
-                    
-                    buffer += data
-                    while '\n' in buffer:
-                        line, buffer = buffer.split('\n', 1)
-                        line = line.strip()
-                        if line:
-                            try:
-                                self.handle_message(line)
-                            except Exception as e:
-                                print(f"[ERROR] Failed to handle message '{line}': {e}")
-                                import traceback
-                                traceback.print_exc()
-                except Exception as e:
-                    print(f"[ERROR] recv() failed: {e}")
-                    if self.running:
-                        self.signals.message_received.emit(f"Error: {e}")
-                    break
-                    
-        except Exception as e:
-            self.signals.message_received.emit(f"Connection failed: {e}")
+            self.loop.run_until_complete(self.client.run())
         finally:
-            self.running = False
-            if self.sock:
-                try:
-                    self.sock.close()
-                except:
-                    pass
-            self.signals.disconnected.emit()
-    
-    def handle_message(self, msg):
-        self.signals.message_received.emit(f"[Server] {msg}")
-
-        # Kiểm tra xem có phải là history line không
-        # History line format: msgId|sender|timestamp|TYPE|length|content
-        # msgId và timestamp phải là số
-        # Chỉ xử lý nếu đang chờ history lines (_history_expected > 0)
-        if hasattr(self, '_history_expected') and self._history_expected > 0:
-            # Kiểm tra format: phải có ít nhất 5 dấu | và part đầu tiên là số
-            if msg.count('|') >= 5:
-                first_part = msg.split('|')[0]
-                if first_part.isdigit():
-                    # Đây là history line
-                    self._history_buffer.append(msg)
-                    self._history_expected -= 1
-                    if self._history_expected == 0:
-                        self.signals.history_received.emit("", "", self._history_buffer)
-                        self._history_buffer = []
-                    return  # Đã xử lý xong, không cần parse tiếp
-        
-        # Parse các loại message khác
-        parts = msg.split(' ', 2)
-        if len(parts) < 2:
-            return
-            
-        if parts[0] == "SUCCESS":
-            code = parts[1]
-            data = parts[2] if len(parts) > 2 else ""
-            
-            if code == "200":
-                if data.startswith("SESSION "):
-                    session = data.split(' ', 1)[1]
-                    self.session = session
-                    # Send AUTH command to authenticate this connection with the session
-                    self.send(f"AUTH {session}")
-                    self.signals.login_success.emit(session, self.username)
-                elif data.startswith("FRIENDS "):
-                    friends_str = data.split(' ', 1)[1] if ' ' in data else ""
-                    friends = []
-                    if friends_str:
-                        for f in friends_str.split():
-                            if ':' in f:
-                                name, status = f.split(':', 1)
-                                friends.append((name, status))
-                    self.signals.friends_updated.emit(friends)
-                elif data.startswith("PENDING_REQUESTS "):
-                    # SUCCESS 200 PENDING_REQUESTS user1 user2 user3
-                    requests_str = data.split(' ', 1)[1] if ' ' in data else ""
-                    requests = []
-                    if requests_str:
-                        requests = [r.strip() for r in requests_str.split() if r.strip()]
-                    self.signals.pending_requests_updated.emit(requests)
-                elif data.startswith("GROUP_INVITES "):
-                    # SUCCESS 200 GROUP_INVITES group1:inviter1 group2:inviter2
-                    invites_str = data.split(' ', 1)[1] if ' ' in data else ""
-                    invites = []
-                    if invites_str:
-                        for inv in invites_str.split():
-                            if ':' in inv:
-                                group_name, inviter = inv.split(':', 1)
-                                invites.append((group_name, inviter))
-                    self.signals.group_invites_updated.emit(invites)
-                elif data.startswith("GROUPS "):
-                    groups_str = data.split(' ', 1)[1] if ' ' in data else ""
-                    groups = []
-                    if groups_str:
-                        for g in groups_str.split():
-                            if ':' in g:
-                                name, count = g.split(':', 1)
-                                groups.append((name, count))
-                    self.signals.groups_updated.emit(groups)
-                elif data.startswith("MEMBERS "):
-                    # SUCCESS 200 MEMBERS user1:role:status user2:role:status ...
-                    members_str = data.split(' ', 1)[1] if ' ' in data else ""
-                    members = []
-                    if members_str:
-                        for m in members_str.split():
-                            if ':' in m:
-                                parts = m.split(':', 2)
-                                if len(parts) >= 3:
-                                    username, role, status = parts[0], parts[1], parts[2]
-                                    members.append((username, role, status))
-                    # Emit with empty group name (will be determined by context)
-                    self.signals.members_received.emit("", members)
-                elif data.startswith("READY_UPLOAD "):
-                    # Server ready to receive file
-                    file_id = data.split(' ')[1]
-                    self.signals.upload_ready.emit(file_id, "0")
-                elif data.startswith("LEFT "):
-                    # SUCCESS 200 LEFT <group_name>
-                    group_name = data.split(' ', 1)[1]
-                    self.signals.left_group.emit(group_name)
-                    self.signals.notification.emit("Left Group", f"You have left {group_name}")
-                    # Refresh groups list
-                    self.send("GET_GROUPS\n")
-                elif data.startswith("LEFT_AND_DELETED "):
-                    # SUCCESS 200 LEFT_AND_DELETED <group_name>
-                    group_name = data.split(' ', 1)[1]
-                    self.signals.left_group.emit(group_name)
-                    self.signals.notification.emit("Group Deleted", f"You left and {group_name} was deleted")
-                    # Refresh groups list
-                    self.send("GET_GROUPS\n")
-                elif data.startswith("START_UPLOAD "):
-                    # Server ready, provides offset for resume
-                    offset = data.split(' ')[1]
-                    # Start uploading file immediately in this thread
-                    if hasattr(self, 'upload_manager') and self.upload_manager.active_upload:
-                        file_id, filepath, filename, filesize, _, _ = self.upload_manager.active_upload
-                        self.upload_file_sync(filepath, filesize, int(offset))
-                elif data.startswith("UPLOAD_COMPLETE"):
-                    if hasattr(self, 'upload_manager'):
-                        self.upload_manager.on_upload_complete_from_server()
-                elif data.startswith("READY_DOWNLOAD "):
-                    # SUCCESS 200 READY_DOWNLOAD <file_id> <filename> <filesize>
-                    download_parts = data.split(' ', 3)
-                    if len(download_parts) >= 4:
-                        file_id = download_parts[1]
-                        filename = download_parts[2]
-                        filesize = int(download_parts[3])
-                        
-                        
-                        # Look up save path from pending_downloads
-                        if file_id in self.pending_downloads:
-                            _, save_path, _ = self.pending_downloads[file_id]
-                            
-                            # Start downloading (this will block the recv loop temporarily)
-                            self.download_file_sync(file_id, save_path, filesize)
-                        else:
-                            print(f"[ERROR] No pending download for file_id={file_id}")
-                elif data.startswith("RESUME_DOWNLOAD "):
-                    offset = data.split(' ')[1]
-                    # Continue download from offset
-                    self.signals.download_ready.emit("", "", int(offset))
-                else:
-                    # Possible HISTORY header: server uses multi-line response
-                    # Formats supported:
-                    #   SUCCESS 200 <N>
-                    #   SUCCESS 200 HISTORY <N>
-                    hdr = msg.strip().split()
-                    n = -1
-                    if len(hdr) >= 3 and hdr[0] == "SUCCESS" and hdr[1] == "200":
-                        if len(hdr) == 3 and hdr[2].isdigit():
-                            n = int(hdr[2])
-                        elif len(hdr) >= 4 and hdr[2] == "HISTORY" and hdr[3].isdigit():
-                            n = int(hdr[3])
-                    if n >= 0:
-                        # Expect next n lines as history; buffer them using state
-                        self._history_expected = n
-                        self._history_buffer = []
-                        if n == 0:
-                            # Emit empty history immediately
-                            self.signals.history_received.emit("", "", [])
-                        return  # handled
-                    
-            elif code == "201":
-                if data.startswith("REGISTERED "):
-                    user = data.split(' ', 1)[1]
-                    self.signals.notification.emit("Success", f"Account created: {user}")
-                    # Tự động LOGIN sau khi REGISTER thành công
-                    self.signals.registration_success.emit(user)
-                elif data.startswith("FRIEND_ADDED "):
-                    friend = data.split(' ', 1)[1]
-                    self.signals.notification.emit("Friend Added", f"{friend} is now your friend")
-                    
-        elif parts[0] == "FAIL":
-            # Only treat as login failure before session is established.
-            code = parts[1]
-            msg_text = parts[2] if len(parts) > 2 else "Unknown error"
-            
-            # Xử lý NO_MESSAGES - chỉ hiển thị popup nếu là fetch history có time range
-            if code == "404" and msg_text == "NO_MESSAGES":
-                # Emit với flag để biết là FAIL, không phải SUCCESS với 0 messages
-                self.signals.history_received.emit("", "", ["__NO_MESSAGES__"])
-            elif not self.session:
-                self.signals.login_failed.emit(msg_text)
-            else:
-                # For post-login errors, show a notification and keep the connection.
-                try:
-                    self.signals.notification.emit("Error", msg_text)
-                except Exception:
-                    self.signals.message_received.emit(f"Error: {msg_text}")
-            
-        elif msg.startswith("NOTIFY_FRIEND_REQUEST "):
-            sender = msg.split(' ', 1)[1]
-            self.signals.notification.emit("Friend Request", f"{sender} sent you a friend request")
-            
-        elif msg.startswith("NOTIFY_FRIEND_ACCEPTED "):
-            friend = msg.split(' ', 1)[1]
-            self.signals.notification.emit("Request Accepted", f"{friend} accepted your friend request")
-            
-        elif msg.startswith("NOTIFY_SESSION_EXPIRED "):
-            self.signals.notification.emit("Session Expired", "Logged out from another device")
-            
-        # Handle TEXT messages (NOTIFY_TEXT from server)
-        elif msg.startswith("NOTIFY_TEXT "):
-            # Server format:
-            # NOTIFY_TEXT U <sender> <timestamp> <content> (for user messages)
-            # NOTIFY_TEXT G <group_name> <sender> <timestamp> <content> (for group messages)
-            # Split into 3 parts so the rest contains everything after the type
-            parts = msg.split(' ', 2)  # NOTIFY_TEXT + type + rest
-            if len(parts) >= 3:
-                msg_type = parts[1]  # U or G
-                rest = parts[2]  # remaining content (sender ...)
-
-                if msg_type == "U":
-                    # Format: <sender> <timestamp> <content>
-                    rest_parts = rest.split(' ', 2)
-                    if len(rest_parts) >= 3:
-                        sender = rest_parts[0]
-                        timestamp = rest_parts[1]
-                        content = rest_parts[2]
-                        # For U type, conversation name = sender name
-                        self.signals.text_message.emit(msg_type, sender, sender, content)
-
-                elif msg_type == "G":
-                    # Format: <group_name> <sender> <timestamp> <content>
-                    rest_parts = rest.split(' ', 3)
-                    if len(rest_parts) >= 4:
-                        group_name = rest_parts[0]
-                        sender = rest_parts[1]
-                        timestamp = rest_parts[2]
-                        content = rest_parts[3]
-                        self.signals.text_message.emit(msg_type, group_name, sender, content)
-                
-        # (moved) HISTORY header is handled inside SUCCESS 200 branch above
-        
-                
-        # Xử lý lời mời nhóm
-        elif msg.startswith("NOTIFY_GROUP_INVITE "):
-            # NOTIFY_GROUP_INVITE <group_name> <inviter>
-            parts = msg.split(' ', 3)
-            if len(parts) >= 3:
-                group_name = parts[1]
-                inviter = parts[2]
-                self.signals.notification.emit("Group Invite", f"{inviter} invited you to {group_name}")
-        
-        # Xử lý khi bị kick khỏi nhóm
-        elif msg.startswith("NOTIFY_EJECTED "):
-            # NOTIFY_EJECTED <group_name> <admin>
-            parts = msg.split(' ', 3)
-            if len(parts) >= 3:
-                group_name = parts[1]
-                admin = parts[2]
-                self.signals.notification.emit("Removed from Group", f"You were removed from {group_name} by {admin}")
-                # Emit signal to close chat window
-                self.signals.left_group.emit(group_name)
-                # Refresh groups list
-                self.send("GET_GROUPS\n")
-        
-        # Xử lý khi có member rời nhóm
-        elif msg.startswith("NOTIFY_MEMBER_LEFT "):
-            # NOTIFY_MEMBER_LEFT <group_name> <username>
-            parts = msg.split(' ', 3)
-            if len(parts) >= 3:
-                group_name = parts[1]
-                username = parts[2]
-                self.signals.notification.emit("Member Left", f"{username} left {group_name}")
-        
-        # Xử lý khi được chỉ định làm admin mới
-        elif msg.startswith("NOTIFY_NEW_ADMIN "):
-            # NOTIFY_NEW_ADMIN <group_name>
-            parts = msg.split(' ', 2)
-            if len(parts) >= 2:
-                group_name = parts[1]
-                self.signals.notification.emit("New Group Admin", f"You are now the admin of {group_name}")
-        
-        # Handle file notifications
-        elif msg.startswith("NOTIFY_FILE "):
-            # NOTIFY_FILE <type> <target> <sender> <file_id> <filename>
-            parts = msg.split(' ', 5)
-            if len(parts) >= 6:
-                file_type = parts[1]  # U or G
-                target = parts[2]  # username or group_name
-                sender = parts[3]
-                file_id = parts[4]
-                filename = parts[5]
-                self.signals.file_notification.emit(file_type, target, sender, file_id, filename)
-    
+            self.loop.close()
+
+    @property
+    def telemetry(self):
+        return self.client.telemetry
+
+    @property
+    def session(self):
+        return self.client.session
+
+    @property
+    def username(self):
+        return self.client.username
+
+    @username.setter
+    def username(self, value):
+        self.client.username = value
+
+    @property
+    def running(self):
+        return self.client.running
+
+    @property
+    def outbox(self):
+        return self.client.outbox
+
+    @property
+    def message_ids(self):
+        # True once the server acknowledges and echoes by message id
+        return self.client.message_ids
+
+    def _call(self, fn, *args):
+        # While reconnecting, TEXT goes to the client's offline outbox
+        if not (self.loop and (self.client.running or self.client.reconnecting)):
+            print("[ERROR] Cannot send - not connected")
+            return False
+        self.loop.call_soon_threadsafe(fn, *args)
+        return True
+
     def send(self, cmd):
-        if self.sock and self.running:
-            try:
-                # Don't add newline if cmd already ends with it
-                if not cmd.endswith('\n'):
-                    cmd = cmd + '\n'
-                self.sock.sendall(cmd.encode('utf-8'))
-                return True
-            except Exception as e:
-                print(f"[ERROR] Failed to send: {e}")
-                return False
-        else:
-            print(f"[ERROR] Cannot send - sock or running is False")
-        return False
-    
+        return self._call(self.client.send, cmd)
+
+    def send_text(self, chat_type, name, content):
+        """Send a message; returns its id (text_delivered / text_failed follow) or None"""
+        message_id = new_message_id()
+        if not self._call(self.client.send_text, chat_type, name, content, message_id):
+            return None
+        return message_id
+
+    def request(self, cmd, callback=None, timeout=None):
+        """Send cmd; callback(reply) runs on the GUI thread (reply is None on error)"""
+        return self._submit(lambda: self.client.request(cmd, timeout), callback)
+
+    def request_preview(self, file_id, save_path, max_bytes, callback=None):
+        """REQ_PREVIEW via AsyncChatClient.fetch_preview (small files only)"""
+        return self._submit(lambda: self.client.fetch_preview(file_id, save_path, max_bytes), callback)
+
+    def resume_session(self, session, callback=None, timeout=None):
+        """AUTH with a saved session via AsyncChatClient.resume_session"""
+        return self._submit(lambda: self.client.resume_session(session, timeout), callback)
+
+    def offer_upload(self, target_type, target_name, filepath, filename, filesize, callback=None):
+        """REQ_UPLOAD via AsyncChatClient.offer_upload (content hash first)"""
+        return self._submit(lambda: self.client.offer_upload(
+            target_type, target_name, filepath, filename, filesize), callback)
+
+    def _submit(self, make_coro, callback):
+        if not (self.loop and self.client.running):
+            return None
+        import asyncio
+        fut = asyncio.run_coroutine_threadsafe(make_coro(), self.loop)
+        if callback is not None:
+            fut.add_done_callback(lambda f: self.signals.request_done.emit(
+                callback, None if f.cancelled() or f.exception() else f.result()))
+        return fut
+
     def stop(self):
-        self.running = False
-        if self.sock:
+        if self.loop and not self.loop.is_closed():
             try:
-                self.sock.close()
-            except:
+                self.loop.call_soon_threadsafe(self.client.stop)
+            except RuntimeError:
                 pass
-    
-    def recv_exact(self, n):
-        """Receive exactly n bytes from socket"""
-        data = b''
-        while len(data) < n:
-            chunk = self.sock.recv(n - len(data))
-            if not chunk:
-                raise ConnectionError("Connection closed while receiving data")
-            data += chunk
-        return data
-    
-    def upload_file_sync(self, filepath, filesize, offset):
-        """Upload file synchronously (called from network thread)"""
-        try:
-            
-            with open(filepath, 'rb') as f:
-                f.seek(offset)
-                bytes_sent = offset
-                
-                while bytes_sent < filesize:
-                    # Read chunk
-                    chunk_size = min(CHUNK_SIZE, filesize - bytes_sent)
-                    data = f.read(chunk_size)
-                    if not data:
-                        break
-                    
-                    # Send binary chunk: [offset:4][length:4][data]
-                    header = struct.pack('!II', bytes_sent, len(data))
-                    self.sock.sendall(header + data)
-                    
-                    bytes_sent += len(data)
-                    
-                    # Emit progress signal
-                    if hasattr(self, 'upload_manager') and self.upload_manager.active_upload:
-                        file_id = self.upload_manager.active_upload[0]
-                        self.signals.upload_progress.emit(file_id, bytes_sent, filesize)
-                    
-                
-                # Send EOF marker
-                eof_header = struct.pack('!II', bytes_sent, 0)
-                self.sock.sendall(eof_header)
-                
-        except Exception as e:
-            print(f"[ERROR] Upload failed: {e}")
-            if hasattr(self, 'upload_manager') and self.upload_manager.active_upload:
-                file_id = self.upload_manager.active_upload[0]
-                self.signals.upload_failed.emit(file_id, str(e))
-    
-    def download_file_sync(self, file_id, save_path, filesize):
-        """Download file synchronously (called from network thread)"""
-        try:
-            
-            with open(save_path, 'wb') as f:
-                bytes_received = 0
-                
-                while bytes_received < filesize:
-                    # Read chunk header: [offset:4][length:4]
-                    header = self.recv_exact(8)
-                    offset, length = struct.unpack('!II', header)
-                    
-                    
-                    # Check for EOF marker
-                    if length == 0:
-                        break
-                    
-                    # Read chunk data
-                    data = self.recv_exact(length)
-                    
-                    # Write to file at offset
-                    f.seek(offset)
-                    f.write(data)
-                    
-                    bytes_received += length
-                    
-                    # Emit progress signal
-                    self.signals.download_progress.emit(file_id, bytes_received, filesize)
-                    
-                
-                self.signals.download_complete.emit(file_id)
-                # Cleanup pending mapping (if any)
-                try:
-                    if hasattr(self, 'pending_downloads') and file_id in self.pending_downloads:
-                        self.pending_downloads.pop(file_id, None)
-                except Exception:
-                    pass
-                
-        except Exception as e:
-            print(f"[ERROR] Download failed: {e}")
-            import traceback
-            traceback.print_exc()
+
+    def upload_data(self, file_id, filepath, filesize):
+        return self._call(self.client.upload_data, file_id, filepath, filesize)
+
+    def open_outbox(self, path):
+        """Keep unsent messages in path (see async_core.OfflineOutbox)"""
+        return self._call(self.client.open_outbox, path)
+
+    def request_download(self, file_id, save_path, filename=""):
+        return self._call(self.client.request_download, file_id, save_path, filename)
 
 # ============================================================================
 # Cửa sổ đăng nhập
@@ -525,8 +239,9 @@ class LoginWindow(QWidget):
     def __init__(self):
         super().__init__()
         self.setWindowTitle("Chat Client")
-        self.setFixedSize(450, 520)
+        self.setFixedSize(450, 550)
         self.net_thread = None
+        self._resuming = False
         self.init_ui()
 
     def init_ui(self):
@@ -593,7 +308,13 @@ class LoginWindow(QWidget):
         self.password_input.setFont(QFont("Segoe UI", 11))
         layout.addWidget(self.password_input)
 
-        layout.addSpacing(20)
+        # Lưu phiên (session token) để lần sau vào thẳng bằng AUTH
+        self.remember_box = QCheckBox("Keep me signed in on this computer")
+        self.remember_box.setFont(QFont("Segoe UI", 10))
+        self.remember_box.setChecked(self.load_config().get("remember", False))
+        layout.addWidget(self.remember_box)
+
+        layout.addSpacing(5)
 
         # Buttons
         self.login_btn = QPushButton("Login")
@@ -698,7 +419,8 @@ class LoginWindow(QWidget):
         config_file = config_dir / "config.json"
         try:
             with open(config_file, 'w') as f:
-                json.dump({"server": server, "username": username}, f)
+                json.dump({"server": server, "username": username,
+                           "remember": self.remember_box.isChecked()}, f)
         except:
             pass
 
@@ -775,10 +497,22 @@ class LoginWindow(QWidget):
             self.register_btn.setEnabled(True)
 
     def on_login_success(self, server, username, session):
-        self.save_config(server, username)
+        STARTUP.mark(LOGIN_REPLY)
         self.status_label.setText("Success!")
         self.status_label.setStyleSheet("color: green;")
-        QTimer.singleShot(500, lambda: self.open_main_window(server, username, session))
+        if self._resuming:
+            self._resuming = False
+            STARTUP.mark(SESSION_RESUMED)
+            self.open_main_window(server, username, session)  # AUTH already answered
+            return
+        self.save_config(server, username)
+        if self.remember_box.isChecked():
+            SessionStore().save(server, username, session)
+        else:
+            SessionStore().forget(server, username)
+        # AUTH goes out after the LOGIN reply; let it through before the main
+        # window's burst of GET_* commands
+        QTimer.singleShot(LOGIN_PAUSE_MS, lambda: self.open_main_window(server, username, session))
 
     def on_login_failed(self, error):
         self.status_label.setText(error)
@@ -788,7 +522,71 @@ class LoginWindow(QWidget):
         if self.net_thread:
             self.net_thread.stop()
 
+    def try_resume(self):
+        """AUTH with the session saved for the last server/user; False if there is none"""
+        config = self.load_config()
+        server, username = config.get("server", ""), config.get("username", "")
+        if not (config.get("remember") and server and username):
+            return False
+        session = SessionStore().load(server, username)
+        try:
+            host, port = server.rsplit(':', 1)
+            port = int(port)
+        except ValueError:
+            return False
+        if not session:
+            return False
+
+        self._resuming = True
+        self.status_label.setText("Resuming session...")
+        self.status_label.setStyleSheet("color: blue;")
+        self.login_btn.setEnabled(False)
+        self.register_btn.setEnabled(False)
+
+        signals = NetworkSignals()
+        signals.connected.connect(lambda: self.net_thread.resume_session(
+            session, lambda reply: self.on_resume_reply(server, username, reply), RESUME_TIMEOUT))
+        signals.login_success.connect(lambda s, u: self.on_login_success(server, u, s))
+        signals.disconnected.connect(lambda: self.resume_failed("Cannot reach the server - please log in"))
+        signals.message_received.connect(lambda msg: None)
+
+        self.net_thread = NetworkThread(host, port, signals)
+        self.net_thread.username = username
+        self.net_thread.start()
+        # Không hiện cửa sổ đăng nhập nếu AUTH trả lời nhanh
+        QTimer.singleShot(RESUME_SHOW_AFTER_MS, self._show_if_resuming)
+        return True
+
+    def _show_if_resuming(self):
+        if self._resuming:
+            self.show()
+
+    def on_resume_reply(self, server, username, reply):
+        if reply is not None and reply.ok:
+            return  # login_success opens the main window
+        if reply is not None:
+            # Rejected (expired, or logged in elsewhere): only then is the saved session dropped
+            SessionStore().forget(server, username)
+            self.resume_failed("Session expired - please log in")
+        else:
+            self.resume_failed("Could not resume the session - please log in")
+
+    def resume_failed(self, message):
+        if not self._resuming:
+            return
+        self._resuming = False
+        if self.net_thread:
+            self.net_thread.stop()
+            self.net_thread = None
+        self.status_label.setText(message)
+        self.status_label.setStyleSheet("color: red;")
+        self.login_btn.setEnabled(True)
+        self.register_btn.setEnabled(True)
+        self.show()
+        self.password_input.setFocus()
+
     def open_main_window(self, server, username, session):
+        STARTUP.mark(OPEN_MAIN)
         self.login_success.emit(server, username, session)
         self.close()
 
@@ -937,9 +735,8 @@ class ChatWindow(QWidget):
         text = self.message_input.text().strip()
         if not text:
             return
-        # TEXT <loại> <tên> <nội_dung>
-        cmd = f"TEXT {self.chat_type} {self.chat_name} {text}\n"
-        self.network.send(cmd)
+        # TEXT <loại> <tên> <nội_dung> (TEXT_ID nếu server hỗ trợ)
+        self.network.send_text(self.chat_type, self.chat_name, text)
         self.message_input.clear()
         
         # Ghi nhận tin nhắn local cuối để khử trùng và hiển thị cục bộ
@@ -955,7 +752,8 @@ class ChatWindow(QWidget):
                 import time
                 sender_norm = sender.strip().lower()
                 my_norm = self.username.strip().lower()
-                if sender_norm == my_norm and hasattr(self, 'last_local_message'):
+                # Với message id, client đã bỏ bản echo của chính mình
+                if sender_norm == my_norm and hasattr(self, 'last_local_message') and not self.network.message_ids:
                     if content == self.last_local_message and (time.time() - self.last_local_msg_ts) < 5:
                         pass  # Không hiển thị, đã có rồi
                     else:
@@ -1139,126 +937,22 @@ class ChatWindow(QWidget):
 # Trình quản lý truyền file
 # ============================================================================
 
-class FileTransferWorker(QThread):
-    """Worker thread for uploading/downloading files"""
-    progress = pyqtSignal(str, int, int)  # id_file/path, bytes_transferred, total
-    completed = pyqtSignal(str)  # id_file/path
-    failed = pyqtSignal(str, str)  # id_file/path, error_message
-    
-    def __init__(self, mode, sock, file_id, filepath, filesize, offset=0):
-        super().__init__()
-        self.mode = mode  # 'upload' hoặc 'download'
-        self.sock = sock
-        self.file_id = file_id
-        self.filepath = filepath
-        self.filesize = filesize
-        self.offset = offset
-        self.cancelled = False
-        
-    def run(self):
-        try:
-            if self.mode == 'upload':
-                self.upload_file()
-            elif self.mode == 'download':
-                self.download_file()
-        except Exception as e:
-            self.failed.emit(self.file_id, str(e))
-    
-    def upload_file(self):
-        """Upload file with binary chunks"""
-        try:
-            with open(self.filepath, 'rb') as f:
-                f.seek(self.offset)
-                bytes_sent = self.offset
-                
-                while bytes_sent < self.filesize:
-                    if self.cancelled:
-                        return
-                    
-                    # Read chunk
-                    chunk_size = min(CHUNK_SIZE, self.filesize - bytes_sent)
-                    data = f.read(chunk_size)
-                    if not data:
-                        break
-                    
-                    # Send binary chunk: [offset:4][length:4][data]
-                    header = struct.pack('!II', bytes_sent, len(data))
-                    self.sock.sendall(header + data)
-                    
-                    bytes_sent += len(data)
-                    self.progress.emit(self.file_id, bytes_sent, self.filesize)
-                
-                # Send EOF marker
-                eof_header = struct.pack('!II', bytes_sent, 0)
-                self.sock.sendall(eof_header)
-                
-                self.completed.emit(self.file_id)
-        except Exception as e:
-            self.failed.emit(self.file_id, f"Upload error: {str(e)}")
-    
-    def download_file(self):
-        """Download file with binary chunks"""
-        try:
-            mode = 'ab' if self.offset > 0 else 'wb'
-            with open(self.filepath, mode) as f:
-                bytes_received = self.offset
-                
-                while bytes_received < self.filesize:
-                    if self.cancelled:
-                        return
-                    
-                    # Receive chunk header: [offset:4][length:4]
-                    header = self.recv_exact(8)
-                    if not header:
-                        break
-                    
-                    offset, length = struct.unpack('!II', header)
-                    
-                    # EOF marker
-                    if length == 0:
-                        break
-                    
-                    # Receive payload
-                    data = self.recv_exact(length)
-                    if not data:
-                        break
-                    
-                    f.write(data)
-                    bytes_received += length
-                    self.progress.emit(self.file_id, bytes_received, self.filesize)
-                
-                self.completed.emit(self.file_id)
-        except Exception as e:
-            self.failed.emit(self.file_id, f"Download error: {str(e)}")
-    
-    def recv_exact(self, n):
-        """Receive exactly n bytes"""
-        data = b''
-        while len(data) < n:
-            if self.cancelled:
-                return None
-            chunk = self.sock.recv(n - len(data))
-            if not chunk:
-                return None
-            data += chunk
-        return data
-    
-    def cancel(self):
-        self.cancelled = True
-
-
 class UploadQueueManager(QObject):
     """Manages sequential upload queue"""
     queue_updated = pyqtSignal(list)  # Danh sách upload đang chờ
     upload_started = pyqtSignal(str, str)  # id_file, filename
+    upload_finished = pyqtSignal(str, str)  # id_file, đường_dẫn_file
+    upload_ended = pyqtSignal(str)  # đường_dẫn_file: xong, lỗi hoặc bị hủy
     
     def __init__(self, network_thread):
         super().__init__()
         self.network = network_thread
-        self.queue = Queue()
-        self.current_worker = None
         self.pending_uploads = []  # [(đường_dẫn_file, loại_đích, tên_đích)]
-        self.active_upload = None  # (id_file, đường_dẫn_file, tên_file, kích_thước)
+        self.active_upload = None  # (id_file, đường_dẫn_file, tên_file, kích_thước, loại_đích, tên_đích)
+        # Connected before MainWindow's handlers so the queue advances first
+        self.network.signals.upload_complete.connect(self.on_upload_complete_from_server)
+        self.network.signals.upload_failed.connect(self.on_failed)
+        self.network.signals.upload_deduplicated.connect(self.on_deduplicated)
         
     def add_files(self, filepaths, target_type, target_name):
         """Add files to upload queue"""
@@ -1268,7 +962,7 @@ class UploadQueueManager(QObject):
         self.queue_updated.emit(self.pending_uploads)
         
         # Bắt đầu upload nếu chưa hoạt động
-        if not self.current_worker or not self.current_worker.isRunning():
+        if not self.active_upload:
             self.process_next()
     
     def process_next(self):
@@ -1280,13 +974,18 @@ class UploadQueueManager(QObject):
         filename = os.path.basename(filepath)
         filesize = os.path.getsize(filepath)
         
-        # Gửi REQ_UPLOAD
-        cmd = f"REQ_UPLOAD {target_type} {target_name} {filename} {filesize}\n"
-        self.network.send(cmd)
-        
         # Lưu lại để dùng khi nhận READY_UPLOAD
         self.active_upload = (None, filepath, filename, filesize, target_type, target_name)
         self.queue_updated.emit(self.pending_uploads)
+
+        # Gửi REQ_UPLOAD (hash first: the server may already have the content)
+        self.network.offer_upload(target_type, target_name, filepath, filename, filesize,
+                                  callback=self.on_upload_offer_reply)
+
+    def on_upload_offer_reply(self, reply):
+        """READY_UPLOAD and UPLOAD_DEDUP arrive as signals; only failures land here"""
+        if reply is None or not reply.ok:
+            self.on_failed(None, reply.line if reply else "No reply")
     
     def on_ready_upload(self, file_id, offset):
         """Server is ready to receive file"""
@@ -1296,66 +995,47 @@ class UploadQueueManager(QObject):
         _, filepath, filename, filesize, target_type, target_name = self.active_upload
         self.active_upload = (file_id, filepath, filename, filesize, target_type, target_name)
         
-        # Gửi lệnh UPLOAD_DATA
-        cmd = f"UPLOAD_DATA {file_id}\n"
-        result = self.network.send(cmd)
-        
-        # Đợi phản hồi START_UPLOAD, sau đó bắt đầu worker
-        # (Sẽ được xử lý trong network thread)
+        # Gửi UPLOAD_DATA; chat_core streams the chunks once START_UPLOAD arrives
+        self.network.upload_data(file_id, filepath, filesize)
         self.upload_started.emit(file_id, filename)
     
-    def start_upload_worker(self, offset):
-        """Start binary upload worker"""
+    def on_deduplicated(self, file_id):
+        """Server reused a stored copy: the upload is complete without sending data"""
         if not self.active_upload:
             return
-        
-        file_id, filepath, filename, filesize, _, _ = self.active_upload
-        
-        self.current_worker = FileTransferWorker('upload', self.network.sock, 
-                                                 file_id, filepath, filesize, int(offset))
-        self.current_worker.progress.connect(self.on_progress)
-        self.current_worker.completed.connect(self.on_complete)
-        self.current_worker.failed.connect(self.on_failed)
-        self.current_worker.start()
-    
-    def on_progress(self, file_id, bytes_sent, total):
-        """Upload progress"""
-        self.network.signals.upload_progress.emit(file_id, bytes_sent, total)
-    
-    def on_complete(self, file_id):
-        """Upload completed"""
-        # Server sẽ gửi phản hồi UPLOAD_COMPLETE
-        pass
-    
+        _, filepath, filename, filesize, target_type, target_name = self.active_upload
+        self.active_upload = (file_id, filepath, filename, filesize, target_type, target_name)
+        self.upload_started.emit(file_id, filename)
+        self.network.signals.upload_complete.emit(file_id)
+
+    def _end_active(self):
+        if self.active_upload:
+            filepath = self.active_upload[1]
+            self.active_upload = None
+            self.upload_ended.emit(filepath)
+
     def on_failed(self, file_id, error):
         """Upload failed"""
-        self.network.signals.upload_failed.emit(file_id, error)
-        self.active_upload = None
+        self._end_active()
         self.process_next()  # Tiếp tục với file tiếp theo
     
-    def on_upload_complete_from_server(self):
+    def on_upload_complete_from_server(self, file_id):
         """Server confirmed upload complete"""
-        if self.active_upload:
-            file_id = self.active_upload[0]
-            self.network.signals.upload_complete.emit(file_id)
-            self.active_upload = None
+        if self.active_upload and self.active_upload[0] == file_id:
+            self.upload_finished.emit(file_id, self.active_upload[1])
+        self._end_active()
         
         # Xử lý file tiếp theo trong hàng đợi
         self.process_next()
     
     def cancel_current(self):
         """Cancel current upload"""
-        if self.current_worker and self.current_worker.isRunning():
-            self.current_worker.cancel()
-            self.current_worker.wait()
-        
         if self.active_upload:
             file_id = self.active_upload[0]
             if file_id:
-                cmd = f"REQ_CANCEL_UPLOAD {file_id}\n"
-                self.network.send(cmd)
+                self.network.send(encode_cancel_upload(file_id))
         
-        self.active_upload = None
+        self._end_active()
         self.process_next()
 
 
@@ -1377,14 +1057,31 @@ class MainWindow(QWidget):
         self.group_invites = []  # Store group invites: list of (group_name, inviter)
         self.chat_windows = {}  # Track open chat windows: name -> ChatWindow
         self.recent_chats = []  # List of recent conversations
+        # Names from the last GET_FRIENDS / GET_GROUPS (None: not known yet)
+        self._friend_names = None
+        self._group_names = None
         
         # File transfer management
         self.upload_manager = UploadQueueManager(net_thread)
-        net_thread.upload_manager = self.upload_manager  # Link for callbacks
         self.file_notifications = []  # List of (type, target, sender, file_id, filename)
         self.active_downloads = {}  # id_file -> (worker, progress_bar, filepath)
         # Track local uploads (to show file bubble on sender side when complete)
         self.local_uploads = {}  # id_file -> (filename, target_type, target_name)
+        self.pending_saves = {}  # id_file -> (save_path, filename) for downloads in flight
+        self.file_catalog = {}  # (type, name) -> {LIST_FILES command: Reply}; dropped on new files
+        self.forward_copies = {}  # temporary copy -> source file_id (forward by upload)
+        # Bubble HTML from precompiled templates, timestamps cached per day
+        self.renderer = MessageRenderer(username, (THUMB_WIDTH, THUMB_HEIGHT))
+        try:
+            with STARTUP.phase("download cache"):
+                self.download_cache = DownloadCache(cache_dir_for(server))
+        except OSError as e:
+            print(f"[WARN] Download cache disabled: {e}")
+            self.download_cache = None
+        self.thumbnails = ThumbnailManager(net_thread, self.download_cache,
+                                           os.path.join(cache_dir_for(server), "thumbs"))
+        # Messages typed while reconnecting survive a restart; re-sent at the next login
+        self.net_thread.open_outbox(os.path.join(cache_dir_for(server), f"outbox-{username}.txt"))
         
         self.setWindowTitle(f"Chat - {username}")
         self.setMinimumSize(1200, 800)
@@ -1396,10 +1093,16 @@ class MainWindow(QWidget):
         self.net_thread.signals.notification.connect(self.show_notification)
         self.net_thread.signals.message_received.connect(self.log_message)
         self.net_thread.signals.disconnected.connect(self.on_disconnected)
+        self.net_thread.signals.session_rejected.connect(self.on_session_rejected)
         self.net_thread.signals.text_message.connect(self.on_new_message)
         self.net_thread.signals.history_received.connect(self.on_history_received)
         self.net_thread.signals.members_received.connect(self.show_members_dialog)
         self.net_thread.signals.left_group.connect(self.on_left_group)
+        self.net_thread.signals.write_backpressure.connect(self.on_write_backpressure)
+        self.net_thread.signals.reconnecting.connect(self.on_reconnecting)
+        self.net_thread.signals.reconnected.connect(self.on_reconnected)
+        self.net_thread.signals.text_delivered.connect(self.on_text_delivered)
+        self.net_thread.signals.text_failed.connect(self.on_text_failed)
         
         # Tín hiệu truyền file
         self.net_thread.signals.file_notification.connect(self.on_file_notification)
@@ -1407,16 +1110,28 @@ class MainWindow(QWidget):
         self.net_thread.signals.upload_progress.connect(self.on_upload_progress)
         self.net_thread.signals.upload_complete.connect(self.on_upload_complete)
         self.net_thread.signals.upload_failed.connect(self.on_upload_failed)
+        self.net_thread.signals.download_complete.connect(self.on_download_complete)
+        self.net_thread.signals.download_failed.connect(self.on_download_failed)
+        self.upload_manager.upload_finished.connect(self.on_upload_finished)
+        self.upload_manager.upload_ended.connect(self.on_upload_ended)
         self.upload_manager.upload_started.connect(self.on_upload_started)
         
-        self.init_ui()
+        with STARTUP.phase("init_ui"):
+            self.init_ui()
+        # Last session's lists, shown until the server's answers replace them
+        self.snapshot = UiSnapshot(os.path.join(cache_dir_for(server), f"state-{username}.json"))
+        self._snapshot_timer = QTimer(self)
+        self._snapshot_timer.setSingleShot(True)
+        self._snapshot_timer.setInterval(1000)
+        self._snapshot_timer.timeout.connect(self.snapshot.flush)
+        with STARTUP.phase("snapshot"):
+            self.apply_snapshot()
         self.refresh_friends()
         self.refresh_groups()
         # Load pending notifications on login
         QTimer.singleShot(500, self.load_pending_notifications)
 
-    # Track last date shown in chat for inserting day separators
-        self._last_date_shown = None
+    # Day separators are tracked by self.renderer (message_render.py)
         
         # Auto-refresh friends status every 5 seconds
     # Remove auto-refresh friends
@@ -1439,6 +1154,23 @@ class MainWindow(QWidget):
         
         header.addStretch()
         
+        diag_btn = QPushButton("Diagnostics")
+        diag_btn.setFixedSize(110, 30)
+        diag_btn.setStyleSheet("""
+            QPushButton {
+                background-color: white;
+                color: #333;
+                border: none;
+                border-radius: 4px;
+                font-weight: bold;
+            }
+            QPushButton:hover {
+                background-color: #f0f0f0;
+            }
+        """)
+        diag_btn.clicked.connect(self.show_diagnostics_dialog)
+        header.addWidget(diag_btn)
+        
         # Notifications button with badge
         notif_btn = QPushButton("Notifications")
         notif_btn.setFixedSize(140, 30)
@@ -1557,6 +1289,10 @@ class MainWindow(QWidget):
             QPushButton:hover { background-color: #e0e0e0; }
         """)
         header_actions.addWidget(self.history_btn)
+        self.files_btn = QPushButton("Files")
+        self.files_btn.clicked.connect(self.show_files_dialog)
+        self.files_btn.setStyleSheet(self.history_btn.styleSheet())
+        header_actions.addWidget(self.files_btn)
         self.load_more_btn = QPushButton("Load More Messages")
         self.load_more_btn.setVisible(False)
         self.load_more_btn.clicked.connect(self.load_more_history)
@@ -1568,7 +1304,8 @@ class MainWindow(QWidget):
         chat_panel.addLayout(header_actions)
         
         # Messages area
-        self.chat_display = QTextBrowser()
+        self.chat_display = ChatBrowser()
+        self.chat_display.set_thumbnails(self.thumbnails)
         self.chat_display.setReadOnly(True)
         # Use a consistent font across clients (prefer Segoe UI on Windows, fallback to Arial)
         self.chat_display.setFont(QFont("Segoe UI", 12))
@@ -1675,6 +1412,12 @@ class MainWindow(QWidget):
         # Track current chat
         self.current_chat_type = None  # 'U' or 'G'
         self.current_chat_name = None
+        # For the resync after a reconnect: newest server timestamp shown in
+        # the current chat and the bubbles shown at or after it
+        self._live_since = None
+        self._live_bubbles = Counter()
+        # Own messages awaiting their ack: message id -> cursor on the status mark
+        self._bubble_status = {}
 
         # Column 3: Left Sidebar - Friends & Groups
         left_sidebar = QVBoxLayout()
@@ -1918,7 +1661,71 @@ class MainWindow(QWidget):
         
         groups_tab.setLayout(groups_layout)
         
-        # Tab 3: Notifications
+        # Add tabs - Friends & Groups on left, Notifications on right
+        left_tabs.addTab(friends_tab, "Friends")
+        left_tabs.addTab(groups_tab, "Groups")
+        
+        left_sidebar.addWidget(left_tabs)
+        
+        left_sidebar_widget = QWidget()
+        left_sidebar_widget.setLayout(left_sidebar)
+        left_sidebar_widget.setStyleSheet("background-color: #f8f9fa;")
+        left_sidebar_widget.setFixedWidth(250)
+        content.addWidget(left_sidebar_widget)
+        
+        # Notifications panel (friend requests, group invites, activity log):
+        # never on screen at login, so built on first use
+        self._notif_tab = None
+        self.notif_popup = None
+
+        main_layout.addLayout(content)
+        self.setLayout(main_layout)
+        
+        # Overall window style (unify fonts across all widgets)
+        self.setStyleSheet("""
+            QWidget {
+                font-family: 'Segoe UI', Arial, sans-serif;
+                font-size: 13px;
+                color: #333;
+            }
+            QLabel {
+                color: #333;
+            }
+            QListWidget {
+                color: #333;
+            }
+            QLineEdit {
+                color: #333;
+            }
+            QTextEdit {
+                color: #333;
+            }
+        """)
+
+    @property
+    def notif_tab(self):
+        if self._notif_tab is None:
+            with STARTUP.phase("notifications panel"):
+                self._notif_tab = self._build_notifications_panel()
+        return self._notif_tab
+
+    # Its lists also hold the pending requests / invites shown in the popup
+    @property
+    def pending_list(self):
+        self.notif_tab  # built on first use
+        return self._pending_list
+
+    @property
+    def group_invites_list(self):
+        self.notif_tab  # built on first use
+        return self._group_invites_list
+
+    @property
+    def activity_log(self):
+        self.notif_tab  # built on first use
+        return self._activity_log
+
+    def _build_notifications_panel(self):
         notif_tab = QWidget()
         notif_layout = QVBoxLayout()
         notif_layout.setContentsMargins(10, 10, 10, 10)
@@ -1932,9 +1739,9 @@ class MainWindow(QWidget):
         pending_label.setFont(QFont("Arial", 10, QFont.Bold))
         notif_layout.addWidget(pending_label)
         
-        self.pending_list = QListWidget()
-        self.pending_list.setMaximumHeight(120)
-        self.pending_list.setStyleSheet("""
+        self._pending_list = QListWidget()
+        self._pending_list.setMaximumHeight(120)
+        self._pending_list.setStyleSheet("""
             QListWidget {
                 border: 1px solid #ddd;
                 border-radius: 4px;
@@ -1943,7 +1750,9 @@ class MainWindow(QWidget):
                 padding: 6px;
             }
         """)
-        notif_layout.addWidget(self.pending_list)
+        for sender in self.pending_requests:
+            self._pending_list.addItem(sender)
+        notif_layout.addWidget(self._pending_list)
         
         pending_btns = QHBoxLayout()
         accept_btn = QPushButton("Accept")
@@ -1986,9 +1795,9 @@ class MainWindow(QWidget):
         group_inv_label.setFont(QFont("Arial", 10, QFont.Bold))
         notif_layout.addWidget(group_inv_label)
         
-        self.group_invites_list = QListWidget()
-        self.group_invites_list.setMaximumHeight(120)
-        self.group_invites_list.setStyleSheet("""
+        self._group_invites_list = QListWidget()
+        self._group_invites_list.setMaximumHeight(120)
+        self._group_invites_list.setStyleSheet("""
             QListWidget {
                 border: 1px solid #ddd;
                 border-radius: 4px;
@@ -1997,7 +1806,9 @@ class MainWindow(QWidget):
                 padding: 6px;
             }
         """)
-        notif_layout.addWidget(self.group_invites_list)
+        for group_name, inviter in self.group_invites:
+            self._group_invites_list.addItem(f"{group_name} (invited by {inviter})")
+        notif_layout.addWidget(self._group_invites_list)
         
         group_btns = QHBoxLayout()
         join_btn = QPushButton("Join")
@@ -2040,10 +1851,15 @@ class MainWindow(QWidget):
         log_label.setFont(QFont("Arial", 10, QFont.Bold))
         notif_layout.addWidget(log_label)
         
-        self.activity_log = QTextEdit()
-        self.activity_log.setReadOnly(True)
-        self.activity_log.setMaximumHeight(150)
-        self.activity_log.setStyleSheet("""
+        self._activity_log = QTextEdit()
+        self._activity_log.setReadOnly(True)
+        self._activity_log.setMaximumHeight(150)
+        self._activity_log.document().setMaximumBlockCount(500)
+        self._log_seq = 0
+        self._log_timer = QTimer(self)
+        self._log_timer.timeout.connect(self.drain_activity_log)
+        self._log_timer.start(500)
+        self._activity_log.setStyleSheet("""
             QTextEdit {
                 border: 1px solid #ddd;
                 border-radius: 4px;
@@ -2051,49 +1867,10 @@ class MainWindow(QWidget):
                 font-size: 10px;
             }
         """)
-        notif_layout.addWidget(self.activity_log)
+        notif_layout.addWidget(self._activity_log)
         
         notif_tab.setLayout(notif_layout)
-        
-        # Add tabs - Friends & Groups on left, Notifications on right
-        left_tabs.addTab(friends_tab, "Friends")
-        left_tabs.addTab(groups_tab, "Groups")
-        
-        left_sidebar.addWidget(left_tabs)
-        
-        left_sidebar_widget = QWidget()
-        left_sidebar_widget.setLayout(left_sidebar)
-        left_sidebar_widget.setStyleSheet("background-color: #f8f9fa;")
-        left_sidebar_widget.setFixedWidth(250)
-        content.addWidget(left_sidebar_widget)
-        
-        # Store notification tab for popup
-        self.notif_tab = notif_tab
-        self.notif_popup = None
-
-        main_layout.addLayout(content)
-        self.setLayout(main_layout)
-        
-        # Overall window style (unify fonts across all widgets)
-        self.setStyleSheet("""
-            QWidget {
-                font-family: 'Segoe UI', Arial, sans-serif;
-                font-size: 13px;
-                color: #333;
-            }
-            QLabel {
-                color: #333;
-            }
-            QListWidget {
-                color: #333;
-            }
-            QLineEdit {
-                color: #333;
-            }
-            QTextEdit {
-                color: #333;
-            }
-        """)
+        return notif_tab
 
     def refresh_friends(self):
         self.net_thread.send("GET_FRIENDS")
@@ -2104,6 +1881,9 @@ class MainWindow(QWidget):
         for name, status in friends:
             item = QListWidgetItem(f"{name} ({status})")
             self.friends_list.addItem(item)
+        self._friend_names = {name for name, _ in friends}
+        self.save_snapshot("friends", friends)
+        self.reconcile_conversations()
         
         self.log_message(f"Friends updated: {len(friends)} friends")
     
@@ -2116,11 +1896,13 @@ class MainWindow(QWidget):
     def update_pending_requests(self, requests):
         """Update pending_requests list and show notifications"""
         self.pending_requests = requests
+        self.save_snapshot("pending_requests", requests)
         
-        # Update the pending_list widget
-        self.pending_list.clear()
-        for sender in requests:
-            self.pending_list.addItem(sender)
+        # The panel lists pending_requests when it is built; refresh it only if it exists
+        if self._notif_tab is not None:
+            self._pending_list.clear()
+            for sender in requests:
+                self._pending_list.addItem(sender)
         
         if requests:
             self.log_message(f"You have {len(requests)} pending friend request(s)")
@@ -2133,12 +1915,14 @@ class MainWindow(QWidget):
         """Update group invites and show notifications"""
         # Store in a class variable for access in notifications popup
         self.group_invites = invites
+        self.save_snapshot("group_invites", invites)
         
-        # Update the group_invites_list widget
-        self.group_invites_list.clear()
-        for group_name, inviter in invites:
-            invite_text = f"{group_name} (invited by {inviter})"
-            self.group_invites_list.addItem(invite_text)
+        # Same for the group_invites_list widget
+        if self._notif_tab is not None:
+            self._group_invites_list.clear()
+            for group_name, inviter in invites:
+                invite_text = f"{group_name} (invited by {inviter})"
+                self._group_invites_list.addItem(invite_text)
         
         if invites:
             self.log_message(f"You have {len(invites)} group invite(s)")
@@ -2158,9 +1942,46 @@ class MainWindow(QWidget):
             item = QListWidgetItem(f"{name} ({count} members)")
             item.setData(Qt.UserRole, name)  # Store group name
             self.groups_list.addItem(item)
+        self._group_names = {name for name, _ in groups}
+        self.save_snapshot("groups", groups)
+        self.reconcile_conversations()
         
         self.log_message(f"Groups updated: {len(groups)} groups")
 
+    def apply_snapshot(self):
+        """Fill the lists from the last session (see ui_snapshot.py)"""
+        snap = self.snapshot
+        for title, preview in snap.get("conversations"):
+            self.conversations_list.addItem(QListWidgetItem(f"{title}\n{preview}"))
+        if snap.get("friends"):
+            self.update_friends_list(snap.get("friends"))
+        if snap.get("groups"):
+            self.update_groups_list(snap.get("groups"))
+        # Listed when the Notifications panel / popup is first built
+        self.pending_requests = list(snap.get("pending_requests"))
+        self.group_invites = [tuple(invite) for invite in snap.get("group_invites")]
+
+    def save_snapshot(self, key, values):
+        if self.snapshot.update(key, values) and not self._snapshot_timer.isActive():
+            self._snapshot_timer.start()  # at most one write a second
+
+    def save_conversations(self):
+        # Item text is "<title>\n<preview>" (see add_to_conversations)
+        self.save_snapshot("conversations", [self.conversations_list.item(i).text().partition('\n')[::2]
+                                             for i in range(self.conversations_list.count())])
+
+    def reconcile_conversations(self):
+        """Drop conversations with ex-friends and groups left while offline"""
+        for i in reversed(range(self.conversations_list.count())):
+            title = self.conversations_list.item(i).text().split('\n', 1)[0]
+            if title.startswith("[Group] "):
+                names, name = self._group_names, title[len("[Group] "):]
+            else:
+                names, name = self._friend_names, title
+            if names is not None and name not in names:
+                self.conversations_list.takeItem(i)
+        self.save_conversations()
+
     def handle_add_friend(self):
         username = self.add_friend_input.text().strip()
         if not username:
@@ -2527,9 +2348,121 @@ class MainWindow(QWidget):
         QMessageBox.information(self, title, message)
 
     def log_message(self, msg):
-        timestamp = datetime.now().strftime("%H:%M:%S")
-        self.activity_log.append(f"[{timestamp}] {msg}")
+        # Buffered in DEBUG_LOG; the Activity Log pane pulls it only while visible
+        DEBUG_LOG.info("%s", msg)
+
+    def drain_activity_log(self):
+        """Append new log records to the Activity Log if it is on screen"""
+        if not self.activity_log.isVisible() or DEBUG_LOG.last_seq == self._log_seq:
+            return
+        records = DEBUG_LOG.since(self._log_seq)
+        if records:
+            self._log_seq = records[-1][0]
+            self.activity_log.append("\n".join(line for _, line in records))
     
+    def show_diagnostics_dialog(self):
+        """Show per-command latency, byte counters and transfer throughput"""
+        telemetry = self.net_thread.telemetry
+        dlg = QDialog(self)
+        dlg.setWindowTitle("Diagnostics")
+        dlg.setWindowFlags(dlg.windowFlags() & ~Qt.WindowContextHelpButtonHint)
+        dlg.resize(720, 480)
+        layout = QVBoxLayout(dlg)
+
+        summary_label = QLabel()
+        summary_label.setWordWrap(True)
+        layout.addWidget(summary_label)
+
+        columns = ["Command", "Count", "Sent", "Fail", "p50 ms", "p95 ms", "p99 ms", "Max ms"]
+        table = QTableWidget(0, len(columns), dlg)
+        table.setHorizontalHeaderLabels(columns)
+        table.setEditTriggers(QTableWidget.NoEditTriggers)
+        table.verticalHeader().setVisible(False)
+        table.horizontalHeader().setSectionResizeMode(0, QHeaderView.Stretch)
+        layout.addWidget(table)
+
+        transfers_label = QLabel()
+        transfers_label.setWordWrap(True)
+        layout.addWidget(transfers_label)
+
+        def refresh():
+            snap = telemetry.snapshot()
+            summary_label.setText(
+                f"Uptime {snap['uptime_s']:.0f}s    "
+                f"Out {snap['bytes_out']:,} B ({snap['out_rate_b_s']:.0f} B/s)    "
+                f"In {snap['bytes_in']:,} B ({snap['in_rate_b_s']:.0f} B/s)    "
+                f"Awaiting reply: {len(snap['pending'])}")
+            outbox = self.net_thread.outbox
+            if outbox is not None:
+                q = outbox.snapshot()
+                summary_label.setText(
+                    summary_label.text() +
+                    f"\nOutbound queue: {q['control_queued']} commands, "
+                    f"{q['bulk_queued_bytes']:,} B of chunks    "
+                    f"{q['lines_written']} commands in {q['writes']} writes    "
+                    f"Dropped: {q['dropped']}" + ("    (congested)" if q['congested'] else ""))
+            rtt = snap['rtt']
+            if rtt['samples']:
+                summary_label.setText(
+                    summary_label.text() +
+                    f"\nRTT {rtt['srtt_ms']:.1f} ms (+/- {rtt['rttvar_ms']:.1f}) over {rtt['samples']} pings    "
+                    f"Dead connections detected: {rtt['dead_peers']}")
+            startup = STARTUP.targets()
+            if startup:
+                summary_label.setText(
+                    summary_label.text() + "\nStartup: " + "    ".join(
+                        f"{name} {t:.2f}s (target {TARGETS[name][1]:.2f}s)" for name, t in startup.items()))
+            client = self.net_thread.client
+            if client.compression:
+                ratio = client.plain_bytes_in / client.wire_bytes_in if client.wire_bytes_in else 1.0
+                summary_label.setText(
+                    summary_label.text() +
+                    f"\nCompression: {client.compression}, {client.wire_bytes_in:,} B on the wire "
+                    f"for {client.plain_bytes_in:,} B ({ratio:.1f}x)")
+            rows = snap['latency']
+            table.setRowCount(len(rows))
+            for row, (name, st) in enumerate(rows.items()):
+                values = [name, st['count'], st['sent'], st['failures'],
+                          f"{st['p50_ms']:.1f}", f"{st['p95_ms']:.1f}",
+                          f"{st['p99_ms']:.1f}", f"{st['max_ms']:.1f}"]
+                for col, value in enumerate(values):
+                    table.setItem(row, col, QTableWidgetItem(str(value)))
+            lines = []
+            for direction, t in snap['transfers'].items():
+                lines.append(f"{direction.title()}: {t['count']} files, {t['bytes']:,} B, "
+                             f"avg {t['avg_kib_s']:.0f} KiB/s, p50 {t['p50_kib_s']} KiB/s, "
+                             f"p95 {t['p95_kib_s']} KiB/s")
+            transfers_label.setText("\n".join(lines))
+
+        def export():
+            path, _ = QFileDialog.getSaveFileName(dlg, "Export Diagnostics", "telemetry.json",
+                                                  "JSON Files (*.json)")
+            if path:
+                try:
+                    telemetry.export_json(path)
+                    self.log_message(f"Diagnostics exported to {path}")
+                except OSError as e:
+                    QMessageBox.warning(dlg, "Export Failed", str(e))
+
+        btns = QHBoxLayout()
+        cache_btn = QPushButton("Download Cache...", dlg)
+        cache_btn.clicked.connect(lambda: self.show_cache_dialog(dlg))
+        export_btn = QPushButton("Export JSON", dlg)
+        export_btn.clicked.connect(export)
+        close_btn = QPushButton("Close", dlg)
+        close_btn.clicked.connect(dlg.accept)
+        btns.addWidget(cache_btn)
+        btns.addStretch()
+        btns.addWidget(export_btn)
+        btns.addWidget(close_btn)
+        layout.addLayout(btns)
+
+        timer = QTimer(dlg)
+        timer.timeout.connect(refresh)
+        timer.start(1000)
+        refresh()
+        dlg.exec_()
+
     def open_conversation(self, item):
         """Open chat from conversation list"""
         # Item format: "Name\nLast message..."
@@ -2602,7 +2535,10 @@ class MainWindow(QWidget):
         self.chat_display.clear()
         
         # Reset day separator tracking when switching chats
-        self._last_date_shown = None
+        self.renderer.reset()
+        self._live_since = None
+        self._live_bubbles = Counter()
+        self._bubble_status = {}
         
         # Set flag để biết đây là load lần đầu (không nên popup nếu không có tin nhắn)
         self._initial_load = True
@@ -2630,168 +2566,62 @@ class MainWindow(QWidget):
             return
         
         
-        # Send TEXT command
-        cmd = f"TEXT {self.current_chat_type} {self.current_chat_name} {text}\n"
-        self.net_thread.send(cmd)
+        # Send TEXT command (TEXT_ID: bubble shows pending -> delivered / failed)
+        message_id = self.net_thread.send_text(self.current_chat_type, self.current_chat_name, text)
         self.message_input.clear()
         
         # Ghi nhận tin nhắn local cuối để khử trùng và hiển thị cục bộ
         import time
         self.last_local_message = text
         self.last_local_msg_ts = time.time()
-        self.append_message_to_panel(self.username, text)
+        self.append_message_to_panel(self.username, text, message_id=message_id or "unsent")
+        if message_id is None:
+            self.on_text_failed("unsent", "not connected")
     
-    def append_message_to_panel(self, sender, content, timestamp=None):
-        """Add message to chat display"""
-        # Format timestamp for display
-        from datetime import datetime
-        today_dt = datetime.now()
-        if timestamp:
-            try:
-                ts = int(timestamp)
-                dt = datetime.fromtimestamp(ts)
-            except:
-                dt = today_dt
-        else:
-            dt = today_dt
-    # Display format: dd:mm:yy  hh:mm (as requested)
-        time_str = dt.strftime("%d:%m:%y %H:%M")
-
-        # Insert day separator if date changed since last message
-        current_date = dt.strftime("%A, %d %B %Y")  # e.g., Monday, 16 December 2025
-        if self._last_date_shown != current_date:
-            sep_html = f"""
-            <div style='display:block; width:100%; text-align:center; margin:12px 0;'>
-                <span style='background:#eef3f8; color:#555; font-size:12px; padding:4px 10px; border-radius:12px; display:inline-block;'>
-                    {current_date}
-                </span>
-            </div>
-            """
+    def append_message_to_panel(self, sender, content, timestamp=None, message_id=None):
+        """Add message to chat display (message_id: own message awaiting its ack)"""
+        self._track_bubble((sender, "TEXT", content), timestamp)
+        status_html = f" {MSG_PENDING}" if message_id else ""
+        sep_html, msg_html = self.renderer.text(sender, content, timestamp, status_html)
+        if sep_html:
             self.chat_display.append(sep_html)
-            self._last_date_shown = current_date
-
-        # Messenger style: your message always right, incoming always left
-        sender_norm = sender.strip().lower()
-        username_norm = self.username.strip().lower()
-        
-        # Escape HTML in content to avoid breaking
-        from html import escape
-        safe_content = escape(content)
-        
-        # Unified style for both text and file messages:
-        # - Sender name blue (#1976D2)
-        # - Light blue bubble (#e3f2fd) with subtle left border (#2196F3)
-        # - Consistent font and time color
-        if sender_norm == username_norm:
-            msg_html = f"""
-            <table width='100%' style='margin:6px 0; border-collapse:collapse;'><tr>
-                <td width='35%'></td>
-                <td width='65%' align='right'>
-                    <div style='display:inline-block; max-width:85%; text-align:left;'>
-                        <div style='font-size:11px; font-weight:bold; color:#1976D2; margin-bottom:4px; padding-left:10px;'>{escape(sender)}</div>
-                        <div style='background-color:#e3f2fd; color:#333; padding:10px 12px; border-radius:10px; border-left:4px solid #2196F3; word-wrap:break-word;'>
-                            {safe_content}
-                            <div style='font-size:10px; color:#666; margin-top:6px; text-align:right;'>{time_str}</div>
-                        </div>
-                    </div>
-                </td>
-            </tr></table>
-            """
-        else:
-            msg_html = f"""
-            <table width='100%' style='margin:6px 0; border-collapse:collapse;'><tr>
-                <td width='65%' align='left'>
-                    <div style='display:inline-block; max-width:85%; text-align:left;'>
-                        <div style='font-size:11px; font-weight:bold; color:#1976D2; margin-bottom:4px; padding-left:10px;'>{escape(sender)}</div>
-                        <div style='background-color:#e3f2fd; color:#333; padding:10px 12px; border-radius:10px; border-left:4px solid #2196F3; word-wrap:break-word;'>
-                            {safe_content}
-                            <div style='font-size:10px; color:#666; margin-top:6px;'>{time_str}</div>
-                        </div>
-                    </div>
-                </td>
-                <td width='35%'></td>
-            </tr></table>
-            """
 
         self.chat_display.append(msg_html)
+        if status_html:
+            # Nhớ vị trí ký hiệu trạng thái để cập nhật khi có ack
+            doc = self.chat_display.document()
+            cursor = doc.find(MSG_PENDING, doc.characterCount() - 1, QTextDocument.FindBackward)
+            if not cursor.isNull():
+                self._bubble_status[message_id] = cursor
         self.chat_display.verticalScrollBar().setValue(self.chat_display.verticalScrollBar().maximum())
+
+    def _set_bubble_status(self, message_id, glyph, color):
+        cursor = self._bubble_status.pop(message_id, None)
+        if cursor is None or not cursor.hasSelection():
+            return  # chat switched or cleared since
+        fmt = cursor.charFormat()
+        fmt.setForeground(QColor(color))
+        cursor.insertText(glyph, fmt)
+
+    def on_text_delivered(self, message_id, timestamp):
+        self._set_bubble_status(message_id, MSG_DELIVERED, "#2E7D32")
+
+    def on_text_failed(self, message_id, reason):
+        self._set_bubble_status(message_id, MSG_FAILED, "#D32F2F")
+        self.log_message(f"Message not delivered: {reason}")
     
     def append_file_message_to_panel_html(self, sender, filename, file_id, timestamp=None):
         """Add file message to chat display (HTML version for MainWindow).
         File từ mình gửi nằm bên phải, file từ người khác nằm bên trái.
         """
-        from datetime import datetime
-        from html import escape
-        
-        # Format timestamp
-        today_dt = datetime.now()
-        if timestamp:
-            try:
-                ts = int(timestamp)
-                dt = datetime.fromtimestamp(ts)
-            except:
-                dt = today_dt
-        else:
-            dt = today_dt
-        time_str = dt.strftime("%d:%m:%y %H:%M")
-        
-        # Insert day separator if needed
-        current_date = dt.strftime("%A, %d %B %Y")
-        if self._last_date_shown != current_date:
-            sep_html = f"""
-            <div style='display:block; width:100%; text-align:center; margin:12px 0;'>
-                <span style='background:#eef3f8; color:#555; font-size:12px; padding:4px 10px; border-radius:12px; display:inline-block;'>
-                    {current_date}
-                </span>
-            </div>
-            """
+        self._track_bubble((sender, "FILE", file_id), timestamp)
+        thumbnail = is_image(filename)
+        if thumbnail:
+            # Loaded by ChatBrowser only once this bubble is painted
+            self.thumbnails.register(file_id, filename)
+        sep_html, file_html = self.renderer.file(sender, filename, file_id, timestamp, thumbnail)
+        if sep_html:
             self.chat_display.append(sep_html)
-            self._last_date_shown = current_date
-        
-        # Check if file is from current user
-        sender_norm = sender.strip().lower()
-        username_norm = self.username.strip().lower()
-        is_self = (sender_norm == username_norm)
-        
-        # File bubble HTML with download link
-        safe_filename = escape(filename)
-        safe_sender = escape(sender)
-        
-        # Create clickable download link
-        download_link = f'<a href="#download|{file_id}|{filename}" style="color:#1976D2; text-decoration:none; font-weight:bold;">📎 {safe_filename}</a>'
-        
-        if is_self:
-            # Right-aligned (your file)
-            file_html = f"""
-            <table width='100%' style='margin:6px 0; border-collapse:collapse;'><tr>
-                <td width='35%'></td>
-                <td width='65%' align='right'>
-                    <div style='display:inline-block; max-width:85%; text-align:left;'>
-                        <div style='font-size:11px; font-weight:bold; color:#1976D2; margin-bottom:4px; padding-left:10px;'>{safe_sender}</div>
-                        <div style='background-color:#e3f2fd; color:#333; padding:10px 12px; border-radius:10px; border-left:4px solid #2196F3;'>
-                            {download_link}
-                            <div style='font-size:10px; color:#666; margin-top:6px; text-align:right;'>{time_str}</div>
-                        </div>
-                    </div>
-                </td>
-            </tr></table>
-            """
-        else:
-            # Left-aligned (their file)
-            file_html = f"""
-            <table width='100%' style='margin:6px 0; border-collapse:collapse;'><tr>
-                <td width='65%' align='left'>
-                    <div style='display:inline-block; max-width:85%; text-align:left;'>
-                        <div style='font-size:11px; font-weight:bold; color:#1976D2; margin-bottom:4px; padding-left:10px;'>{safe_sender}</div>
-                        <div style='background-color:#e3f2fd; color:#333; padding:10px 12px; border-radius:10px; border-left:4px solid #2196F3;'>
-                            {download_link}
-                            <div style='font-size:10px; color:#666; margin-top:6px;'>{time_str}</div>
-                        </div>
-                    </div>
-                </td>
-                <td width='35%'></td>
-            </tr></table>
-            """
         
         self.chat_display.append(file_html)
         self.chat_display.verticalScrollBar().setValue(
@@ -2809,6 +2639,10 @@ class MainWindow(QWidget):
             finally:
                 self._capture_history_mode = None
             return
+        if getattr(self, '_capture_history_mode', None) == 'resync':
+            self._capture_history_mode = None
+            self._resync_history(messages)
+            return
         # Clear on first fetch batch
         if getattr(self, '_history_fetching', False):
             self.chat_display.clear()
@@ -2842,6 +2676,7 @@ class MainWindow(QWidget):
             self._initial_load = False
         
         # Display both TEXT and FILE messages
+        render_started = time.perf_counter()
         for line in messages:
             parts6 = line.split('|', 5)
             if len(parts6) >= 6:
@@ -2863,6 +2698,7 @@ class MainWindow(QWidget):
                 file_id = file_id or filename
                 # Dùng method HTML để hiển thị file đúng thứ tự và căn đúng bên
                 self.append_file_message_to_panel_html(sender, filename, file_id, ts)
+        self.net_thread.telemetry.record(SPAN_RENDER_HISTORY, time.perf_counter() - render_started)
     
     def on_more_history_received(self, messages):
         """Handle additional HISTORY response - prepend to existing messages"""
@@ -3008,6 +2844,7 @@ class MainWindow(QWidget):
             # Add new conversation at top
             item = QListWidgetItem(f"{conv_name}\n{preview}")
             self.conversations_list.insertItem(0, item)
+        self.save_conversations()
     
     def on_new_message(self, msg_type, name, sender, content):
         """Handle new incoming message - update conversations list and chat panel"""
@@ -3022,7 +2859,8 @@ class MainWindow(QWidget):
                 import time
                 sender_norm = sender.strip().lower()
                 my_norm = self.username.strip().lower()
-                if sender_norm == my_norm and self.last_local_message is not None:
+                # Với message id, client đã bỏ bản echo của chính mình
+                if sender_norm == my_norm and self.last_local_message is not None and not self.net_thread.message_ids:
                     # same sender as me - check if it's the echo of what we just sent
                     if content == self.last_local_message and (time.time() - self.last_local_msg_ts) < 5:
                         pass  # Don't display, it's already displayed locally
@@ -3351,13 +3189,89 @@ class MainWindow(QWidget):
                                       "Are you sure?",
                                       QMessageBox.Yes | QMessageBox.No)
         if reply == QMessageBox.Yes:
+            SessionStore().forget(self.server, self.username)
             self.net_thread.send("LOGOUT")
             self.log_message("Logging out...")
             QTimer.singleShot(500, self.close)
 
+    def on_session_rejected(self, reason):
+        # Only a refused session voids "Keep me signed in"; quitting or a
+        # dropped connection keeps it for the next launch
+        SessionStore().forget(self.server, self.username)
+
     def on_disconnected(self):
+        # With reconnect, this only happens on stop() or once the session is gone
         QMessageBox.warning(self, "Disconnected", "Connection lost")
         self.close()
+
+    def on_reconnecting(self, attempt, delay):
+        if attempt == 1:
+            self.setWindowTitle(f"Chat - {self.username} (reconnecting...)")
+            self.log_message("Connection lost - reconnecting; messages you send are queued")
+        elif delay >= 1:
+            self.log_message(f"Reconnect attempt {attempt} in {delay:.1f}s")
+
+    def on_reconnected(self, offline_s, replayed):
+        self.setWindowTitle(f"Chat - {self.username}")
+        self.log_message(f"Reconnected after {offline_s:.1f}s"
+                         + (f", sent {replayed} queued message(s)" if replayed else ""))
+        self.net_thread.send("GET_FRIENDS")
+        self.net_thread.send("GET_GROUPS")
+        self.load_pending_notifications()
+        if self.current_chat_type and self.current_chat_name:
+            # Messages since the newest one shown; on_history_received skips
+            # those already on screen
+            self._capture_history_mode = 'resync'
+            self.net_thread.send(f"HISTORY {self.current_chat_type} {self.current_chat_name} "
+                                 f"{self._live_since or 0} 0")
+
+    def _track_bubble(self, key, timestamp):
+        """Remember a rendered bubble for the resync (timestamp: server time, or None for live)"""
+        try:
+            ts = int(timestamp) if timestamp else None
+        except ValueError:
+            ts = None
+        if ts is not None and (self._live_since is None or ts > self._live_since):
+            self._live_since = ts
+            self._live_bubbles = Counter()
+        if ts is None or ts == self._live_since:
+            self._live_bubbles[key] += 1
+
+    def _resync_history(self, messages):
+        """Render the resync HISTORY lines that are not on screen yet"""
+        if len(messages) == 1 and messages[0] == NO_MESSAGES:
+            return
+        seen = Counter(self._live_bubbles)
+        missing = []
+        for line in messages:
+            parts = line.split('|', 5)
+            if len(parts) < 6:
+                continue
+            _msg_id, sender, ts, mtype, _length, content = parts
+            if mtype == "FILE":
+                key = (sender, "FILE", content.split(':', 1)[0])
+            elif mtype == "TEXT":
+                key = (sender, "TEXT", content)
+            else:
+                continue
+            if seen[key] > 0:
+                seen[key] -= 1
+            else:
+                missing.append((key, sender, ts, content))
+        for key, sender, ts, content in missing:
+            if key[1] == "TEXT":
+                self.append_message_to_panel(sender, content, ts)
+            else:
+                file_id, _, filename = content.partition(':')
+                self.append_file_message_to_panel_html(sender, filename or file_id, file_id, ts)
+        if missing:
+            self.log_message(f"{len(missing)} message(s) arrived while offline")
+    
+    def on_write_backpressure(self, congested):
+        if congested:
+            self.log_message("Network busy: outgoing commands are queued")
+        else:
+            self.log_message("Outgoing queue drained")
     
     def on_left_group(self, group_name):
         """Handle when user leaves or is kicked from a group"""
@@ -3372,6 +3286,7 @@ class MainWindow(QWidget):
             item = self.conversations_list.item(i)
             if item.text().startswith(f"[Group] {group_name}"):
                 self.conversations_list.takeItem(i)
+                self.save_conversations()
                 break
         
         # Remove from groups list immediately
@@ -3510,10 +3425,11 @@ class MainWindow(QWidget):
         info = self.local_uploads.pop(file_id, None)
         if info:
             filename, tgt_type, tgt_name = info
+            self.file_catalog.pop((tgt_type, tgt_name), None)
             if (self.current_chat_type == tgt_type and
                 self.current_chat_name == tgt_name):
                 # Show as from self (sender side)
-                self.append_file_message_to_panel(self.username, filename, file_id)
+                self.append_file_message_to_panel_html(self.username, filename, file_id)
     
     def on_upload_failed(self, file_id, error):
         """Upload failed"""
@@ -3524,6 +3440,7 @@ class MainWindow(QWidget):
     
     def on_file_notification(self, file_type, target, sender, file_id, filename):
         """Received file notification - hiển thị real-time ngay cả khi không mở chat"""
+        self.file_catalog.pop((file_type, sender if file_type == "U" else target), None)
         # Store notification
         self.file_notifications.append((file_type, target, sender, file_id, filename))
         
@@ -3570,10 +3487,15 @@ class MainWindow(QWidget):
                 self.start_download(file_id, filename, save_path)
     
     def start_download(self, file_id, original_filename, save_path):
-        """Start downloading file"""
+        """Start downloading file (served from the download cache when possible)"""
+        if self.download_cache is not None and self.download_cache.materialize(file_id, save_path):
+            self.log_message(f"{original_filename} copied from cache to {save_path}")
+            self.show_notification("Download Complete", f"{original_filename} (from cache)")
+            return
+
         # Send download request
-        cmd = f"REQ_DOWNLOAD {file_id}\n"
-        self.net_thread.send(cmd)
+        self.pending_saves[file_id] = (save_path, original_filename)
+        self.net_thread.request_download(file_id, save_path, original_filename)
         
         # Store download info (will be used when READY_DOWNLOAD is received)
         self.active_downloads[file_id] = {
@@ -3755,7 +3677,15 @@ class MainWindow(QWidget):
             }}
         """)
         download_btn.clicked.connect(lambda: self.show_download_dialog('', '', sender, file_id, filename))
-        bubble_layout.addWidget(download_btn)
+        forward_btn = QPushButton("Forward")
+        forward_btn.setCursor(Qt.PointingHandCursor)
+        forward_btn.setStyleSheet(download_btn.styleSheet())
+        forward_btn.clicked.connect(lambda: self.show_forward_dialog(file_id, filename))
+        btn_row = QHBoxLayout()
+        btn_row.setSpacing(6)
+        btn_row.addWidget(download_btn)
+        btn_row.addWidget(forward_btn)
+        bubble_layout.addLayout(btn_row)
         
         # Apply bubble style
         bubble.setStyleSheet(f"""
@@ -3796,6 +3726,128 @@ class MainWindow(QWidget):
             self.scroll.verticalScrollBar().maximum()
         ))
     
+    def show_files_dialog(self):
+        """Paged file catalog of the open conversation (LIST_FILES)"""
+        chat_type = getattr(self, 'current_chat_type', None)
+        chat_name = getattr(self, 'current_chat_name', None)
+        if not chat_type or not chat_name:
+            QMessageBox.warning(self, "No Chat Selected", "Please select a conversation first!")
+            return
+        client = self.net_thread.client
+        if not client.supports("LIST_FILES"):
+            self._show_files_from_history(chat_type, chat_name)
+            return
+
+        conv = (chat_type, chat_name)
+        dlg = QDialog(self)
+        dlg.setWindowTitle(f"Files - {chat_name}")
+        dlg.setWindowFlags(dlg.windowFlags() & ~Qt.WindowContextHelpButtonHint)
+        dlg.resize(720, 520)
+        layout = QVBoxLayout(dlg)
+
+        filters = QHBoxLayout()
+        sender_input = QLineEdit(dlg)
+        sender_input.setPlaceholderText("Sender")
+        category_box, size_box, sort_box = QComboBox(dlg), QComboBox(dlg), QComboBox(dlg)
+        for box, options in ((category_box, FILE_CATEGORIES), (size_box, FILE_SIZES), (sort_box, FILE_SORTS)):
+            for label, value in options:
+                box.addItem(label, value)
+            filters.addWidget(box)
+        filters.insertWidget(0, sender_input)
+        layout.addLayout(filters)
+
+        columns = ["Name", "Sender", "Time", "Size"]
+        table = QTableWidget(0, len(columns), dlg)
+        table.setHorizontalHeaderLabels(columns)
+        table.setEditTriggers(QTableWidget.NoEditTriggers)
+        table.setSelectionBehavior(QTableWidget.SelectRows)
+        table.verticalHeader().setVisible(False)
+        table.horizontalHeader().setSectionResizeMode(0, QHeaderView.Stretch)
+        layout.addWidget(table)
+
+        status = QLabel("Loading...", dlg)
+        layout.addWidget(status)
+        state = {"offset": 0, "total": 0, "entries": []}
+
+        def show_page(reply, cmd):
+            if reply is None:
+                status.setText("No reply from server")
+                return
+            if reply.kind != "files":
+                if is_unknown_command(reply.line):
+                    dlg.reject()
+                    self._show_files_from_history(chat_type, chat_name)
+                else:
+                    status.setText(reply.line)
+                return
+            self.file_catalog.setdefault(conv, {})[cmd] = reply
+            total, offset, entries = reply.fields
+            state.update(total=total, offset=offset, entries=entries)
+            table.setRowCount(len(entries))
+            for row, (_fid, sender, ts, size, name) in enumerate(entries):
+                when = datetime.fromtimestamp(ts).strftime('%d/%m/%y %H:%M')
+                for col, value in enumerate([name, sender, when, f"{size:,}"]):
+                    table.setItem(row, col, QTableWidgetItem(value))
+            shown = f"{offset + 1}-{offset + len(entries)}" if entries else "0"
+            status.setText(f"{shown} of {total} files")
+            prev_btn.setEnabled(offset > 0)
+            next_btn.setEnabled(offset + len(entries) < total)
+
+        def load(offset=0):
+            cmd = encode_list_files(chat_type, chat_name, offset=offset, limit=FILES_PAGE_SIZE,
+                                    sort=sort_box.currentData(), sender=sender_input.text().strip(),
+                                    ext=category_box.currentData(), min_size=size_box.currentData())
+            cached = self.file_catalog.get(conv, {}).get(cmd)
+            if cached is not None:
+                show_page(cached, cmd)
+                return
+            status.setText("Loading...")
+            self.net_thread.request(cmd, lambda reply: show_page(reply, cmd))
+
+        def selected():
+            rows = {i.row() for i in table.selectedIndexes()}
+            return [state["entries"][r] for r in sorted(rows) if r < len(state["entries"])]
+
+        def download():
+            for file_id, _sender, _ts, _size, name in selected():
+                self.show_download_dialog('', '', '', file_id, name)
+
+        def forward():
+            for file_id, _sender, _ts, _size, name in selected():
+                self.show_forward_dialog(file_id, name, dlg)
+
+        sender_input.returnPressed.connect(lambda: load(0))
+        for box in (category_box, size_box, sort_box):
+            box.currentIndexChanged.connect(lambda _: load(0))
+        table.doubleClicked.connect(lambda _: download())
+
+        btns = QHBoxLayout()
+        prev_btn = QPushButton("< Prev", dlg)
+        prev_btn.clicked.connect(lambda: load(max(0, state["offset"] - FILES_PAGE_SIZE)))
+        next_btn = QPushButton("Next >", dlg)
+        next_btn.clicked.connect(lambda: load(state["offset"] + FILES_PAGE_SIZE))
+        download_btn = QPushButton("Download", dlg)
+        download_btn.clicked.connect(download)
+        forward_btn = QPushButton("Forward", dlg)
+        forward_btn.clicked.connect(forward)
+        close_btn = QPushButton("Close", dlg)
+        close_btn.clicked.connect(dlg.accept)
+        for b in (prev_btn, next_btn):
+            b.setEnabled(False)
+            btns.addWidget(b)
+        btns.addStretch()
+        for b in (download_btn, forward_btn, close_btn):
+            btns.addWidget(b)
+        layout.addLayout(btns)
+
+        load(0)
+        dlg.exec_()
+
+    def _show_files_from_history(self, chat_type, chat_name):
+        """Servers without LIST_FILES: filter FILE entries out of the full history"""
+        self._capture_history_mode = 'files'
+        self.net_thread.send(f"HISTORY {chat_type} {chat_name} 0 0")
+
     def show_files_popup_from_history(self, messages):
         """Build and show a popup dialog that lists all FILE entries parsed from history lines.
         Expected line format: 'msgId|sender|timestamp|TYPE|length|content' where for TYPE=FILE,
@@ -3847,8 +3899,11 @@ class MainWindow(QWidget):
                 btn = QPushButton('Download')
                 # Capture values in default args
                 btn.clicked.connect(lambda _, fid=item['file_id'], fn=item['filename']: self.show_download_dialog('', '', '', fid, fn))
+                fwd_btn = QPushButton('Forward')
+                fwd_btn.clicked.connect(lambda _, fid=item['file_id'], fn=item['filename']: self.show_forward_dialog(fid, fn, dlg))
                 row.addWidget(info, 1)
                 row.addWidget(btn, 0)
+                row.addWidget(fwd_btn, 0)
                 list_layout.addLayout(row)
             list_layout.addStretch(1)
             scroll.setWidget(container)
@@ -3864,11 +3919,17 @@ class MainWindow(QWidget):
         url_str = url.toString()
         frag = url.fragment()  # part after '#'
 
-        # Preferred format: #download|<file_id>|<filename>
+        if frag and frag.startswith("forward|"):
+            parts = frag.split("|", 2)
+            if len(parts) >= 3:
+                self.show_forward_dialog(unquote(parts[1]), unquote(parts[2]))
+            return
+
+        # Preferred format: #download|<file_id>|<filename>, both percent-encoded
         if frag and frag.startswith("download|"):
             parts = frag.split("|", 2)
             if len(parts) >= 3:
-                _, file_id, filename = parts[0], parts[1], parts[2]
+                file_id, filename = unquote(parts[1]), unquote(parts[2])
                 self.show_download_dialog("", "", "", file_id, filename)
                 return
 
@@ -3906,42 +3967,237 @@ class MainWindow(QWidget):
         if not save_path:
             return
         
-        
-        # Send download request to server
-        cmd = f"REQ_DOWNLOAD {file_id}\n"
-        self.net_thread.send(cmd)
-        
-        # Store download info in network thread for when server responds
-        self.net_thread.pending_downloads[file_id] = (filename, save_path, 0)  # (filename, save_path, filesize - will be updated)
+        self.start_download(file_id, filename, save_path)
+
+    def show_forward_dialog(self, file_id, filename, parent=None):
+        """Pick friends/groups to share an already uploaded file with"""
+        dlg = QDialog(parent or self)
+        dlg.setWindowTitle(f"Forward {filename}")
+        dlg.setWindowFlags(dlg.windowFlags() & ~Qt.WindowContextHelpButtonHint)
+        dlg.resize(360, 420)
+        layout = QVBoxLayout(dlg)
+        layout.addWidget(QLabel("Send to:"))
+        targets = QListWidget(dlg)
+        for i in range(self.friends_list.count()):
+            text = self.friends_list.item(i).text()
+            name = text.split(' (')[0].strip() if ' (' in text else text.strip()
+            if name:
+                item = QListWidgetItem(f"👤 {name}")
+                item.setData(Qt.UserRole, ("U", name))
+                item.setFlags(item.flags() | Qt.ItemIsUserCheckable)
+                item.setCheckState(Qt.Unchecked)
+                targets.addItem(item)
+        for i in range(self.groups_list.count()):
+            name = self.groups_list.item(i).data(Qt.UserRole)
+            if name:
+                item = QListWidgetItem(f"👥 {name}")
+                item.setData(Qt.UserRole, ("G", name))
+                item.setFlags(item.flags() | Qt.ItemIsUserCheckable)
+                item.setCheckState(Qt.Unchecked)
+                targets.addItem(item)
+        layout.addWidget(targets)
+
+        btns = QHBoxLayout()
+        send_btn = QPushButton("Forward", dlg)
+        send_btn.clicked.connect(dlg.accept)
+        cancel_btn = QPushButton("Cancel", dlg)
+        cancel_btn.clicked.connect(dlg.reject)
+        btns.addStretch()
+        btns.addWidget(send_btn)
+        btns.addWidget(cancel_btn)
+        layout.addLayout(btns)
+        if dlg.exec_() != QDialog.Accepted:
+            return
+        for i in range(targets.count()):
+            item = targets.item(i)
+            if item.checkState() == Qt.Checked:
+                target_type, target_name = item.data(Qt.UserRole)
+                self.forward_file(file_id, filename, target_type, target_name)
+
+    def forward_file(self, file_id, filename, target_type, target_name):
+        """FORWARD_FILE: the server reuses the stored file, nothing is uploaded"""
+        client = self.net_thread.client
+        if client is not None and not client.supports("FORWARD_FILE"):
+            self._forward_by_upload(file_id, filename, target_type, target_name)
+            return
+        self.net_thread.request(
+            encode_forward_file(file_id, target_type, target_name),
+            lambda reply: self._on_forward_reply(reply, file_id, filename, target_type, target_name))
+
+    def _on_forward_reply(self, reply, file_id, filename, target_type, target_name):
+        if reply is not None and reply.kind == "forwarded":
+            new_id = reply.fields[0]
+            self.log_message(f"Forwarded {filename} to {target_name}")
+            self.file_catalog.pop((target_type, target_name), None)
+            if self.download_cache is not None:
+                self.download_cache.alias(new_id, file_id, filename)
+            if (getattr(self, 'current_chat_type', None) == target_type and
+                    getattr(self, 'current_chat_name', None) == target_name):
+                self.append_file_message_to_panel_html(self.username, filename, new_id)
+        elif reply is not None and is_unknown_command(reply.line):
+            self._forward_by_upload(file_id, filename, target_type, target_name)
+        else:
+            error = reply.line if reply is not None else "No reply from server"
+            QMessageBox.warning(self, "Forward Failed", f"Could not forward {filename}:\n{error}")
+
+    def _forward_by_upload(self, file_id, filename, target_type, target_name):
+        """Servers without FORWARD_FILE: upload the copy from the download cache"""
+        import shutil
+        import tempfile
+        folder = tempfile.mkdtemp(prefix="ltm_forward_")
+        path = os.path.join(folder, filename)
+        if self.download_cache is None or not self.download_cache.materialize(file_id, path):
+            shutil.rmtree(folder, ignore_errors=True)
+            QMessageBox.information(self, "Forward",
+                                    "This server cannot forward files directly.\n"
+                                    "Download the file first, then forward it again.")
+            return
+        self.forward_copies[path] = file_id  # removed in on_upload_ended
+        self.upload_manager.add_files([path], target_type, target_name)
+        self.log_message(f"Server has no FORWARD_FILE; uploading {filename} to {target_name}")
+
+    def on_download_complete(self, file_id):
+        info = self.pending_saves.pop(file_id, None)
+        self.active_downloads.pop(file_id, None)
+        if info is None:
+            return
+        save_path, filename = info
+        self.log_message(f"Downloaded {filename} to {save_path}")
+        if self.download_cache is not None:
+            self.download_cache.put_async(file_id, save_path, filename)
+
+    def on_download_failed(self, file_id, error):
+        self.pending_saves.pop(file_id, None)
+        self.active_downloads.pop(file_id, None)
+        self.log_message(f"Download failed ({file_id}): {error}")
+
+    def on_upload_finished(self, file_id, filepath):
+        """The sender already has the content; later downloads of it are local"""
+        if self.download_cache is None:
+            return
+        source = self.forward_copies.get(filepath)
+        if source is not None:
+            self.download_cache.alias(file_id, source)  # the copy is about to be removed
+        else:
+            self.download_cache.put_async(file_id, filepath)
+
+    def on_upload_ended(self, filepath):
+        if self.forward_copies.pop(filepath, None) is not None:
+            import shutil
+            shutil.rmtree(os.path.dirname(filepath), ignore_errors=True)
+
+    def show_cache_dialog(self, parent=None):
+        """List cached files with size and last use; remove or clear them"""
+        cache = self.download_cache
+        dlg = QDialog(parent or self)
+        dlg.setWindowTitle("Download Cache")
+        dlg.setWindowFlags(dlg.windowFlags() & ~Qt.WindowContextHelpButtonHint)
+        dlg.resize(640, 420)
+        layout = QVBoxLayout(dlg)
+        if cache is None:
+            layout.addWidget(QLabel("The download cache is disabled."))
+            dlg.exec_()
+            return
+
+        summary_label = QLabel()
+        layout.addWidget(summary_label)
+        columns = ["File", "Size", "Last used", "file_id"]
+        table = QTableWidget(0, len(columns), dlg)
+        table.setHorizontalHeaderLabels(columns)
+        table.setEditTriggers(QTableWidget.NoEditTriggers)
+        table.setSelectionBehavior(QTableWidget.SelectRows)
+        table.verticalHeader().setVisible(False)
+        table.horizontalHeader().setSectionResizeMode(0, QHeaderView.Stretch)
+        layout.addWidget(table)
+
+        def refresh():
+            st = cache.stats()
+            summary_label.setText(
+                f"{cache.directory}\n{st['files']} files ({st['blobs']} distinct), "
+                f"{st['bytes'] / 1048576:.1f} of {st['budget'] / 1048576:.0f} MB    "
+                f"Hits {st['hits']}    Misses {st['misses']}")
+            entries = cache.entries()
+            table.setRowCount(len(entries))
+            for row, e in enumerate(entries):
+                used = datetime.fromtimestamp(e.last_used).strftime('%d/%m/%y %H:%M')
+                for col, value in enumerate([e.filename, f"{e.size:,}", used, e.file_id]):
+                    table.setItem(row, col, QTableWidgetItem(value))
+
+        def remove_selected():
+            for row in sorted({i.row() for i in table.selectedIndexes()}):
+                cache.remove(table.item(row, 3).text())
+            refresh()
+
+        def clear():
+            cache.clear()
+            refresh()
+
+        btns = QHBoxLayout()
+        remove_btn = QPushButton("Remove selected", dlg)
+        remove_btn.clicked.connect(remove_selected)
+        clear_btn = QPushButton("Clear", dlg)
+        clear_btn.clicked.connect(clear)
+        close_btn = QPushButton("Close", dlg)
+        close_btn.clicked.connect(dlg.accept)
+        btns.addWidget(remove_btn)
+        btns.addWidget(clear_btn)
+        btns.addStretch()
+        btns.addWidget(close_btn)
+        layout.addLayout(btns)
+        refresh()
+        dlg.exec_()
 
     def closeEvent(self, event):
+        self.snapshot.flush()
         if self.net_thread:
             self.net_thread.stop()
             self.net_thread.wait(2000)
+        for filepath in list(self.forward_copies):
+            self.on_upload_ended(filepath)  # forwards still queued
         event.accept()
 
 # ============================================================================
 # Application
 # ============================================================================
 
+def preload_network():
+    """Import async_core (and asyncio) while the user types, off the path to the login window"""
+    import async_core  # noqa: F401
+
+
 class ChatApp(QApplication):
     def __init__(self, argv):
         super().__init__(argv)
+        STARTUP.mark("QApplication")
         self.setApplicationName("Chat Client")
         self.main_window = None
         self.net_thread = None
 
     def run(self):
-        login = LoginWindow()
+        with STARTUP.phase("LoginWindow()"):
+            login = LoginWindow()
         login.login_success.connect(self.on_login_success)
-        login.show()
+        STARTUP.first_paint(login, LOGIN_WINDOW, then=preload_network)
+        # A saved session goes straight to the main window (the profiler's
+        # login-window and --login runs always start from the form)
+        if STARTUP.login or STARTUP.exit_at == LOGIN_WINDOW or not login.try_resume():
+            login.show()
+        if STARTUP.login:
+            # startup_profile.py --login: sign in as soon as the window is up
+            server, username, password = STARTUP.login
+            login.server_input.setText(server)
+            login.username_input.setText(username)
+            login.password_input.setText(password)
+            QTimer.singleShot(0, login.handle_login)
         return self.exec_()
 
     def on_login_success(self, server, username, session):
         sender = self.sender()
         if hasattr(sender, 'net_thread'):
             self.net_thread = sender.net_thread
-            self.main_window = MainWindow(server, username, session, self.net_thread)
+            with STARTUP.phase("MainWindow()"):
+                self.main_window = MainWindow(server, username, session, self.net_thread)
+            STARTUP.first_paint(self.main_window, MAIN_WINDOW)
             self.main_window.show()
 
 if __name__ == '__main__':
@@ -0,0 +1,393 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Load generator: thousands of simulated chat users over the real protocol.
+
+Each simulated user is an async_core.AsyncChatClient. A setup pass registers
+the users (lg_00000, lg_00001, ...), creates the load-test groups and joins
+every user to one of them. The run pass then drives a weighted mix of:
+
+    chat     TEXT G <group> to the user's group (fan-out to all members)
+    history  HISTORY G <group> over one page of a sliding time window
+    upload   REQ_UPLOAD / UPLOAD_DATA of a small file to the group
+
+TEXT payloads carry the send time, so every NOTIFY_TEXT received yields one
+fan-out latency sample. Users may be spread over several processes; all
+clocks are the local wall clock, so run it on the server's machine.
+
+Usage:
+    python load_generator.py --users 1000 --duration 60
+    python load_generator.py --users 4000 --processes 4 --mix chat=80,history=15,upload=5 --json report.json
+"""
+
+import argparse
+import asyncio
+import json
+import multiprocessing
+import os
+import random
+import sys
+import tempfile
+import time
+
+from async_core import AsyncChatClient
+from chat_core import (encode, encode_register, encode_login, encode_text, encode_history,
+                       encode_req_upload, encode_upload_data)
+from telemetry import LatencyHistogram
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+# Prefix of load-test TEXT payloads: "lgprobe <unix_time> <sender>"
+PROBE = "lgprobe"
+
+DEFAULT_MIX = "chat=80,history=15,upload=5"
+
+
+class LoadStats:
+    """Counters and latency histograms for one worker (mergeable)"""
+
+    def __init__(self):
+        self.fanout = LatencyHistogram()
+        self.text_ack = LatencyHistogram()
+        self.history = LatencyHistogram()
+        self.upload = LatencyHistogram()
+        self.counts = {
+            "text_sent": 0,
+            "text_delivered": 0,
+            "history": 0,
+            "history_lines": 0,
+            "uploads": 0,
+            "upload_bytes": 0,
+            "connected": 0,
+            "errors": 0,
+        }
+        self.failures = {}  # reply text -> count
+
+    def fail(self, reason):
+        self.counts["errors"] += 1
+        self.failures[reason] = self.failures.get(reason, 0) + 1
+
+    def merge(self, other):
+        for name in ("fanout", "text_ack", "history", "upload"):
+            getattr(self, name).merge(getattr(other, name))
+        for key, value in other.counts.items():
+            self.counts[key] = self.counts.get(key, 0) + value
+        for key, value in other.failures.items():
+            self.failures[key] = self.failures.get(key, 0) + value
+
+    def report(self, duration):
+        duration = max(duration, 1e-9)
+        c = self.counts
+        return {
+            "duration_s": duration,
+            "counts": dict(c),
+            "text_sent_per_s": c["text_sent"] / duration,
+            "text_delivered_per_s": c["text_delivered"] / duration,
+            "fanout": self.fanout.summary(),
+            "text_ack": self.text_ack.summary(),
+            "history": self.history.summary(),
+            "upload": self.upload.summary(),
+            "failures": dict(self.failures),
+        }
+
+
+def parse_mix(text):
+    mix = {}
+    for item in text.split(','):
+        name, _, weight = item.partition('=')
+        name = name.strip()
+        if name not in ("chat", "history", "upload"):
+            raise argparse.ArgumentTypeError(f"unknown action in mix: {name}")
+        mix[name] = float(weight or 1)
+    return mix
+
+
+def user_names(cfg):
+    return [f"{cfg.prefix}{i:05d}" for i in range(cfg.users)]
+
+
+def group_of(cfg, index):
+    return cfg.groups[index % len(cfg.groups)]
+
+
+def raise_fd_limit():
+    """Thousands of sockets need more than the default 1024 descriptors"""
+    if resource is None:
+        return
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    if soft < hard:
+        resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+
+
+class SimUser:
+    """One simulated user on its own connection"""
+
+    def __init__(self, cfg, name, group, stats, payload=None):
+        self.cfg = cfg
+        self.name = name
+        self.group = group
+        self.stats = stats
+        self.payload = payload
+        self.measuring = False
+        self.client = AsyncChatClient(cfg.host, cfg.port, on_event=self.on_event)
+        self.client.username = name
+        self._task = None
+
+    def on_event(self, name, *args):
+        if name == "text_message" and self.measuring:
+            content = args[3]
+            if content.startswith(PROBE + " "):
+                try:
+                    sent_at = float(content.split(' ')[1])
+                except (IndexError, ValueError):
+                    return
+                self.stats.fanout.record(max(0.0, time.time() - sent_at))
+                self.stats.counts["text_delivered"] += 1
+
+    async def request(self, cmd):
+        reply = await self.client.request(cmd, self.cfg.timeout)
+        if not reply.ok:
+            self.stats.fail(reply.line)
+        return reply
+
+    async def connect(self, register=False):
+        self._task = asyncio.ensure_future(self.client.run())
+        while not self.client.running:
+            if self._task.done():
+                raise ConnectionError(f"{self.name}: connection failed")
+            await asyncio.sleep(0.01)
+        if register:
+            reply = await self.client.request(encode_register(self.name, self.cfg.password), self.cfg.timeout)
+            if not reply.ok and " 409 " not in reply.line:
+                self.stats.fail(reply.line)
+        reply = await self.request(encode_login(self.name, self.cfg.password))
+        if not reply.ok:
+            raise ConnectionError(f"{self.name}: {reply.line}")
+        self.stats.counts["connected"] += 1
+
+    async def close(self):
+        self.client.stop()
+        if self._task is not None:
+            try:
+                await asyncio.wait_for(self._task, 5)
+            except asyncio.TimeoutError:
+                pass
+
+    # -- actions -----------------------------------------------------------
+
+    async def chat(self):
+        content = f"{PROBE} {time.time():.6f} {self.name}"
+        started = time.perf_counter()
+        reply = await self.request(encode_text("G", self.group, content))
+        if reply.ok:
+            self.stats.text_ack.record(time.perf_counter() - started)
+            self.stats.counts["text_sent"] += 1
+
+    async def history(self):
+        # One page of a sliding window reaching back cfg.history_pages pages
+        page = random.randint(1, self.cfg.history_pages)
+        end = int(time.time()) - (page - 1) * self.cfg.history_window
+        begin = end - self.cfg.history_window
+        started = time.perf_counter()
+        reply = await self.client.request(encode_history("G", self.group, begin, end), self.cfg.timeout)
+        if reply.ok or reply.line.startswith("FAIL 404 NO_MESSAGES"):
+            self.stats.history.record(time.perf_counter() - started)
+            self.stats.counts["history"] += 1
+            self.stats.counts["history_lines"] += len(reply.lines or [])
+        else:
+            self.stats.fail(reply.line)
+
+    async def upload(self):
+        path, size = self.payload
+        started = time.perf_counter()
+        reply = await self.request(encode_req_upload("G", self.group, os.path.basename(path), size))
+        if reply.kind != "ready_upload":
+            return
+        file_id = reply.fields[0]
+        self.client.active_upload = (file_id, path, size)
+        reply = await self.request(encode_upload_data(file_id))
+        if reply.ok:
+            self.stats.upload.record(time.perf_counter() - started)
+            self.stats.counts["uploads"] += 1
+            self.stats.counts["upload_bytes"] += size
+
+    async def run(self, start_at, stop_at, actions, weights):
+        think = self.cfg.think
+        await asyncio.sleep(max(0.0, start_at - time.time()))
+        self.measuring = True
+        while self.client.running:
+            await asyncio.sleep(random.expovariate(1.0 / think) if think > 0 else 0)
+            if time.time() >= stop_at:
+                break
+            action = random.choices(actions, weights)[0]
+            try:
+                await getattr(self, action)()
+            except (ConnectionError, asyncio.TimeoutError) as e:
+                self.stats.fail(type(e).__name__)
+        # Keep counting deliveries that are still in flight
+        await asyncio.sleep(max(0.0, stop_at + self.cfg.drain - time.time()))
+        self.measuring = False
+
+
+async def _gather_limited(coros, limit):
+    sem = asyncio.Semaphore(limit)
+
+    async def one(coro):
+        async with sem:
+            return await coro
+    return await asyncio.gather(*(one(c) for c in coros), return_exceptions=True)
+
+
+async def setup_groups(cfg):
+    """Register every user, create the groups and join each user to one"""
+    stats = LoadStats()
+    names = user_names(cfg)
+    users = [SimUser(cfg, name, group_of(cfg, i), stats) for i, name in enumerate(names)]
+    results = await _gather_limited([u.connect(register=True) for u in users], cfg.connect_concurrency)
+    online = [u for u, r in zip(users, results) if not isinstance(r, Exception)]
+    for u, r in zip(users, results):
+        if isinstance(r, Exception):
+            print(f"[setup] {r}")
+    by_name = {u.name: u for u in online}
+
+    for gi, group in enumerate(cfg.groups):
+        admin = by_name.get(names[gi]) if gi < len(names) else None
+        if admin is None:
+            continue
+        reply = await admin.client.request(encode("INIT_GROUP", group, cfg.users + 1), cfg.timeout)
+        if not reply.ok and " 409 " not in reply.line:
+            print(f"[setup] INIT_GROUP {group}: {reply.line}")
+        members = [u for u in online if u.group == group and u is not admin]
+
+        async def join(member):
+            reply = await admin.client.request(encode("SEND_INVITE", group, member.name), cfg.timeout)
+            if reply.ok:
+                reply = await member.client.request(encode("CONFIRM_JOIN", group), cfg.timeout)
+            if not reply.ok and "ALREADY_MEMBER" not in reply.line:
+                stats.fail(reply.line)
+        await _gather_limited([join(m) for m in members], cfg.connect_concurrency)
+
+    await asyncio.gather(*(u.close() for u in online))
+    return stats
+
+
+async def run_users(cfg, indexes, start_at):
+    stats = LoadStats()
+    names = user_names(cfg)
+    payload = None
+    if cfg.mix.get("upload"):
+        fd, path = tempfile.mkstemp(prefix="lg_", suffix=".bin")
+        with os.fdopen(fd, 'wb') as f:
+            f.write(os.urandom(cfg.upload_size))
+        payload = (path, cfg.upload_size)
+    users = [SimUser(cfg, names[i], group_of(cfg, i), stats, payload) for i in indexes]
+
+    # Spread connects over the ramp period
+    async def connect(u, delay):
+        await asyncio.sleep(delay)
+        await u.connect()
+    step = cfg.ramp / max(len(users), 1)
+    results = await _gather_limited([connect(u, i * step) for i, u in enumerate(users)],
+                                    cfg.connect_concurrency)
+    online = [u for u, r in zip(users, results) if not isinstance(r, Exception)]
+    for r in results:
+        if isinstance(r, Exception):
+            stats.fail(str(r))
+
+    actions = list(cfg.mix)
+    weights = [cfg.mix[a] for a in actions]
+    stop_at = start_at + cfg.duration
+    await asyncio.gather(*(u.run(start_at, stop_at, actions, weights) for u in online))
+    await asyncio.gather(*(u.close() for u in online))
+    if payload:
+        os.unlink(payload[0])
+    return stats
+
+
+def _worker(args):
+    cfg, indexes, start_at = args
+    raise_fd_limit()
+    return asyncio.run(run_users(cfg, indexes, start_at))
+
+
+def print_report(cfg, report):
+    c = report["counts"]
+
+    def ms(summary):
+        return (f"p50 {summary['p50_ms']:8.2f}  p95 {summary['p95_ms']:8.2f}  "
+                f"p99 {summary['p99_ms']:8.2f}  max {summary['max_ms']:8.2f} ms")
+    print(f"\nUsers {c['connected']}/{cfg.users} in {cfg.processes} process(es), "
+          f"groups {','.join(cfg.groups)}, {report['duration_s']:.1f}s")
+    print(f"  TEXT sent        {c['text_sent']:10d}  {report['text_sent_per_s']:10.1f} msg/s")
+    print(f"  NOTIFY_TEXT recv {c['text_delivered']:10d}  {report['text_delivered_per_s']:10.1f} msg/s")
+    print(f"  Fan-out latency  {ms(report['fanout'])}")
+    print(f"  TEXT ack         {ms(report['text_ack'])}")
+    print(f"  HISTORY x{c['history']:<7d} {ms(report['history'])}  "
+          f"({c['history_lines']} lines)")
+    print(f"  Uploads x{c['uploads']:<7d} {ms(report['upload'])}  "
+          f"({c['upload_bytes']:,} B)")
+    print(f"  Errors           {c['errors']:10d}")
+    for reason, count in sorted(report["failures"].items(), key=lambda kv: -kv[1])[:10]:
+        print(f"    {count:8d}  {reason}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Simulate many chat users against a server")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8888)
+    parser.add_argument("--users", type=int, default=100)
+    parser.add_argument("--processes", type=int, default=1)
+    parser.add_argument("--groups", default="lg_hust,lg_thanh",
+                        help="comma separated group names; users are spread round-robin")
+    parser.add_argument("--prefix", default="lg_", help="user name prefix")
+    parser.add_argument("--password", default="loadtest")
+    parser.add_argument("--duration", type=float, default=30.0, help="measured seconds")
+    parser.add_argument("--ramp", type=float, default=5.0, help="seconds to spread connects over")
+    parser.add_argument("--think", type=float, default=5.0, help="mean seconds between a user's actions")
+    parser.add_argument("--mix", type=parse_mix, default=parse_mix(DEFAULT_MIX))
+    parser.add_argument("--history-window", type=int, default=600, help="seconds per HISTORY page")
+    parser.add_argument("--history-pages", type=int, default=6)
+    parser.add_argument("--upload-size", type=int, default=64 * 1024)
+    parser.add_argument("--timeout", type=float, default=30.0, help="per-request timeout")
+    parser.add_argument("--drain", type=float, default=2.0, help="seconds to wait for late deliveries")
+    parser.add_argument("--connect-concurrency", type=int, default=200)
+    parser.add_argument("--skip-setup", action="store_true", help="users and groups already exist")
+    parser.add_argument("--json", help="write the report to this file")
+    cfg = parser.parse_args(argv)
+    cfg.groups = [g for g in cfg.groups.split(',') if g]
+    raise_fd_limit()
+
+    if not cfg.skip_setup:
+        print(f"[setup] registering {cfg.users} users and joining groups...")
+        started = time.perf_counter()
+        setup_stats = asyncio.run(setup_groups(cfg))
+        print(f"[setup] done in {time.perf_counter() - started:.1f}s "
+              f"({setup_stats.counts['connected']} users, {setup_stats.counts['errors']} errors)")
+
+    processes = max(1, min(cfg.processes, cfg.users))
+    cfg.processes = processes
+    start_at = time.time() + cfg.ramp + 2.0
+    parts = [(cfg, list(range(p, cfg.users, processes)), start_at) for p in range(processes)]
+    print(f"[run] {cfg.users} users, measuring {cfg.duration:.0f}s after a {cfg.ramp:.0f}s ramp")
+    if processes == 1:
+        results = [_worker(parts[0])]
+    else:
+        with multiprocessing.Pool(processes) as pool:
+            results = pool.map(_worker, parts)
+
+    total = LoadStats()
+    for stats in results:
+        total.merge(stats)
+    report = total.report(cfg.duration)
+    print_report(cfg, report)
+    if cfg.json:
+        with open(cfg.json, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
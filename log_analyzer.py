@@ -0,0 +1,430 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Streaming analyzer for server.log (server.cpp and reference_server.py).
+
+Reads the log through mmap line by line and reports:
+- per-command counts and the replies each command got
+  (FAIL 404 NO_MESSAGES, FAIL 400 UNKNOWN_COMMAND, ...);
+- per-client request rates (distribution and busiest clients);
+- NOTIFY fan-out volume per kind, delivered vs offline;
+- busiest seconds.
+
+Memory does not grow with the log: a client's counters are folded into a
+histogram when it disconnects, so only connected clients are held. Client
+numbers restart with the server, so "Server started on port" ends every
+open client, and a "connected" line for a number already in use starts a
+new session. With
+--jobs N the file is split at line boundaries into N ranges analysed by
+separate processes and the partial results are merged in file order
+(replies whose command sits in the previous range are matched on merge).
+
+Usage:
+    python log_analyzer.py server.log
+    python log_analyzer.py server.log --jobs 0 --top 30 --json report.json
+"""
+
+import argparse
+import heapq
+import json
+import mmap
+import os
+import sys
+import time
+from collections import Counter
+from multiprocessing import Pool
+
+from telemetry import LatencyHistogram
+
+# Flags on a per-client record
+RECEIVED = 2  # at least one command was received in this range
+CLOSED = 4
+
+MAX_TOKEN = 40  # longer or non-[A-Z_] command names are grouped as <invalid>
+UNMATCHED = "?"
+
+
+def _command_name(body):
+    token = body.split(b' ', 1)[0][:MAX_TOKEN + 1]
+    if not token or len(token) > MAX_TOKEN or not token.replace(b'_', b'').isalpha() or not token.isupper():
+        return "<invalid>"
+    return token.decode('ascii')
+
+
+def reply_key(reply):
+    """'FAIL 404 USER_NOT_FOUND bob' -> 'FAIL 404 USER_NOT_FOUND', 'SUCCESS 200 7' -> 'SUCCESS 200'"""
+    parts = reply.split(' ', 3)
+    if len(parts) > 2 and not parts[2].isdigit():
+        return ' '.join(parts[:3])[:80]
+    return ' '.join(parts[:2])[:80]
+
+
+class LogStats:
+    """Counters for one range of the log; merge() combines ranges in file order"""
+
+    def __init__(self, top=20):
+        self.top = top
+        self.lines = 0
+        self.other = 0
+        self.first_ts = None
+        self.last_ts = None
+        self.commands = Counter()
+        self.replies = {}  # command -> Counter(reply key)
+        self.notify = Counter()  # kind -> delivered
+        self.notify_offline = Counter()
+        self.notify_bytes = 0
+        self.recipients = Counter()
+        self.per_second = Counter()  # unix second -> commands received
+        self.connections = 0
+        self.clients = {}  # client -> [requests, first_ts, last_ts, flags], sessions begun in this range
+        self.head = {}  # the same for sessions begun before it (until CLOSED)
+        self.restarted = False  # "Server started" seen: no session continues past it
+        self.client_rates = LatencyHistogram()  # requests/min x10, per finished client
+        self.top_clients = []  # heap of (requests, client, seconds)
+        self.pending = {}  # client -> command still waiting for its reply
+        self.orphans = {}  # client -> first reply seen before any command in this range
+        self._stamp = None
+        self._stamp_ts = 0
+
+    # -- parsing -----------------------------------------------------------
+
+    def _timestamp(self, stamp):
+        if stamp != self._stamp:
+            self._stamp = stamp
+            try:
+                self._stamp_ts = int(time.mktime(time.strptime(stamp.decode('ascii'), "%Y-%m-%d %H:%M:%S")))
+            except (ValueError, UnicodeDecodeError):
+                pass
+        return self._stamp_ts
+
+    def feed(self, line):
+        """Account one raw log line (bytes, without the newline)"""
+        self.lines += 1
+        close = line.find(b'] ', 1)
+        if not line.startswith(b'[') or close < 0:
+            if line.startswith(b'Server started'):
+                self._restart()  # written before log_message() added timestamps
+            else:
+                self.other += 1  # continuation of a multi-line message
+            return
+        ts = self._timestamp(line[1:close])
+        if self.first_ts is None:
+            self.first_ts = ts
+        self.last_ts = ts
+        rest = line[close + 2:]
+        if rest.startswith(b'Client['):
+            end = rest.find(b'] ', 7)
+            if end > 7 and rest[7:end].isdigit():
+                self._client_line(int(rest[7:end]), rest[end + 2:], ts)
+                return
+        elif rest.startswith(b'NOTIFY to '):
+            self._notify_line(rest[10:])
+            return
+        elif rest.startswith(b'Server started'):
+            self._restart()
+            return
+        self.other += 1
+
+    def _end_session(self, client):
+        rec = self.clients.pop(client, None)
+        if rec is not None:
+            self._finish(client, rec)
+        else:
+            head = self.head.get(client)
+            if head is not None:
+                head[3] |= CLOSED  # merge() adds the part before this range
+        self.pending.pop(client, None)
+
+    def _restart(self):
+        for client in list(self.clients):
+            self._finish(client, self.clients.pop(client))
+        for rec in self.head.values():
+            rec[3] |= CLOSED
+        self.pending.clear()
+        self.restarted = True
+
+    def _client_line(self, client, body, ts):
+        if body.startswith(b'connected'):
+            self._end_session(client)  # the number was reused
+            self.connections += 1
+            self.clients[client] = [0, ts, ts, 0]
+            return
+        rec = self.clients.get(client)
+        if rec is None:
+            rec = self.head.get(client)
+            if rec is None and not self.restarted:
+                rec = self.head[client] = [0, ts, ts, 0]
+            elif rec is None or rec[3] & CLOSED:
+                rec = self.clients[client] = [0, ts, ts, 0]  # "connected" not logged
+        rec[2] = ts
+        if body.startswith(b'Received: '):
+            cmd = _command_name(body[10:])
+            self.commands[cmd] += 1
+            self.per_second[ts] += 1
+            rec[0] += 1
+            rec[3] |= RECEIVED
+            self.pending[client] = cmd
+        elif body.startswith(b'Sent: '):
+            key = reply_key(body[6:].decode('utf-8', errors='replace'))
+            cmd = self.pending.pop(client, None)
+            if cmd is not None:
+                self._count_reply(cmd, key)
+            elif self.head.get(client) is rec and not rec[3] & RECEIVED and client not in self.orphans:
+                self.orphans[client] = key  # command is in the previous range
+            else:
+                self._count_reply(UNMATCHED, key)
+        elif body.startswith(b'disconnected'):
+            self._end_session(client)
+
+    def _notify_line(self, rest):
+        sep = rest.find(b': ')
+        if sep < 0:
+            self.other += 1
+            return
+        who, payload = rest[:sep], rest[sep + 2:]
+        kind = payload.split(b' ', 2)
+        kind = b' '.join(kind[:2]) if kind[0] == b'NOTIFY' else kind[0]
+        kind = kind[:MAX_TOKEN].decode('utf-8', errors='replace')
+        if who.endswith(b' (offline)'):
+            self.notify_offline[kind] += 1
+            who = who[:-10]
+        else:
+            self.notify[kind] += 1
+        self.notify_bytes += len(payload) + 1
+        self.recipients[who.decode('utf-8', errors='replace')] += 1
+
+    def _count_reply(self, cmd, key):
+        counter = self.replies.get(cmd)
+        if counter is None:
+            counter = self.replies[cmd] = Counter()
+        counter[key] += 1
+
+    def _finish(self, client, rec):
+        requests, first, last, _ = rec
+        seconds = max(1, last - first)
+        self.client_rates.record_value(round(requests * 600.0 / seconds))
+        entry = (requests, client, seconds)
+        if len(self.top_clients) < self.top:
+            heapq.heappush(self.top_clients, entry)
+        elif entry > self.top_clients[0]:
+            heapq.heapreplace(self.top_clients, entry)
+
+    # -- merging -----------------------------------------------------------
+
+    def merge(self, later):
+        """Fold in the stats of the range that follows this one in the file"""
+        for client, key in later.orphans.items():
+            self._count_reply(self.pending.pop(client, UNMATCHED), key)
+        for client, rec in later.head.items():
+            if rec[3] & (RECEIVED | CLOSED):
+                self.pending.pop(client, None)
+            mine = self.clients.pop(client, None)
+            if mine is not None:
+                rec = [mine[0] + rec[0], mine[1], rec[2], mine[3] | rec[3]]
+            if rec[3] & CLOSED:
+                self._finish(client, rec)
+            else:
+                self.clients[client] = rec
+        if later.restarted:
+            for client, rec in self.clients.items():
+                self._finish(client, rec)
+            self.clients.clear()
+            self.pending.clear()
+            self.restarted = True
+        for client, rec in later.clients.items():
+            # A session begun in the later range ends any older one of that number
+            mine = self.clients.pop(client, None)
+            if mine is not None:
+                self._finish(client, mine)
+                self.pending.pop(client, None)
+            self.clients[client] = rec
+        self.pending.update(later.pending)
+
+        self.lines += later.lines
+        self.other += later.other
+        if self.first_ts is None:
+            self.first_ts = later.first_ts
+        if later.last_ts is not None:
+            self.last_ts = later.last_ts
+        self.commands.update(later.commands)
+        for cmd, counter in later.replies.items():
+            self.replies.setdefault(cmd, Counter()).update(counter)
+        self.notify.update(later.notify)
+        self.notify_offline.update(later.notify_offline)
+        self.notify_bytes += later.notify_bytes
+        self.recipients.update(later.recipients)
+        self.per_second.update(later.per_second)
+        self.connections += later.connections
+        self.client_rates.merge(later.client_rates)
+        for entry in later.top_clients:
+            if len(self.top_clients) < self.top:
+                heapq.heappush(self.top_clients, entry)
+            elif entry > self.top_clients[0]:
+                heapq.heapreplace(self.top_clients, entry)
+
+    def finish(self):
+        """Account clients still connected at the end of the log"""
+        for records in (self.head, self.clients):
+            for client, rec in records.items():
+                self._finish(client, rec)
+            records.clear()
+
+    # -- reporting ---------------------------------------------------------
+
+    def report(self):
+        span = (self.last_ts - self.first_ts) if self.first_ts is not None else 0
+        fails = Counter()
+        commands = {}
+        for cmd, count in self.commands.most_common():
+            replies = self.replies.get(cmd, Counter())
+            failed = sum(n for key, n in replies.items() if key.startswith("FAIL"))
+            commands[cmd] = {"count": count, "failures": failed, "replies": dict(replies.most_common())}
+        for replies in self.replies.values():
+            for key, n in replies.items():
+                if key.startswith("FAIL"):
+                    fails[key] += n
+        rates = self.client_rates
+        return {
+            "lines": self.lines,
+            "unparsed_lines": self.other,
+            "first": self.first_ts,
+            "last": self.last_ts,
+            "seconds": span,
+            "commands": commands,
+            "unmatched_replies": dict(self.replies.get(UNMATCHED, Counter()).most_common()),
+            "errors": dict(fails.most_common()),
+            "notify": {
+                "delivered": dict(self.notify.most_common()),
+                "offline": dict(self.notify_offline.most_common()),
+                "bytes": self.notify_bytes,
+                "top_recipients": self.recipients.most_common(self.top),
+            },
+            "clients": {
+                "connections": self.connections,
+                "measured": rates.total,
+                "req_per_min": {p: rates.percentile(v) / 10.0 for p, v in
+                                (("p50", 50), ("p95", 95), ("p99", 99), ("max", 100))},
+                "top": [{"client": c, "requests": n, "seconds": s,
+                         "req_per_min": round(n * 60.0 / s, 1)}
+                        for n, c, s in sorted(self.top_clients, reverse=True)],
+            },
+            "peak_seconds": [(datetime_text(ts), n) for ts, n in self.per_second.most_common(5)],
+        }
+
+
+def datetime_text(ts):
+    return time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(ts))
+
+
+def split_ranges(path, jobs):
+    """Byte ranges of roughly equal size that start and end on line boundaries"""
+    size = os.path.getsize(path)
+    if size == 0:
+        return []
+    jobs = max(1, min(jobs, size // (1 << 20) or 1))
+    points = [0]
+    with open(path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        for i in range(1, jobs):
+            nl = mm.find(b'\n', size * i // jobs)
+            if nl < 0:
+                break
+            if nl + 1 > points[-1]:
+                points.append(nl + 1)
+    points.append(size)
+    return [(a, b) for a, b in zip(points, points[1:]) if b > a]
+
+
+def analyze_range(path, start, end, top=20):
+    stats = LogStats(top)
+    with open(path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        pos = start
+        while pos < end:
+            nl = mm.find(b'\n', pos, end)
+            if nl < 0:
+                nl = end
+            line = mm[pos:nl]
+            if line.endswith(b'\r'):
+                line = line[:-1]
+            if line:
+                stats.feed(line)
+            pos = nl + 1
+    return stats
+
+
+def _worker(args):
+    return analyze_range(*args)
+
+
+def analyze(path, jobs=1, top=20):
+    ranges = split_ranges(path, jobs)
+    total = LogStats(top)
+    if len(ranges) <= 1:
+        for start, end in ranges:
+            total.merge(analyze_range(path, start, end, top))
+    else:
+        with Pool(len(ranges)) as pool:
+            for part in pool.imap(_worker, [(path, a, b, top) for a, b in ranges]):
+                total.merge(part)
+    total.finish()
+    return total
+
+
+def print_report(path, r):
+    print(f"{path}: {r['lines']:,} lines ({r['unparsed_lines']:,} unparsed)")
+    if r["first"] is not None:
+        print(f"  {datetime_text(r['first'])} -> {datetime_text(r['last'])} ({r['seconds']:,} s)")
+    print()
+    print(f"  {'Command':24} {'Count':>10} {'FAIL':>8}  Top replies")
+    for cmd, c in r["commands"].items():
+        top = ", ".join(f"{k} x{n}" for k, n in list(c["replies"].items())[:3])
+        print(f"  {cmd:24} {c['count']:>10,} {c['failures']:>8,}  {top}")
+    if r["unmatched_replies"]:
+        print(f"  Replies without a logged command: {sum(r['unmatched_replies'].values()):,}")
+    print()
+    print("  Errors")
+    for key, n in r["errors"].items():
+        print(f"    {key:40} {n:>10,}")
+    n = r["notify"]
+    print()
+    print(f"  NOTIFY: {sum(n['delivered'].values()):,} delivered, "
+          f"{sum(n['offline'].values()):,} to offline users, {n['bytes']:,} B")
+    for kind in sorted(set(n["delivered"]) | set(n["offline"]),
+                       key=lambda k: -(n["delivered"].get(k, 0) + n["offline"].get(k, 0))):
+        print(f"    {kind:30} {n['delivered'].get(kind, 0):>10,} {n['offline'].get(kind, 0):>10,} offline")
+    text = r["commands"].get("TEXT", {}).get("count", 0)
+    if text:
+        fanout = n["delivered"].get("NOTIFY_TEXT", 0) + n["offline"].get("NOTIFY_TEXT", 0)
+        print(f"    NOTIFY_TEXT per TEXT: {fanout / text:.1f}")
+    c = r["clients"]
+    print()
+    q = c["req_per_min"]
+    print(f"  Clients: {c['connections']:,} connections; requests/min p50 {q['p50']:.1f}  "
+          f"p95 {q['p95']:.1f}  p99 {q['p99']:.1f}  max {q['max']:.1f}")
+    for t in c["top"][:10]:
+        print(f"    Client[{t['client']}] {t['requests']:>8,} requests in {t['seconds']:,} s "
+              f"({t['req_per_min']}/min)")
+    if r["peak_seconds"]:
+        print("  Busiest seconds: " + ", ".join(f"{ts} ({n:,})" for ts, n in r["peak_seconds"]))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Per-command statistics from server.log")
+    parser.add_argument("log", nargs="?", default="server.log")
+    parser.add_argument("--jobs", "-j", type=int, default=1, help="worker processes (0 = all cores)")
+    parser.add_argument("--top", type=int, default=20, help="busiest clients / recipients to keep")
+    parser.add_argument("--json", metavar="PATH", help="also write the report as JSON")
+    args = parser.parse_args(argv)
+
+    jobs = args.jobs if args.jobs > 0 else (os.cpu_count() or 1)
+    started = time.perf_counter()
+    report = analyze(args.log, jobs, args.top).report()
+    print_report(args.log, report)
+    print(f"\n  analysed in {time.perf_counter() - started:.2f} s with {jobs} job(s)")
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,346 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+HTML for the chat bubbles of gui_client.MainWindow (text and file
+messages, day separators), without Qt.
+
+- Templates are compiled once at import: whitespace between tags is
+  dropped and each template becomes a tuple of literal pieces with slots
+  that render() fills with the escaped values and joins.
+- Timestamps go through time.localtime and a per-day cache: the day label
+  ("Monday, 16 December 2025"), the "dd:mm:yy " prefix and the separator
+  HTML are formatted once per day; "HH:MM" comes from a table.
+So a bubble costs one localtime call, escape() and one join.
+
+    python message_render.py bench --messages 50000   # vs the previous gui_client code
+"""
+
+import argparse
+import re
+import sys
+import time
+from html import escape
+from string import Formatter
+from urllib.parse import quote
+
+SEPARATOR_TEMPLATE = """
+    <div style='display:block; width:100%; text-align:center; margin:12px 0;'>
+        <span style='background:#eef3f8; color:#555; font-size:12px; padding:4px 10px; border-radius:12px; display:inline-block;'>
+            {label}
+        </span>
+    </div>
+"""
+
+# Messenger style: your message always right, incoming always left
+OWN_BUBBLE_TEMPLATE = """
+    <table width='100%' style='margin:6px 0; border-collapse:collapse;'><tr>
+        <td width='35%'></td>
+        <td width='65%' align='right'>
+            <div style='display:inline-block; max-width:85%; text-align:left;'>
+                <div style='font-size:11px; font-weight:bold; color:#1976D2; margin-bottom:4px; padding-left:10px;'>{sender}</div>
+                <div style='background-color:#e3f2fd; color:#333; padding:10px 12px; border-radius:10px; border-left:4px solid #2196F3; word-wrap:break-word;'>
+                    {body}
+                    <div style='font-size:10px; color:#666; margin-top:6px; text-align:right;'>{time}{status}</div>
+                </div>
+            </div>
+        </td>
+    </tr></table>
+"""
+
+OTHER_BUBBLE_TEMPLATE = """
+    <table width='100%' style='margin:6px 0; border-collapse:collapse;'><tr>
+        <td width='65%' align='left'>
+            <div style='display:inline-block; max-width:85%; text-align:left;'>
+                <div style='font-size:11px; font-weight:bold; color:#1976D2; margin-bottom:4px; padding-left:10px;'>{sender}</div>
+                <div style='background-color:#e3f2fd; color:#333; padding:10px 12px; border-radius:10px; border-left:4px solid #2196F3; word-wrap:break-word;'>
+                    {body}
+                    <div style='font-size:10px; color:#666; margin-top:6px;'>{time}{status}</div>
+                </div>
+            </div>
+        </td>
+        <td width='35%'></td>
+    </tr></table>
+"""
+
+# File bubble body: download / forward links, and a thumbnail for images
+# (file_id and filename are percent-encoded in the href, so '|', '"' or '<' in a
+# name cannot break the link; handle_download_link_click splits on '|' and unquotes)
+FILE_LINK_TEMPLATE = ('<a href="#download|{file_id}|{filename}" style="color:#1976D2; text-decoration:none; '
+                      'font-weight:bold;">📎 {name}</a>'
+                      ' &nbsp;<a href="#forward|{file_id}|{filename}" style="color:#666; font-size:11px; '
+                      'text-decoration:none;">↪ Forward</a>')
+THUMBNAIL_TEMPLATE = ('<br><a href="#download|{file_id}|{filename}">'
+                      '<img src="thumb:{file_id}" width="{width}" height="{height}"></a>')
+
+DAY_LABEL = "%A, %d %B %Y"  # Monday, 16 December 2025
+DATE_PREFIX = "%d:%m:%y "  # bubble time: dd:mm:yy hh:mm
+HHMM = [f"{h:02d}:{m:02d}" for h in range(24) for m in range(60)]
+MAX_DAYS = 4096
+
+
+def compile_template(source):
+    """source with {name} slots -> render(name=..., ...) joining literals and values"""
+    source = re.sub(r">\s+<", "><", source.strip())
+    source = re.sub(r">\s+\{", ">{", re.sub(r"\}\s+<", "}<", source))
+    pieces = []
+    slots = []  # (index in pieces, name)
+    for literal, field, _spec, _conv in Formatter().parse(source):
+        if literal:
+            pieces.append(literal)
+        if field is not None:
+            if not field.isidentifier():
+                raise ValueError(f"bad template field {field!r}")
+            slots.append((len(pieces), field))
+            pieces.append("")
+    pieces = tuple(pieces)
+    slots = tuple(slots)
+
+    # No parsing left at render time: fill the slots, one join
+    def render(**values):
+        out = list(pieces)
+        for index, name in slots:
+            out[index] = values[name]
+        return "".join(out)
+    return render
+
+
+render_separator = compile_template(SEPARATOR_TEMPLATE)
+render_own_bubble = compile_template(OWN_BUBBLE_TEMPLATE)
+render_other_bubble = compile_template(OTHER_BUBBLE_TEMPLATE)
+render_file_link = compile_template(FILE_LINK_TEMPLATE)
+render_thumbnail = compile_template(THUMBNAIL_TEMPLATE)
+
+
+class MessageRenderer:
+    """Bubbles for one user's view of a chat; tracks the last day separator"""
+
+    def __init__(self, username, thumb_size=(160, 120)):
+        self.username_norm = username.strip().lower()
+        self.thumb_width, self.thumb_height = (str(v) for v in thumb_size)
+        self.last_day = None  # label of the newest separator emitted
+        self._days = {}  # (year, yday) -> (label, date prefix, separator html)
+
+    def reset(self):
+        """New chat (or cleared view): the next bubble gets a separator again"""
+        self.last_day = None
+
+    def stamp(self, timestamp=None):
+        """(day, "dd:mm:yy hh:mm") for a server timestamp (now if missing or invalid);
+        day is the cached (label, date prefix, separator html)"""
+        try:
+            tm = time.localtime(int(timestamp)) if timestamp else time.localtime()
+        except (ValueError, TypeError, OverflowError, OSError):
+            tm = time.localtime()
+        key = (tm.tm_year, tm.tm_yday)
+        day = self._days.get(key)
+        if day is None:
+            if len(self._days) >= MAX_DAYS:
+                self._days.clear()
+            label = time.strftime(DAY_LABEL, tm)
+            day = self._days[key] = (label, time.strftime(DATE_PREFIX, tm), render_separator(label=label))
+        return day, day[1] + HHMM[tm.tm_hour * 60 + tm.tm_min]
+
+    def separator(self, day):
+        """Separator HTML if day starts a new day in this view, else ''"""
+        if day[0] == self.last_day:
+            return ""
+        self.last_day = day[0]
+        return day[2]
+
+    def _bubble(self, sender, body, time_str, status):
+        if sender.strip().lower() == self.username_norm:
+            return render_own_bubble(sender=escape(sender), body=body, time=time_str, status=status)
+        return render_other_bubble(sender=escape(sender), body=body, time=time_str, status="")
+
+    def text(self, sender, content, timestamp=None, status=""):
+        """(separator html or '', bubble html); status: trailing mark on own bubbles"""
+        day, time_str = self.stamp(timestamp)
+        return self.separator(day), self._bubble(sender, escape(content), time_str, status)
+
+    def file(self, sender, filename, file_id, timestamp=None, thumbnail=False):
+        """(separator html or '', file bubble html); thumbnail: add the image preview slot"""
+        day, time_str = self.stamp(timestamp)
+        file_id, link_name = quote(str(file_id), safe=""), quote(filename, safe="")
+        body = render_file_link(file_id=file_id, filename=link_name, name=escape(filename))
+        if thumbnail:
+            body += render_thumbnail(file_id=file_id, filename=link_name,
+                                     width=self.thumb_width, height=self.thumb_height)
+        return self.separator(day), self._bubble(sender, body, time_str, "")
+
+
+# ============================================================================
+# Benchmark
+# ============================================================================
+
+class PreviousRenderer:
+    """MainWindow's bubble code from before this module, minus the
+    QTextBrowser calls; the baseline for bench and for the tests comparing
+    output. Kept as it was, f-strings and all."""
+
+    def __init__(self, username, thumb_size=(160, 120)):
+        self.username = username
+        self.thumb_size = thumb_size
+        self._last_date_shown = None
+
+    def _separator(self, dt):
+        current_date = dt.strftime("%A, %d %B %Y")  # e.g., Monday, 16 December 2025
+        if self._last_date_shown != current_date:
+            sep_html = f"""
+            <div style='display:block; width:100%; text-align:center; margin:12px 0;'>
+                <span style='background:#eef3f8; color:#555; font-size:12px; padding:4px 10px; border-radius:12px; display:inline-block;'>
+                    {current_date}
+                </span>
+            </div>
+            """
+            self._last_date_shown = current_date
+            return sep_html
+        return ""
+
+    def text(self, sender, content, timestamp=None, status_html=""):
+        from datetime import datetime
+        today_dt = datetime.now()
+        if timestamp:
+            try:
+                ts = int(timestamp)
+                dt = datetime.fromtimestamp(ts)
+            except:  # noqa: E722
+                dt = today_dt
+        else:
+            dt = today_dt
+        time_str = dt.strftime("%d:%m:%y %H:%M")
+        sep_html = self._separator(dt)
+        sender_norm = sender.strip().lower()
+        username_norm = self.username.strip().lower()
+        from html import escape
+        safe_content = escape(content)
+        if sender_norm == username_norm:
+            msg_html = f"""
+            <table width='100%' style='margin:6px 0; border-collapse:collapse;'><tr>
+                <td width='35%'></td>
+                <td width='65%' align='right'>
+                    <div style='display:inline-block; max-width:85%; text-align:left;'>
+                        <div style='font-size:11px; font-weight:bold; color:#1976D2; margin-bottom:4px; padding-left:10px;'>{escape(sender)}</div>
+                        <div style='background-color:#e3f2fd; color:#333; padding:10px 12px; border-radius:10px; border-left:4px solid #2196F3; word-wrap:break-word;'>
+                            {safe_content}
+                            <div style='font-size:10px; color:#666; margin-top:6px; text-align:right;'>{time_str}{status_html}</div>
+                        </div>
+                    </div>
+                </td>
+            </tr></table>
+            """
+        else:
+            msg_html = f"""
+            <table width='100%' style='margin:6px 0; border-collapse:collapse;'><tr>
+                <td width='65%' align='left'>
+                    <div style='display:inline-block; max-width:85%; text-align:left;'>
+                        <div style='font-size:11px; font-weight:bold; color:#1976D2; margin-bottom:4px; padding-left:10px;'>{escape(sender)}</div>
+                        <div style='background-color:#e3f2fd; color:#333; padding:10px 12px; border-radius:10px; border-left:4px solid #2196F3; word-wrap:break-word;'>
+                            {safe_content}
+                            <div style='font-size:10px; color:#666; margin-top:6px;'>{time_str}</div>
+                        </div>
+                    </div>
+                </td>
+                <td width='35%'></td>
+            </tr></table>
+            """
+        return sep_html, msg_html
+
+    def file(self, sender, filename, file_id, timestamp=None, thumbnail=False):
+        from datetime import datetime
+        from html import escape
+        today_dt = datetime.now()
+        if timestamp:
+            try:
+                ts = int(timestamp)
+                dt = datetime.fromtimestamp(ts)
+            except:  # noqa: E722
+                dt = today_dt
+        else:
+            dt = today_dt
+        time_str = dt.strftime("%d:%m:%y %H:%M")
+        sep_html = self._separator(dt)
+        sender_norm = sender.strip().lower()
+        username_norm = self.username.strip().lower()
+        is_self = (sender_norm == username_norm)
+        safe_filename = escape(filename)
+        safe_sender = escape(sender)
+        download_link = f'<a href="#download|{file_id}|{filename}" style="color:#1976D2; text-decoration:none; font-weight:bold;">📎 {safe_filename}</a>'
+        download_link += f' &nbsp;<a href="#forward|{file_id}|{filename}" style="color:#666; font-size:11px; text-decoration:none;">↪ Forward</a>'
+        if thumbnail:
+            download_link += (f'<br><a href="#download|{file_id}|{filename}">'
+                              f'<img src="thumb:{file_id}" width="{self.thumb_size[0]}" height="{self.thumb_size[1]}"></a>')
+        if is_self:
+            file_html = f"""
+            <table width='100%' style='margin:6px 0; border-collapse:collapse;'><tr>
+                <td width='35%'></td>
+                <td width='65%' align='right'>
+                    <div style='display:inline-block; max-width:85%; text-align:left;'>
+                        <div style='font-size:11px; font-weight:bold; color:#1976D2; margin-bottom:4px; padding-left:10px;'>{safe_sender}</div>
+                        <div style='background-color:#e3f2fd; color:#333; padding:10px 12px; border-radius:10px; border-left:4px solid #2196F3;'>
+                            {download_link}
+                            <div style='font-size:10px; color:#666; margin-top:6px; text-align:right;'>{time_str}</div>
+                        </div>
+                    </div>
+                </td>
+            </tr></table>
+            """
+        else:
+            file_html = f"""
+            <table width='100%' style='margin:6px 0; border-collapse:collapse;'><tr>
+                <td width='65%' align='left'>
+                    <div style='display:inline-block; max-width:85%; text-align:left;'>
+                        <div style='font-size:11px; font-weight:bold; color:#1976D2; margin-bottom:4px; padding-left:10px;'>{safe_sender}</div>
+                        <div style='background-color:#e3f2fd; color:#333; padding:10px 12px; border-radius:10px; border-left:4px solid #2196F3;'>
+                            {download_link}
+                            <div style='font-size:10px; color:#666; margin-top:6px;'>{time_str}</div>
+                        </div>
+                    </div>
+                </td>
+                <td width='35%'></td>
+            </tr></table>
+            """
+        return sep_html, file_html
+
+
+def sample_messages(count, days=30):
+    """(sender, content, timestamp) spread over the last days, a few per minute"""
+    now = int(time.time())
+    step = max(1, days * 86400 // max(count, 1))
+    senders = ["alice", "bob", "carol", "dave"]
+    return [(senders[i % 4], f"message {i} with <b>markup</b> & text " * (1 + i % 3), now - (count - i) * step)
+            for i in range(count)]
+
+
+def bench(count, repeat):
+    messages = sample_messages(count)
+    results = {}
+    for name, make in (("previous gui_client", PreviousRenderer), ("message_render", MessageRenderer)):
+        best = None
+        for _ in range(repeat):
+            renderer = make("alice")
+            started = time.perf_counter()
+            for sender, content, ts in messages:
+                renderer.text(sender, content, ts)
+            elapsed = time.perf_counter() - started
+            best = elapsed if best is None else min(best, elapsed)
+        results[name] = count / best
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Chat bubble rendering")
+    sub = parser.add_subparsers(dest="cmd", required=True)
+    b = sub.add_parser("bench", help="messages rendered per second (HTML only, no Qt)")
+    b.add_argument("--messages", type=int, default=20000)
+    b.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args(argv)
+
+    results = bench(args.messages, args.repeat)
+    base = results["previous gui_client"]
+    for name, rate in results.items():
+        print(f"  {name:<22}{rate:12,.0f} msg/s  {rate / base:5.1f}x")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,356 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Conversation logs (messages/*.txt) with a sparse timestamp index.
+
+Each log keeps its server.cpp format, one 'ts|sender|TYPE|content' line per
+message, and gets a sidecar '<file>.idx' that splits the file into blocks of
+about BLOCK_SIZE bytes and records each block's byte offset, min/max
+timestamp and record count:
+
+    MSGIDX 1 <block_size> <indexed_size> <head_crc32>
+    <offset> <min_ts> <max_ts> <count>
+    ...
+
+Range queries only read blocks whose [min_ts, max_ts] overlaps the range and
+tail queries ("last N before T") walk blocks backwards, so neither depends on
+the file size. The index catches up with lines appended by anyone else
+(e.g. server.cpp writing the same directory) and is rebuilt if the file was
+truncated or replaced.
+
+Usage:
+    python message_store.py index messages/
+    python message_store.py tail messages/G_hust.txt -n 50 --before 1735000000
+    python message_store.py range messages/G_hust.txt --begin 2025-01-01T00:00 --end 0
+"""
+
+import argparse
+import os
+import sys
+import time
+import zlib
+from collections import OrderedDict
+
+INDEX_SUFFIX = ".idx"
+INDEX_MAGIC = "MSGIDX"
+INDEX_VERSION = 1
+BLOCK_SIZE = 64 * 1024
+HEAD_BYTES = 4096  # prefix checksummed to detect a replaced file
+OPEN_LOGS = 256
+
+
+def parse_record(line):
+    """(ts, sender, type, content) for a 'ts|sender|TYPE|content' line, else None"""
+    parts = line.split('|', 3)
+    if len(parts) < 4:
+        return None
+    try:
+        ts = int(parts[0])
+    except ValueError:
+        ts = 0
+    return ts, parts[1], parts[2], parts[3]
+
+
+def format_record(ts, sender, mtype, content):
+    return f"{ts}|{sender}|{mtype}|{content}\n"
+
+
+def parse_time_to_unix(s):
+    """Integer seconds, 'YYYY-MM-DD[ T]HH:MM[:SS]', '' -> 0, otherwise now"""
+    s = s.strip()
+    if not s:
+        return 0
+    if s.isdigit():
+        return int(s)
+    s = s.replace('T', ' ').replace('t', ' ')
+    for fmt in ("%Y-%m-%d %H:%M:%S", "%Y-%m-%d %H:%M"):
+        try:
+            return int(time.mktime(time.strptime(s, fmt)))
+        except ValueError:
+            pass
+    return int(time.time())
+
+
+def in_range(ts, tbegin, tend):
+    """0 means unbounded on that side, as in HISTORY"""
+    return (tbegin == 0 or ts >= tbegin) and (tend == 0 or ts <= tend)
+
+
+class MessageLog:
+    """One conversation file plus its sparse index"""
+
+    def __init__(self, path, block_size=BLOCK_SIZE):
+        self.path = path
+        self.index_path = path + INDEX_SUFFIX
+        self.block_size = block_size
+        self._blocks = []  # [offset, min_ts, max_ts, count]
+        self._size = 0  # bytes of the file covered by the index
+        self._head = 0  # crc32 of the first min(HEAD_BYTES, _size) bytes
+        self._loaded = False
+        self._dirty = False
+        self._append = None
+
+    # -- index maintenance -------------------------------------------------
+
+    def _reset(self):
+        self._blocks = []
+        self._size = 0
+        self._head = 0
+        self._dirty = True
+
+    def _load_index(self):
+        self._loaded = True
+        try:
+            with open(self.index_path, 'r', encoding='ascii') as f:
+                header = f.readline().split()
+                if (len(header) != 5 or header[0] != INDEX_MAGIC or int(header[1]) != INDEX_VERSION
+                        or int(header[2]) != self.block_size):
+                    raise ValueError("stale index")
+                blocks = [[int(v) for v in line.split()] for line in f if line.strip()]
+                if any(len(b) != 4 for b in blocks):
+                    raise ValueError("corrupt index")
+            self._blocks = blocks
+            self._size = int(header[3])
+            self._head = int(header[4])
+        except (OSError, ValueError):
+            self._reset()
+
+    def _add(self, offset, ts):
+        last = self._blocks[-1] if self._blocks else None
+        if last is None or offset - last[0] >= self.block_size:
+            self._blocks.append([offset, ts, ts, 1])
+            return
+        if ts < last[1]:
+            last[1] = ts
+        if ts > last[2]:
+            last[2] = ts
+        last[3] += 1
+
+    def _scan(self, f, start):
+        """Index complete lines from byte offset start"""
+        f.seek(start)
+        offset = start
+        for raw in f:
+            if not raw.endswith(b'\n'):
+                break  # partial line still being written
+            record = parse_record(raw.decode('utf-8', errors='replace').rstrip('\r\n'))
+            if record is not None:
+                self._add(offset, record[0])
+            offset += len(raw)
+        if offset != self._size:
+            self._size = offset
+            self._dirty = True
+
+    def refresh(self):
+        """Bring the index up to date with the file"""
+        if not self._loaded:
+            self._load_index()
+        try:
+            size = os.path.getsize(self.path)
+        except OSError:
+            if self._size:
+                self._reset()
+            return
+        if size == self._size:
+            return
+        with open(self.path, 'rb') as f:
+            if size < self._size or zlib.crc32(f.read(min(HEAD_BYTES, self._size))) != self._head:
+                self._reset()
+            self._scan(f, self._size)
+            f.seek(0)
+            self._head = zlib.crc32(f.read(min(HEAD_BYTES, self._size)))
+
+    def save_index(self):
+        if not self._dirty:
+            return
+        tmp = self.index_path + ".tmp"
+        with open(tmp, 'w', encoding='ascii') as f:
+            f.write(f"{INDEX_MAGIC} {INDEX_VERSION} {self.block_size} {self._size} {self._head}\n")
+            f.writelines(f"{o} {lo} {hi} {n}\n" for o, lo, hi, n in self._blocks)
+        os.replace(tmp, self.index_path)
+        self._dirty = False
+
+    def close(self):
+        if self._append is not None:
+            self._append.close()
+            self._append = None
+        if self._loaded:
+            self.save_index()
+
+    # -- writing -----------------------------------------------------------
+
+    def append(self, sender, mtype, content, ts=None):
+        """Append one message; returns its timestamp"""
+        ts = int(time.time()) if ts is None else ts
+        if self._append is None:
+            self._append = open(self.path, 'ab')
+        # Not tell(): an append-mode handle only learns of other writers'
+        # lines when it writes, so it would report the end of our own last write
+        offset = os.fstat(self._append.fileno()).st_size
+        if not self._loaded or offset != self._size:
+            self.refresh()  # first use, or another writer appended
+            offset = os.fstat(self._append.fileno()).st_size
+        data = format_record(ts, sender, mtype, content).encode('utf-8')
+        self._append.write(data)
+        self._append.flush()
+        self._add(offset, ts)
+        self._size = offset + len(data)
+        if offset < HEAD_BYTES:
+            with open(self.path, 'rb') as f:
+                self._head = zlib.crc32(f.read(min(HEAD_BYTES, self._size)))
+        self._dirty = True
+        return ts
+
+    # -- queries -----------------------------------------------------------
+
+    def __len__(self):
+        self.refresh()
+        return sum(b[3] for b in self._blocks)
+
+    def _block_records(self, f, i):
+        start = self._blocks[i][0]
+        end = self._blocks[i + 1][0] if i + 1 < len(self._blocks) else self._size
+        f.seek(start)
+        records = []
+        for line in f.read(end - start).decode('utf-8', errors='replace').split('\n'):
+            record = parse_record(line.rstrip('\r'))
+            if record is not None:
+                records.append(record)
+        return records
+
+    def _overlapping(self, tbegin, tend):
+        return [i for i, (_, lo, hi, _) in enumerate(self._blocks)
+                if (tend == 0 or lo <= tend) and (tbegin == 0 or hi >= tbegin)]
+
+    def range(self, tbegin=0, tend=0):
+        """Records with tbegin <= ts <= tend, in file order"""
+        self.refresh()
+        blocks = self._overlapping(tbegin, tend)
+        if not blocks:
+            return []
+        out = []
+        with open(self.path, 'rb') as f:
+            for i in blocks:
+                out.extend(r for r in self._block_records(f, i) if in_range(r[0], tbegin, tend))
+        return out
+
+    def tail(self, limit, tbegin=0, tend=0):
+        """The last `limit` records (in file order) with tbegin <= ts <= tend"""
+        if limit <= 0:
+            return self.range(tbegin, tend)
+        self.refresh()
+        blocks = self._overlapping(tbegin, tend)
+        if not blocks:
+            return []
+        picked = []
+        with open(self.path, 'rb') as f:
+            for i in reversed(blocks):
+                matches = [r for r in self._block_records(f, i) if in_range(r[0], tbegin, tend)]
+                picked[:0] = matches
+                if len(picked) >= limit:
+                    break
+        return picked[-limit:]
+
+
+class MessageStore:
+    """Logs for one messages/ directory, LRU of open handles
+
+    A conversation that has a segmented directory (see segment_log.py) is
+    served from it; with segmented=True new conversations are created that
+    way too, otherwise as plain .txt files with a sparse index.
+    """
+
+    def __init__(self, directory, capacity=OPEN_LOGS, block_size=BLOCK_SIZE, segmented=False):
+        self.directory = directory
+        self.capacity = capacity
+        self.block_size = block_size
+        self.segmented = segmented
+        self._logs = OrderedDict()  # filename -> MessageLog or SegmentedLog
+
+    def _open(self, filename):
+        from segment_log import SegmentedLog, segment_dir, COLD_AGE
+
+        path = os.path.join(self.directory, filename)
+        seg = segment_dir(path)
+        if os.path.isdir(seg) or (self.segmented and not os.path.exists(path)):
+            return SegmentedLog(seg, cold_age=COLD_AGE)
+        return MessageLog(path, self.block_size)
+
+    def log(self, filename):
+        log = self._logs.pop(filename, None)
+        if log is None:
+            log = self._open(filename)
+            if len(self._logs) >= self.capacity:
+                _, old = self._logs.popitem(last=False)
+                old.close()
+        self._logs[filename] = log
+        return log
+
+    def exists(self, filename):
+        from segment_log import segment_dir
+
+        path = os.path.join(self.directory, filename)
+        return os.path.exists(path) or os.path.isdir(segment_dir(path))
+
+    def append(self, filename, sender, mtype, content, ts=None):
+        return self.log(filename).append(sender, mtype, content, ts)
+
+    def save_indexes(self):
+        for log in self._logs.values():
+            log.save_index()
+
+    def close(self):
+        for log in self._logs.values():
+            log.close()
+        self._logs.clear()
+
+
+def open_log(path):
+    """MessageLog for a messages/*.txt path, index refreshed"""
+    log = MessageLog(path)
+    log.refresh()
+    return log
+
+
+def _print_records(records):
+    for ts, sender, mtype, content in records:
+        print(f"{ts}|{sender}|{mtype}|{content}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Sparse time index for messages/*.txt")
+    sub = parser.add_subparsers(dest="command", required=True)
+    p = sub.add_parser("index", help="build or refresh .idx files")
+    p.add_argument("paths", nargs="+", help="conversation files or messages/ directories")
+    p = sub.add_parser("tail", help="last N messages")
+    p.add_argument("path")
+    p.add_argument("-n", type=int, default=50)
+    p.add_argument("--before", default="0", help="only messages strictly before this time")
+    p = sub.add_parser("range", help="messages in [begin, end]")
+    p.add_argument("path")
+    p.add_argument("--begin", default="0")
+    p.add_argument("--end", default="0")
+    args = parser.parse_args(argv)
+
+    if args.command == "index":
+        files = []
+        for path in args.paths:
+            if os.path.isdir(path):
+                files.extend(os.path.join(path, n) for n in sorted(os.listdir(path)) if n.endswith(".txt"))
+            else:
+                files.append(path)
+        for path in files:
+            log = open_log(path)
+            log.save_index()
+            print(f"{path}: {len(log)} messages, {len(log._blocks)} blocks")
+    elif args.command == "tail":
+        before = parse_time_to_unix(args.before)
+        _print_records(open_log(args.path).tail(args.n, 0, before - 1 if before else 0))
+    else:
+        log = open_log(args.path)
+        _print_records(log.range(parse_time_to_unix(args.begin), parse_time_to_unix(args.end)))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,1352 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+asyncio reference server speaking the same protocol as server.cpp.
+
+Runs anywhere Python does (server.cpp needs Winsock2) and is meant as the
+local target for client benchmarks, load tests and integration tests. It
+reads and writes the same files in the data directory:
+
+    users.txt, sessions.txt, pending_requests.txt, friends.txt, groups.txt,
+    group_invites.txt, file_metadata.txt, messages/*.txt, files/*.txt,
+    uploads/<file_id>, server.log
+
+Completed uploads are content-addressed: they move from uploads/<file_id>
+to blobs/<sha256[:2]>/<sha256> and file_metadata.txt points there, so
+identical content is stored once however often it is shared.
+
+Differences from server.cpp, all invisible to a well-behaved client:
+- commands are framed by newline (server.cpp treats each recv() as one
+  command), so pipelined commands are safe;
+- NOTIFY_* lines for a connection that is receiving a download are held
+  until the download finishes instead of landing between binary chunks;
+- whole-file rewrites (friends.txt, groups.txt, ...) are batched and
+  flushed at most every SAVE_INTERVAL seconds, and server.log is buffered;
+- HISTORY is served from message_store's sparse time index and also
+  accepts 'HISTORY <type> <name> <limit> <begin> <end>' (newest `limit`
+  messages), which the GUI sends for its first page and "load more";
+- REQ_UPLOAD_HASH <type> <target> <sha256> <size> <filename> is an
+  extension: if a blob with that hash and size is stored, the file is
+  attached without a transfer (SUCCESS 201 UPLOAD_DEDUP <file_id>),
+  otherwise it answers like REQ_UPLOAD. Knowing a hash is then enough to
+  share its content, just as knowing a file_id is enough for REQ_DOWNLOAD;
+- FORWARD_FILE <file_id> <type> <target> is an extension too: it shares a
+  stored file with another chat under a new file_id (FILE entry and
+  NOTIFY_FILE as for an upload) and answers SUCCESS 201 FORWARDED <file_id>;
+- REQ_PREVIEW <file_id> <max_bytes> is REQ_DOWNLOAD for files of at most
+  max_bytes and FAIL 413 FILE_TOO_LARGE otherwise (image thumbnails);
+- LIST_FILES <type> <name> [offset= limit= sort= sender= ext= min_size=
+  max_size=] pages through a conversation's files, from an in-memory
+  catalog built from file_metadata.txt, answering on one line:
+  SUCCESS 200 FILES <total> <offset> <file_id|sender|time|size|name>...
+  (name percent-encoded);
+- CAPS <capability>... negotiates optional features and answers
+  SUCCESS 200 CAPS <accepted>... in plain text. With "zlib" accepted,
+  everything the server sends afterwards is framed as [flags|length:4]
+  [payload]: FRAME_COMPRESSED payloads continue one zlib stream (flushed
+  per write), the others are raw (download chunks, already dense);
+- CAPS zchunk lets both sides set CHUNK_COMPRESSED in a chunk's length and
+  send it zlib-compressed. Downloads of files that pass chat_core's
+  compressibility probe (not JPEG/PNG/ZIP/..., and the first 16KB shrink)
+  are compressed on async_core's pool a few chunks ahead of the socket;
+- CAPS msgid enables TEXT_ID <id> <type> <name> <content>: a TEXT carrying a
+  client message id, answered SUCCESS 201 SENT <id> <ts>. An id the same
+  user already sent (a resend after reconnecting) is acknowledged again but
+  not stored or delivered twice. Receivers that negotiated msgid get
+  NOTIFY_TEXT_ID <id> <NOTIFY_TEXT fields>, the others plain NOTIFY_TEXT;
+- PING [token] answers SUCCESS 200 PONG [token], also before login (the
+  client heartbeat; server.cpp answers UNKNOWN_COMMAND, which serves too);
+- the legacy INIT_UPLOAD / DOWNLOAD placeholders are not implemented.
+
+Usage:
+    python reference_server.py --port 8888 --data-dir ./server_data
+"""
+
+import argparse
+import asyncio
+import hashlib
+import os
+import random
+import struct
+import sys
+import time
+import zlib
+from collections import OrderedDict
+from datetime import datetime
+from urllib.parse import quote
+
+from async_core import chunk_frames
+from chat_core import COMPRESS_PROBE_SIZE, is_compressible, split_chunk_length, unpack_chunk_data
+from message_store import MessageStore, parse_time_to_unix
+
+CHUNK_HEADER_SIZE = 8
+CHUNK_SIZE = 65536  # 64KB
+
+SAVE_INTERVAL = 0.5  # seconds between batched rewrites of state files
+LOG_FLUSH_INTERVAL = 0.5
+OPEN_MESSAGE_FILES = 256  # append handles kept open for messages/ and files/
+BLOB_DIR = "blobs"
+HASH_READ_SIZE = 1 << 20
+LIST_FILES_LIMIT = 50  # default page size
+LIST_FILES_MAX = 200
+CAPABILITIES = ("zlib", "zchunk", "msgid")
+RECENT_TEXT_IDS = 1024  # TEXT_ID ids remembered per user
+ZLIB_LEVEL = 3  # ~3.5x on HISTORY text at tens of MB/s; higher levels cost far more CPU
+FRAME_COMPRESSED = 0x80000000
+LIST_FILES_SORTS = {
+    "time": lambda m: m.upload_time,
+    "size": lambda m: m.filesize,
+    "name": lambda m: m.filename.lower(),
+}
+
+
+class ServerLog:
+    """server.log writer in server.cpp's format, flushed in batches"""
+
+    def __init__(self, path):
+        self.path = path
+        self._buffer = []
+        self._file = open(path, 'a', encoding='utf-8')
+
+    def write(self, message):
+        stamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        self._buffer.append(f"[{stamp}] {message}\n")
+
+    def flush(self):
+        if self._buffer:
+            self._file.write(''.join(self._buffer))
+            self._buffer.clear()
+            self._file.flush()
+
+    def close(self):
+        self.flush()
+        self._file.close()
+
+
+class AppendFiles:
+    """LRU of open append handles for messages/*.txt and files/*.txt"""
+
+    def __init__(self, capacity=OPEN_MESSAGE_FILES):
+        self.capacity = capacity
+        self._open = OrderedDict()
+
+    def append(self, path, line):
+        f = self._open.pop(path, None)
+        if f is None:
+            f = open(path, 'a', encoding='utf-8')
+            if len(self._open) >= self.capacity:
+                _, old = self._open.popitem(last=False)
+                old.close()
+        self._open[path] = f
+        f.write(line)
+        f.flush()
+
+    def close(self):
+        for f in self._open.values():
+            f.close()
+        self._open.clear()
+
+
+class Group:
+    __slots__ = ("name", "creator", "max_members", "members")
+
+    def __init__(self, name, creator, max_members, members):
+        self.name = name
+        self.creator = creator
+        self.max_members = max_members
+        self.members = members
+
+
+class FileMeta:
+    __slots__ = ("file_id", "filename", "sender", "target_type", "target_name",
+                 "filesize", "bytes_received", "filepath", "upload_time")
+
+    def __init__(self, file_id, filename, sender, target_type, target_name,
+                 filesize, filepath, upload_time, bytes_received=0):
+        self.file_id = file_id
+        self.filename = filename
+        self.sender = sender
+        self.target_type = target_type
+        self.target_name = target_name
+        self.filesize = filesize
+        self.bytes_received = bytes_received
+        self.filepath = filepath
+        self.upload_time = upload_time
+
+
+def _hash_file(path):
+    h = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(HASH_READ_SIZE), b''):
+            h.update(block)
+    return h.hexdigest()
+
+
+def _is_sha256(value):
+    return len(value) == 64 and all(c in "0123456789abcdef" for c in value)
+
+
+def _read_lines(path):
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            for line in f:
+                line = line.rstrip('\r\n')
+                if line:
+                    yield line
+    except FileNotFoundError:
+        return
+
+
+class ChatServer:
+    """Server state and persistence; one ClientConnection per socket"""
+
+    def __init__(self, data_dir=".", segmented=False):
+        self.data_dir = os.path.abspath(data_dir)
+        self.segmented = segmented
+        self.users = {}  # username -> password
+        self.sessions = {}  # session_id -> username
+        self.user_to_session = {}
+        self.pending_requests = {}  # target -> [senders]
+        self.friends = {}  # username -> [[friend, status, conv]]
+        self.groups = {}  # name -> Group
+        self.user_groups = {}  # username -> [group names]
+        self.group_invites = {}  # group -> [invitees]
+        self.active_uploads = {}  # file_id -> FileMeta
+        self.completed_files = {}  # file_id -> FileMeta
+        self.blobs = {}  # sha256 -> relative path under blobs/
+        self.catalog = {}  # files/<conv>.txt -> [FileMeta] in upload order
+        self.online = {}  # username -> ClientConnection
+        self.text_ids = {}  # username -> OrderedDict(message id -> SENT reply)
+        self.next_client_id = 1
+        self._file_counter = 0
+        self._dirty = set()
+        self._tasks = []
+        self.log = None
+        self.appends = AppendFiles()
+        self.messages = None  # MessageStore for messages/
+
+    def path(self, *parts):
+        return os.path.join(self.data_dir, *parts)
+
+    # -- persistence -------------------------------------------------------
+
+    def load(self):
+        os.makedirs(self.data_dir, exist_ok=True)
+        for d in ("uploads", "files", "messages", BLOB_DIR):
+            os.makedirs(self.path(d), exist_ok=True)
+        for name in ("users.txt", "sessions.txt", "pending_requests.txt", "friends.txt",
+                     "groups.txt", "group_invites.txt", "file_metadata.txt", "server.log"):
+            open(self.path(name), 'a').close()
+        self.log = ServerLog(self.path("server.log"))
+        self.messages = MessageStore(self.path("messages"), segmented=self.segmented)
+
+        for line in _read_lines(self.path("users.txt")):
+            user, sep, pw = line.partition(':')
+            if sep and user.strip():
+                self.users[user.strip()] = pw.strip()
+        for line in _read_lines(self.path("sessions.txt")):
+            sid, sep, user = line.partition(':')
+            if sep and sid.strip() and user.strip():
+                self.sessions[sid.strip()] = user.strip()
+                self.user_to_session[user.strip()] = sid.strip()
+        for line in _read_lines(self.path("pending_requests.txt")):
+            target, sep, rest = line.partition(':')
+            if sep and target.strip():
+                self.pending_requests[target.strip()] = [t.strip() for t in rest.split(',') if t.strip()]
+        for line in _read_lines(self.path("friends.txt")):
+            user, sep, rest = line.partition(':')
+            if not sep or not user.strip():
+                continue
+            entries = []
+            for tok in rest.split(','):
+                parts = [p.strip() for p in tok.strip().split('|')]
+                if parts and parts[0]:
+                    entries.append([parts[0],
+                                    parts[1] if len(parts) > 1 else "offline",
+                                    parts[2] if len(parts) > 2 else ""])
+            self.friends[user.strip()] = entries
+        for line in _read_lines(self.path("groups.txt")):
+            parts = [p.strip() for p in line.split(':')]
+            if len(parts) < 3 or not parts[0]:
+                continue
+            members = [m.strip() for m in parts[3].split(',') if m.strip()] if len(parts) > 3 else []
+            try:
+                max_members = int(parts[2])
+            except ValueError:
+                max_members = 0
+            self.groups[parts[0]] = Group(parts[0], parts[1], max_members, members)
+            for m in members:
+                self.user_groups.setdefault(m, []).append(parts[0])
+        for line in _read_lines(self.path("group_invites.txt")):
+            gname, sep, rest = line.partition(':')
+            if sep and gname.strip():
+                self.group_invites[gname.strip()] = [t.strip() for t in rest.split(',') if t.strip()]
+        for line in _read_lines(self.path("file_metadata.txt")):
+            parts = line.split('|')
+            if len(parts) >= 8:
+                try:
+                    meta = FileMeta(parts[0], parts[1], parts[2], parts[3], parts[4],
+                                    int(parts[5]), parts[6], int(parts[7]))
+                except ValueError:
+                    continue
+                meta.bytes_received = meta.filesize
+                self.completed_files[meta.file_id] = meta
+                if meta.filepath.startswith(BLOB_DIR + "/"):
+                    self.blobs[os.path.basename(meta.filepath)] = meta.filepath
+                self.add_to_catalog(meta)
+
+    def mark_dirty(self, *names):
+        self._dirty.update(names)
+
+    def save_dirty(self):
+        dirty, self._dirty = self._dirty, set()
+        for name in dirty:
+            getattr(self, "_save_" + name)()
+
+    def _write(self, filename, lines):
+        tmp = self.path(filename + ".tmp")
+        with open(tmp, 'w', encoding='utf-8') as f:
+            f.writelines(lines)
+        os.replace(tmp, self.path(filename))
+
+    def _save_users(self):
+        self._write("users.txt", (f"{u}:{p}\n" for u, p in self.users.items()))
+
+    def _save_sessions(self):
+        self._write("sessions.txt", (f"{s}:{u}\n" for s, u in self.sessions.items()))
+
+    def _save_pending(self):
+        self._write("pending_requests.txt",
+                    (f"{t}:{','.join(s)}\n" for t, s in self.pending_requests.items()))
+
+    def _save_friends(self):
+        self._write("friends.txt",
+                    (f"{u}:{','.join('|'.join(e) for e in entries)}\n"
+                     for u, entries in self.friends.items()))
+
+    def _save_groups(self):
+        self._write("groups.txt",
+                    (f"{g.name}:{g.creator}:{g.max_members}:{','.join(g.members)}\n"
+                     for g in self.groups.values()))
+
+    def _save_invites(self):
+        self._write("group_invites.txt",
+                    (f"{g}:{','.join(v)}\n" for g, v in self.group_invites.items()))
+
+    def save_file_metadata(self, meta):
+        self.appends.append(self.path("file_metadata.txt"),
+                            f"{meta.file_id}|{meta.filename}|{meta.sender}|{meta.target_type}|"
+                            f"{meta.target_name}|{meta.filesize}|{meta.filepath}|{meta.upload_time}\n")
+
+    def save_message(self, relpath, sender, mtype, content, ts=None):
+        if relpath.startswith("messages/"):
+            return self.messages.append(relpath[len("messages/"):], sender, mtype, content, ts)
+        ts = int(time.time()) if ts is None else ts
+        self.appends.append(self.path(relpath), f"{ts}|{sender}|{mtype}|{content}\n")
+        return ts
+
+    def read_history(self, relpath, tbegin, tend, limit=0):
+        """Numbered 'msgId|sender|ts|TYPE|len|content' lines in [tbegin, tend]
+
+        With a limit only the newest `limit` messages are returned. None if
+        the conversation file does not exist.
+        """
+        name = relpath[len("messages/"):]
+        if not self.messages.exists(name):
+            return None
+        records = self.messages.log(name).tail(limit, tbegin, tend)
+        return [f"{i}|{sender}|{ts}|{mtype}|{len(content)}|{content}"
+                for i, (ts, sender, mtype, content) in enumerate(records, 1)]
+
+    # -- shared helpers ----------------------------------------------------
+
+    def is_online(self, username):
+        return username in self.online
+
+    def set_online_status(self, username, status):
+        changed = False
+        for entries in self.friends.values():
+            for e in entries:
+                if e[0] == username and e[1] != status:
+                    e[1] = status
+                    changed = True
+        if changed:
+            self.mark_dirty("friends")
+
+    def conversation_id(self, user1, user2):
+        for e in self.friends.get(user1, ()):
+            if e[0] == user2:
+                return e[2]
+        return ""
+
+    def notify_user(self, username, message):
+        conn = self.online.get(username)
+        if conn is None:
+            self.log.write(f"NOTIFY to {username} (offline): {message}")
+            return
+        conn.notify(message)
+        self.log.write(f"NOTIFY to {username}: {message}")
+
+    def notify_text(self, username, line, message_id=None):
+        """notify_user for a NOTIFY_TEXT line, tagged with message_id for msgid clients"""
+        conn = self.online.get(username)
+        if message_id and conn is not None and conn.msgid:
+            line = f"NOTIFY_TEXT_ID {message_id} {line[len('NOTIFY_TEXT '):]}"
+        self.notify_user(username, line)
+
+    def generate_file_id(self):
+        self._file_counter += 1
+        return f"{int(time.time())}_{self._file_counter}"
+
+    def find_blob(self, digest, filesize):
+        """Relative path of the stored content with this sha256, or None"""
+        relpath = self.blobs.get(digest)
+        if relpath is None:
+            return None
+        try:
+            if os.path.getsize(self.path(relpath)) == filesize:
+                return relpath
+        except OSError:
+            pass
+        del self.blobs[digest]
+        return None
+
+    def store_blob(self, meta, digest):
+        """Move a finished upload into blobs/, dropping it if the content is already there"""
+        relpath = f"{BLOB_DIR}/{digest[:2]}/{digest}"
+        src = self.path(meta.filepath)
+        if self.find_blob(digest, meta.filesize) == relpath:
+            os.remove(src)
+        else:
+            os.makedirs(os.path.dirname(self.path(relpath)), exist_ok=True)
+            os.replace(src, self.path(relpath))
+            self.blobs[digest] = relpath
+        meta.filepath = relpath
+
+    def add_to_catalog(self, meta):
+        paths = self.conversation_paths(meta)
+        if paths:
+            self.catalog.setdefault(paths[1], []).append(meta)
+
+    def conversation_paths(self, meta):
+        """(messages path, files index path) for a completed file, or None"""
+        if meta.target_type == "G":
+            return f"messages/G_{meta.target_name}.txt", f"files/G_{meta.target_name}.txt"
+        conv = self.conversation_id(meta.sender, meta.target_name) or \
+            self.conversation_id(meta.target_name, meta.sender)
+        if conv:
+            return f"messages/U_{conv}.txt", f"files/U_{conv}.txt"
+        return None
+
+    # -- lifecycle ---------------------------------------------------------
+
+    async def _background(self):
+        while True:
+            await asyncio.sleep(min(SAVE_INTERVAL, LOG_FLUSH_INTERVAL))
+            self.save_dirty()
+            self.messages.save_indexes()
+            self.log.flush()
+
+    async def start(self, host="0.0.0.0", port=8888):
+        if self.log is None:
+            self.load()
+        server = await asyncio.start_server(self._accept, host, port, limit=1 << 20)
+        self._tasks.append(asyncio.ensure_future(self._background()))
+        self.log.write(f"Server started on port {port}.")
+        return server
+
+    def close(self):
+        for task in self._tasks:
+            task.cancel()
+        self.save_dirty()
+        self.appends.close()
+        if self.messages is not None:
+            self.messages.close()
+        if self.log is not None:
+            self.log.write("Server shutting down")
+            self.log.close()
+
+    async def _accept(self, reader, writer):
+        client_id = self.next_client_id
+        self.next_client_id += 1
+        conn = ClientConnection(self, reader, writer, client_id)
+        await conn.run()
+
+
+class ClientConnection:
+    """Command loop for one client socket"""
+
+    def __init__(self, server, reader, writer, client_id):
+        self.server = server
+        self.reader = reader
+        self.writer = writer
+        self.prefix = f"Client[{client_id}] "
+        self.session = ""
+        self.user = ""
+        self.in_download = False
+        self._held = []  # notifications held during a download
+        self._deflate = None  # zlib compressobj once CAPS zlib was accepted
+        self.zchunk = False  # CAPS zchunk accepted
+        self.msgid = False  # CAPS msgid accepted
+
+    def log(self, message):
+        self.server.log.write(self.prefix + message)
+
+    def _write(self, data, compress=True):
+        """Write to the client, framed once stream compression is on"""
+        if self._deflate is None:
+            self.writer.write(data)
+        elif compress:
+            data = self._deflate.compress(data) + self._deflate.flush(zlib.Z_SYNC_FLUSH)
+            self.writer.write(struct.pack('!I', FRAME_COMPRESSED | len(data)) + data)
+        else:
+            self.writer.write(struct.pack('!I', len(data)) + data)
+
+    def write_line(self, line):
+        self._write((line + "\n").encode('utf-8'))
+
+    def notify(self, message):
+        if self.in_download:
+            self._held.append(message)
+        else:
+            self.write_line(message)
+
+    def close(self):
+        self.writer.close()
+
+    async def run(self):
+        peer = self.writer.get_extra_info('peername') or ("?", 0)
+        self.log(f"connected: {peer[0]}:{peer[1]}")
+        s = self.server
+        try:
+            while True:
+                raw = await self.reader.readline()
+                if not raw:
+                    break
+                msg = raw.decode('utf-8', errors='replace').strip()
+                if not msg:
+                    continue
+                self.log("Received: " + msg)
+                cmd, _, args = msg.partition(' ')
+                handler = getattr(self, "cmd_" + cmd.lower(), None) if cmd.isupper() else None
+                try:
+                    if handler is None:
+                        response = "FAIL 400 UNKNOWN_COMMAND"
+                    else:
+                        response = handler(args)
+                        if asyncio.iscoroutine(response):
+                            response = await response
+                except (ConnectionError, asyncio.IncompleteReadError):
+                    raise
+                except Exception as e:
+                    response = f"FAIL 500 SERVER_ERROR {e}"
+                    self.log("Exception during command processing: " + str(e))
+                if response is not None:
+                    self.write_line(response)
+                    self.log("Sent: " + response)
+                await self.writer.drain()
+        except (ConnectionError, asyncio.IncompleteReadError, ValueError):
+            pass
+        finally:
+            self.log("disconnected.")
+            if self.user and s.online.get(self.user) is self:
+                del s.online[self.user]
+                s.set_online_status(self.user, "offline")
+            self.writer.close()
+
+    def _require_login(self, code="FAIL 401 UNAUTHORIZED"):
+        return None if self.session else code
+
+    # -- account -----------------------------------------------------------
+
+    def cmd_register(self, args):
+        parts = args.split()
+        if len(parts) < 2:
+            return "FAIL 400 INVALID_FORMAT"
+        username, password = parts[0], parts[1]
+        s = self.server
+        if username in s.users:
+            return "FAIL 409 USER_EXISTS"
+        s.users[username] = password
+        s.mark_dirty("users")
+        return f"SUCCESS 201 REGISTERED {username}"
+
+    def cmd_login(self, args):
+        parts = args.split()
+        if len(parts) < 2:
+            return "FAIL 400 INVALID_FORMAT"
+        username, password = parts[0], parts[1]
+        s = self.server
+        if s.users.get(username) != password:
+            return "FAIL 401 INVALID_LOGIN"
+        # Single active session per user: expire and disconnect the old one
+        old_sid = s.user_to_session.pop(username, None)
+        if old_sid:
+            s.sessions.pop(old_sid, None)
+            self.log(f"Removed old session for user {username} ({old_sid})")
+            old = s.online.pop(username, None)
+            if old is not None and old is not self:
+                old.write_line(f"NOTIFY SESSION_EXPIRED {old_sid}")
+                old.user = ""
+                old.session = ""
+                old.close()
+            s.set_online_status(username, "offline")
+        session_id = f"{int(time.time())}-{random.randrange(100000)}"
+        s.sessions[session_id] = username
+        s.user_to_session[username] = session_id
+        s.mark_dirty("sessions")
+        self.session = session_id
+        self.user = username
+        s.online[username] = self
+        s.set_online_status(username, "online")
+        return f"SUCCESS 200 SESSION {session_id}"
+
+    def cmd_logout(self, args):
+        if not self.session:
+            return "FAIL 400 NOT_LOGGED_IN"
+        s = self.server
+        removed_user = s.sessions.pop(self.session, None)
+        if removed_user is not None:
+            s.user_to_session.pop(removed_user, None)
+            s.mark_dirty("sessions")
+            self.log(f"User {removed_user} logged out (session {self.session})")
+            if s.online.get(removed_user) is self:
+                del s.online[removed_user]
+            s.set_online_status(removed_user, "offline")
+        self.session = ""
+        self.user = ""
+        return "SUCCESS 200 LOGOUT"
+
+    def cmd_auth(self, args):
+        session_id = args.strip()
+        if not session_id:
+            return "FAIL 400 INVALID_FORMAT"
+        s = self.server
+        user = s.sessions.get(session_id)
+        if user is None:
+            return "FAIL 401 SESSION_EXPIRED"
+        self.session = session_id
+        self.user = user
+        s.online[user] = self
+        s.set_online_status(user, "online")
+        return "SUCCESS 200 AUTH_OK"
+
+    def cmd_ping(self, args):
+        token = args.strip()
+        return f"SUCCESS 200 PONG {token}" if token else "SUCCESS 200 PONG"
+
+    def cmd_caps(self, args):
+        if not self.session:
+            return "FAIL 401 NOT_AUTHENTICATED"
+        accepted = [c for c in args.split() if c in CAPABILITIES]
+        # The reply itself is the last plain line the client reads
+        response = "SUCCESS 200 CAPS " + " ".join(accepted)
+        self.write_line(response.rstrip())
+        self.log("Sent: " + response.rstrip())
+        if "zlib" in accepted and self._deflate is None:
+            self._deflate = zlib.compressobj(ZLIB_LEVEL)
+        self.zchunk = "zchunk" in accepted
+        self.msgid = "msgid" in accepted
+        return None
+
+    # -- friends -----------------------------------------------------------
+
+    def cmd_add_friend(self, args):
+        if not self.session:
+            return "FAIL 401 NOT_AUTHENTICATED"
+        target = args.strip().split(' ')[0] if args.strip() else ""
+        if not target:
+            return "FAIL 400 INVALID_FORMAT"
+        s = self.server
+        if target not in s.users:
+            return f"FAIL 404 USER_NOT_FOUND {target}"
+        senders = s.pending_requests.setdefault(target, [])
+        if self.user not in senders:
+            senders.append(self.user)
+        s.mark_dirty("pending")
+        s.notify_user(target, f"NOTIFY_FRIEND_REQUEST {self.user}")
+        return f"SUCCESS 200 REQUEST_SENT {target}"
+
+    def _take_request(self, sender):
+        s = self.server
+        senders = s.pending_requests.get(self.user)
+        if not senders or sender not in senders:
+            return False
+        senders.remove(sender)
+        if not senders:
+            del s.pending_requests[self.user]
+        s.mark_dirty("pending")
+        return True
+
+    def cmd_confirm_friend(self, args):
+        if not self.session:
+            return "FAIL 401 NOT_AUTHENTICATED"
+        sender = args.strip().split(' ')[0] if args.strip() else ""
+        if not sender:
+            return "FAIL 400 INVALID_FORMAT"
+        if not self._take_request(sender):
+            return "FAIL 404 REQUEST_NOT_FOUND"
+        s = self.server
+        conv = s.conversation_id(self.user, sender) or s.conversation_id(sender, self.user)
+        if not conv:
+            conv = f"U{int(time.time())}-{random.randrange(100000)}"
+
+        def add_entry(owner, name, status):
+            entries = s.friends.setdefault(owner, [])
+            for e in entries:
+                if e[0] == name:
+                    e[1], e[2] = status, conv
+                    return
+            entries.append([name, status, conv])
+        add_entry(self.user, sender, "online" if s.is_online(sender) else "offline")
+        add_entry(sender, self.user, "online" if s.is_online(self.user) else "offline")
+        s.mark_dirty("friends")
+        s.notify_user(sender, f"NOTIFY_FRIEND_ACCEPTED {self.user}")
+        return f"SUCCESS 201 FRIEND_ADDED {sender}"
+
+    def cmd_reject_friend(self, args):
+        if not self.session:
+            return "FAIL 401 NOT_AUTHENTICATED"
+        sender = args.strip().split(' ')[0] if args.strip() else ""
+        if not sender:
+            return "FAIL 400 INVALID_FORMAT"
+        if not self._take_request(sender):
+            return "FAIL 404 REQUEST_NOT_FOUND"
+        self.server.notify_user(sender, f"NOTIFY_FRIEND_REJECTED {self.user}")
+        return f"SUCCESS 200 REJECTED_FRIEND {sender}"
+
+    def cmd_get_friends(self, args):
+        if not self.session:
+            return "FAIL 401 UNAUTHORIZED"
+        s = self.server
+        if self.session not in s.sessions:
+            self.session = ""
+            self.user = ""
+            return "FAIL 401 SESSION_EXPIRED"
+        out = ' '.join(f"{e[0]}:{'online' if s.is_online(e[0]) else 'offline'}"
+                       for e in s.friends.get(self.user, ()))
+        return f"SUCCESS 200 FRIENDS {out}"
+
+    def cmd_get_pending_requests(self, args):
+        if not self.session:
+            return "FAIL 401 UNAUTHORIZED"
+        senders = self.server.pending_requests.get(self.user, [])
+        self.log(f"Sent {len(senders)} pending requests to {self.user}")
+        return f"SUCCESS 200 PENDING_REQUESTS {' '.join(senders)}"
+
+    # -- groups ------------------------------------------------------------
+
+    def cmd_init_group(self, args):
+        if not self.session:
+            return "FAIL 401 UNAUTHORIZED"
+        parts = args.split()
+        if not parts:
+            return "FAIL 400 INVALID_LIMIT"
+        name = parts[0]
+        try:
+            max_members = int(parts[1]) if len(parts) > 1 else 20
+        except ValueError:
+            max_members = 20
+        s = self.server
+        if name in s.groups:
+            return "FAIL 409 GROUP_EXISTS"
+        s.groups[name] = Group(name, self.user, max_members, [self.user])
+        s.user_groups.setdefault(self.user, []).append(name)
+        s.mark_dirty("groups")
+        self.log(f"Created group: {name} (max: {max_members})")
+        return f"SUCCESS 201 GROUP_CREATED {name}"
+
+    def cmd_send_invite(self, args):
+        if not self.session:
+            return "FAIL 401 UNAUTHORIZED"
+        parts = args.split()
+        if len(parts) < 2:
+            return "FAIL 400 INVALID_FORMAT"
+        name, target = parts[0], parts[1]
+        s = self.server
+        group = s.groups.get(name)
+        if group is None:
+            return "FAIL 404 GROUP_NOT_FOUND"
+        if group.creator != self.user:
+            return "FAIL 403 NO_PERMISSION"
+        if target in group.members:
+            return "FAIL 409 ALREADY_MEMBER"
+        s.group_invites.setdefault(name, []).append(target)
+        s.mark_dirty("invites")
+        s.notify_user(target, f"NOTIFY_GROUP_INVITE {name} {self.user}")
+        self.log(f"Invited {target} to group {name}")
+        return f"SUCCESS 200 INVITE_SENT {target}"
+
+    def _take_invite(self, name):
+        s = self.server
+        if name not in s.groups:
+            return "FAIL 404 GROUP_NOT_FOUND"
+        invites = s.group_invites.get(name)
+        if not invites or self.user not in invites:
+            return "FAIL 404 INVITE_NOT_FOUND"
+        invites.remove(self.user)
+        s.mark_dirty("invites")
+        return None
+
+    def cmd_confirm_join(self, args):
+        if not self.session:
+            return "FAIL 401 UNAUTHORIZED"
+        name = args.strip().split(' ')[0] if args.strip() else ""
+        if not name:
+            return "FAIL 400 INVALID_FORMAT"
+        error = self._take_invite(name)
+        if error:
+            return error
+        s = self.server
+        group = s.groups[name]
+        group.members.append(self.user)
+        s.user_groups.setdefault(self.user, []).append(name)
+        s.mark_dirty("groups")
+        self.log(f"{self.user} joined group {name}")
+        for m in group.members:
+            if m != self.user:
+                s.notify_user(m, f"NOTIFY_MEMBER_JOIN {name} {self.user}")
+        return f"SUCCESS 201 JOINED {name}"
+
+    def cmd_reject_join(self, args):
+        if not self.session:
+            return "FAIL 401 UNAUTHORIZED"
+        name = args.strip().split(' ')[0] if args.strip() else ""
+        if not name:
+            return "FAIL 400 INVALID_FORMAT"
+        error = self._take_invite(name)
+        if error:
+            return error
+        s = self.server
+        self.log(f"{self.user} rejected invite to group {name}")
+        s.notify_user(s.groups[name].creator, f"NOTIFY_INVITE_REJECTED {name} {self.user}")
+        return "SUCCESS 200 REJECTED_JOIN"
+
+    def _drop_membership(self, group, username):
+        group.members.remove(username)
+        ugroups = self.server.user_groups.get(username, [])
+        if group.name in ugroups:
+            ugroups.remove(group.name)
+
+    def cmd_eject_user(self, args):
+        if not self.session:
+            return "FAIL 401 UNAUTHORIZED"
+        parts = args.split()
+        if len(parts) < 2:
+            return "FAIL 400 INVALID_FORMAT"
+        name, target = parts[0], parts[1]
+        s = self.server
+        group = s.groups.get(name)
+        if group is None:
+            return "FAIL 404 GROUP_NOT_FOUND"
+        if group.creator != self.user:
+            return "FAIL 403 NO_PERMISSION"
+        if target == self.user:
+            return "FAIL 400 CANNOT_EJECT_SELF"
+        if target not in group.members:
+            return "FAIL 404 USER_NOT_FOUND"
+        self._drop_membership(group, target)
+        s.mark_dirty("groups")
+        self.log(f"{self.user} ejected {target} from group {name}")
+        s.notify_user(target, f"NOTIFY_EJECTED {name} {self.user}")
+        for m in group.members:
+            s.notify_user(m, f"NOTIFY_MEMBER_LEFT {name} {target}")
+        return f"SUCCESS 200 EJECTED {target}"
+
+    def cmd_leave_group(self, args):
+        if not self.session:
+            return "FAIL 401 UNAUTHORIZED"
+        name = args.strip().split(' ')[0] if args.strip() else ""
+        if not name:
+            return "FAIL 400 INVALID_FORMAT"
+        s = self.server
+        group = s.groups.get(name)
+        if group is None:
+            return "FAIL 404 GROUP_NOT_FOUND"
+        if self.user not in group.members:
+            return "FAIL 404 NOT_A_MEMBER"
+        self._drop_membership(group, self.user)
+        response = f"SUCCESS 200 LEFT {name}"
+        if group.creator == self.user:
+            if not group.members:
+                del s.groups[name]
+                self.log(f"{self.user} left and deleted group {name}")
+                response = f"SUCCESS 200 LEFT_AND_DELETED {name}"
+            else:
+                group.creator = group.members[0]
+                self.log(f"{self.user} left group {name}, ownership transferred to {group.creator}")
+                s.notify_user(group.creator, f"NOTIFY_NEW_ADMIN {name}")
+        else:
+            self.log(f"{self.user} left group {name}")
+        s.mark_dirty("groups")
+        for m in group.members:
+            s.notify_user(m, f"NOTIFY_MEMBER_LEFT {name} {self.user}")
+        return response
+
+    def cmd_get_members(self, args):
+        if not self.session:
+            return "FAIL 401 UNAUTHORIZED"
+        name = args.strip().split(' ')[0] if args.strip() else ""
+        if not name:
+            return "FAIL 400 INVALID_FORMAT"
+        s = self.server
+        group = s.groups.get(name)
+        if group is None:
+            return "FAIL 404 GROUP_NOT_FOUND"
+        if self.user not in group.members:
+            return "FAIL 403 NOT_A_MEMBER"
+        out = ' '.join(f"{m}:{'admin' if m == group.creator else 'member'}:"
+                       f"{'online' if s.is_online(m) else 'offline'}" for m in group.members)
+        return f"SUCCESS 200 MEMBERS {out}"
+
+    def cmd_get_groups(self, args):
+        if not self.session:
+            return "FAIL 401 UNAUTHORIZED"
+        s = self.server
+        out = ' '.join(f"{g}:{len(s.groups[g].members)}"
+                       for g in s.user_groups.get(self.user, ()) if g in s.groups)
+        return f"SUCCESS 200 GROUPS {out}"
+
+    def cmd_get_group_invites(self, args):
+        if not self.session:
+            return "FAIL 401 UNAUTHORIZED"
+        s = self.server
+        out = []
+        for gname, invitees in s.group_invites.items():
+            if self.user in invitees:
+                group = s.groups.get(gname)
+                out.append(f"{gname}:{group.creator if group else 'unknown'}")
+        self.log(f"Sent {len(out)} group invites to {self.user}")
+        return f"SUCCESS 200 GROUP_INVITES {' '.join(out)}"
+
+    # -- messages ----------------------------------------------------------
+
+    def cmd_text(self, args):
+        if not self.session:
+            return "FAIL 401 UNAUTHORIZED"
+        parts = args.split(None, 2)
+        if len(parts) < 3 or not parts[2].strip():
+            return "FAIL 400 INVALID_FORMAT"
+        result = self._send_text(parts[0], parts[1], parts[2].strip())
+        return result if result.startswith("FAIL ") else "SUCCESS 201 SENT"
+
+    def cmd_text_id(self, args):
+        if not self.session:
+            return "FAIL 401 UNAUTHORIZED"
+        parts = args.split(None, 3)
+        if len(parts) < 4 or not parts[3].strip():
+            return "FAIL 400 INVALID_FORMAT"
+        message_id = parts[0]
+        recent = self.server.text_ids.setdefault(self.user, OrderedDict())
+        if message_id in recent:
+            self.log(f"Duplicate TEXT_ID {message_id} ignored")
+            return recent[message_id]
+        ts = self._send_text(parts[1], parts[2], parts[3].strip(), message_id)
+        if ts.startswith("FAIL "):
+            return ts
+        reply = recent[message_id] = f"SUCCESS 201 SENT {message_id} {ts}"
+        if len(recent) > RECENT_TEXT_IDS:
+            recent.popitem(last=False)
+        return reply
+
+    def _send_text(self, mtype, name, content, message_id=None):
+        """Store and deliver a text message; its timestamp, or a FAIL reply"""
+        s = self.server
+        if mtype == "U":
+            conv = s.conversation_id(self.user, name)
+            if not conv:
+                return "FAIL 404 USER_NOT_FOUND"
+            ts = s.save_message(f"messages/U_{conv}.txt", self.user, "TEXT", content)
+            s.notify_text(name, f"NOTIFY_TEXT U {self.user} {ts} {content}", message_id)
+            self.log(f"Sent TEXT to {name}: {content}")
+            return str(ts)
+        if mtype == "G":
+            group = s.groups.get(name)
+            if group is None:
+                return "FAIL 404 GROUP_NOT_FOUND"
+            if self.user not in group.members:
+                return "FAIL 403 NOT_A_MEMBER"
+            ts = s.save_message(f"messages/G_{name}.txt", self.user, "TEXT", content)
+            line = f"NOTIFY_TEXT G {name} {self.user} {ts} {content}"
+            for m in group.members:
+                if m != self.user:
+                    s.notify_text(m, line, message_id)
+            self.log(f"Sent TEXT to group {name}: {content}")
+            return str(ts)
+        return "FAIL 400 INVALID_TYPE"
+
+    def cmd_history(self, args):
+        if not self.session:
+            return "FAIL 401 UNAUTHORIZED"
+        parts = args.split()
+        if len(parts) < 2:
+            return "FAIL 400 INVALID_FORMAT"
+        mtype, name = parts[0], parts[1]
+        if mtype not in ("U", "G"):
+            return "FAIL 400 INVALID_TYPE"
+        # The GUI also sends 'HISTORY t name <limit> <begin> <end>'
+        limit = 0
+        if len(parts) > 4 and parts[2].isdigit():
+            limit = int(parts.pop(2))
+        tbegin = parse_time_to_unix(parts[2]) if len(parts) > 2 else 0
+        tend = parse_time_to_unix(parts[3]) if len(parts) > 3 else 0
+        s = self.server
+        if mtype == "U":
+            conv = s.conversation_id(self.user, name) or s.conversation_id(name, self.user)
+            if not conv:
+                return "FAIL 404 CONVERSATION_NOT_FOUND"
+            relpath = f"messages/U_{conv}.txt"
+        else:
+            group = s.groups.get(name)
+            if group is None:
+                return "FAIL 404 GROUP_NOT_FOUND"
+            if self.user not in group.members:
+                return "FAIL 403 ACCESS_DENIED"
+            relpath = f"messages/G_{name}.txt"
+        lines = s.read_history(relpath, tbegin, tend, limit)
+        if not lines:
+            return "FAIL 404 NO_MESSAGES"
+        header = f"SUCCESS 200 {len(lines)}"
+        self._write((header + "\n" + "\n".join(lines) + "\n").encode('utf-8'))
+        self.log("Sent: " + header)
+        return None
+
+    def cmd_list_files(self, args):
+        if not self.session:
+            return "FAIL 401 UNAUTHORIZED"
+        parts = args.split()
+        if len(parts) < 2:
+            return "FAIL 400 INVALID_FORMAT"
+        mtype, name = parts[0], parts[1]
+        opts = dict(p.split('=', 1) for p in parts[2:] if '=' in p)
+        s = self.server
+        if mtype == "U":
+            conv = s.conversation_id(self.user, name) or s.conversation_id(name, self.user)
+            if not conv:
+                return "FAIL 404 CONVERSATION_NOT_FOUND"
+            key = f"files/U_{conv}.txt"
+        elif mtype == "G":
+            group = s.groups.get(name)
+            if group is None:
+                return "FAIL 404 GROUP_NOT_FOUND"
+            if self.user not in group.members:
+                return "FAIL 403 ACCESS_DENIED"
+            key = f"files/G_{name}.txt"
+        else:
+            return "FAIL 400 INVALID_TYPE"
+        try:
+            offset = max(0, int(opts.get("offset", 0)))
+            limit = min(LIST_FILES_MAX, max(1, int(opts.get("limit", LIST_FILES_LIMIT))))
+            min_size = int(opts.get("min_size", 0))
+            max_size = int(opts.get("max_size", 0))
+        except ValueError:
+            return "FAIL 400 INVALID_FORMAT"
+        sort = opts.get("sort", "-time")
+        sort_key = LIST_FILES_SORTS.get(sort.lstrip('-'))
+        if sort_key is None:
+            return "FAIL 400 INVALID_SORT"
+        sender = opts.get("sender", "")
+        exts = {"." + e.lower().lstrip('.') for e in opts.get("ext", "").split(',') if e}
+
+        files = [m for m in s.catalog.get(key, ())
+                 if (not sender or m.sender == sender)
+                 and (not exts or os.path.splitext(m.filename)[1].lower() in exts)
+                 and m.filesize >= min_size and (not max_size or m.filesize <= max_size)]
+        if sort == "-time":
+            files.reverse()  # catalog is already in upload order
+        elif sort != "time":
+            files.sort(key=sort_key, reverse=sort.startswith('-'))
+        page = files[offset:offset + limit]
+        entries = " ".join(f"{m.file_id}|{m.sender}|{m.upload_time}|{m.filesize}|{quote(m.filename)}"
+                           for m in page)
+        return f"SUCCESS 200 FILES {len(files)} {offset} {entries}".rstrip()
+
+    # -- file transfer -----------------------------------------------------
+
+    def _upload_target_ok(self, ttype, target):
+        s = self.server
+        if ttype == "U":
+            return target in s.users
+        if ttype == "G":
+            group = s.groups.get(target)
+            return group is not None and self.user in group.members
+        return False
+
+    def cmd_req_upload(self, args):
+        if not self.session:
+            return "FAIL 401 NOT_AUTHENTICATED"
+        parts = args.split(None, 2)
+        filename, filesize = "", 0
+        if len(parts) == 3 and ' ' in parts[2].strip():
+            filename, size_s = parts[2].strip().rsplit(' ', 1)
+            filename = filename.strip()
+            filesize = int(size_s) if size_s.strip().isdigit() else 0
+        if len(parts) < 3 or not filename or filesize == 0:
+            self.log(f"Invalid upload format - {args}")
+            return "FAIL 400 INVALID_FORMAT"
+        ttype, target = parts[0], parts[1]
+        if not self._upload_target_ok(ttype, target):
+            return "FAIL 404 TARGET_NOT_FOUND"
+        return self._start_upload(ttype, target, filename, filesize)
+
+    def cmd_req_upload_hash(self, args):
+        if not self.session:
+            return "FAIL 401 NOT_AUTHENTICATED"
+        parts = args.split(None, 4)
+        if (len(parts) < 5 or not _is_sha256(parts[2]) or not parts[3].isdigit()
+                or int(parts[3]) == 0 or not parts[4].strip()):
+            self.log(f"Invalid upload format - {args}")
+            return "FAIL 400 INVALID_FORMAT"
+        ttype, target, digest = parts[0], parts[1], parts[2]
+        filesize, filename = int(parts[3]), parts[4].strip()
+        if not self._upload_target_ok(ttype, target):
+            return "FAIL 404 TARGET_NOT_FOUND"
+        s = self.server
+        relpath = s.find_blob(digest, filesize)
+        if relpath is None:
+            return self._start_upload(ttype, target, filename, filesize)
+        file_id = s.generate_file_id()
+        meta = FileMeta(file_id, filename, self.user, ttype, target, filesize,
+                        relpath, int(time.time()), bytes_received=filesize)
+        self.log(f"Upload deduplicated: {filename} -> {file_id} ({digest})")
+        self._complete_upload(meta)
+        return f"SUCCESS 201 UPLOAD_DEDUP {file_id}"
+
+    def cmd_forward_file(self, args):
+        if not self.session:
+            return "FAIL 401 NOT_AUTHENTICATED"
+        parts = args.split()
+        if len(parts) != 3:
+            return "FAIL 400 INVALID_FORMAT"
+        s = self.server
+        source = s.completed_files.get(parts[0])
+        if source is None:
+            return "FAIL 404 FILE_NOT_FOUND"
+        if not os.path.exists(s.path(source.filepath)):
+            return "FAIL 500 FILE_OPEN_ERROR"
+        ttype, target = parts[1], parts[2]
+        if not self._upload_target_ok(ttype, target):
+            return "FAIL 404 TARGET_NOT_FOUND"
+        file_id = s.generate_file_id()
+        meta = FileMeta(file_id, source.filename, self.user, ttype, target, source.filesize,
+                        source.filepath, int(time.time()), bytes_received=source.filesize)
+        self.log(f"File forwarded: {source.file_id} -> {file_id} ({ttype} {target})")
+        self._complete_upload(meta)
+        return f"SUCCESS 201 FORWARDED {file_id}"
+
+    def _start_upload(self, ttype, target, filename, filesize):
+        s = self.server
+        file_id = s.generate_file_id()
+        s.active_uploads[file_id] = FileMeta(file_id, filename, self.user, ttype, target, filesize,
+                                             f"uploads/{file_id}", int(time.time()))
+        self.log(f"Upload request: {filename} -> {file_id}")
+        return f"SUCCESS 200 READY_UPLOAD {file_id}"
+
+    async def cmd_upload_data(self, args):
+        if not self.session:
+            return "FAIL 401 NOT_AUTHENTICATED"
+        file_id = args.strip()
+        s = self.server
+        meta = s.active_uploads.get(file_id)
+        if meta is None:
+            return "FAIL 404 FILE_ID_NOT_FOUND"
+        self.write_line(f"SUCCESS 200 START_UPLOAD {meta.bytes_received}")
+        await self.writer.drain()
+        self.log(f"Start receiving binary chunks for {file_id}")
+        # Hash while receiving; a resumed or out-of-order upload is hashed afterwards
+        hasher = hashlib.sha256() if meta.bytes_received == 0 else None
+        hashed = 0
+        # Not 'ab': append mode ignores seek(), so a chunk resent below the
+        # current size would be appended again
+        path = s.path(meta.filepath)
+        with open(path, 'r+b' if os.path.exists(path) else 'wb') as out:
+            while True:
+                header = await self.reader.readexactly(CHUNK_HEADER_SIZE)
+                offset, length = struct.unpack('!II', header)
+                if length == 0:
+                    self.log(f"Received EOF marker for {file_id}")
+                    break
+                length, compressed = split_chunk_length(length)
+                data = unpack_chunk_data(await self.reader.readexactly(length), compressed)
+                out.seek(offset)
+                out.write(data)
+                meta.bytes_received += len(data)
+                if hasher is not None:
+                    if offset == hashed:
+                        hasher.update(data)
+                        hashed += len(data)
+                    else:
+                        hasher = None
+        if meta.bytes_received < meta.filesize:
+            self.log(f"Upload interrupted: {file_id}")
+            return "FAIL 500 UPLOAD_INTERRUPTED"
+        if hasher is not None and hashed == meta.filesize:
+            digest = hasher.hexdigest()
+        else:
+            digest = await asyncio.get_running_loop().run_in_executor(
+                None, _hash_file, s.path(meta.filepath))
+        del s.active_uploads[file_id]
+        s.store_blob(meta, digest)
+        self.log(f"Upload complete: {file_id}")
+        self._complete_upload(meta)
+        return "SUCCESS 200 UPLOAD_COMPLETE"
+
+    def _complete_upload(self, meta):
+        """Register a stored file, log it to the conversation and notify the target"""
+        s = self.server
+        file_id = meta.file_id
+        s.completed_files[file_id] = meta
+        s.save_file_metadata(meta)
+        s.add_to_catalog(meta)
+        paths = s.conversation_paths(meta)
+        if meta.target_type == "G":
+            group = s.groups.get(meta.target_name)
+            if group is not None and paths:
+                s.save_message(paths[0], self.user, "FILE", f"{file_id}:{meta.filename}")
+                s.save_message(paths[1], self.user, "FILEMETA",
+                               f"{file_id}:{meta.filename}:{meta.filesize}")
+                for m in group.members:
+                    if m != self.user:
+                        s.notify_user(m, f"NOTIFY_FILE G {meta.target_name} {self.user} {file_id} {meta.filename}")
+        else:
+            if paths:
+                s.save_message(paths[0], self.user, "FILE", f"{file_id}:{meta.filename}")
+                s.save_message(paths[1], self.user, "FILEMETA",
+                               f"{file_id}:{meta.filename}:{meta.filesize}")
+            # server.cpp leaves the target field empty for U (double space)
+            s.notify_user(meta.target_name, f"NOTIFY_FILE U  {self.user} {file_id} {meta.filename}")
+
+    def cmd_req_resume_upload(self, args):
+        if not self.session:
+            return "FAIL 401 NOT_AUTHENTICATED"
+        file_id = args.strip()
+        meta = self.server.active_uploads.get(file_id)
+        if meta is None:
+            return "FAIL 404 FILE_ID_NOT_FOUND"
+        path = self.server.path(meta.filepath)
+        meta.bytes_received = os.path.getsize(path) if os.path.exists(path) else 0
+        self.log(f"Resume upload: {file_id} from byte {meta.bytes_received}")
+        return f"SUCCESS 200 READY_UPLOAD {meta.bytes_received}"
+
+    def cmd_req_cancel_upload(self, args):
+        if not self.session:
+            return "FAIL 401 NOT_AUTHENTICATED"
+        file_id = args.strip()
+        meta = self.server.active_uploads.pop(file_id, None)
+        if meta is None:
+            return "FAIL 404 FILE_ID_NOT_FOUND"
+        try:
+            os.remove(self.server.path(meta.filepath))
+        except OSError:
+            pass
+        self.log(f"Upload cancelled: {file_id}")
+        return "SUCCESS 200 UPLOAD_CANCELLED"
+
+    async def _send_file(self, meta, offset):
+        """Stream chunks from offset, the EOF marker and DOWNLOAD_COMPLETE"""
+        s = self.server
+        self.in_download = True
+        try:
+            with open(s.path(meta.filepath), 'rb') as f:
+                f.seek(offset)
+                compress = self.zchunk and is_compressible(meta.filename, f.read(COMPRESS_PROBE_SIZE))
+                f.seek(offset)
+                async for frame, length in chunk_frames(f, offset, meta.filesize, compress):
+                    self._write(frame, compress=False)
+                    offset += length
+                    await self.writer.drain()
+            self._write(struct.pack('!II', offset, 0), compress=False)
+            self.write_line("SUCCESS 200 DOWNLOAD_COMPLETE")
+            self.log(f"Download complete: {meta.file_id}")
+            self.log("Sent: SUCCESS 200 DOWNLOAD_COMPLETE")
+        finally:
+            self.in_download = False
+            held, self._held = self._held, []
+            for message in held:
+                self.write_line(message)
+        paths = s.conversation_paths(meta)
+        if paths:
+            content = f"{meta.file_id}:{meta.filename}"
+            s.save_message(paths[0], self.user, "DOWNLOAD", content)
+            s.save_message(paths[1], self.user, "DOWNLOAD", content)
+
+    async def cmd_req_download(self, args):
+        if not self.session:
+            return "FAIL 401 NOT_AUTHENTICATED"
+        file_id = args.strip()
+        meta = self.server.completed_files.get(file_id)
+        if meta is None:
+            return "FAIL 404 FILE_NOT_FOUND"
+        if not os.path.exists(self.server.path(meta.filepath)):
+            return "FAIL 500 FILE_OPEN_ERROR"
+        self.write_line(f"SUCCESS 200 READY_DOWNLOAD {file_id} {meta.filename} {meta.filesize}")
+        self.log(f"Start sending file: {file_id}")
+        await self._send_file(meta, 0)
+        return None
+
+    async def cmd_req_preview(self, args):
+        if not self.session:
+            return "FAIL 401 NOT_AUTHENTICATED"
+        parts = args.split()
+        if len(parts) != 2 or not parts[1].isdigit():
+            return "FAIL 400 INVALID_FORMAT"
+        meta = self.server.completed_files.get(parts[0])
+        if meta is None:
+            return "FAIL 404 FILE_NOT_FOUND"
+        if meta.filesize > int(parts[1]):
+            return "FAIL 413 FILE_TOO_LARGE"
+        return await self.cmd_req_download(parts[0])
+
+    async def cmd_req_resume_download(self, args):
+        if not self.session:
+            return "FAIL 401 NOT_AUTHENTICATED"
+        parts = args.split()
+        file_id = parts[0] if parts else ""
+        offset = int(parts[1]) if len(parts) > 1 and parts[1].isdigit() else 0
+        meta = self.server.completed_files.get(file_id)
+        if meta is None:
+            return "FAIL 404 FILE_NOT_FOUND"
+        if offset >= meta.filesize:
+            return "FAIL 400 INVALID_OFFSET"
+        if not os.path.exists(self.server.path(meta.filepath)):
+            return "FAIL 500 FILE_OPEN_ERROR"
+        self.write_line(f"SUCCESS 200 RESUME_DOWNLOAD {offset}")
+        self.log(f"Resume download: {file_id} from byte {offset}")
+        await self._send_file(meta, offset)
+        return None
+
+    def cmd_req_cancel_download(self, args):
+        if not self.session:
+            return "FAIL 401 NOT_AUTHENTICATED"
+        self.log(f"Download cancelled by client: {args.strip()}")
+        return "SUCCESS 200 DOWNLOAD_CANCELLED"
+
+
+async def serve(host, port, data_dir, segmented=False):
+    server = ChatServer(data_dir, segmented)
+    listener = await server.start(host, port)
+    print(f"Reference server listening on {host}:{port} (data: {server.data_dir})")
+    try:
+        async with listener:
+            await listener.serve_forever()
+    finally:
+        server.close()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="asyncio stand-in for server.cpp")
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=8888)
+    parser.add_argument("--data-dir", default=".", help="directory holding users.txt, messages/, ...")
+    parser.add_argument("--segmented", action="store_true",
+                        help="store new conversations as segmented logs (see segment_log.py)")
+    args = parser.parse_args(argv)
+    try:
+        asyncio.run(serve(args.host, args.port, args.data_dir, args.segmented))
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,558 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Replay benchmark: turns real traffic into repeatable runs.
+
+A replay script is a JSON-lines file (chat_core.TrafficRecorder format):
+a header line, then one event per line,
+
+    {"t": 12.5, "c": 3, "op": "send", "line": "TEXT G hust hello"}
+    {"t": 12.51, "c": 3, "op": "recv", "line": "SUCCESS 201 SENT"}
+    {"t": 13.0, "c": 3, "op": "upload", "bytes": 46231}
+    {"t": 20.0, "c": 3, "op": "close"}
+
+where t is seconds from the start and c the connection. Scripts come from
+    - a client session recorded with LTM_RECORD=<file> (gui_client.py or
+      chat_core.py), which has exact timing and HISTORY bodies;
+    - server.log via `convert`: every Client[N] session becomes one
+      connection (numbers are reused after "Server started" or a new
+      "connected" line), NOTIFY lines go to the client logged in as the
+      recipient, events in
+      the same second are spread evenly, and HISTORY bodies (not logged)
+      are filled with placeholder lines.
+
+Modes:
+    offline  feed the recorded server lines through chat_core's parser
+             (ProtocolHandler.handle_line) and time every line
+    live     re-send the commands to a running server, one connection per
+             recorded client; session ids and upload file ids are mapped
+             to the ones the server hands out, upload payloads are random
+             bytes of the recorded size; a command waits for every command
+             (on any connection) whose reply was recorded before it was
+             sent, so causality survives any speed
+
+--speed 1 keeps the recorded pacing, 10 plays ten times faster and 0 as
+fast as possible.
+
+Usage:
+    python replay_bench.py convert server.log -o traffic.replay
+    python replay_bench.py offline traffic.replay --repeat 5
+    python replay_bench.py live traffic.replay --port 8888 --speed 10 --register
+"""
+
+import argparse
+import asyncio
+import bisect
+import heapq
+import json
+import os
+import sys
+import tempfile
+import time
+from collections import Counter, namedtuple
+
+from async_core import AsyncChatClient
+from chat_core import (ProtocolHandler, REPLAY_FORMAT, decode_reply, encode_register,
+                       is_history_line)
+from log_analyzer import reply_key
+from telemetry import INTERIM_REPLIES, LatencyHistogram, command_name
+
+Event = namedtuple("Event", "t client op line nbytes")
+
+
+# ============================================================================
+# Scripts
+# ============================================================================
+
+def read_script(path):
+    """(header, [Event]) from a replay script"""
+    events = []
+    with open(path, 'r', encoding='utf-8') as f:
+        header = json.loads(f.readline() or "{}")
+        if header.get("format") != REPLAY_FORMAT:
+            raise ValueError(f"{path}: not a replay script")
+        for line in f:
+            if not line.strip():
+                continue
+            e = json.loads(line)
+            events.append(Event(float(e["t"]), int(e.get("c", 0)), e["op"],
+                                e.get("line", ""), int(e.get("bytes", 0))))
+    events.sort(key=lambda e: e.t)
+    return header, events
+
+
+def write_script(path, header, events):
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write(json.dumps(dict(header, format=REPLAY_FORMAT, version=1)) + "\n")
+        for e in events:
+            record = {"t": round(e.t, 6), "c": e.client, "op": e.op}
+            if e.op in ("send", "recv"):
+                record["line"] = e.line
+            elif e.op != "close":
+                record["bytes"] = e.nbytes
+            f.write(json.dumps(record, ensure_ascii=False) + "\n")
+
+
+def _log_entries(path):
+    """(unix second, client or None, kind, text) for each server.log line;
+    kind is the recipient for NOTIFY lines (client None), and both are None
+    when the server restarted"""
+    stamp_cache = (None, 0)
+    with open(path, 'r', encoding='utf-8', errors='replace') as f:
+        for line in f:
+            line = line.rstrip('\r\n')
+            close = line.find('] ', 1)
+            if not line.startswith('[') or close < 0:
+                if line.startswith('Server started') and stamp_cache[0] is not None:
+                    yield stamp_cache[1], None, None, ""  # logged without a timestamp
+                continue
+            stamp = line[1:close]
+            if stamp != stamp_cache[0]:
+                try:
+                    stamp_cache = (stamp, int(time.mktime(time.strptime(stamp, "%Y-%m-%d %H:%M:%S"))))
+                except ValueError:
+                    continue
+            sec = stamp_cache[1]
+            rest = line[close + 2:]
+            if rest.startswith('Client['):
+                end = rest.find('] ', 7)
+                if end < 0 or not rest[7:end].isdigit():
+                    continue
+                client, body = int(rest[7:end]), rest[end + 2:]
+                if body.startswith('Received: '):
+                    yield sec, client, "send", body[10:]
+                elif body.startswith('Sent: '):
+                    yield sec, client, "recv", body[6:]
+                elif body.startswith('disconnected'):
+                    yield sec, client, "close", ""
+                elif body.startswith('connected'):
+                    yield sec, client, "connect", ""
+            elif rest.startswith('Server started'):
+                yield sec, None, None, ""
+            elif rest.startswith('NOTIFY to '):
+                who, sep, payload = rest[10:].partition(': ')
+                if sep and not who.endswith(' (offline)'):
+                    yield sec, None, who, payload
+
+
+def convert_server_log(log_path, out_path):
+    """Write a replay script from server.log; returns the number of events"""
+    events = []
+    connection = {}  # Client[N] -> connection in the script, while connected
+    next_connection = 1
+    last_cmd = {}  # client -> last command line
+    login_user = {}  # client -> user name in a pending LOGIN
+    sessions = {}  # session id -> user
+    client_of = {}  # user -> client currently logged in
+    req_size = {}  # client -> size in a pending REQ_UPLOAD
+    upload_size = {}  # file id -> size
+    batch = []
+    t0 = None
+
+    def flush():
+        for i, (sec, client, op, line, nbytes) in enumerate(batch):
+            events.append(Event(sec - t0 + i / len(batch), client, op, line, nbytes))
+        batch.clear()
+
+    for sec, client, kind, text in _log_entries(log_path):
+        if t0 is None:
+            t0 = sec
+        if batch and sec != batch[0][0]:
+            flush()
+        if client is None and kind is None:  # server restart: every connection is gone
+            for c in connection.values():
+                batch.append((sec, c, "close", "", 0))
+            connection.clear()
+            client_of.clear()
+            continue
+        if client is None:  # NOTIFY to <user>
+            target = client_of.get(kind)
+            if target is not None:
+                batch.append((sec, target, "recv", text, 0))
+            continue
+        if kind == "connect" or client not in connection:
+            old = connection.pop(client, None)
+            if old is not None:  # the number was reused without "disconnected"
+                batch.append((sec, old, "close", "", 0))
+            connection[client] = next_connection
+            next_connection += 1
+            if kind == "connect":
+                continue
+        client = connection[client] if kind != "close" else connection.pop(client)
+        if kind == "send":
+            cmd = command_name(text)
+            last_cmd[client] = text
+            parts = text.split()
+            if cmd == "LOGIN" and len(parts) >= 2:
+                login_user[client] = parts[1]
+            elif cmd == "AUTH" and len(parts) >= 2 and parts[1] in sessions:
+                client_of[sessions[parts[1]]] = client
+            elif cmd == "REQ_UPLOAD" and parts[-1].isdigit():
+                req_size[client] = int(parts[-1])
+            batch.append((sec, client, "send", text, 0))
+            if cmd == "UPLOAD_DATA" and len(parts) >= 2:
+                batch.append((sec, client, "upload", "", upload_size.get(parts[1], 0)))
+            continue
+        if kind == "close":
+            batch.append((sec, client, "close", "", 0))
+            continue
+        batch.append((sec, client, "recv", text, 0))
+        reply = decode_reply(text)
+        if reply[0] == "session" and client in login_user:
+            user = login_user.pop(client)
+            sessions[reply[1]] = user
+            client_of[user] = client
+        elif reply[0] == "ready_upload" and client in req_size:
+            upload_size[reply[1]] = req_size.pop(client)
+        elif reply[0] == "history_header" and command_name(last_cmd.get(client, "")) == "HISTORY":
+            # Bodies are not logged; keep the line count realistic
+            for i in range(1, reply[1] + 1):
+                body = f"placeholder history line {i}"
+                batch.append((sec, client, "recv", f"{i}|replay|{sec}|TEXT|{len(body)}|{body}", 0))
+    if batch:
+        flush()
+    write_script(out_path, {"source": os.path.basename(log_path), "created": time.time()}, events)
+    return len(events)
+
+
+# ============================================================================
+# Offline replay (parser)
+# ============================================================================
+
+class OfflineClient(ProtocolHandler):
+    """ProtocolHandler with no transport: sends and transfers are dropped"""
+
+    def __init__(self):
+        self.emitted = Counter()
+        super().__init__(on_event=self._count)
+
+    def _count(self, name, *args):
+        self.emitted[name] += 1
+
+    def send(self, cmd):
+        return True
+
+    def begin_upload(self, file_id, filepath, filesize, offset):
+        pass
+
+    def begin_download(self, file_id, save_path, filesize):
+        pass
+
+
+def _pace(started, t, speed):
+    """Seconds to wait before an event at script time t (0 when behind)"""
+    if speed <= 0:
+        return 0.0
+    return max(0.0, started + t / speed - time.perf_counter())
+
+
+def replay_offline(events, speed=0.0, repeat=1):
+    per_kind = {}
+    emitted = Counter()
+    lines = 0
+    busy = 0.0
+    started_all = time.perf_counter()
+    for _ in range(repeat):
+        clients = {}
+        started = time.perf_counter()
+        for e in events:
+            client = clients.get(e.client)
+            if client is None:
+                client = clients[e.client] = OfflineClient()
+            delay = _pace(started, e.t, speed)
+            if delay:
+                time.sleep(delay)
+            if e.op == "send":
+                cmd = command_name(e.line)
+                parts = e.line.split()
+                if cmd == "LOGIN" and len(parts) > 1:
+                    client.username = parts[1]
+                elif cmd == "UPLOAD_DATA" and len(parts) > 1:
+                    client.active_upload = (parts[1], None, 0)
+                elif cmd == "REQ_DOWNLOAD" and len(parts) > 1:
+                    client.pending_downloads[parts[1]] = ("", os.devnull, 0)
+                continue
+            if e.op != "recv":
+                continue
+            kind = "history line" if client._history_expected and is_history_line(e.line) \
+                else decode_reply(e.line)[0]
+            t = time.perf_counter()
+            client.handle_line(e.line)
+            elapsed = time.perf_counter() - t
+            busy += elapsed
+            lines += 1
+            hist = per_kind.get(kind)
+            if hist is None:
+                hist = per_kind[kind] = LatencyHistogram()
+            hist.record(elapsed)
+        for client in clients.values():
+            emitted.update(client.emitted)
+    wall = time.perf_counter() - started_all
+    return {
+        "lines": lines,
+        "wall_s": round(wall, 3),
+        "parse_s": round(busy, 3),
+        "lines_per_s": lines / busy if busy else 0.0,
+        "per_kind_us": {k: {"count": h.total, "p50": h.percentile(50), "p99": h.percentile(99),
+                            "max": h.max or 0}
+                        for k, h in sorted(per_kind.items(), key=lambda kv: -kv[1].total)},
+        "events": dict(emitted.most_common()),
+    }
+
+
+def print_offline(report):
+    print(f"Offline replay: {report['lines']:,} lines in {report['parse_s']:.3f} s of parsing "
+          f"({report['lines_per_s']:,.0f} lines/s, wall {report['wall_s']:.3f} s)")
+    print(f"  {'Reply kind':28} {'Count':>9} {'p50 us':>8} {'p99 us':>8} {'max us':>8}")
+    for kind, h in report["per_kind_us"].items():
+        print(f"  {kind:28} {h['count']:>9,} {h['p50']:>8} {h['p99']:>8} {h['max']:>8}")
+    print("  Events: " + ", ".join(f"{k} x{n}" for k, n in report["events"].items()))
+
+
+# ============================================================================
+# Live replay (server)
+# ============================================================================
+
+# line is None for a recorded disconnect; done is when the reply was recorded
+Step = namedtuple("Step", "seq t line expected nbytes done")
+
+
+def client_steps(events):
+    """client -> [Step]; each command carries the reply recorded for it"""
+    steps = {}
+    waiting = {}  # client -> [[step index, command, interim seen]]
+    seq = 0
+    for e in events:
+        mine = steps.setdefault(e.client, [])
+        if e.op in ("send", "close"):
+            mine.append(Step(seq, e.t, e.line if e.op == "send" else None, None, 0, e.t))
+            seq += 1
+            if e.op == "send":
+                waiting.setdefault(e.client, []).append([len(mine) - 1, command_name(e.line), False])
+        elif e.op == "upload" and mine:
+            mine[-1] = mine[-1]._replace(nbytes=e.nbytes)
+        elif e.op == "recv" and e.line.startswith(("SUCCESS ", "FAIL ")) and waiting.get(e.client):
+            entry = waiting[e.client][0]
+            parts = e.line.split(' ', 3)
+            if not entry[2] and len(parts) > 2 and INTERIM_REPLIES.get(entry[1]) == parts[2]:
+                entry[2] = True
+                continue
+            waiting[e.client].pop(0)
+            mine[entry[0]] = mine[entry[0]]._replace(expected=e.line, done=e.t)
+    return steps
+
+
+class Sequencer:
+    """Recorded happens-before: a step starts once every step whose reply was
+    recorded before the step was sent has completed in this replay"""
+
+    def __init__(self, steps):
+        by_done = sorted((s for client in steps.values() for s in client), key=lambda s: s.done)
+        self._done_ts = [s.done for s in by_done]
+        self._rank = {s.seq: i for i, s in enumerate(by_done)}
+        self._completed = bytearray(len(by_done))
+        self._frontier = 0  # every step below this rank has completed
+        self._waiters = []  # heap of (needed frontier, seq, future)
+
+    async def wait(self, step):
+        needed = bisect.bisect_left(self._done_ts, step.t)
+        if self._frontier >= needed:
+            return
+        fut = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._waiters, (needed, step.seq, fut))
+        await fut
+
+    def complete(self, step):
+        self._completed[self._rank[step.seq]] = 1
+        n = len(self._completed)
+        while self._frontier < n and self._completed[self._frontier]:
+            self._frontier += 1
+        while self._waiters and self._waiters[0][0] <= self._frontier:
+            _, _, fut = heapq.heappop(self._waiters)
+            if not fut.done():
+                fut.set_result(None)
+
+
+class LiveStats:
+    def __init__(self):
+        self.latency = {}  # command -> LatencyHistogram
+        self.lag = LatencyHistogram()
+        self.counts = Counter()
+        self.failures = Counter()
+        self.mismatches = Counter()
+
+    def record(self, cmd, seconds, reply, expected):
+        hist = self.latency.get(cmd)
+        if hist is None:
+            hist = self.latency[cmd] = LatencyHistogram()
+        hist.record(seconds)
+        self.counts[cmd] += 1
+        if reply.line.startswith("FAIL"):
+            self.failures[reply_key(reply.line)] += 1
+        if expected is not None and reply_key(expected) != reply_key(reply.line):
+            self.mismatches[f"{cmd}: {reply_key(expected)} -> {reply_key(reply.line)}"] += 1
+
+
+class Payloads:
+    """Random upload payload files, one per size"""
+
+    def __init__(self):
+        self.dir = tempfile.mkdtemp(prefix="replay_")
+        self._paths = {}
+
+    def path(self, size):
+        path = self._paths.get(size)
+        if path is None:
+            path = self._paths[size] = os.path.join(self.dir, f"{size}.bin")
+            with open(path, 'wb') as f:
+                remaining = size
+                while remaining:
+                    n = min(remaining, 1 << 20)
+                    f.write(os.urandom(n))
+                    remaining -= n
+        return path
+
+    def cleanup(self):
+        for name in os.listdir(self.dir):
+            os.remove(os.path.join(self.dir, name))
+        os.rmdir(self.dir)
+
+
+async def replay_client(cfg, steps, stats, payloads, started, sequencer):
+    client = AsyncChatClient(cfg.host, cfg.port)
+    task = asyncio.ensure_future(client.run())
+    ids = {}  # recorded token -> live token
+    pos = 0
+    try:
+        while not client.running:
+            if task.done():
+                stats.failures["connect failed"] += 1
+                return
+            await asyncio.sleep(0.01)
+        for pos, step in enumerate(steps):
+            await sequencer.wait(step)
+            delay = _pace(started, step.t, cfg.speed)
+            if delay:
+                await asyncio.sleep(delay)
+            elif cfg.speed > 0:
+                stats.lag.record(time.perf_counter() - (started + step.t / cfg.speed))
+            if step.line is None:
+                break  # recorded disconnect
+            cmd = command_name(step.line)
+            if cmd in ("AUTH", "CAPS"):
+                sequencer.complete(step)
+                continue  # the client authenticates (and negotiates) by itself after LOGIN
+            line = ' '.join(ids.get(tok, tok) for tok in step.line.split(' '))
+            parts = line.split()
+            if cmd == "LOGIN" and len(parts) > 1:
+                client.username = parts[1]
+            elif cmd == "UPLOAD_DATA" and len(parts) > 1:
+                client.active_upload = (parts[1], payloads.path(step.nbytes), step.nbytes)
+            elif cmd == "REQ_DOWNLOAD" and len(parts) > 1:
+                client.pending_downloads[parts[1]] = ("", os.path.join(payloads.dir, "download.tmp"), 0)
+            t = time.perf_counter()
+            reply = await client.request(line, cfg.timeout)
+            if cmd == "LOGIN" and not reply.ok and cfg.register and len(parts) > 2:
+                await client.request(encode_register(parts[1], parts[2]), cfg.timeout)
+                t = time.perf_counter()
+                reply = await client.request(line, cfg.timeout)
+            stats.record(cmd, time.perf_counter() - t, reply, step.expected)
+            if step.expected is not None and reply.kind in ("session", "ready_upload"):
+                # Later commands (UPLOAD_DATA, REQ_DOWNLOAD, ...) use the live ids
+                recorded = decode_reply(step.expected)
+                if recorded[0] == reply.kind and len(recorded) > 1 and reply.fields:
+                    ids[recorded[1]] = reply.fields[0]
+            sequencer.complete(step)
+        else:
+            pos = len(steps)
+    except (ConnectionError, asyncio.TimeoutError) as e:
+        stats.failures[type(e).__name__] += 1
+    finally:
+        # Unblock steps of other clients that were waiting on this one
+        for step in steps[pos:]:
+            sequencer.complete(step)
+        client.stop()
+        try:
+            await asyncio.wait_for(task, 5)
+        except asyncio.TimeoutError:
+            pass
+
+
+async def replay_live(cfg, events):
+    stats = LiveStats()
+    payloads = Payloads()
+    steps = client_steps(events)
+    sequencer = Sequencer(steps)
+    started = time.perf_counter()
+    try:
+        await asyncio.gather(*(replay_client(cfg, s, stats, payloads, started, sequencer)
+                               for s in steps.values() if s))
+    finally:
+        payloads.cleanup()
+    return stats, time.perf_counter() - started
+
+
+def print_live(stats, wall, speed):
+    total = sum(stats.counts.values())
+    print(f"Live replay: {total:,} commands in {wall:.2f} s ({total / wall if wall else 0:,.0f}/s), "
+          f"speed {'max' if speed <= 0 else f'{speed:g}x'}")
+    print(f"  {'Command':20} {'Count':>8} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'max ms':>9}")
+    for cmd, hist in sorted(stats.latency.items(), key=lambda kv: -kv[1].total):
+        s = hist.summary()
+        print(f"  {cmd:20} {s['count']:>8,} {s['p50_ms']:>9.2f} {s['p95_ms']:>9.2f} "
+              f"{s['p99_ms']:>9.2f} {s['max_ms']:>9.2f}")
+    if stats.lag.total:
+        print(f"  Behind schedule: {stats.lag.total:,} commands, p95 {stats.lag.percentile(95) / 1000.0:.1f} ms")
+    for title, counter in (("Failures", stats.failures), ("Replies differing from the recording", stats.mismatches)):
+        if counter:
+            print(f"  {title}:")
+            for key, n in counter.most_common(10):
+                print(f"    {n:8,}  {key}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Replay recorded traffic as a benchmark")
+    sub = parser.add_subparsers(dest="command", required=True)
+    p = sub.add_parser("convert", help="server.log -> replay script")
+    p.add_argument("log")
+    p.add_argument("-o", "--output", required=True)
+    p = sub.add_parser("offline", help="time chat_core's parser on the recorded server lines")
+    p.add_argument("script")
+    p.add_argument("--speed", type=float, default=0.0, help="1 = recorded pace, 0 = as fast as possible")
+    p.add_argument("--repeat", type=int, default=1)
+    p.add_argument("--json")
+    p = sub.add_parser("live", help="re-send the recorded commands to a server")
+    p.add_argument("script")
+    p.add_argument("--host", default="127.0.0.1")
+    p.add_argument("--port", type=int, default=8888)
+    p.add_argument("--speed", type=float, default=1.0, help="1 = recorded pace, 0 = as fast as possible")
+    p.add_argument("--register", action="store_true", help="REGISTER users whose LOGIN fails")
+    p.add_argument("--timeout", type=float, default=30.0)
+    p.add_argument("--json")
+    args = parser.parse_args(argv)
+
+    if args.command == "convert":
+        n = convert_server_log(args.log, args.output)
+        print(f"{args.output}: {n:,} events")
+        return 0
+    _, events = read_script(args.script)
+    if args.command == "offline":
+        report = replay_offline(events, args.speed, args.repeat)
+        print_offline(report)
+    else:
+        stats, wall = asyncio.run(replay_live(args, events))
+        print_live(stats, wall, args.speed)
+        report = {
+            "wall_s": wall,
+            "latency": {cmd: h.summary() for cmd, h in stats.latency.items()},
+            "failures": dict(stats.failures),
+            "mismatches": dict(stats.mismatches),
+        }
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
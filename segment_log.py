@@ -0,0 +1,371 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Segmented conversation logs: a replacement for one ever-growing
+messages/<conv>.txt file.
+
+A conversation becomes a directory messages/<conv>.seg/ of numbered
+segments holding the same 'ts|sender|TYPE|content' lines:
+
+    00000000.seg  sealed: body + fixed footer (min/max ts, count, crc)
+    00000001.seg  sealed, body zlib-compressed once it went cold
+    00000002.open active: plain text, appended to until SEGMENT_SIZE
+
+The footer of a sealed segment is FOOTER.size bytes at the end of the file
+and is never compressed, so opening a log reads only footers, and range or
+tail queries skip every segment whose [min_ts, max_ts] misses the range.
+
+Usage:
+    python segment_log.py migrate messages/ --cold-days 7 --remove-source
+    python segment_log.py compact messages/ --cold-days 7
+    python segment_log.py stats messages/
+"""
+
+import argparse
+import os
+import shutil
+import struct
+import sys
+import time
+import zlib
+
+from message_store import parse_record, format_record, in_range
+
+SEGMENT_SIZE = 4 * 1024 * 1024
+SEGMENT_DIR_SUFFIX = ".seg"
+SEALED_SUFFIX = ".seg"
+ACTIVE_SUFFIX = ".open"
+COLD_AGE = 7 * 24 * 3600  # seconds after a segment's newest message before it is compressed
+
+# magic, min_ts, max_ts, count, raw body size, flags, crc32 of the raw body
+FOOTER = struct.Struct('!8sqqIIII')
+FOOTER_MAGIC = b'LTMSEG01'
+FLAG_ZLIB = 1
+
+
+def segment_dir(txt_path):
+    """messages/G_x.txt -> messages/G_x.seg"""
+    base = txt_path[:-4] if txt_path.endswith(".txt") else txt_path
+    return base + SEGMENT_DIR_SUFFIX
+
+
+def _parse_lines(body):
+    records = []
+    for line in body.decode('utf-8', errors='replace').split('\n'):
+        record = parse_record(line.rstrip('\r'))
+        if record is not None:
+            records.append(record)
+    return records
+
+
+class Segment:
+    __slots__ = ("number", "path", "min_ts", "max_ts", "count", "size", "flags", "sealed")
+
+    def __init__(self, number, path, min_ts=0, max_ts=0, count=0, size=0, flags=0, sealed=True):
+        self.number = number
+        self.path = path
+        self.min_ts = min_ts
+        self.max_ts = max_ts
+        self.count = count
+        self.size = size  # raw (uncompressed) body bytes
+        self.flags = flags
+        self.sealed = sealed
+
+    def add(self, ts, nbytes):
+        if not self.count:
+            self.min_ts = self.max_ts = ts
+        else:
+            self.min_ts = min(self.min_ts, ts)
+            self.max_ts = max(self.max_ts, ts)
+        self.count += 1
+        self.size += nbytes
+
+    def overlaps(self, tbegin, tend):
+        return self.count and (tend == 0 or self.min_ts <= tend) and (tbegin == 0 or self.max_ts >= tbegin)
+
+
+class SegmentedLog:
+    """Same append/range/tail interface as message_store.MessageLog"""
+
+    def __init__(self, directory, segment_size=SEGMENT_SIZE, cold_age=None):
+        self.directory = directory
+        self.segment_size = segment_size
+        self.cold_age = cold_age  # compress cold segments on seal when set
+        self._segments = []  # sealed, in order
+        self._active = None
+        self._append = None
+        os.makedirs(directory, exist_ok=True)
+        self._load()
+
+    # -- opening -----------------------------------------------------------
+
+    def _path(self, number, suffix):
+        return os.path.join(self.directory, f"{number:08d}{suffix}")
+
+    def _load(self):
+        active = []
+        for name in sorted(os.listdir(self.directory)):
+            path = os.path.join(self.directory, name)
+            stem, suffix = os.path.splitext(name)
+            if suffix == ".tmp":
+                os.remove(path)
+            elif suffix == SEALED_SUFFIX and stem.isdigit():
+                self._segments.append(self._read_footer(int(stem), path))
+            elif suffix == ACTIVE_SUFFIX and stem.isdigit():
+                active.append(int(stem))
+        sealed = {seg.number for seg in self._segments}
+        for number in [n for n in active if n in sealed]:
+            # seal() got as far as the sealed copy; it is complete
+            os.remove(self._path(number, ACTIVE_SUFFIX))
+        active = [n for n in active if n not in sealed]
+        for number in active:
+            self._active = self._scan_active(number)
+            if number != active[-1]:
+                self.seal()  # interrupted before sealing
+
+    @staticmethod
+    def _read_footer(number, path):
+        with open(path, 'rb') as f:
+            f.seek(-FOOTER.size, os.SEEK_END)
+            magic, min_ts, max_ts, count, size, flags, _ = FOOTER.unpack(f.read(FOOTER.size))
+        if magic != FOOTER_MAGIC:
+            raise ValueError(f"bad segment footer: {path}")
+        return Segment(number, path, min_ts, max_ts, count, size, flags)
+
+    def _scan_active(self, number):
+        path = self._path(number, ACTIVE_SUFFIX)
+        seg = Segment(number, path, sealed=False)
+        good = 0
+        with open(path, 'rb') as f:
+            for raw in f:
+                if not raw.endswith(b'\n'):
+                    break
+                record = parse_record(raw.decode('utf-8', errors='replace').rstrip('\r\n'))
+                if record is not None:
+                    seg.add(record[0], 0)
+                good += len(raw)
+        if good != os.path.getsize(path):
+            with open(path, 'r+b') as f:
+                f.truncate(good)  # drop a line torn by a crash
+        seg.size = good
+        return seg
+
+    # -- writing -----------------------------------------------------------
+
+    def append_line(self, data, ts):
+        """Append one encoded record line (ending in newline) without flushing"""
+        if self._active is not None and self._active.count and \
+                self._active.size + len(data) > self.segment_size:
+            self.seal()
+        if self._active is None:
+            last = self._segments[-1].number if self._segments else -1
+            self._active = Segment(last + 1, self._path(last + 1, ACTIVE_SUFFIX), sealed=False)
+        if self._append is None:
+            self._append = open(self._active.path, 'ab')
+        self._append.write(data)
+        self._active.add(ts, len(data))
+
+    def append(self, sender, mtype, content, ts=None):
+        """Append one message; returns its timestamp"""
+        ts = int(time.time()) if ts is None else ts
+        self.append_line(format_record(ts, sender, mtype, content).encode('utf-8'), ts)
+        self._append.flush()
+        return ts
+
+    def flush(self):
+        if self._append is not None:
+            self._append.flush()
+
+    def _write_sealed(self, seg, body, flags):
+        crc = zlib.crc32(body)
+        payload = zlib.compress(body, 6) if flags & FLAG_ZLIB else body
+        path = self._path(seg.number, SEALED_SUFFIX)
+        tmp = path + ".tmp"
+        with open(tmp, 'wb') as f:
+            f.write(payload)
+            f.write(FOOTER.pack(FOOTER_MAGIC, seg.min_ts, seg.max_ts, seg.count, len(body), flags, crc))
+        os.replace(tmp, path)
+        return Segment(seg.number, path, seg.min_ts, seg.max_ts, seg.count, len(body), flags)
+
+    def seal(self):
+        """Close the active segment and write it out with its footer"""
+        if self._append is not None:
+            self._append.close()
+            self._append = None
+        seg, self._active = self._active, None
+        if seg is None:
+            return
+        with open(seg.path, 'rb') as f:
+            body = f.read()
+        if seg.count:
+            self._segments.append(self._write_sealed(seg, body, 0))
+        # Only once the sealed copy is in place; _load() drops a leftover .open
+        os.remove(seg.path)
+        if self.cold_age is not None:
+            self.compact(self.cold_age)
+
+    def compact(self, older_than=COLD_AGE, now=None):
+        """Compress sealed segments whose newest message is older than older_than
+        seconds; returns (bytes before, bytes after)"""
+        cutoff = (time.time() if now is None else now) - older_than
+        before = after = 0
+        for i, seg in enumerate(self._segments):
+            if seg.flags & FLAG_ZLIB or seg.max_ts > cutoff:
+                continue
+            before += os.path.getsize(seg.path)
+            self._segments[i] = self._write_sealed(seg, self._body(seg), seg.flags | FLAG_ZLIB)
+            after += os.path.getsize(seg.path)
+        return before, after
+
+    def save_index(self):
+        self.flush()
+
+    def close(self):
+        if self._append is not None:
+            self._append.close()
+            self._append = None
+
+    # -- reading -----------------------------------------------------------
+
+    def _body(self, seg):
+        if not seg.sealed:
+            self.flush()
+            with open(seg.path, 'rb') as f:
+                return f.read()
+        with open(seg.path, 'rb') as f:
+            data = f.read()
+        _, _, _, _, size, flags, crc = FOOTER.unpack(data[-FOOTER.size:])
+        body = data[:-FOOTER.size]
+        if flags & FLAG_ZLIB:
+            body = zlib.decompress(body)
+        if len(body) != size or zlib.crc32(body) != crc:
+            raise ValueError(f"corrupt segment: {seg.path}")
+        return body
+
+    def segments(self):
+        return self._segments + ([self._active] if self._active is not None else [])
+
+    def __len__(self):
+        return sum(seg.count for seg in self.segments())
+
+    def range(self, tbegin=0, tend=0):
+        """Records with tbegin <= ts <= tend, in append order"""
+        out = []
+        for seg in self.segments():
+            if seg.overlaps(tbegin, tend):
+                out.extend(r for r in _parse_lines(self._body(seg)) if in_range(r[0], tbegin, tend))
+        return out
+
+    def tail(self, limit, tbegin=0, tend=0):
+        """The last `limit` records (in append order) with tbegin <= ts <= tend"""
+        if limit <= 0:
+            return self.range(tbegin, tend)
+        picked = []
+        for seg in reversed(self.segments()):
+            if seg.overlaps(tbegin, tend):
+                picked[:0] = [r for r in _parse_lines(self._body(seg)) if in_range(r[0], tbegin, tend)]
+                if len(picked) >= limit:
+                    break
+        return picked[-limit:]
+
+
+# -- migration -------------------------------------------------------------
+
+def migrate_file(txt_path, segment_size=SEGMENT_SIZE, cold_age=COLD_AGE, remove_source=False):
+    """Stream messages/<conv>.txt into messages/<conv>.seg/
+
+    Returns (records, skipped lines, bytes before, bytes after). The
+    segments are built in a temporary directory and renamed into place, so
+    an interrupted migration leaves the source untouched.
+    """
+    dest = segment_dir(txt_path)
+    if os.path.exists(dest):
+        raise FileExistsError(dest)
+    tmp = dest + ".tmp"
+    shutil.rmtree(tmp, ignore_errors=True)
+    log = SegmentedLog(tmp, segment_size)
+    records = skipped = 0
+    with open(txt_path, 'rb') as f:
+        for raw in f:
+            line = raw.decode('utf-8', errors='replace').rstrip('\r\n')
+            record = parse_record(line)
+            if record is None:
+                skipped += line != ""
+                continue
+            log.append_line((line + "\n").encode('utf-8'), record[0])
+            records += 1
+    log.seal()
+    if cold_age is not None:
+        log.compact(cold_age)
+    log.close()
+    os.replace(tmp, dest)
+    before = os.path.getsize(txt_path)
+    after = sum(os.path.getsize(os.path.join(dest, n)) for n in os.listdir(dest))
+    if remove_source:
+        os.remove(txt_path)
+        for extra in (txt_path + ".idx",):
+            if os.path.exists(extra):
+                os.remove(extra)
+    return records, skipped, before, after
+
+
+def _conversation_files(paths, suffix):
+    for path in paths:
+        if os.path.isdir(path) and not path.rstrip('/\\').endswith(SEGMENT_DIR_SUFFIX):
+            for name in sorted(os.listdir(path)):
+                if name.endswith(suffix):
+                    yield os.path.join(path, name)
+        else:
+            yield path
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Segmented conversation logs")
+    sub = parser.add_subparsers(dest="command", required=True)
+    p = sub.add_parser("migrate", help="convert messages/*.txt to segmented logs")
+    p.add_argument("paths", nargs="+", help="conversation files or messages/ directories")
+    p.add_argument("--segment-size", type=int, default=SEGMENT_SIZE)
+    p.add_argument("--cold-days", type=float, default=COLD_AGE / 86400.0,
+                   help="compress segments whose newest message is older than this")
+    p.add_argument("--remove-source", action="store_true", help="delete the .txt after migrating")
+    p = sub.add_parser("compact", help="compress cold segments")
+    p.add_argument("paths", nargs="+")
+    p.add_argument("--cold-days", type=float, default=COLD_AGE / 86400.0)
+    p = sub.add_parser("stats", help="per-segment summary")
+    p.add_argument("paths", nargs="+")
+    args = parser.parse_args(argv)
+
+    if args.command == "migrate":
+        total_before = total_after = 0
+        for path in _conversation_files(args.paths, ".txt"):
+            try:
+                records, skipped, before, after = migrate_file(
+                    path, args.segment_size, args.cold_days * 86400, args.remove_source)
+            except FileExistsError:
+                print(f"{path}: already migrated, skipped")
+                continue
+            total_before += before
+            total_after += after
+            print(f"{path}: {records} messages ({skipped} bad lines skipped), {before:,} -> {after:,} B")
+        print(f"Total: {total_before:,} -> {total_after:,} B")
+    elif args.command == "compact":
+        for path in _conversation_files(args.paths, SEGMENT_DIR_SUFFIX):
+            log = SegmentedLog(path)
+            before, after = log.compact(args.cold_days * 86400)
+            log.close()
+            if before:
+                print(f"{path}: {before:,} -> {after:,} B")
+    else:
+        for path in _conversation_files(args.paths, SEGMENT_DIR_SUFFIX):
+            log = SegmentedLog(path)
+            print(f"{path}: {len(log)} messages")
+            for seg in log.segments():
+                state = "active" if not seg.sealed else ("zlib" if seg.flags & FLAG_ZLIB else "plain")
+                print(f"  {seg.number:08d} {state:6} {seg.count:8} msgs  {seg.min_ts}..{seg.max_ts}  "
+                      f"{seg.size:,} B raw")
+            log.close()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
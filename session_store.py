@@ -0,0 +1,165 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Saved session tokens, so that a later launch resumes with AUTH <session>
+instead of sending LOGIN with the password.
+
+One token per server and username in %APPDATA%\\LTM\\session.json (the
+directory of the login config). On Windows the token is encrypted with
+DPAPI for the current Windows user (CryptProtectData), so the file is
+useless when copied to another account or machine. Elsewhere it is stored
+as is in a file readable only by its owner. Tokens are dropped on LOGOUT
+and when the server rejects them.
+
+    python session_store.py list
+    python session_store.py forget 127.0.0.1:8888 alice
+"""
+
+import base64
+import json
+import os
+import sys
+from pathlib import Path
+
+SESSION_FILE = "session.json"
+SCHEME_DPAPI = "dpapi"
+SCHEME_PLAIN = "plain"
+
+
+def default_path():
+    return str(Path.home() / "AppData" / "Roaming" / "LTM" / SESSION_FILE)
+
+
+# ============================================================================
+# DPAPI (Windows)
+# ============================================================================
+
+CRYPTPROTECT_UI_FORBIDDEN = 0x01
+
+
+def _dpapi(data, protect):
+    import ctypes
+    from ctypes import wintypes
+
+    class DataBlob(ctypes.Structure):
+        _fields_ = [("cbData", wintypes.DWORD), ("pbData", ctypes.POINTER(ctypes.c_char))]
+
+    buf = ctypes.create_string_buffer(data, len(data))
+    blob_in = DataBlob(len(data), ctypes.cast(buf, ctypes.POINTER(ctypes.c_char)))
+    blob_out = DataBlob()
+    crypt32 = ctypes.windll.crypt32
+    if protect:
+        ok = crypt32.CryptProtectData(ctypes.byref(blob_in), "LTM session", None, None, None,
+                                      CRYPTPROTECT_UI_FORBIDDEN, ctypes.byref(blob_out))
+    else:
+        ok = crypt32.CryptUnprotectData(ctypes.byref(blob_in), None, None, None, None,
+                                        CRYPTPROTECT_UI_FORBIDDEN, ctypes.byref(blob_out))
+    if not ok:
+        raise OSError(ctypes.GetLastError(), "DPAPI failed")
+    try:
+        return ctypes.string_at(blob_out.pbData, blob_out.cbData)
+    finally:
+        ctypes.windll.kernel32.LocalFree(ctypes.cast(blob_out.pbData, ctypes.c_void_p))
+
+
+def protect(token):
+    """token -> (scheme, stored string)"""
+    if sys.platform == "win32":
+        return SCHEME_DPAPI, base64.b64encode(_dpapi(token.encode('utf-8'), True)).decode('ascii')
+    return SCHEME_PLAIN, token
+
+
+def unprotect(scheme, stored):
+    """The token, or None if it cannot be recovered here"""
+    try:
+        if scheme == SCHEME_DPAPI and sys.platform == "win32":
+            return _dpapi(base64.b64decode(stored), False).decode('utf-8')
+        if scheme == SCHEME_PLAIN:
+            return stored
+    except (OSError, ValueError):
+        pass
+    return None
+
+
+# ============================================================================
+# Store
+# ============================================================================
+
+class SessionStore:
+    """"<server> <username>" -> protected session token"""
+
+    def __init__(self, path=None):
+        self.path = path or default_path()
+
+    @staticmethod
+    def _key(server, username):
+        return f"{server} {username}"
+
+    def _read(self):
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+            return data if isinstance(data, dict) else {}
+        except (OSError, ValueError):
+            return {}
+
+    def _write(self, data):
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        tmp = self.path + ".tmp"
+        fd = os.open(tmp, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        with os.fdopen(fd, 'w', encoding='utf-8') as f:
+            json.dump(data, f)
+        os.replace(tmp, self.path)
+
+    def load(self, server, username):
+        entry = self._read().get(self._key(server, username))
+        if not isinstance(entry, dict):
+            return None
+        return unprotect(entry.get("scheme"), entry.get("token", ""))
+
+    def save(self, server, username, token):
+        data = self._read()
+        scheme, stored = protect(token)
+        data[self._key(server, username)] = {"scheme": scheme, "token": stored}
+        try:
+            self._write(data)
+        except OSError as e:
+            print(f"[WARN] Session not saved: {e}")
+
+    def forget(self, server, username):
+        data = self._read()
+        if data.pop(self._key(server, username), None) is not None:
+            try:
+                self._write(data)
+            except OSError as e:
+                print(f"[WARN] Session not removed: {e}")
+
+    def entries(self):
+        """[(server, username, scheme)]"""
+        result = []
+        for key, entry in self._read().items():
+            server, _, username = key.partition(' ')
+            result.append((server, username, entry.get("scheme", "?") if isinstance(entry, dict) else "?"))
+        return result
+
+
+def main(argv=None):
+    import argparse
+    parser = argparse.ArgumentParser(description="Saved LTM session tokens")
+    sub = parser.add_subparsers(dest="cmd", required=True)
+    sub.add_parser("list")
+    forget = sub.add_parser("forget")
+    forget.add_argument("server")
+    forget.add_argument("username")
+    args = parser.parse_args(argv)
+    store = SessionStore()
+    if args.cmd == "list":
+        for server, username, scheme in store.entries():
+            print(f"{server:<24}{username:<20}{scheme}")
+    else:
+        store.forget(args.server, args.username)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
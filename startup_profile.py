@@ -0,0 +1,264 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Startup profiler for gui_client.py.
+
+gui_client imports this module first; STARTUP then records, relative to
+that moment:
+- marks after each import block (stdlib, PyQt5, app modules) and after
+  QApplication;
+- phases: LoginWindow(), MainWindow() and its parts (download cache,
+  init_ui), and the panels built later on first use;
+- the first paint of the login window and of the main window.
+
+Targets checked against those numbers:
+- time to login window: process start -> login window painted;
+- time to main window: LOGIN reply -> main window painted (usable);
+- time to main window (resumed): process start -> main window painted,
+  when a saved session is resumed with AUTH (session_store.py).
+Diagnostics shows them for the running client. From a terminal the client
+is started in a subprocess, which quits once the window is painted:
+    python startup_profile.py                     # warm start, login window
+    python startup_profile.py --cold --runs 5     # no bytecode cache
+    python startup_profile.py --login 127.0.0.1:8888 alice   # main window too
+    python startup_profile.py --resume            # saved session, no login window
+    python startup_profile.py --imports           # python -X importtime, slowest modules
+
+--cold gives every run an empty __pycache__ (PYTHONPYCACHEPREFIX), so all
+of the app's modules are compiled again; the OS file cache stays warm.
+"""
+
+import argparse
+import json
+import os
+import re
+import subprocess
+import sys
+import tempfile
+import time
+from contextlib import contextmanager
+
+PROFILE_ENV = "LTM_STARTUP_PROFILE"  # child writes its report (JSON) here
+EXIT_ENV = "LTM_STARTUP_EXIT"  # "login window" / "main window": quit once painted
+LOGIN_ENV = "LTM_STARTUP_LOGIN"  # "host:port user password": sign in at once
+
+LOGIN_WINDOW = "login window"
+MAIN_WINDOW = "main window"
+LOGIN_REPLY = "login reply"
+OPEN_MAIN = "open main window"  # the LOGIN reply, after LOGIN_PAUSE
+SESSION_RESUMED = "session resumed"  # LOGIN skipped: AUTH with a saved session
+RESUMED = "main window (resumed)"
+
+# Seconds: (cold, warm)
+TARGETS = {
+    LOGIN_WINDOW: (1.5, 0.6),  # from process start
+    MAIN_WINDOW: (0.5, 0.25),  # from OPEN_MAIN
+    RESUMED: (2.0, 0.9),  # from process start, with a saved session
+}
+
+
+class StartupProfile:
+    """Marks and phases since import, in seconds; cheap enough to stay on"""
+
+    def __init__(self):
+        self.t0 = time.perf_counter()
+        self.wall0 = time.time()
+        self.marks = []  # (name, seconds since t0)
+        self.phases = []  # (name, start, duration)
+        self._filters = []
+        self.exit_at = os.environ.get(EXIT_ENV, "")
+        login = os.environ.get(LOGIN_ENV, "").split(None, 2)
+        self.login = login if len(login) == 3 else None
+
+    def now(self):
+        return time.perf_counter() - self.t0
+
+    def mark(self, name):
+        self.marks.append((name, self.now()))
+
+    def at(self, name):
+        """Seconds since t0 of the first mark called name, or None"""
+        for mark, t in self.marks:
+            if mark == name:
+                return t
+        return None
+
+    @contextmanager
+    def phase(self, name):
+        start = self.now()
+        try:
+            yield
+        finally:
+            self.phases.append((name, start, self.now() - start))
+
+    def first_paint(self, widget, name, then=None):
+        """Mark name when widget is first painted, then call then() from the event loop
+        (or quit if name is the exit target)"""
+        from PyQt5.QtCore import QEvent, QObject, QTimer
+        from PyQt5.QtWidgets import QApplication
+
+        profile = self
+
+        class _PaintWatch(QObject):
+            def eventFilter(self, obj, event):
+                if event.type() == QEvent.Paint:
+                    obj.removeEventFilter(self)
+                    profile._filters.remove(self)
+                    profile.mark(name)
+                    if profile.exit_at == name:
+                        profile.dump()
+                        QTimer.singleShot(0, QApplication.closeAllWindows)
+                        QTimer.singleShot(0, QApplication.quit)
+                    elif then is not None:
+                        QTimer.singleShot(0, then)
+                return False
+
+        watch = _PaintWatch(widget)
+        self._filters.append(watch)
+        widget.installEventFilter(watch)
+
+    def targets(self):
+        """{target: seconds} measured so far (login window: since this module's import)"""
+        result = {}
+        if self.at(LOGIN_WINDOW) is not None:
+            result[LOGIN_WINDOW] = self.at(LOGIN_WINDOW)
+        if self.at(MAIN_WINDOW) is not None and self.at(OPEN_MAIN) is not None:
+            result[MAIN_WINDOW] = self.at(MAIN_WINDOW) - self.at(OPEN_MAIN)
+            if self.at(SESSION_RESUMED) is not None:
+                result[RESUMED] = self.at(MAIN_WINDOW)
+        return result
+
+    def report(self):
+        return {"wall0": self.wall0, "marks": self.marks, "phases": self.phases,
+                "targets": self.targets()}
+
+    def dump(self, path=None):
+        path = path or os.environ.get(PROFILE_ENV)
+        if path:
+            with open(path, 'w', encoding='utf-8') as f:
+                json.dump(self.report(), f)
+
+
+STARTUP = StartupProfile()
+
+
+# ============================================================================
+# Command line
+# ============================================================================
+
+def run_client(script, exit_at, cold=False, login=None, timeout=60):
+    """Start script, wait until exit_at is painted; the child's report plus 'spawn' (s before t0)"""
+    with tempfile.TemporaryDirectory() as tmp:
+        env = dict(os.environ)
+        env[PROFILE_ENV] = os.path.join(tmp, "startup.json")
+        env[EXIT_ENV] = exit_at
+        if login:
+            env[LOGIN_ENV] = login
+        if cold:
+            env["PYTHONPYCACHEPREFIX"] = os.path.join(tmp, "pycache")
+        spawned = time.time()
+        subprocess.run([sys.executable, script], env=env, timeout=timeout,
+                       stdout=subprocess.DEVNULL, check=False)
+        try:
+            with open(env[PROFILE_ENV], encoding='utf-8') as f:
+                report = json.load(f)
+        except (OSError, ValueError):
+            return None
+    report["spawn"] = max(0.0, report["wall0"] - spawned)
+    for target in (LOGIN_WINDOW, RESUMED):
+        if target in report["targets"]:
+            report["targets"][target] += report["spawn"]
+    return report
+
+
+def import_times(script, top):
+    """Slowest modules imported by script (python -X importtime): [(cumulative us, self us, name)]"""
+    module = os.path.splitext(os.path.basename(script))[0]
+    proc = subprocess.run([sys.executable, "-X", "importtime", "-c", f"import {module}"],
+                          cwd=os.path.dirname(os.path.abspath(script)),
+                          capture_output=True, text=True, check=False)
+    rows = []
+    for line in proc.stderr.splitlines():
+        m = re.match(r"import time:\s+(\d+) \|\s+(\d+) \| (\s*)(\S+)", line)
+        if m:
+            rows.append((int(m.group(2)), int(m.group(1)), len(m.group(3)) // 2, m.group(4)))
+    if proc.returncode:
+        print(proc.stderr.strip().splitlines()[-1] if proc.stderr.strip() else "import failed")
+    # Only top-level imports and their direct children, or PyQt5 submodules hide everything
+    rows = [r for r in rows if r[2] <= 2]
+    return sorted(((cum, own, name) for cum, own, _, name in rows), reverse=True)[:top]
+
+
+def print_runs(runs, cold):
+    print(f"  {len(runs)} {'cold' if cold else 'warm'} run(s), median seconds\n")
+
+    def median(values):
+        values = sorted(values)
+        return values[len(values) // 2] if values else None
+
+    print("  marks (since startup_profile import)")
+    names = [name for name, _ in runs[0]["marks"]]
+    for name in names:
+        t = median([dict(r["marks"]).get(name) for r in runs if name in dict(r["marks"])])
+        print(f"    {name:<28}{t:8.3f}")
+    print(f"    {'(interpreter start)':<28}{median([r['spawn'] for r in runs]):8.3f}  before")
+    print("\n  phases")
+    for name in dict.fromkeys(name for name, _, _ in runs[0]["phases"]):
+        d = median([dur for r in runs for n, _, dur in r["phases"] if n == name])
+        print(f"    {name:<28}{d:8.3f}")
+    print("\n  targets")
+    failed = False
+    for target, (cold_limit, warm_limit) in TARGETS.items():
+        values = [r["targets"][target] for r in runs if target in r["targets"]]
+        if not values:
+            continue
+        limit = cold_limit if cold else warm_limit
+        value = median(values)
+        ok = value <= limit
+        failed |= not ok
+        print(f"    time to {target:<20}{value:8.3f}  target {limit:.2f}  {'ok' if ok else 'OVER'}")
+    return failed
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Startup time of gui_client.py")
+    parser.add_argument("--script", default=os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                                         "gui_client.py"))
+    parser.add_argument("--runs", type=int, default=3)
+    parser.add_argument("--cold", action="store_true", help="empty bytecode cache for every run")
+    parser.add_argument("--login", nargs=2, metavar=("SERVER", "USER"),
+                        help="sign in and time the main window too (password is asked)")
+    parser.add_argument("--resume", action="store_true",
+                        help="time the main window with the saved session (Keep me signed in)")
+    parser.add_argument("--imports", action="store_true", help="show the slowest imports instead")
+    parser.add_argument("--top", type=int, default=15)
+    args = parser.parse_args(argv)
+
+    if args.imports:
+        print(f"  {'cumulative ms':>14}{'self ms':>10}  module")
+        for cum, own, name in import_times(args.script, args.top):
+            print(f"  {cum / 1000:14.1f}{own / 1000:10.1f}  {name}")
+        return 0
+
+    login = None
+    exit_at = LOGIN_WINDOW
+    if args.login:
+        import getpass
+        login = f"{args.login[0]} {args.login[1]} {getpass.getpass()}"
+        exit_at = MAIN_WINDOW
+    elif args.resume:
+        exit_at = MAIN_WINDOW
+    if not args.cold:
+        run_client(args.script, exit_at, login=login)  # warm-up: bytecode and file cache
+    runs = []
+    for _ in range(args.runs):
+        report = run_client(args.script, exit_at, cold=args.cold, login=login)
+        if report is None:
+            print("client exited before the window was painted")
+            return 2
+        runs.append(report)
+    return 1 if print_runs(runs, args.cold) else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
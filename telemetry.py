@@ -0,0 +1,295 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Client-side protocol telemetry: per-command latency, byte counters, throughput.
+
+The server answers commands on a connection strictly in order, so every
+SUCCESS/FAIL line is matched against the oldest command still waiting for a
+reply; the client drops commands whose replies it found lost (trim_pending). NOTIFY_* lines and HISTORY body lines are not replies and are ignored.
+"""
+
+import json
+import math
+import threading
+import time
+from collections import deque
+
+# Commands whose first reply is only an interim step; the command stays open
+# until the final status line (UPLOAD_COMPLETE / DOWNLOAD_COMPLETE / FAIL).
+INTERIM_REPLIES = {
+    "UPLOAD_DATA": "START_UPLOAD",
+    "REQ_DOWNLOAD": "READY_DOWNLOAD",
+    "REQ_PREVIEW": "READY_DOWNLOAD",
+}
+
+# Named spans recorded in addition to plain command latencies
+SPAN_UPLOAD_SETUP = "REQ_UPLOAD->START_UPLOAD"
+SPAN_HISTORY_BODY = "HISTORY body"
+SPAN_RENDER_HISTORY = "render history"
+
+
+class LatencyHistogram:
+    """Log-linear (HDR-style) histogram of integer values (microseconds by default).
+
+    Values below 2 * 2**sub_bits are stored exactly; above that each power of
+    two is split into 2**sub_bits linear buckets, so the relative error of a
+    reported percentile is bounded by 1 / 2**sub_bits (about 3% by default).
+    """
+
+    def __init__(self, sub_bits=5):
+        self.sub_bits = sub_bits
+        self.sub_count = 1 << sub_bits
+        self.counts = {}
+        self.total = 0
+        self.sum = 0
+        self.min = None
+        self.max = None
+
+    def _index(self, value):
+        if value < 2 * self.sub_count:
+            return value
+        shift = value.bit_length() - self.sub_bits - 1
+        top = value >> shift
+        return (shift + 1) * self.sub_count + (top - self.sub_count)
+
+    def _upper_bound(self, index):
+        if index < 2 * self.sub_count:
+            return index
+        shift = index // self.sub_count - 1
+        top = self.sub_count + index % self.sub_count
+        return ((top + 1) << shift) - 1
+
+    def record(self, seconds):
+        self.record_value(int(seconds * 1_000_000))
+
+    def record_value(self, value):
+        value = max(0, int(value))
+        idx = self._index(value)
+        self.counts[idx] = self.counts.get(idx, 0) + 1
+        self.total += 1
+        self.sum += value
+        self.min = value if self.min is None else min(self.min, value)
+        self.max = value if self.max is None else max(self.max, value)
+
+    def merge(self, other):
+        """Add another histogram's samples (same sub_bits)"""
+        for idx, count in other.counts.items():
+            self.counts[idx] = self.counts.get(idx, 0) + count
+        self.total += other.total
+        self.sum += other.sum
+        if other.min is not None:
+            self.min = other.min if self.min is None else min(self.min, other.min)
+            self.max = other.max if self.max is None else max(self.max, other.max)
+
+    def percentile(self, p):
+        """Recorded value at percentile p in [0, 100]"""
+        if not self.total:
+            return 0
+        target = max(1, math.ceil(p / 100.0 * self.total))
+        seen = 0
+        for idx in sorted(self.counts):
+            seen += self.counts[idx]
+            if seen >= target:
+                return min(self._upper_bound(idx), self.max)
+        return self.max
+
+    def summary(self):
+        """Percentiles in milliseconds"""
+        return {
+            "count": self.total,
+            "min_ms": (self.min or 0) / 1000.0,
+            "mean_ms": (self.sum / self.total / 1000.0) if self.total else 0.0,
+            "p50_ms": self.percentile(50) / 1000.0,
+            "p95_ms": self.percentile(95) / 1000.0,
+            "p99_ms": self.percentile(99) / 1000.0,
+            "max_ms": (self.max or 0) / 1000.0,
+        }
+
+
+def command_name(line):
+    """First token of a command line, e.g. 'HISTORY' for 'HISTORY G hust 0 0'"""
+    return line.split(' ', 1)[0].strip().upper()
+
+
+class Telemetry:
+    """Thread-safe collector shared by the network layer and the GUI"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        # [command, sent_at, interim_seen] per unanswered command; popped by
+        # its reply and cleared on disconnect, never capped (a dropped entry
+        # would shift every later reply onto the wrong command)
+        self._pending = deque()
+        self._spans = {}  # (name, key) -> start time
+        self.started_at = time.time()
+        self.latency = {}  # name -> LatencyHistogram
+        self.sent = {}  # command -> count
+        self.failures = {}  # latency row ("CMD" or "CMD (total)") -> count
+        self.bytes_out = 0
+        self.bytes_in = 0
+        self.transfers = {
+            "upload": {"count": 0, "bytes": 0, "seconds": 0.0, "throughput": LatencyHistogram()},
+            "download": {"count": 0, "bytes": 0, "seconds": 0.0, "throughput": LatencyHistogram()},
+        }
+        # Heartbeat round trips, smoothed as in RFC 6298 (seconds)
+        self.srtt = None
+        self.rttvar = None
+        self.rtt_samples = 0
+        self.dead_peers = 0
+
+    # -- recording ---------------------------------------------------------
+
+    def _record(self, name, seconds):
+        hist = self.latency.get(name)
+        if hist is None:
+            hist = self.latency[name] = LatencyHistogram()
+        hist.record(seconds)
+
+    def record(self, name, seconds):
+        with self._lock:
+            self._record(name, seconds)
+
+    def command_sent(self, line, nbytes):
+        cmd = command_name(line)
+        with self._lock:
+            self.bytes_out += nbytes
+            self.sent[cmd] = self.sent.get(cmd, 0) + 1
+            self._pending.append([cmd, time.perf_counter(), False])
+            if cmd == "REQ_UPLOAD":
+                self._spans[(SPAN_UPLOAD_SETUP, None)] = time.perf_counter()
+
+    def bytes_sent(self, nbytes):
+        with self._lock:
+            self.bytes_out += nbytes
+
+    def bytes_received(self, nbytes):
+        with self._lock:
+            self.bytes_in += nbytes
+
+    def reply_received(self, line):
+        """Match a SUCCESS/FAIL line to the oldest open command"""
+        now = time.perf_counter()
+        parts = line.split(' ', 3)
+        keyword = parts[2] if len(parts) > 2 else ""
+        with self._lock:
+            if keyword == "START_UPLOAD":
+                start = self._spans.pop((SPAN_UPLOAD_SETUP, None), None)
+                if start is not None:
+                    self._record(SPAN_UPLOAD_SETUP, now - start)
+            if not self._pending:
+                return None
+            entry = self._pending[0]
+            cmd, sent_at, interim_seen = entry
+            if not interim_seen and INTERIM_REPLIES.get(cmd) == keyword:
+                entry[2] = True
+                self._record(cmd, now - sent_at)
+                return cmd
+            self._pending.popleft()
+            name = f"{cmd} (total)" if interim_seen else cmd
+            self._record(name, now - sent_at)
+            if parts[0] == "FAIL":
+                self.failures[name] = self.failures.get(name, 0) + 1
+            return cmd
+
+    def trim_pending(self, keep):
+        """Keep only the newest keep open commands; the client found that the
+        older ones will never get a reply"""
+        with self._lock:
+            while len(self._pending) > keep:
+                self._pending.popleft()
+
+    def connection_reset(self):
+        """Forget commands sent on a connection that is gone (no reply will come)"""
+        with self._lock:
+            self._pending.clear()
+            self._spans.clear()
+
+    def rtt_sample(self, seconds):
+        with self._lock:
+            if self.srtt is None:
+                self.srtt, self.rttvar = seconds, seconds / 2
+            else:
+                self.rttvar = 0.75 * self.rttvar + 0.25 * abs(self.srtt - seconds)
+                self.srtt = 0.875 * self.srtt + 0.125 * seconds
+            self.rtt_samples += 1
+            self._record("RTT", seconds)
+
+    def rto(self, floor=1.0):
+        """Retransmission-style timeout from the smoothed RTT (None before a sample)"""
+        with self._lock:
+            if self.srtt is None:
+                return None
+            return max(floor, self.srtt + 4 * self.rttvar)
+
+    def dead_peer(self):
+        with self._lock:
+            self.dead_peers += 1
+
+    def throughput(self, direction):
+        """Average bytes/s over completed transfers in direction (0 if none)"""
+        with self._lock:
+            t = self.transfers[direction]
+            return t["bytes"] / t["seconds"] if t["seconds"] else 0.0
+
+    def start_span(self, name, key=None):
+        with self._lock:
+            self._spans[(name, key)] = time.perf_counter()
+
+    def end_span(self, name, key=None):
+        with self._lock:
+            start = self._spans.pop((name, key), None)
+            if start is not None:
+                self._record(name, time.perf_counter() - start)
+
+    def transfer_done(self, direction, nbytes, seconds):
+        with self._lock:
+            t = self.transfers[direction]
+            t["count"] += 1
+            t["bytes"] += nbytes
+            t["seconds"] += seconds
+            if seconds > 0:
+                t["throughput"].record_value(nbytes / 1024.0 / seconds)
+
+    # -- reporting ---------------------------------------------------------
+
+    def snapshot(self):
+        with self._lock:
+            elapsed = max(time.time() - self.started_at, 1e-9)
+            latency = {name: h.summary() for name, h in sorted(self.latency.items())}
+            for name, summary in latency.items():
+                summary["sent"] = self.sent.get(name.replace(" (total)", ""), 0)
+                summary["failures"] = self.failures.get(name, 0)
+            transfers = {}
+            for direction, t in self.transfers.items():
+                hist = t["throughput"]
+                transfers[direction] = {
+                    "count": t["count"],
+                    "bytes": t["bytes"],
+                    "seconds": round(t["seconds"], 3),
+                    "avg_kib_s": (t["bytes"] / 1024.0 / t["seconds"]) if t["seconds"] else 0.0,
+                    "p50_kib_s": hist.percentile(50),
+                    "p95_kib_s": hist.percentile(95),
+                }
+            return {
+                "uptime_s": round(elapsed, 3),
+                "bytes_out": self.bytes_out,
+                "bytes_in": self.bytes_in,
+                "out_rate_b_s": self.bytes_out / elapsed,
+                "in_rate_b_s": self.bytes_in / elapsed,
+                "pending": [cmd for cmd, _, _ in self._pending],
+                "rtt": {
+                    "srtt_ms": round(self.srtt * 1000, 3) if self.srtt is not None else None,
+                    "rttvar_ms": round(self.rttvar * 1000, 3) if self.rttvar is not None else None,
+                    "samples": self.rtt_samples,
+                    "dead_peers": self.dead_peers,
+                },
+                "latency": latency,
+                "transfers": transfers,
+            }
+
+    def to_json(self, indent=2):
+        return json.dumps(self.snapshot(), indent=indent)
+
+    def export_json(self, path):
+        with open(path, 'w', encoding='utf-8') as f:
+            f.write(self.to_json())
@@ -0,0 +1,60 @@
+"""
+Shared fixtures: a reference_server.ChatServer on an ephemeral port with its
+data in tmp_path, and logged-in AsyncChatClient connections to it.
+
+Tests are plain functions; ``with_server(body)`` runs ``await body(server,
+port)`` on a fresh event loop and closes the server afterwards.
+"""
+
+import asyncio
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import reference_server  # noqa: E402
+from async_core import AsyncChatClient  # noqa: E402
+from chat_core import encode_login, encode_register  # noqa: E402
+
+TEST_TIMEOUT = 20
+
+
+@pytest.fixture
+def with_server(tmp_path):
+    def run(body, **server_options):
+        async def main():
+            server = reference_server.ChatServer(str(tmp_path / "server"), **server_options)
+            listener = await server.start("127.0.0.1", 0)
+            try:
+                port = listener.sockets[0].getsockname()[1]
+                return await asyncio.wait_for(body(server, port), TEST_TIMEOUT)
+            finally:
+                listener.close()
+                server.close()
+        return asyncio.run(main())
+    return run
+
+
+async def connect(port, username, password="pw", register=True, **options):
+    """(client, events): a logged-in AsyncChatClient and the events it emitted"""
+    events = []
+    client = AsyncChatClient("127.0.0.1", port, on_event=lambda name, *args: events.append((name, args)),
+                             **options)
+    asyncio.ensure_future(client.run())
+    while not client.running:
+        await asyncio.sleep(0.01)
+    if register:
+        await client.request(encode_register(username, password))
+    client.username = username
+    reply = await client.request(encode_login(username, password))
+    assert reply.ok, reply.line
+    if client.negotiation is not None:
+        await client.negotiation  # CAPS goes out once AUTH is answered
+    return client, events
+
+
+def names(events, name):
+    """Arguments of every event called name"""
+    return [args for n, args in events if n == name]
@@ -0,0 +1,48 @@
+import asyncio
+
+import reference_server
+from conftest import connect, names
+
+
+async def chat(client, count):
+    await client.request("INIT_GROUP g1 10")
+    for i in range(count):
+        client.send(f"TEXT G g1 message number {i} about the plans for the weekend")
+    return await client.request("HISTORY G g1")
+
+
+def test_compression_negotiated_after_auth(with_server, tmp_path):
+    text = tmp_path / "notes.txt"
+    text.write_bytes(b"the same line of notes, again and again\n" * 20000)
+
+    async def body(server, port):
+        client, events = await connect(port, "alice", compress=True, client_ids=True)
+        assert (client.compression, client.chunk_compression, client.message_ids) == ("zlib", True, True)
+        history = await chat(client, 300)
+        assert len(history.lines) == 300
+        assert client.wire_bytes_in < client.plain_bytes_in / 3
+
+        size = text.stat().st_size
+        offer = await client.offer_upload("G", "g1", str(text), "notes.txt", size)
+        client.upload_data(offer.fields[0], str(text), size)
+        while not names(events, "upload_complete"):
+            await asyncio.sleep(0.01)
+        reply = await client.fetch_preview(offer.fields[0], str(tmp_path / "back.txt"), size)
+        assert reply.kind == "download_complete"
+        assert (tmp_path / "back.txt").read_bytes() == text.read_bytes()
+        client.stop()
+    with_server(body)
+
+
+def test_server_without_caps_keeps_plain_stream(with_server, monkeypatch):
+    monkeypatch.delattr(reference_server.ClientConnection, "cmd_caps")
+
+    async def body(server, port):
+        client, events = await connect(port, "alice", compress=True, client_ids=True)
+        assert not client.supports("CAPS")
+        assert (client.compression, client.chunk_compression, client.message_ids) == (None, False, False)
+        history = await chat(client, 50)
+        assert len(history.lines) == 50
+        assert [title for title, _ in names(events, "notification")] == ["Success"]  # REGISTER only
+        client.stop()
+    with_server(body)
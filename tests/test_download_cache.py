@@ -0,0 +1,59 @@
+import os
+
+from download_cache import DownloadCache
+
+
+def write(path, data):
+    path.write_bytes(data)
+    return str(path)
+
+
+def test_same_content_is_stored_once_and_survives_restart(tmp_path):
+    cache = DownloadCache(str(tmp_path / "cache"), budget=1 << 20)
+    src = write(tmp_path / "a.bin", b"x" * 1000)
+    cache.put("f1", src, "a.bin")
+    cache.put("f2", src, "copy of a.bin")
+    cache.alias("f3", "f1")
+    assert cache.stats()["blobs"] == 1 and cache.stats()["bytes"] == 1000
+
+    reopened = DownloadCache(str(tmp_path / "cache"), budget=1 << 20)
+    dest = str(tmp_path / "out.bin")
+    assert reopened.materialize("f3", dest)
+    with open(dest, 'rb') as f:
+        assert f.read() == b"x" * 1000
+    assert not reopened.materialize("missing", dest)
+    assert (reopened.hits, reopened.misses) == (1, 1)
+
+
+def test_least_recently_used_is_evicted_over_budget(tmp_path):
+    cache = DownloadCache(str(tmp_path / "cache"), budget=2500)
+    for i in range(3):
+        cache.put(f"f{i}", write(tmp_path / f"{i}.bin", bytes([i]) * 1000))
+    assert cache.lookup("f0") is None  # put f2 -> 3000 bytes > budget
+    assert cache.materialize("f1", str(tmp_path / "use.bin"))  # f1 now newer than f2
+    cache.put("f3", write(tmp_path / "3.bin", b"3" * 1000))
+    assert [e.file_id for e in cache.entries()] == ["f3", "f1"]
+
+
+def test_changed_blob_is_dropped_on_lookup(tmp_path):
+    cache = DownloadCache(str(tmp_path / "cache"))
+    cache.put("f1", write(tmp_path / "a.bin", b"abc"))
+    with open(cache.lookup("f1"), 'ab') as f:
+        f.write(b"tampered")
+    assert cache.lookup("f1") is None
+    assert os.listdir(cache.blob_dir) == []
+
+
+def test_put_never_writes_into_a_materialized_copy(tmp_path):
+    cache = DownloadCache(str(tmp_path / "cache"))
+    src = write(tmp_path / "a.bin", b"original")
+    cache.put("f1", src)
+    dest = tmp_path / "saved.bin"
+    assert cache.materialize("f1", str(dest))
+    with open(dest, 'r+b') as f:  # edited in place by the user, same size
+        f.write(b"EDITED!!")
+    cache.put("f2", src)
+    assert dest.read_bytes() == b"EDITED!!"
+    for file_id in ("f1", "f2"):
+        with open(cache.lookup(file_id), 'rb') as f:
+            assert f.read() == b"original"
@@ -0,0 +1,115 @@
+import asyncio
+import time
+
+import pytest
+
+from async_core import AsyncChatClient, ReplyLost
+
+
+def serve_one_command_per_recv(answer):
+    """A server.cpp-like stub: every recv() is one command, answered by
+    ``await answer(command)`` (None: no reply). Returns (start, received)."""
+    received = []
+
+    async def handle(reader, writer):
+        while True:
+            data = await reader.read(65536)
+            if not data:
+                break
+            command = data.decode().strip()
+            received.append((time.perf_counter(), command))
+            reply = await answer(command)
+            if reply is not None:
+                writer.write(reply.encode() + b"\n")
+        writer.close()
+
+    async def start():
+        listener = await asyncio.start_server(handle, "127.0.0.1", 0)
+        return listener, listener.sockets[0].getsockname()[1]
+    return start, received
+
+
+async def unknown_command(command):
+    return "FAIL 400 UNKNOWN_COMMAND"
+
+
+async def start_client(port, **options):
+    client = AsyncChatClient("127.0.0.1", port, heartbeat=(0.2, 0.2), **options)
+    asyncio.ensure_future(client.run())
+    while not client.running:
+        await asyncio.sleep(0.01)
+    return client
+
+
+def test_no_ping_while_a_command_is_outstanding():
+    async def answer(command):
+        if command == "GET_FRIENDS":
+            await asyncio.sleep(0.35)  # longer than the interval, shorter than interval + timeout
+            return "SUCCESS 200 FRIENDS bob|online"
+        return await unknown_command(command)
+    start, received = serve_one_command_per_recv(answer)
+
+    async def main():
+        listener, port = await start()
+        client = await start_client(port)
+        await asyncio.sleep(0.3)  # idle: probed
+        assert received and received[-1][1].startswith("PING")
+        asked_at = time.perf_counter()
+        reply = await client.request("GET_FRIENDS")
+        answered_at = time.perf_counter()
+        assert reply.kind == "friends"
+        assert not [c for t, c in received if asked_at < t < answered_at and c.startswith("PING")]
+        await asyncio.sleep(0.5)
+        assert received[-1][1].startswith("PING")  # probing again once idle
+        assert client.telemetry.dead_peers == 0
+        client.stop()
+        listener.close()
+        await asyncio.sleep(0.02)
+    asyncio.run(main())
+
+
+def test_lost_reply_is_not_a_dead_peer():
+    lost = []
+
+    async def answer(command):
+        if command == "GET_GROUPS" and not lost:
+            lost.append(command)
+            return None
+        if command == "GET_GROUPS":
+            return "SUCCESS 200 GROUPS g1|1"
+        return await unknown_command(command)
+    start, received = serve_one_command_per_recv(answer)
+
+    async def main():
+        listener, port = await start()
+        client = await start_client(port)
+        with pytest.raises(ReplyLost):
+            await asyncio.wait_for(client.request("GET_GROUPS"), 5)
+        reply = await asyncio.wait_for(client.request("GET_GROUPS"), 5)
+        assert reply.kind == "groups"
+        await asyncio.sleep(0.8)
+        assert client.running and client.telemetry.dead_peers == 0
+        client.stop()
+        listener.close()
+        await asyncio.sleep(0.02)
+    asyncio.run(main())
+
+
+def test_silent_server_is_a_dead_peer():
+    async def answer(command):
+        return None
+    start, received = serve_one_command_per_recv(answer)
+
+    async def main():
+        listener, port = await start()
+        client = await start_client(port)
+        client.send("GET_GROUPS")
+        for _ in range(300):
+            if not client.running:
+                break
+            await asyncio.sleep(0.01)
+        assert client.telemetry.dead_peers == 1
+        client.stop()
+        listener.close()
+        await asyncio.sleep(0.02)
+    asyncio.run(main())
@@ -0,0 +1,51 @@
+import os
+
+from log_analyzer import LogStats, analyze, analyze_range
+
+SERVER_LOG = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "server.log")
+
+
+def split_run(path, parts):
+    """analyze() with the file cut into parts ranges at line boundaries"""
+    with open(path, 'rb') as f:
+        data = f.read()
+    points = [0]
+    for i in range(1, parts):
+        nl = data.find(b'\n', len(data) * i // parts)
+        if nl > points[-1]:
+            points.append(nl + 1)
+    points.append(len(data))
+    total = LogStats()
+    for start, end in zip(points, points[1:]):
+        total.merge(analyze_range(path, start, end))
+    total.finish()
+    return total.report()
+
+
+def test_split_run_matches_single_run_on_server_log():
+    single = analyze(SERVER_LOG).report()
+    for parts in (2, 7, 31):
+        assert split_run(SERVER_LOG, parts) == single
+
+
+def test_restart_and_reused_numbers_start_new_sessions(tmp_path):
+    log = tmp_path / "server.log"
+    log.write_text(
+        "[2025-01-01 10:00:00] Server started on port 8888.\n"
+        "[2025-01-01 10:00:01] Client[1] connected: 10.0.0.1:5000\n"
+        "[2025-01-01 10:00:02] Client[1] Received: GET_FRIENDS\n"
+        "[2025-01-01 10:00:10] Server started on port 8888.\n"
+        "[2025-01-01 10:00:11] Client[1] connected: 10.0.0.2:5001\n"
+        "[2025-01-01 10:00:12] Client[1] Received: GET_GROUPS\n"
+        "[2025-01-01 10:00:13] Client[1] Sent: SUCCESS 200 GROUPS \n"
+        "[2025-01-01 10:00:20] Client[1] connected: 10.0.0.3:5002\n"
+        "[2025-01-01 10:00:21] Client[1] Received: LOGIN bob pw\n"
+        "[2025-01-01 10:00:22] Client[1] Sent: SUCCESS 200 SESSION abc\n"
+        "[2025-01-01 10:00:23] Client[1] disconnected\n")
+    report = analyze(str(log)).report()
+    assert report["clients"]["connections"] == 3
+    assert report["clients"]["measured"] == 3
+    assert report["commands"]["GET_FRIENDS"]["replies"] == {}  # lost with the restart
+    assert report["unmatched_replies"] == {}
+    for parts in (2, 3, 5, 11):
+        assert split_run(str(log), parts) == report
@@ -0,0 +1,60 @@
+import asyncio
+
+from chat_core import encode_text_id
+from conftest import connect, names
+
+
+async def group_of_three(port):
+    alice, a_events = await connect(port, "alice", client_ids=True, reconnect=True)
+    bob, b_events = await connect(port, "bob", client_ids=True)
+    carol, c_events = await connect(port, "carol")  # no msgid: plain NOTIFY_TEXT
+    await alice.request("INIT_GROUP g1 10")
+    for name, client in (("bob", bob), ("carol", carol)):
+        await alice.request(f"SEND_INVITE g1 {name}")
+        await client.request("CONFIRM_JOIN g1")
+    return (alice, a_events), (bob, b_events), (carol, c_events)
+
+
+def received(events):
+    return [args[3] for args in names(events, "text_message")]
+
+
+def test_each_message_id_is_delivered_and_stored_once(with_server):
+    async def body(server, port):
+        (alice, a_events), (bob, b_events), (carol, c_events) = await group_of_three(port)
+        ids = [alice.send_text("G", "g1", "same text") for _ in range(3)]
+        alice.send(encode_text_id(ids[0], "G", "g1", "same text"))  # resent, as after a reconnect
+        await alice.request("GET_GROUPS")
+        await bob.request("GET_GROUPS")
+        await carol.request("GET_GROUPS")
+
+        assert sorted(args[0] for args in names(a_events, "text_delivered")) == sorted(ids + ids[:1])
+        assert received(b_events) == received(c_events) == ["same text"] * 3
+        assert received(a_events) == []  # own echoes are not new messages
+        assert len((await alice.request("HISTORY G g1")).lines) == 3
+        for client in (alice, bob, carol):
+            client.stop()
+    with_server(body)
+
+
+def test_unknown_group_fails_the_message(with_server):
+    async def body(server, port):
+        (alice, a_events), _, _ = await group_of_three(port)
+        message_id = alice.send_text("G", "nope", "lost")
+        await alice.request("GET_GROUPS")
+        assert [args[0] for args in names(a_events, "text_failed")] == [message_id]
+    with_server(body)
+
+
+def test_unacknowledged_messages_arrive_once_after_a_drop(with_server):
+    async def body(server, port):
+        (alice, a_events), (bob, b_events), _ = await group_of_three(port)
+        for i in range(5):
+            alice.send_text("G", "g1", f"blip {i}")
+        server.online["alice"].writer.transport.abort()
+        while not names(a_events, "reconnected"):
+            await asyncio.sleep(0.01)
+        await alice.request("GET_GROUPS")
+        await bob.request("GET_GROUPS")
+        assert received(b_events) == [f"blip {i}" for i in range(5)]
+    with_server(body)
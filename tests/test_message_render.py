@@ -0,0 +1,67 @@
+import re
+import time
+from urllib.parse import unquote
+
+import pytest
+
+from message_render import MessageRenderer, PreviousRenderer, compile_template
+
+DAY = 86400
+NOW = int(time.time())
+
+
+def squeeze(html):
+    """Drop the template indentation the compiled templates drop (values here have no newlines)"""
+    return re.sub(r"\s*\n\s*", "", html)
+
+
+def both(*calls):
+    old, new = PreviousRenderer("Alice"), MessageRenderer("Alice")
+    for method, args in calls:
+        old_sep, old_html = getattr(old, method)(*args)
+        new_sep, new_html = getattr(new, method)(*args)
+        yield squeeze(old_sep), squeeze(old_html), new_sep, new_html
+
+
+@pytest.mark.parametrize("sender", ["alice", "bob"])
+def test_text_bubbles_match_the_previous_html(sender):
+    calls = [("text", (sender, "hi <b>there</b> & \"you\"", NOW - 2 * DAY, " ◷")),
+             ("text", (sender, "same day", NOW - 2 * DAY + 60, "")),
+             ("text", (sender, "next day", NOW - DAY, "")),
+             ("text", (sender, "bad timestamp", "x", ""))]
+    results = list(both(*calls))
+    for old_sep, old_html, new_sep, new_html in results:
+        assert new_sep == old_sep
+        if sender == "bob":
+            old_html = old_html.replace(" ◷", "")  # incoming bubbles never had the mark
+        assert new_html == old_html
+    assert results[1][2] == ""  # no second separator on the same day
+
+
+@pytest.mark.parametrize("sender", ["Alice", "carol"])
+@pytest.mark.parametrize("thumbnail", [False, True])
+def test_file_bubbles_match_the_previous_html(sender, thumbnail):
+    calls = [("file", (sender, "report <final>.png", "f123", NOW, thumbnail))]
+    for old_sep, old_html, new_sep, new_html in both(*calls):
+        assert new_sep == old_sep
+        # The file bubble now wraps long names like the text bubble, and the
+        # links carry the filename percent-encoded
+        old_html = old_html.replace("solid #2196F3;'>", "solid #2196F3; word-wrap:break-word;'>")
+        assert new_html == old_html.replace("|report <final>.png", "|report%20%3Cfinal%3E.png")
+        assert 'href="#download|f123|report%20%3Cfinal%3E.png"' in new_html
+        assert "📎 report &lt;final&gt;.png" in new_html
+
+
+def test_file_link_round_trips_names_with_separators():
+    name = 'a|b "c" 100%.txt'
+    _, html = MessageRenderer("Alice").file("bob", name, "f|1")
+    href = re.search(r'href="#download\|([^"]*)"', html).group(1)
+    file_id, filename = href.split("|", 1)
+    assert (unquote(file_id), unquote(filename)) == ("f|1", name)
+
+
+def test_compile_template_fills_every_slot():
+    render = compile_template("<p>\n  {a}-{b}-{a}\n</p>")
+    assert render(a="1", b="2") == "<p>1-2-1</p>"
+    with pytest.raises(ValueError):
+        compile_template("{a.b}")
@@ -0,0 +1,71 @@
+from message_store import MessageLog, format_record, in_range
+
+T0 = 1734300000
+
+
+def records(n):
+    # A few messages per timestamp, some out of order (server clocks, imports)
+    return [(T0 + i // 3 - (7 if i % 50 == 49 else 0), f"user{i % 4}", "TEXT", f"message {i} | with pipes")
+            for i in range(n)]
+
+
+def expected_range(recs, tbegin, tend):
+    return [r for r in recs if in_range(r[0], tbegin, tend)]
+
+
+QUERIES = [(0, 0), (T0 + 20, T0 + 40), (T0 + 150, 0), (0, T0 + 5), (T0 + 1000, 0)]
+
+
+def test_range_and_tail_match_a_full_scan(tmp_path):
+    log = MessageLog(str(tmp_path / "G_hust.txt"), block_size=512)
+    recs = records(600)
+    for r in recs:
+        log.append(r[1], r[2], r[3], r[0])
+    assert len(log) == len(recs)
+    for tbegin, tend in QUERIES:
+        assert log.range(tbegin, tend) == expected_range(recs, tbegin, tend)
+        for limit in (1, 25, 1000):
+            assert log.tail(limit, tbegin, tend) == expected_range(recs, tbegin, tend)[-limit:]
+    log.close()
+
+
+def test_index_survives_reopen_and_catches_up_with_other_writers(tmp_path):
+    path = str(tmp_path / "U_1.txt")
+    recs = records(200)
+    log = MessageLog(path, block_size=512)
+    for r in recs[:150]:
+        log.append(r[1], r[2], r[3], r[0])
+    log.close()
+    with open(path, 'a', encoding='utf-8') as f:  # e.g. server.cpp on the same directory
+        f.writelines(format_record(*r) for r in recs[150:])
+    reopened = MessageLog(path, block_size=512)
+    assert reopened.tail(60) == recs[-60:]
+    reopened.close()
+
+
+def test_replaced_file_rebuilds_the_index(tmp_path):
+    path = str(tmp_path / "U_2.txt")
+    log = MessageLog(path, block_size=512)
+    for r in records(100):
+        log.append(r[1], r[2], r[3], r[0])
+    log.close()
+    recs = records(10)
+    with open(path, 'w', encoding='utf-8') as f:
+        f.writelines(format_record(*r) for r in recs)
+    assert MessageLog(path, block_size=512).range() == recs
+
+
+
+def test_append_after_another_writer_while_open(tmp_path):
+    path = str(tmp_path / "G_1.txt")
+    recs = [(T0 + i, f"user{i}", "TEXT", f"message {i}") for i in range(3)]
+    log = MessageLog(path, block_size=1)  # one block per record
+    log.append(recs[0][1], recs[0][2], recs[0][3], recs[0][0])
+    with open(path, 'a', encoding='utf-8') as f:  # our append handle stays open
+        f.write(format_record(*recs[1]))
+    log.append(recs[2][1], recs[2][2], recs[2][3], recs[2][0])
+    assert len(log) == 3
+    for r in recs:
+        assert log.range(r[0], r[0]) == [r]
+    log.close()
+    assert MessageLog(path, block_size=1).range() == recs
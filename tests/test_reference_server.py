@@ -0,0 +1,42 @@
+import asyncio
+import os
+
+from chat_core import CHUNK_SIZE, encode_login, encode_register, pack_chunk, pack_eof
+
+
+async def raw_login(port, username):
+    reader, writer = await asyncio.open_connection("127.0.0.1", port)
+
+    async def command(line):
+        writer.write(line.encode('utf-8'))
+        return (await reader.readline()).decode('utf-8').strip()
+
+    await command(encode_register(username, "pw"))
+    assert (await command(encode_login(username, "pw"))).startswith("SUCCESS 200 SESSION ")
+    return reader, writer, command
+
+
+def test_resumed_upload_overwrites_chunks_sent_again(with_server):
+    payload = os.urandom(3 * CHUNK_SIZE)
+    chunks = [payload[i:i + CHUNK_SIZE] for i in range(0, len(payload), CHUNK_SIZE)]
+
+    async def body(server, port):
+        reader, writer, command = await raw_login(port, "alice")
+        await command("INIT_GROUP g1 10\n")
+        file_id = (await command(f"REQ_UPLOAD G g1 payload.bin {len(payload)}\n")).split()[-1]
+
+        # First attempt stops after two chunks
+        assert await command(f"UPLOAD_DATA {file_id}\n") == "SUCCESS 200 START_UPLOAD 0"
+        writer.write(pack_chunk(0, chunks[0]) + pack_chunk(CHUNK_SIZE, chunks[1]) + pack_eof(2 * CHUNK_SIZE))
+        assert (await reader.readline()).strip() == b"FAIL 500 UPLOAD_INTERRUPTED"
+
+        # The retry sends the second chunk again, at its offset, below the file size
+        assert await command(f"UPLOAD_DATA {file_id}\n") == f"SUCCESS 200 START_UPLOAD {2 * CHUNK_SIZE}"
+        writer.write(pack_chunk(CHUNK_SIZE, chunks[1]) + pack_chunk(2 * CHUNK_SIZE, chunks[2])
+                     + pack_eof(len(payload)))
+        assert (await reader.readline()).strip() == b"SUCCESS 200 UPLOAD_COMPLETE"
+
+        with open(server.path(server.completed_files[file_id].filepath), 'rb') as f:
+            assert f.read() == payload
+        writer.close()
+    with_server(body)
@@ -0,0 +1,20 @@
+from replay_bench import convert_server_log, read_script
+
+
+def test_restart_and_reused_numbers_become_new_connections(tmp_path):
+    log = tmp_path / "server.log"
+    log.write_text(
+        "[2025-01-01 10:00:00] Server started on port 8888.\n"
+        "[2025-01-01 10:00:01] Client[1] connected: 10.0.0.1:5000\n"
+        "[2025-01-01 10:00:02] Client[1] Received: GET_FRIENDS\n"
+        "[2025-01-01 10:00:10] Server started on port 8888.\n"
+        "[2025-01-01 10:00:11] Client[1] connected: 10.0.0.2:5001\n"
+        "[2025-01-01 10:00:12] Client[1] Received: GET_GROUPS\n"
+        "[2025-01-01 10:00:20] Client[1] connected: 10.0.0.3:5002\n"
+        "[2025-01-01 10:00:21] Client[1] Received: PING\n"
+        "[2025-01-01 10:00:23] Client[1] disconnected\n")
+    convert_server_log(str(log), str(tmp_path / "t.replay"))
+    _, events = read_script(str(tmp_path / "t.replay"))
+    sends = [(e.client, e.line) for e in events if e.op == "send"]
+    assert sends == [(1, "GET_FRIENDS"), (2, "GET_GROUPS"), (3, "PING")]
+    assert sorted(e.client for e in events if e.op == "close") == [1, 2, 3]
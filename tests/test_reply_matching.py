@@ -0,0 +1,63 @@
+import asyncio
+
+import pytest
+
+from async_core import AsyncChatClient, ReplyLost, WriteQueue
+from test_write_queue import FakeWriter
+
+
+def offline_client():
+    """A client whose replies are fed by hand"""
+    client = AsyncChatClient("127.0.0.1", 0)
+    client.outbox = WriteQueue(FakeWriter(), coalesce=True)
+    client.running = True
+    return client
+
+
+def test_reply_for_a_later_request_fails_the_ones_before_it():
+    async def main():
+        client = offline_client()
+        friends = asyncio.ensure_future(client.request("GET_FRIENDS"))
+        members = asyncio.ensure_future(client.request("GET_MEMBERS g1"))
+        groups = asyncio.ensure_future(client.request("GET_GROUPS"))
+        ping = asyncio.ensure_future(client.request("PING 1"))
+        await asyncio.sleep(0)
+        client.handle_line("SUCCESS 200 GROUPS g1|1")
+        client.handle_line("SUCCESS 200 PONG 1")
+        for lost in (friends, members):
+            with pytest.raises(ReplyLost):
+                await lost
+        assert (await groups).kind == "groups"
+        assert (await ping).line == "SUCCESS 200 PONG 1"
+        assert client.telemetry.snapshot()["pending"] == []
+    asyncio.run(main())
+
+
+def test_generic_replies_still_match_in_order():
+    async def main():
+        client = offline_client()
+        first = asyncio.ensure_future(client.request("ADD_FRIEND bob"))
+        second = asyncio.ensure_future(client.request("GET_FRIENDS"))
+        await asyncio.sleep(0)
+        client.handle_line("FAIL 404 USER_NOT_FOUND")
+        client.handle_line("SUCCESS 200 FRIENDS bob|online")
+        assert (await first).kind == "fail"
+        assert (await second).kind == "friends"
+    asyncio.run(main())
+
+
+def test_interim_reply_after_lost_ones_keeps_the_upload_open():
+    async def main():
+        client = offline_client()
+        groups = asyncio.ensure_future(client.request("GET_GROUPS"))
+        upload = asyncio.ensure_future(client.request("UPLOAD_DATA f1"))
+        await asyncio.sleep(0)
+        client.handle_line("SUCCESS 200 START_UPLOAD 0")
+        with pytest.raises(ReplyLost):
+            await groups
+        assert not upload.done()
+        assert client.telemetry.snapshot()["pending"] == ["UPLOAD_DATA"]
+        client.handle_line("SUCCESS 200 UPLOAD_COMPLETE")
+        assert (await upload).kind == "upload_complete"
+        assert client.telemetry.snapshot()["pending"] == []
+    asyncio.run(main())
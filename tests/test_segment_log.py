@@ -0,0 +1,73 @@
+import os
+
+import pytest
+
+import segment_log
+from message_store import MessageStore, format_record
+from segment_log import SegmentedLog, migrate_file, segment_dir
+from test_message_store import QUERIES, T0, expected_range, records
+
+
+def test_range_and_tail_match_a_full_scan(tmp_path):
+    log = SegmentedLog(str(tmp_path / "G_hust.seg"), segment_size=1024)
+    recs = records(600)
+    for r in recs:
+        log.append(r[1], r[2], r[3], r[0])
+    assert len(log) == len(recs)
+    for tbegin, tend in QUERIES:
+        assert log.range(tbegin, tend) == expected_range(recs, tbegin, tend)
+        for limit in (1, 25, 1000):
+            assert log.tail(limit, tbegin, tend) == expected_range(recs, tbegin, tend)[-limit:]
+    assert len(log.segments()) > 10
+    log.close()
+
+
+def test_segments_compact_and_reload(tmp_path):
+    directory = str(tmp_path / "G_x.seg")
+    recs = records(300)
+    log = SegmentedLog(directory, segment_size=1024)
+    for r in recs:
+        log.append(r[1], r[2], r[3], r[0])
+    before, after = log.compact(older_than=0, now=T0 + 10 ** 6)
+    assert after < before
+    log.close()
+    assert SegmentedLog(directory, segment_size=1024).range() == recs
+
+
+def test_reload_after_a_crash_between_sealing_and_removing(tmp_path, monkeypatch):
+    directory = str(tmp_path / "G_crash.seg")
+    recs = records(300)
+    log = SegmentedLog(directory, segment_size=1024)
+    for r in recs[:200]:
+        log.append(r[1], r[2], r[3], r[0])
+
+    def crash(path):
+        raise OSError("crashed")
+    monkeypatch.setattr(segment_log.os, "remove", crash)
+    with pytest.raises(OSError):
+        log.seal()  # the sealed copy is written, the .open stays
+    monkeypatch.undo()
+
+    reopened = SegmentedLog(directory, segment_size=1024)
+    assert reopened.range() == recs[:200]
+    assert not [name for name in os.listdir(directory) if name.endswith(".open")]
+    for r in recs[200:]:
+        reopened.append(r[1], r[2], r[3], r[0])
+    reopened.close()
+    assert SegmentedLog(directory, segment_size=1024).range() == recs
+
+
+def test_migration_keeps_every_record(tmp_path):
+    path = str(tmp_path / "G_old.txt")
+    recs = records(400)
+    with open(path, 'w', encoding='utf-8') as f:
+        f.writelines(format_record(*r) for r in recs)
+        f.write("not a record\n")
+    migrated, skipped, _, _ = migrate_file(path, segment_size=2048, cold_age=None, remove_source=True)
+    assert (migrated, skipped) == (len(recs), 1)
+    assert not os.path.exists(path)
+    store = MessageStore(str(tmp_path))
+    assert store.exists("G_old.txt")
+    assert store.log("G_old.txt").tail(50) == recs[-50:]
+    assert os.path.isdir(segment_dir(path))
+    store.close()
@@ -0,0 +1,65 @@
+import asyncio
+
+from chat_core import decode_reply
+from conftest import connect, names
+from session_store import SessionStore
+
+
+def test_session_expired_notify_as_sent_by_the_servers():
+    # server.cpp and reference_server.py: "NOTIFY SESSION_EXPIRED " + old session id
+    assert decode_reply("NOTIFY SESSION_EXPIRED 1734300000-4711") == ("notify_session_expired",)
+
+
+def test_store_roundtrip(tmp_path):
+    store = SessionStore(str(tmp_path / "LTM" / "session.json"))
+    store.save("127.0.0.1:8888", "alice", "1734300000-4711")
+    store.save("127.0.0.1:8888", "bob", "1734300000-42")
+    assert store.load("127.0.0.1:8888", "alice") == "1734300000-4711"
+    store.forget("127.0.0.1:8888", "alice")
+    assert store.load("127.0.0.1:8888", "alice") is None
+    assert store.load("127.0.0.1:8888", "bob") == "1734300000-42"
+
+
+def test_normal_stop_does_not_reject_the_session(with_server):
+    async def body(server, port):
+        client, events = await connect(port, "alice", reconnect=True)
+        client.stop()
+        while not names(events, "disconnected"):
+            await asyncio.sleep(0.01)
+        assert names(events, "session_rejected") == []
+    with_server(body)
+
+
+def test_dropped_connection_resumes_without_rejecting(with_server):
+    async def body(server, port):
+        client, events = await connect(port, "alice", reconnect=True)
+        server.online["alice"].writer.transport.abort()
+        while not names(events, "reconnected"):
+            await asyncio.sleep(0.01)
+        assert names(events, "session_rejected") == []
+        client.stop()
+    with_server(body)
+
+
+def test_refused_auth_rejects_the_session(with_server):
+    async def body(server, port):
+        client, events = await connect(port, "alice", reconnect=True)
+        server.sessions.clear()
+        server.user_to_session.clear()
+        server.online["alice"].writer.transport.abort()
+        while not names(events, "disconnected"):
+            await asyncio.sleep(0.01)
+        assert names(events, "session_rejected") == [("FAIL 401 SESSION_EXPIRED",)]
+    with_server(body)
+
+
+def test_login_elsewhere_rejects_the_session(with_server):
+    async def body(server, port):
+        first, events = await connect(port, "alice", reconnect=True)
+        second, _ = await connect(port, "alice", register=False)
+        while not names(events, "disconnected"):
+            await asyncio.sleep(0.01)
+        assert names(events, "session_rejected") == [("SESSION_EXPIRED",)]
+        assert ("Session Expired", "Logged out from another device") in names(events, "notification")
+        second.stop()
+    with_server(body)
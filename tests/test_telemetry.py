@@ -0,0 +1,32 @@
+from telemetry import Telemetry
+
+
+def test_failure_counted_on_the_row_it_is_reported_under():
+    t = Telemetry()
+    t.command_sent("UPLOAD_DATA f1\n", 15)
+    t.reply_received("SUCCESS 200 START_UPLOAD 0")
+    t.reply_received("FAIL 500 UPLOAD_INTERRUPTED")
+    t.command_sent("UPLOAD_DATA f2\n", 15)
+    t.reply_received("FAIL 404 FILE_ID_NOT_FOUND")
+    latency = t.snapshot()["latency"]
+    assert latency["UPLOAD_DATA (total)"]["failures"] == 1
+    assert latency["UPLOAD_DATA (total)"]["sent"] == 2
+    assert latency["UPLOAD_DATA"]["failures"] == 1
+
+
+def test_burst_keeps_every_pending_command():
+    t = Telemetry()
+    for i in range(1000):
+        t.command_sent("GET_FRIENDS\n" if i % 2 else "HISTORY U bob 0 0\n", 12)
+    for i in range(1000):
+        assert t.reply_received("SUCCESS 200 X") == ("GET_FRIENDS" if i % 2 else "HISTORY")
+    assert t.snapshot()["pending"] == []
+
+
+def test_connection_reset_forgets_unanswered_commands():
+    t = Telemetry()
+    t.command_sent("GET_GROUPS\n", 11)
+    t.connection_reset()
+    t.command_sent("GET_FRIENDS\n", 12)
+    assert t.reply_received("SUCCESS 200 FRIENDS ") == "GET_FRIENDS"
+    assert t.snapshot()["pending"] == []
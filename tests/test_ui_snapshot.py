@@ -0,0 +1,46 @@
+import json
+
+from ui_snapshot import MAX_CONVERSATIONS, SNAPSHOT_VERSION, UiSnapshot
+
+
+def test_flush_writes_only_changes_and_reloads(tmp_path):
+    path = str(tmp_path / "state-alice.json")
+    snapshot = UiSnapshot(path)
+    assert snapshot.update("friends", [("bob", "online"), ("carol", "offline")])
+    assert snapshot.update("pending_requests", ["dave"])
+    assert not snapshot.update("friends", [["bob", "online"], ["carol", "offline"]])  # tuples == lists
+    snapshot.flush()
+    assert not snapshot.dirty
+
+    reloaded = UiSnapshot(path)
+    assert reloaded.get("friends") == [["bob", "online"], ["carol", "offline"]]
+    assert reloaded.get("pending_requests") == ["dave"]
+    assert reloaded.get("groups") == []
+
+
+def test_conversations_are_capped(tmp_path):
+    snapshot = UiSnapshot(str(tmp_path / "state.json"))
+    snapshot.update("conversations", [[f"U:user{i}", "hi"] for i in range(MAX_CONVERSATIONS + 20)])
+    assert len(snapshot.get("conversations")) == MAX_CONVERSATIONS
+
+
+def test_corrupt_or_old_files_load_empty(tmp_path):
+    path = tmp_path / "state.json"
+    path.write_text("{not json", encoding='utf-8')
+    assert UiSnapshot(str(path)).state == {}
+    path.write_text(json.dumps({"version": SNAPSHOT_VERSION - 1, "friends": [["bob", "online"]]}), encoding='utf-8')
+    assert UiSnapshot(str(path)).state == {}
+    path.write_text(json.dumps([1, 2]), encoding='utf-8')
+    assert UiSnapshot(str(path)).state == {}
+
+
+def test_malformed_entries_are_dropped(tmp_path):
+    path = tmp_path / "state.json"
+    path.write_text(json.dumps({"version": SNAPSHOT_VERSION,
+                                "friends": [["bob", "online"], "carol", ["x"], [1, "y"]],
+                                "pending_requests": ["dave", ["eve"]],
+                                "groups": "not a list"}), encoding='utf-8')
+    snapshot = UiSnapshot(str(path))
+    assert snapshot.get("friends") == [["bob", "online"]]
+    assert snapshot.get("pending_requests") == ["dave"]
+    assert snapshot.get("groups") == []
@@ -0,0 +1,112 @@
+import asyncio
+import os
+
+from async_core import AsyncChatClient, WriteQueue
+from chat_core import CHUNK_SIZE, pack_chunk, pack_eof
+from conftest import connect, names
+
+
+class FakeWriter:
+    def __init__(self):
+        self.writes = []
+
+    def write(self, data):
+        self.writes.append(data)
+
+    async def drain(self):
+        pass
+
+
+def test_control_held_from_upload_data_until_close_stream():
+    async def main():
+        writer = FakeWriter()
+        queue = WriteQueue(writer, coalesce=True)
+        queue.start()
+        queue.put_control(b"UPLOAD_DATA f1\n", opens_stream=True)
+        queue.put_control(b"PING\n")
+        await asyncio.sleep(0.01)
+        assert writer.writes == [b"UPLOAD_DATA f1\n"]  # START_UPLOAD not even here yet
+        await queue.put_bulk(pack_chunk(0, b"data"))
+        await queue.put_bulk(pack_eof(4))
+        await asyncio.sleep(0.01)
+        assert b"PING\n" not in writer.writes  # EOF written, final reply not read yet
+        queue.close_stream()
+        await asyncio.sleep(0.01)
+        assert writer.writes[-1] == b"PING\n"
+        queue.close()
+    asyncio.run(main())
+
+
+def test_one_command_in_flight_without_coalesce():
+    async def main():
+        writer = FakeWriter()
+        queue = WriteQueue(writer)
+        queue.start()
+        for name in (b"GET_FRIENDS\n", b"GET_GROUPS\n", b"PING\n"):
+            queue.put_control(name)
+        await asyncio.sleep(0.01)
+        assert writer.writes == [b"GET_FRIENDS\n"]
+        queue.reply_received()
+        await asyncio.sleep(0.01)
+        assert writer.writes == [b"GET_FRIENDS\n", b"GET_GROUPS\n"]
+        queue.reply_received()
+        await asyncio.sleep(0.01)
+        assert writer.writes[-1] == b"PING\n"
+        queue.close()
+    asyncio.run(main())
+
+
+def test_burst_against_a_server_reading_one_command_per_recv():
+    """Like server.cpp: whatever one recv() returns is one command"""
+    received = []
+
+    async def handle(reader, writer):
+        while True:
+            await asyncio.sleep(0.005)  # let queued writes pile up in the socket
+            data = await reader.read(65536)
+            if not data:
+                break
+            received.append(data)
+            command = data.decode().strip()
+            writer.write(b"SUCCESS 200 GROUPS \n" if command == "GET_GROUPS" else b"FAIL 400 UNKNOWN_COMMAND\n")
+        writer.close()
+
+    async def main():
+        listener = await asyncio.start_server(handle, "127.0.0.1", 0)
+        client = AsyncChatClient("127.0.0.1", listener.sockets[0].getsockname()[1])
+        asyncio.ensure_future(client.run())
+        while not client.running:
+            await asyncio.sleep(0.01)
+        replies = await asyncio.wait_for(
+            asyncio.gather(*[client.request("GET_GROUPS") for _ in range(20)]), 10)
+        assert all(reply.ok for reply in replies)
+        assert received == [b"GET_GROUPS\n"] * 20
+        client.stop()
+        listener.close()
+        await asyncio.sleep(0.02)  # let the handler see EOF
+    asyncio.run(main())
+
+
+def test_commands_sent_during_upload_reach_the_server_intact(with_server, tmp_path):
+    payload = os.urandom(3 * CHUNK_SIZE + 123)
+    path = tmp_path / "payload.bin"
+    path.write_bytes(payload)
+
+    async def body(server, port):
+        client, events = await connect(port, "alice")
+        await client.request("INIT_GROUP g1 10")
+        reply = await client.request(f"REQ_UPLOAD G g1 payload.bin {len(payload)}")
+        file_id = reply.fields[0]
+        upload = asyncio.ensure_future(client.request(f"UPLOAD_DATA {file_id}"))
+        client.active_upload = (file_id, str(path), len(payload))
+        # Queued before START_UPLOAD has arrived and while the chunks stream
+        replies = [asyncio.ensure_future(client.request("GET_GROUPS")) for _ in range(5)]
+        assert (await upload).kind == "upload_complete"
+        for reply in await asyncio.gather(*replies):
+            assert reply.kind == "groups"
+        assert names(events, "upload_complete") == [(file_id,)]
+        stored = server.completed_files[file_id]
+        with open(server.path(stored.filepath), 'rb') as f:
+            assert f.read() == payload
+        client.stop()
+    with_server(body)
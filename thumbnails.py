@@ -0,0 +1,225 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Image attachment previews for the chat views.
+
+ThumbnailManager hands out THUMB_WIDTH x THUMB_HEIGHT thumbnails by file_id.
+A thumbnail comes from, in order: memory, thumbs/<file_id>.png on disk, the
+download cache, or the server. Server fetches use REQ_PREVIEW, which only
+sends files of at most PREVIEW_MAX_BYTES; the fetched file also lands in the
+download cache. Decoding, scaling and PNG encoding run on a QThreadPool
+(QImageReader decodes JPEGs at reduced scale), never on the GUI thread.
+
+ChatBrowser resolves <img src="thumb:<file_id>" width=.. height=..> through
+the manager. An image with a fixed size is only loaded when it is painted,
+so bubbles that never scroll into view are never decoded or fetched.
+"""
+
+import os
+from collections import OrderedDict, deque
+from urllib.parse import quote
+
+from PyQt5.QtCore import QObject, QRunnable, QThreadPool, QUrl, Qt, pyqtSignal
+from PyQt5.QtGui import QColor, QImage, QImageReader, QPainter, QTextDocument
+from PyQt5.QtWidgets import QTextBrowser
+
+IMAGE_EXTENSIONS = {".png", ".jpg", ".jpeg", ".jfif", ".gif", ".bmp", ".webp"}
+THUMB_WIDTH = 160
+THUMB_HEIGHT = 120
+PREVIEW_MAX_BYTES = 2 * 1024 * 1024  # larger images are not fetched for a preview
+MEMORY_THUMBS = 256
+DECODE_THREADS = 2
+FETCH_CONCURRENCY = 1  # previews share the control connection with everything else
+
+
+def is_image(filename):
+    return os.path.splitext(filename)[1].lower() in IMAGE_EXTENSIONS
+
+
+def make_thumbnail(path, width=THUMB_WIDTH, height=THUMB_HEIGHT):
+    """Decode path scaled to fit width x height, centred on a transparent canvas"""
+    reader = QImageReader(path)
+    reader.setAutoTransform(True)
+    size = reader.size()
+    if size.isValid() and (size.width() > width or size.height() > height):
+        reader.setScaledSize(size.scaled(width, height, Qt.KeepAspectRatio))
+    image = reader.read()
+    if image.isNull():
+        return image
+    if image.width() > width or image.height() > height:
+        image = image.scaled(width, height, Qt.KeepAspectRatio, Qt.SmoothTransformation)
+    canvas = QImage(width, height, QImage.Format_ARGB32_Premultiplied)
+    canvas.fill(Qt.transparent)
+    painter = QPainter(canvas)
+    painter.drawImage((width - image.width()) // 2, (height - image.height()) // 2, image)
+    painter.end()
+    return canvas
+
+
+class _JobSignals(QObject):
+    done = pyqtSignal(str, QImage)  # file_id, thumbnail (null if it could not be made)
+
+
+class _ThumbJob(QRunnable):
+    """Load or build one thumbnail on the pool"""
+
+    def __init__(self, signals, file_id, thumb_path, source=None, cache=None, filename="", fetched=False):
+        super().__init__()
+        self.signals = signals
+        self.file_id = file_id
+        self.thumb_path = thumb_path
+        self.source = source
+        self.cache = cache
+        self.filename = filename
+        self.fetched = fetched  # source is a temporary REQ_PREVIEW download
+
+    def run(self):
+        image = QImage()
+        try:
+            if self.source is None:
+                image = QImage(self.thumb_path)
+            else:
+                image = make_thumbnail(self.source)
+                if not image.isNull():
+                    tmp = self.thumb_path + ".tmp"
+                    if image.save(tmp, "PNG"):
+                        os.replace(tmp, self.thumb_path)
+                if self.fetched and self.cache is not None:
+                    self.cache.put(self.file_id, self.source, self.filename)
+        except OSError:
+            pass
+        finally:
+            if self.fetched:
+                try:
+                    os.remove(self.source)
+                except OSError:
+                    pass
+        self.signals.done.emit(self.file_id, image)
+
+
+class ThumbnailManager(QObject):
+    """file_id -> thumbnail QImage; see the module docstring"""
+
+    thumbnail_ready = pyqtSignal(str)  # id_file
+
+    def __init__(self, net_thread, cache, directory):
+        super().__init__()
+        self.net_thread = net_thread
+        self.cache = cache  # DownloadCache or None
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+        self._images = OrderedDict()  # file_id -> QImage, LRU
+        self._names = {}  # file_id -> filename
+        self._busy = set()  # decoding or fetching
+        self._failed = set()  # no preview possible this session
+        self._fetch_queue = deque()
+        self._fetching = 0
+        self._pool = QThreadPool(self)
+        self._pool.setMaxThreadCount(DECODE_THREADS)
+        self._signals = _JobSignals()
+        self._signals.done.connect(self._on_done)
+
+    def register(self, file_id, filename):
+        """Remember the filename of an image bubble (used for the cache entry)"""
+        self._names[file_id] = filename
+
+    def cached(self, file_id):
+        return self._images.get(file_id)
+
+    def image(self, file_id):
+        """The thumbnail if it is in memory, else None and start producing it"""
+        image = self._images.get(file_id)
+        if image is not None:
+            self._images.move_to_end(file_id)
+            return image
+        if file_id not in self._busy and file_id not in self._failed:
+            self._produce(file_id)
+        return None
+
+    def _thumb_path(self, file_id):
+        return os.path.join(self.directory, file_id + ".png")
+
+    def _produce(self, file_id):
+        self._busy.add(file_id)
+        thumb = self._thumb_path(file_id)
+        if os.path.exists(thumb):
+            self._pool.start(_ThumbJob(self._signals, file_id, thumb))
+            return
+        source = self.cache.lookup(file_id) if self.cache is not None else None
+        if source is not None:
+            self._pool.start(_ThumbJob(self._signals, file_id, thumb, source))
+            return
+        if not self.net_thread.client.supports("REQ_PREVIEW"):
+            self._busy.discard(file_id)
+            self._failed.add(file_id)
+            return
+        self._fetch_queue.append(file_id)
+        self._pump()
+
+    def _pump(self):
+        while self._fetching < FETCH_CONCURRENCY and self._fetch_queue:
+            file_id = self._fetch_queue.popleft()
+            path = os.path.join(self.directory, f".fetch-{file_id}")
+            fut = self.net_thread.request_preview(
+                file_id, path, PREVIEW_MAX_BYTES,
+                callback=lambda reply, fid=file_id, p=path: self._on_fetched(fid, p, reply))
+            if fut is None:  # not connected
+                self._busy.discard(file_id)
+                continue
+            self._fetching += 1
+
+    def _on_fetched(self, file_id, path, reply):
+        self._fetching -= 1
+        if reply is not None and reply.ok:
+            self._pool.start(_ThumbJob(self._signals, file_id, self._thumb_path(file_id), path,
+                                       self.cache, self._names.get(file_id, ""), fetched=True))
+        else:
+            # Too large, gone, or a server without REQ_PREVIEW
+            self._busy.discard(file_id)
+            self._failed.add(file_id)
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+        self._pump()
+
+    def _on_done(self, file_id, image):
+        self._busy.discard(file_id)
+        if image.isNull():
+            self._failed.add(file_id)
+            return
+        self._images[file_id] = image
+        if len(self._images) > MEMORY_THUMBS:
+            self._images.popitem(last=False)
+        self.thumbnail_ready.emit(file_id)
+
+
+class ChatBrowser(QTextBrowser):
+    """QTextBrowser that resolves thumb:<file_id> images through a ThumbnailManager"""
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.thumbnails = None
+        self._placeholder = None
+
+    def set_thumbnails(self, manager):
+        self.thumbnails = manager
+        manager.thumbnail_ready.connect(self._on_thumbnail_ready)
+
+    def loadResource(self, rtype, url):
+        if rtype == QTextDocument.ImageResource and url.scheme() == "thumb" and self.thumbnails:
+            image = self.thumbnails.image(url.path(QUrl.FullyDecoded))
+            return image if image is not None else self._placeholder_image()
+        return super().loadResource(rtype, url)
+
+    def _placeholder_image(self):
+        if self._placeholder is None:
+            self._placeholder = QImage(THUMB_WIDTH, THUMB_HEIGHT, QImage.Format_ARGB32_Premultiplied)
+            self._placeholder.fill(QColor("#eef3f8"))
+        return self._placeholder
+
+    def _on_thumbnail_ready(self, file_id):
+        image = self.thumbnails.cached(file_id)
+        if image is not None:
+            self.document().addResource(QTextDocument.ImageResource, QUrl("thumb:" + quote(file_id, safe="")), image)
+            self.viewport().update()
@@ -0,0 +1,76 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Warm-start snapshot of the main window's lists.
+
+Friends, groups, pending friend requests, group invites and the recent
+conversations (title and last-message preview) are kept per server and
+user in <cache dir>/state-<user>.json. The next login shows them before
+the server has answered GET_FRIENDS / GET_GROUPS / GET_PENDING_REQUESTS /
+GET_GROUP_INVITES; the answers then replace the snapshot's lists (and
+conversations with ex-friends or groups left meanwhile are dropped).
+
+The GUI calls update() whenever a list changes and flush() from a timer,
+so a burst of changes is written once. The file is replaced atomically; a
+missing, corrupt or older-version file is treated as empty.
+"""
+
+import json
+import os
+
+SNAPSHOT_VERSION = 1
+MAX_CONVERSATIONS = 100
+KEYS = ("friends", "groups", "pending_requests", "group_invites", "conversations")
+NAMES = ("pending_requests",)  # lists of names; the other keys hold [name, value] pairs
+
+
+def _valid(key, entry):
+    if key in NAMES:
+        return isinstance(entry, str)
+    return isinstance(entry, list) and len(entry) == 2 and isinstance(entry[0], str)
+
+
+class UiSnapshot:
+    """Lists of the last session, keyed by KEYS; values are JSON lists"""
+
+    def __init__(self, path):
+        self.path = path
+        self.dirty = False
+        self.state = self._load()
+
+    def _load(self):
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+            if data.get("version") != SNAPSHOT_VERSION:
+                raise ValueError("snapshot version")
+            return {key: [e for e in data[key] if _valid(key, e)]
+                    for key in KEYS if isinstance(data.get(key), list)}
+        except (OSError, ValueError, AttributeError):
+            return {}
+
+    def get(self, key):
+        return self.state.get(key, [])
+
+    def update(self, key, values):
+        """Replace a list; True if it changed (flush() will write it)"""
+        values = [list(v) if isinstance(v, tuple) else v for v in values]
+        if key == "conversations":
+            values = values[:MAX_CONVERSATIONS]
+        if self.state.get(key) == values:
+            return False
+        self.state[key] = values
+        self.dirty = True
+        return True
+
+    def flush(self):
+        if not self.dirty:
+            return
+        self.dirty = False
+        tmp = self.path + ".tmp"
+        try:
+            with open(tmp, 'w', encoding='utf-8') as f:
+                json.dump(dict(self.state, version=SNAPSHOT_VERSION), f)
+            os.replace(tmp, self.path)
+        except OSError as e:
+            print(f"[WARN] UI snapshot not saved: {e}")